@@ -37,7 +37,9 @@ from ironic_python_agent import hardware
 from ironic_python_agent import inspector
 from ironic_python_agent import ironic_api_client
 from ironic_python_agent import mdns
+from ironic_python_agent.metrics_lib import metrics_utils
 from ironic_python_agent import netutils
+from ironic_python_agent import swarm
 from ironic_python_agent import utils
 
 CONF = cfg.CONF
@@ -500,12 +502,32 @@ class IronicPythonAgent(base.ExecuteCommandMixin):
         if not self.standalone and self.api_urls:
             # Don't start heartbeating until the server is listening
             self.heartbeater.start()
+        if swarm.enabled():
+            self._announce_swarm()
+        elif cfg.CONF.image_swarm:
+            LOG.warning('Image sharing is disabled because image_swarm_key '
+                        'is not set')
         try:
             while self.serve_api:
                 time.sleep(0.1)
         except KeyboardInterrupt:
             LOG.info('Caught keyboard interrupt, exiting')
+        swarm.withdraw()
         self.api.stop()
+        metrics_utils.flush_metrics(stop=True)
+
+    def _announce_swarm(self):
+        """Announce the API to other agents sharing images."""
+        try:
+            self.set_agent_advertise_addr()
+            swarm.announce('{}://{}:{}'.format(
+                self.advertise_protocol,
+                netutils.wrap_ipv6(self.advertise_address.hostname),
+                self.advertise_address.port))
+        except (errors.LookupAgentIPError,
+                errors.ServiceRegistrationFailure) as e:
+            LOG.warning('Unable to announce image sharing to peers, only '
+                        'fetching images from them: %s', e)
 
     def process_lookup_data(self, content):
         """Update agent configuration from lookup data."""
@@ -611,6 +633,9 @@ class IronicPythonAgent(base.ExecuteCommandMixin):
 
         # Cached hw managers at runtime, not load time. See bug 1490008.
         hardware.get_managers()
+        if cfg.CONF.lldp_listener:
+            netutils.start_lldp_listener(
+                [name for name in netutils.list_interfaces() if name != 'lo'])
         # Operator-settable delay before hardware actually comes up.
         # Helps with slow RAID drivers - see bug 1582797.
         if self.hardware_initialization_delay > 0:
@@ -15,6 +15,7 @@
 import json
 import ssl
 import threading
+import time
 
 from cheroot.ssl import builtin
 from cheroot import wsgi
@@ -25,7 +26,10 @@ from werkzeug import routing
 
 from ironic_python_agent.api import request_log
 from ironic_python_agent import encoding
+from ironic_python_agent import errors
+from ironic_python_agent.metrics_lib import metrics_prometheus
 from ironic_python_agent.metrics_lib import metrics_utils
+from ironic_python_agent import swarm
 from ironic_python_agent import utils
 
 
@@ -69,6 +73,8 @@ class TLSEnforcingSSLAdapter(builtin.BuiltinSSLAdapter):
 
 _CUSTOM_MEDIA_TYPE = 'application/vnd.openstack.ironic-python-agent.v1+json'
 _DOCS_URL = 'https://docs.openstack.org/ironic-python-agent'
+# Interval (in seconds) of comments sent to keep idle event streams open
+_EVENT_KEEPALIVE = 15
 
 
 class Request(werkzeug.Request):
@@ -77,9 +83,13 @@ class Request(werkzeug.Request):
 
 def jsonify(value, status=200):
     """Convert value to a JSON response using the custom encoder."""
+    started = time.monotonic()
     encoder = encoding.RESTJSONEncoder()
     data = encoder.encode(value)
-    return werkzeug.Response(data, status=status, mimetype='application/json')
+    elapsed = time.monotonic() - started
+    return werkzeug.Response(
+        data, status=status, mimetype='application/json',
+        headers={'Server-Timing': 'serialize;dur=%.1f' % (elapsed * 1000)})
 
 
 def make_link(url, rel_name, resource='', resource_args='',
@@ -136,16 +146,31 @@ class Application(object):
         self.agent = agent
         self.server = None
         self._conf = conf
+        # Waiting requests occupy threads of the server, limit their number
+        # so that other requests are still served.
+        self._waiters = None
+        if conf.api_max_waiting_requests:
+            self._waiters = threading.BoundedSemaphore(
+                conf.api_max_waiting_requests)
         self.url_map = routing.Map([
             routing.Rule('/', endpoint='root', methods=['GET']),
             routing.Rule('/v1/', endpoint='v1', methods=['GET']),
+            routing.Rule('/metrics', endpoint='metrics', methods=['GET']),
             routing.Rule('/v1/status', endpoint='status', methods=['GET']),
+            routing.Rule('/v1/executions', endpoint='executions',
+                         methods=['GET']),
             routing.Rule('/v1/commands/', endpoint='list_commands',
                          methods=['GET']),
             routing.Rule('/v1/commands/<cmd>', endpoint='get_command',
                          methods=['GET']),
+            routing.Rule('/v1/commands/<cmd>/events',
+                         endpoint='command_events', methods=['GET']),
             routing.Rule('/v1/commands/', endpoint='run_command',
                          methods=['POST']),
+            routing.Rule('/v1/swarm/<key>', endpoint='swarm_image',
+                         methods=['GET']),
+            routing.Rule('/v1/swarm/<key>/<int:index>',
+                         endpoint='swarm_chunk', methods=['GET']),
             # Use the default version (i.e. v1) when the version is missing
             routing.Rule('/status', endpoint='status', methods=['GET']),
             routing.Rule('/commands/', endpoint='list_commands',
@@ -162,6 +187,7 @@ class Application(object):
             request = Request(environ)
             adapter = self.url_map.bind_to_environ(request.environ)
             endpoint, values = adapter.match()
+            environ[request_log.ENDPOINT_KEY] = endpoint
             response = getattr(self, "api_" + endpoint)(request, **values)
         except Exception as exc:
             response = self.handle_exception(environ, exc)
@@ -282,23 +308,163 @@ class Application(object):
             return func(self, request, *args, **kwargs)
         return wrapper
 
+    def api_metrics(self, request):
+        if self._conf.metrics.backend != 'prometheus':
+            raise http_exc.NotFound('Metrics are only exposed with the '
+                                    'prometheus metrics backend')
+        return werkzeug.Response(metrics_prometheus.REGISTRY.render(),
+                                 content_type=metrics_prometheus.CONTENT_TYPE)
+
+    @require_agent_token_for_command
+    def api_executions(self, request):
+        executions = utils.get_execution_history()
+        step = request.args.get('step')
+        if step:
+            executions = [entry for entry in executions
+                          if entry['step'] == step]
+        return jsonify({
+            'executions': executions,
+            'summary': utils.summarize_execution_history(executions),
+        })
+
+    def _parse_wait(self, request):
+        """Get the time to wait for a command from the request.
+
+        :returns: None to wait until the command finishes, otherwise the
+                  maximum number of seconds to wait (0 means no waiting).
+        """
+        wait = request.args.get('wait')
+        if not wait or wait.lower() == 'false':
+            return 0
+        if wait.lower() == 'true':
+            return None
+        try:
+            wait = float(wait)
+        except ValueError:
+            wait = -1
+        if not 0 <= wait < float('inf'):
+            raise http_exc.BadRequest(
+                'The wait option must be true, false or a number of seconds')
+        return min(wait, self._conf.api_max_command_wait)
+
+    def _wait_for_command(self, result, timeout):
+        """Wait for a running command to finish for at most timeout seconds.
+
+        Returns immediately if too many requests are already waiting.
+        """
+        if result.is_done() or timeout <= 0:
+            return
+        if self._waiters is None or not self._waiters.acquire(blocking=False):
+            LOG.debug('Too many requests are waiting for commands, not '
+                      'waiting for command %s', result.id)
+            return
+        try:
+            result.join(timeout)
+        finally:
+            self._waiters.release()
+
+    def _paginate(self, request, results):
+        """Apply the pagination options of the request to command results.
+
+        :returns: a tuple (page, next marker or None).
+        """
+        if request.args.get('latest', '').lower() == 'true':
+            return results[-1:], None
+
+        marker = request.args.get('marker')
+        if marker:
+            for index, result in enumerate(results):
+                if result.id == marker:
+                    results = results[index + 1:]
+                    break
+            else:
+                raise errors.RequestedObjectNotFoundError('Command Result',
+                                                          marker)
+
+        limit = request.args.get('limit')
+        if not limit:
+            return results, None
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            raise http_exc.BadRequest('The limit must be a positive integer')
+        if len(results) > limit:
+            return results[:limit], results[limit - 1].id
+        return results, None
+
     @require_agent_token_for_command
     def api_list_commands(self, request):
         with metrics_utils.get_metrics_logger(__name__).timer('list_commands'):
+            wait = self._parse_wait(request)
             results = self.agent.list_command_results()
-            return jsonify({'commands': results})
+            # Only the last command can be running. Unlike for a single
+            # command, wait=true is not supported here.
+            if wait and results:
+                self._wait_for_command(results[-1], wait)
+
+            results, next_marker = self._paginate(request, results)
+            body = {'commands': results}
+            if next_marker:
+                body['next'] = '%s?limit=%s&marker=%s' % (
+                    request.base_url, request.args['limit'], next_marker)
+            return jsonify(body)
 
     @require_agent_token_for_command
     def api_get_command(self, request, cmd):
         with metrics_utils.get_metrics_logger(__name__).timer('get_command'):
+            wait = self._parse_wait(request)
             result = self.agent.get_command_result(cmd)
-            wait = request.args.get('wait')
 
-            if wait and wait.lower() == 'true':
+            if wait is None:
                 result.join()
+            else:
+                self._wait_for_command(result, wait)
 
             return jsonify(result)
 
+    def _stream_events(self, result, last_id):
+        encoder = encoding.RESTJSONEncoder()
+        while True:
+            events = result.get_events(last_id, timeout=_EVENT_KEEPALIVE)
+            if not events:
+                # The command is done before its status is published, end
+                # the stream only once the status event has been sent.
+                if result.has_final_status():
+                    return
+                # Detect closed connections and keep proxies from timing out
+                yield b': keepalive\n\n'
+                continue
+            for event in events:
+                last_id = event['id']
+                yield ('id: %d\nevent: %s\ndata: %s\n\n'
+                       % (last_id, event['event'], encoder.encode(event))
+                       ).encode('utf-8')
+                if event['event'] == 'status':
+                    return
+
+    @require_agent_token_for_command
+    def api_command_events(self, request, cmd):
+        result = self.agent.get_command_result(cmd)
+        last_id = (request.headers.get('Last-Event-ID')
+                   or request.args.get('last_event_id') or 0)
+        try:
+            last_id = int(last_id)
+        except ValueError:
+            raise http_exc.BadRequest('Invalid last event ID %s' % last_id)
+
+        # The stream occupies a thread of the server until the command
+        # finishes, it shares the limit of waiting requests.
+        if self._waiters is None or not self._waiters.acquire(blocking=False):
+            raise http_exc.ServiceUnavailable(
+                'Too many requests are waiting for commands')
+        response = werkzeug.Response(self._stream_events(result, last_id),
+                                     mimetype='text/event-stream',
+                                     headers={'Cache-Control': 'no-cache'})
+        response.call_on_close(self._waiters.release)
+        return response
+
     @require_agent_token_for_command
     def api_run_command(self, request):
         body = request.get_json(force=True)
@@ -311,3 +477,30 @@ class Application(object):
             if wait and wait.lower() == 'true':
                 result.join()
             return jsonify(result)
+
+    def require_swarm_signature(func):
+        # NOTE: peers cannot know the agent token of this node, requests
+        # from them are signed with the key shared by all agents instead.
+        def wrapper(self, request, *args, **kwargs):
+            if not swarm.enabled():
+                raise http_exc.NotFound('Image sharing is not enabled')
+            if not swarm.verify(request.headers.get('Authorization'),
+                                request.path):
+                raise http_exc.Unauthorized('Signature invalid.')
+            return func(self, request, *args, **kwargs)
+        return wrapper
+
+    @require_swarm_signature
+    def api_swarm_image(self, request, key):
+        info = swarm.describe(key)
+        if info is None:
+            raise http_exc.NotFound('Image %s is not shared' % key)
+        return jsonify(info)
+
+    @require_swarm_signature
+    def api_swarm_chunk(self, request, key, index):
+        data = swarm.read_chunk(key, index)
+        if data is None:
+            raise http_exc.NotFound('Chunk %d of image %s is not available'
+                                    % (index, key))
+        return werkzeug.Response(data, mimetype='application/octet-stream')
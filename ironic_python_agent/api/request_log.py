@@ -18,8 +18,13 @@ import time
 
 from oslo_log import log
 
+from ironic_python_agent.metrics_lib import metrics_utils
+
 LOG = log.getLogger('ironic_python_agent.api')
 
+# WSGI environment key the application stores the matched endpoint in
+ENDPOINT_KEY = 'ironic_python_agent.endpoint'
+
 
 def get_real_ip(environ):
     """Safely retrieves the real IP address from a WSGI request."""
@@ -39,8 +44,34 @@ def get_real_ip(environ):
         return environ.get('REMOTE_ADDR')
 
 
+class _ClosingResponse(object):
+    """Pass a response body through and call a function once it is sent."""
+
+    def __init__(self, response, on_close):
+        self._response = response
+        self._on_close = on_close
+
+    def __iter__(self):
+        return iter(self._response)
+
+    def close(self):
+        try:
+            close = getattr(self._response, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            on_close, self._on_close = self._on_close, None
+            if on_close is not None:
+                on_close()
+
+
 class RequestLogMiddleware(object):
-    """Middleware to log request details for debugging."""
+    """Middleware to log request details for debugging.
+
+    Also sends the duration of requests as timers and their status codes as
+    counters to the metrics backend, per API endpoint, and adds the time
+    spent in the application to the Server-Timing header.
+    """
 
     def __init__(self, app):
         self.app = app
@@ -69,16 +100,13 @@ class RequestLogMiddleware(object):
                 status_code = int(status.split(' ', 1)[0])
             except (ValueError, IndexError):
                 status_code = 0
+            # The body of non-streamed responses is ready at this point
+            headers = list(headers) + [
+                ('Server-Timing',
+                 'app;dur=%.1f' % ((time.time() - start_time) * 1000))]
             return start_response(status, headers, exc_info)
 
-        # Process the request
-        try:
-            response = self.app(environ, logging_start_response)
-            # Ensure response is consumed if it's a generator
-            if isinstance(response, collections.abc.Iterator):
-                response = list(response)
-            return response
-        finally:
+        def finish():
             # Calculate request duration
             duration = time.time() - start_time
             duration_ms = round(duration * 1000, 2)
@@ -91,3 +119,23 @@ class RequestLogMiddleware(object):
                       'status': status_code or 'unknown',
                       'duration': duration_ms,
                       'source_ip': get_real_ip(environ) or 'unknown'})
+
+            endpoint = environ.get(ENDPOINT_KEY) or 'unknown'
+            metrics = metrics_utils.get_metrics_logger(__name__)
+            metrics.send_timer('request.%s' % endpoint, duration_ms)
+            metrics.send_counter('status.%s.%s'
+                                 % (endpoint, status_code or 'unknown'), 1)
+
+        # Process the request
+        try:
+            response = self.app(environ, logging_start_response)
+        except BaseException:
+            finish()
+            raise
+
+        # Do not buffer generators (e.g. event streams), finish once the
+        # server has sent the body and closed the response.
+        if isinstance(response, collections.abc.Iterator):
+            return _ClosingResponse(response, finish)
+        finish()
+        return response
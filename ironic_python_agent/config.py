@@ -15,6 +15,8 @@
 from oslo_config import cfg
 from oslo_log import log as logging
 
+from ironic_python_agent.metrics_lib.metrics_prometheus import (
+    prometheus_opts)
 from ironic_python_agent.metrics_lib.metrics_statsd import statsd_opts
 from ironic_python_agent.metrics_lib.metrics_utils import metrics_opts
 from ironic_python_agent import netutils
@@ -59,6 +61,45 @@ cli_opts = [
                 help='The port to listen on. '
                      'Can be supplied as "ipa-listen-port" kernel parameter.'),
 
+    cfg.IntOpt('api_max_command_wait',
+               min=0,
+               default=int(APARAMS.get('ipa-api-max-command-wait', 60)),
+               help='Maximum time (in seconds) a request with the '
+                    '"wait=<seconds>" query option can wait for a command '
+                    'to finish. Longer waits are shortened to this value. '
+                    'Can be supplied as "ipa-api-max-command-wait" kernel '
+                    'parameter.'),
+
+    cfg.IntOpt('api_max_waiting_requests',
+               min=0,
+               default=int(APARAMS.get('ipa-api-max-waiting-requests', 4)),
+               help='Maximum number of requests that can wait for a command '
+                    'to finish at the same time. Each of them occupies one '
+                    'of the 10 threads of the API server, further requests '
+                    'return the current state of the command immediately. '
+                    'Can be supplied as "ipa-api-max-waiting-requests" '
+                    'kernel parameter.'),
+
+    cfg.IntOpt('command_history_size',
+               min=1,
+               default=int(APARAMS.get('ipa-command-history-size', 100)),
+               help='Maximum number of command results kept by the agent. '
+                    'The oldest finished results are removed first. '
+                    'Can be supplied as "ipa-command-history-size" kernel '
+                    'parameter.'),
+
+    cfg.IntOpt('command_history_max_bytes',
+               min=0,
+               default=int(APARAMS.get('ipa-command-history-max-bytes',
+                                       8 * 1024 * 1024)),
+               help='Maximum approximate size (in bytes) of the serialized '
+                    'command results kept by the agent. The oldest finished '
+                    'results are removed first, the most recent one is '
+                    'always kept. Large parameters of finished commands '
+                    '(e.g. configuration drives) are replaced by summaries '
+                    'beforehand. 0 disables the limit. Can be supplied as '
+                    '"ipa-command-history-max-bytes" kernel parameter.'),
+
     # This is intentionally not settable via kernel command line, as it
     # requires configuration parameters which are not configurable over
     # the command line and require files-on-disk.
@@ -200,6 +241,16 @@ cli_opts = [
                 deprecated_for_removal=True,
                 deprecated_reason="Use the lldp collector instead"),
 
+    cfg.BoolOpt('lldp_listener',
+                default=APARAMS.get('ipa-lldp-listener', False),
+                help='Listen for LLDP packets on all network interfaces in '
+                     'the background from the start of the agent, and keep '
+                     'the last packet received on each interface for its '
+                     'advertised time-to-live. Collecting LLDP data then '
+                     'only waits (up to lldp_timeout) for the interfaces '
+                     'without a valid packet. Can be supplied as '
+                     '"ipa-lldp-listener" kernel parameter.'),
+
     cfg.StrOpt('inspection_callback_url',
                default=APARAMS.get('ipa-inspection-callback-url'),
                help='Endpoint(s) to send inspection data to. If set, hardware '
@@ -219,6 +270,19 @@ cli_opts = [
                     'kernel parameter.'
                     % INSPECTION_DEFAULT_COLLECTORS),
 
+    cfg.IntOpt('inspection_collectors_concurrency',
+               min=1,
+               default=int(APARAMS.get(
+                   'ipa-inspection-collectors-concurrency', 1)),
+               help='Number of inspection collectors run at the same time. '
+                    'The default of 1 runs them one after another in the '
+                    'order of inspection_collectors. Otherwise a collector '
+                    'only waits for the preceding collectors it depends '
+                    'on, and the time spent in each collector is reported '
+                    'in the inspection data. Can be supplied as '
+                    '"ipa-inspection-collectors-concurrency" kernel '
+                    'parameter.'),
+
     cfg.IntOpt('inspection_dhcp_wait_timeout',
                min=0,
                default=APARAMS.get('ipa-inspection-dhcp-wait-timeout',
@@ -247,6 +311,72 @@ cli_opts = [
                     'initialize before proceeding with any actions. '
                     'Can be supplied as "ipa-hardware-initialization-delay" '
                     'kernel parameter.'),
+    cfg.IntOpt('inventory_collection_concurrency',
+               min=1,
+               default=int(APARAMS.get(
+                   'ipa-inventory-collection-concurrency', 1)),
+               help='Number of sections of the hardware inventory (network '
+                    'interfaces, CPUs, disks, memory, BMC, system vendor, '
+                    'boot mode) collected at the same time. The default of '
+                    '1 collects them one after another. Can be supplied as '
+                    '"ipa-inventory-collection-concurrency" kernel '
+                    'parameter.'),
+    cfg.IntOpt('inventory_collection_timeout',
+               min=0,
+               default=int(APARAMS.get(
+                   'ipa-inventory-collection-timeout', 0)),
+               help='Maximum time (in seconds) to wait for each section of '
+                    'the hardware inventory when it is collected '
+                    'concurrently, counted from the start of the section. '
+                    'The collection fails when a section times out, except '
+                    'for the BMC addresses and the hostname, which are '
+                    'left out of the inventory. 0 (the default) waits '
+                    'without a limit. '
+                    'Can be supplied as "ipa-inventory-collection-timeout" '
+                    'kernel parameter.'),
+    cfg.BoolOpt('ipmi_native_client',
+                default=APARAMS.get('ipa-ipmi-native-client', False),
+                help='Discover the BMC network configuration by talking to '
+                     'the BMC through the OpenIPMI device (/dev/ipmi0) '
+                     'instead of running ipmitool for every LAN channel. '
+                     'The parameters of all channels are requested at '
+                     'once. ipmitool is still used if the device cannot '
+                     'be used. Can be supplied as "ipa-ipmi-native-client" '
+                     'kernel parameter.'),
+    cfg.BoolOpt('inventory_udev_monitor',
+                default=APARAMS.get('ipa-inventory-udev-monitor', False),
+                help='Cache the hardware inventory and the list of block '
+                     'devices, and invalidate them when udev reports an '
+                     'event for a block or network device (hot-plug, '
+                     'partitioning, RAID assembly, etc). Without it, the '
+                     'list of block devices is read again every time and '
+                     'the hardware inventory is only collected once. Can '
+                     'be supplied as "ipa-inventory-udev-monitor" kernel '
+                     'parameter.'),
+    cfg.IntOpt('execute_cache_ttl',
+               min=0,
+               default=int(APARAMS.get('ipa-execute-cache-ttl', 0)),
+               help='Time (in seconds) for which the output of read-only '
+                    'commands such as lsblk, lscpu, lshw, blkid, dmidecode, '
+                    '"mdadm --detail" or "sgdisk -v" is reused when the '
+                    'same command is run again with the same environment. '
+                    'Running a command that changes block devices '
+                    '(parted, wipefs, mkfs, "mdadm --create", '
+                    '"sgdisk -Z", etc) drops all the cached output. '
+                    'Changes made without running a command are not '
+                    'detected, keep this value short. 0 (the default) '
+                    'disables the cache. Can be supplied as '
+                    '"ipa-execute-cache-ttl" kernel parameter.'),
+    cfg.IntOpt('execution_history_size',
+               min=0,
+               default=int(APARAMS.get('ipa-execution-history-size', 500)),
+               help='Number of the most recent external commands for which '
+                    'the command line, duration, exit code, output size '
+                    'and calling step are kept and exposed through the '
+                    '/v1/executions API endpoint. 0 disables the history. '
+                    'Durations are also sent as execute.<program> timers '
+                    'to the metrics backend. Can be supplied as '
+                    '"ipa-execution-history-size" kernel parameter.'),
 
     cfg.IntOpt('disk_wait_attempts',
                min=0,
@@ -265,6 +395,24 @@ cli_opts = [
                     'in inventory. Set to zero to disable. '
                     'Can be supplied as "ipa-disk-wait-delay" '
                     'kernel parameter.'),
+    cfg.StrOpt('disk_erase_method',
+               default=APARAMS.get('ipa-disk-erase-method', 'shred'),
+               choices=['shred', 'native'],
+               help='How to overwrite block devices when secure erase is '
+                    'not available: "shred" runs the shred utility, '
+                    '"native" overwrites devices from the agent with '
+                    'several parallel streams of direct writes and zeroes '
+                    'them with BLKZEROOUT where the device offloads it, '
+                    'reporting its progress in the command result. Both '
+                    'honour the agent_erase_devices_iterations and '
+                    'agent_erase_devices_zeroize settings. Can be supplied '
+                    'as "ipa-disk-erase-method" kernel parameter.'),
+    cfg.IntOpt('disk_erase_streams', min=1,
+               default=int(APARAMS.get('ipa-disk-erase-streams', 4)),
+               help='Number of writes in flight at the same time on each '
+                    'device when disk_erase_method is "native". Can be '
+                    'supplied as "ipa-disk-erase-streams" kernel '
+                    'parameter.'),
     cfg.BoolOpt('insecure',
                 default=APARAMS.get('ipa-insecure', False),
                 help='Verify HTTPS connections. Can be supplied as '
@@ -295,6 +443,23 @@ cli_opts = [
                     'the bare metal introspection service when the '
                     '``ironic-collect-introspection-data`` program is '
                     'executing in daemon mode.'),
+    cfg.BoolOpt('inspection_compression',
+                default=APARAMS.get('ipa-inspection-compression', False),
+                help='Compress the inspection data posted to the bare metal '
+                     'inspection service with gzip. If the service rejects '
+                     'compressed data, it is posted uncompressed from then '
+                     'on. Can be supplied as "ipa-inspection-compression" '
+                     'kernel parameter.'),
+    cfg.BoolOpt('inspection_delta_posts',
+                default=APARAMS.get('ipa-inspection-delta-posts', False),
+                help='After the inspection data has been accepted once, '
+                     'only post the fields that changed since, together '
+                     'with the list of the unchanged fields in '
+                     '"unchanged_fields". This is mostly useful with '
+                     'introspection_daemon and requires an inspection '
+                     'service that merges such partial data with the data '
+                     'it received before. Can be supplied as '
+                     '"ipa-inspection-delta-posts" kernel parameter.'),
     cfg.StrOpt('ntp_server',
                default=APARAMS.get('ipa-ntp-server', None),
                help='Address of a single NTP server against which the '
@@ -355,6 +520,142 @@ cli_opts = [
                     'downloading an image. If the download exceeds this '
                     'duration, it will be aborted regardless of retry or '
                     'connection success.'),
+    cfg.IntOpt('image_download_parallel_streams', min=1,
+               default=int(APARAMS.get(
+                   'ipa-image-download-parallel-streams', 1)),
+               help='Number of concurrent connections used to download an '
+                    'image. When set to more than 1 and the image server '
+                    'advertises "Accept-Ranges: bytes" together with the '
+                    'image size, the image is fetched as a set of HTTP '
+                    'byte ranges which are written out in order. Servers '
+                    'without range support are always downloaded over a '
+                    'single stream. Can be supplied as '
+                    '"ipa-image-download-parallel-streams" kernel '
+                    'parameter.'),
+    cfg.IntOpt('image_download_range_size', min=1,
+               default=int(APARAMS.get(
+                   'ipa-image-download-range-size', 16)),
+               help='Size (in MiB) of a single byte range requested when '
+                    'downloading an image over several connections. Up to '
+                    'image_download_parallel_streams ranges are held in '
+                    'memory at a time. Can be supplied as '
+                    '"ipa-image-download-range-size" kernel parameter.'),
+    cfg.BoolOpt('image_download_resume',
+                default=APARAMS.get('ipa-image-download-resume', True),
+                help='Whether a failed image download is retried from the '
+                     'last written offset using an HTTP range request, '
+                     'rather than from the start. Only used with image '
+                     'servers advertising "Accept-Ranges: bytes". Can be '
+                     'supplied as "ipa-image-download-resume" kernel '
+                     'parameter.'),
+    cfg.BoolOpt('image_write_pipeline',
+                default=APARAMS.get('ipa-image-write-pipeline', False),
+                help='Write downloaded images through a pipeline in which '
+                     'receiving data from the network, calculating the '
+                     'checksum and writing to disk (using O_DIRECT where '
+                     'supported) run in separate threads. Applies both to '
+                     'images streamed onto a device and to images cached '
+                     'in the ramdisk. Can be supplied as '
+                     '"ipa-image-write-pipeline" kernel parameter.'),
+    cfg.IntOpt('image_write_chunk_size', min=1,
+               default=int(APARAMS.get('ipa-image-write-chunk-size', 4)),
+               help='Size (in MiB) of the buffers used by the image write '
+                    'pipeline. Can be supplied as '
+                    '"ipa-image-write-chunk-size" kernel parameter.'),
+    cfg.IntOpt('image_write_queue_depth', min=2,
+               default=int(APARAMS.get('ipa-image-write-queue-depth', 8)),
+               help='Number of buffers in flight in the image write '
+                    'pipeline. The memory used is this value multiplied by '
+                    'image_write_chunk_size. Can be supplied as '
+                    '"ipa-image-write-queue-depth" kernel parameter.'),
+    cfg.BoolOpt('image_write_sparse',
+                default=APARAMS.get('ipa-image-write-sparse', False),
+                help='Skip writing blocks consisting only of zeroes when '
+                     'writing raw images to a device, zeroing them with '
+                     'BLKZEROOUT instead if the device offloads it (reports '
+                     'a non-zero write_zeroes_max_bytes). Speeds up '
+                     'deployment of mostly empty disk images. Can be '
+                     'supplied as "ipa-image-write-sparse" kernel '
+                     'parameter.'),
+    cfg.BoolOpt('image_stream_convert',
+                default=APARAMS.get('ipa-image-stream-convert', False),
+                help='Convert QCOW2 whole disk images onto the target '
+                     'device while they are downloaded, instead of caching '
+                     'the whole image in the ramdisk and converting it '
+                     'with qemu-img afterwards. The image header is still '
+                     'inspected before anything is written. Images that '
+                     'cannot be converted this way fall back to the '
+                     'cached path. Can be supplied as '
+                     '"ipa-image-stream-convert" kernel parameter.'),
+    cfg.IntOpt('image_stream_spill_size', min=0,
+               default=int(APARAMS.get('ipa-image-stream-spill-size', 256)),
+               help='Maximum amount of data (in MiB) of a streamed QCOW2 '
+                    'image that is held back in a temporary file because '
+                    'it arrived before the tables mapping it. Can be '
+                    'supplied as "ipa-image-stream-spill-size" kernel '
+                    'parameter.'),
+    cfg.StrOpt('image_cache_dir',
+               default=APARAMS.get('ipa-image-cache-dir'),
+               help='Directory of a cache of downloaded images, keyed by '
+                    'their os_hash_value, which is shared by all deploys '
+                    'during the lifetime of the ramdisk. Images found in '
+                    'the cache are not downloaded again. Must not be on '
+                    'a disk that images are written to. The cache is '
+                    'disabled if unset. Can be supplied as '
+                    '"ipa-image-cache-dir" kernel parameter.'),
+    cfg.StrOpt('image_cache_device',
+               default=APARAMS.get('ipa-image-cache-device'),
+               help='A device holding a file system, for example a spare '
+                    'local partition, to mount on image_cache_dir before '
+                    'using the image cache. It must not be located on the '
+                    'disk images are written to, deployments to that disk '
+                    'fail. If unset, image_cache_dir is '
+                    'used as is, which usually places the cache in RAM. '
+                    'Can be supplied as "ipa-image-cache-device" kernel '
+                    'parameter.'),
+    cfg.IntOpt('image_cache_size', min=0,
+               default=int(APARAMS.get('ipa-image-cache-size', 0)),
+               help='Maximum total size (in MiB) of the images in the image '
+                    'cache. The least recently used images are evicted '
+                    'when it is exceeded. The cache is disabled if 0. Can '
+                    'be supplied as "ipa-image-cache-size" kernel '
+                    'parameter.'),
+    cfg.BoolOpt('image_swarm',
+                default=APARAMS.get('ipa-image-swarm', False),
+                help='Share downloaded images with other agents and fetch '
+                     'images from them before falling back to the image '
+                     'server. Agents announce themselves via multicast '
+                     'DNS and serve chunks of the images they hold through '
+                     'their API. Every chunk is verified against a hash '
+                     'manifest and the whole image against its checksum, '
+                     'so only images with an os_hash_value can be shared. '
+                     'Requires image_swarm_key. Can be supplied as '
+                     '"ipa-image-swarm" kernel parameter.'),
+    cfg.StrOpt('image_swarm_key',
+               default=APARAMS.get('ipa-image-swarm-key'),
+               secret=True,
+               help='Key shared by all agents allowed to exchange images. '
+                    'Requests between agents are signed with it, agents '
+                    'without it can neither fetch nor serve images. Image '
+                    'sharing is disabled if it is not set. Can be supplied '
+                    'as "ipa-image-swarm-key" kernel parameter.'),
+    cfg.ListOpt('image_swarm_peers',
+                default=APARAMS.get('ipa-image-swarm-peers', []),
+                help='URLs of the API of other agents to fetch images '
+                     'from, in addition to the ones discovered via '
+                     'multicast DNS. Can be supplied as '
+                     '"ipa-image-swarm-peers" kernel parameter.'),
+    cfg.IntOpt('image_swarm_chunk_size', min=1, max=256,
+               default=int(APARAMS.get('ipa-image-swarm-chunk-size', 16)),
+               help='Size (in MiB) of the chunks of shared images. Each '
+                    'chunk is hashed separately and fetched from any peer '
+                    'holding it. Can be supplied as '
+                    '"ipa-image-swarm-chunk-size" kernel parameter.'),
+    cfg.IntOpt('image_swarm_concurrency', min=1,
+               default=int(APARAMS.get('ipa-image-swarm-concurrency', 4)),
+               help='Number of chunks fetched from peers at the same time. '
+                    'Can be supplied as "ipa-image-swarm-concurrency" '
+                    'kernel parameter.'),
     cfg.StrOpt('ironic_api_version',
                default=APARAMS.get('ipa-ironic-api-version', None),
                help='Ironic API version in format "x.x". If not set, the API '
@@ -531,6 +832,7 @@ def list_opts():
             ('disk_partitioner', disk_part_opts),
             ('metrics', metrics_opts),
             ('metrics_statsd', statsd_opts),
+            ('metrics_prometheus', prometheus_opts),
             ('container', container_opts)
             ]
 
@@ -542,6 +844,7 @@ def populate_config():
     CONF.register_opts(disk_part_opts, group='disk_partitioner')
     CONF.register_opts(metrics_opts, group='metrics')
     CONF.register_opts(statsd_opts, group='metrics_statsd')
+    CONF.register_opts(prometheus_opts, group='metrics_prometheus')
     CONF.register_opts(container_opts, group='container')
 
 
@@ -0,0 +1,192 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process overwriting of block devices, an alternative to shred."""
+
+from concurrent import futures
+import errno
+import mmap
+import os
+import stat
+import threading
+import time
+
+from oslo_log import log
+from oslo_utils import units
+
+from ironic_python_agent import image_writer
+
+LOG = log.getLogger(__name__)
+
+# Size of the buffers written at once by each stream.
+BUFFER_SIZE = 4 * units.Mi
+# Size of the ranges zeroed at once with an ioctl.
+ZERO_RANGE_SIZE = 256 * units.Mi
+
+# Minimum interval (in seconds) between two progress reports.
+_REPORT_INTERVAL = 5
+
+
+class _Aborted(Exception):
+    """Raised inside a stream when another stream has failed."""
+
+
+class _Progress(object):
+
+    def __init__(self, total, callback):
+        self._total = total
+        self._callback = callback
+        self._lock = threading.Lock()
+        self._written = 0
+        self._started = time.monotonic()
+        self._reported = None
+
+    def add(self, length, force=False):
+        with self._lock:
+            self._written += length
+            now = time.monotonic()
+            if (self._callback is None or not force
+                    and self._reported is not None
+                    and now - self._reported < _REPORT_INTERVAL):
+                return
+            self._reported = now
+            elapsed = now - self._started
+            self._callback(
+                bytes_written=self._written, total_bytes=self._total,
+                throughput=int(self._written / elapsed) if elapsed else 0)
+
+
+def _open(path):
+    try:
+        return os.open(path, os.O_WRONLY | os.O_DIRECT)
+    except OSError as e:
+        # Not supported by some file systems, e.g. tmpfs
+        if e.errno != errno.EINVAL:
+            raise
+        LOG.debug('Unable to open %s with O_DIRECT, using buffered '
+                  'writes', path)
+        return os.open(path, os.O_WRONLY)
+
+
+def _run_streams(ranges, streams, write):
+    """Call write(start, length) for ranges spread over several threads.
+
+    Range i is handled by stream i modulo the number of streams, so that
+    the streams progress through the device together.
+    """
+    abort = threading.Event()
+
+    def _stream(index):
+        try:
+            for start, length in ranges[index::streams]:
+                if abort.is_set():
+                    raise _Aborted()
+                write(start, length)
+        except Exception:
+            abort.set()
+            raise
+
+    streams = max(1, min(streams, len(ranges)))
+    with futures.ThreadPoolExecutor(max_workers=streams,
+                                    thread_name_prefix='erase') as executor:
+        results = [executor.submit(_stream, index)
+                   for index in range(streams)]
+    errors = [result.exception() for result in results
+              if result.exception() is not None]
+    # Report the failure that caused the other streams to abort
+    for error in errors:
+        if not isinstance(error, _Aborted):
+            raise error
+
+
+def _split(start, size, chunk_size):
+    return [(offset, min(chunk_size, size - offset))
+            for offset in range(start, size, chunk_size)]
+
+
+def _write_pass(fd, size, streams, progress, random_data):
+    local = threading.local()
+
+    def _write(start, length):
+        # Page-aligned, as required by O_DIRECT.
+        buf = getattr(local, 'buf', None)
+        if buf is None:
+            buf = local.buf = memoryview(mmap.mmap(-1, BUFFER_SIZE))
+        if random_data:
+            buf[:length] = os.urandom(length)
+        image_writer.pwrite_all(fd, buf[:length], start)
+        progress.add(length)
+
+    _run_streams(_split(0, size, BUFFER_SIZE), streams, _write)
+
+
+def _zero_pass(fd, size, streams, progress, zeroout):
+    if zeroout and size:
+        first = min(ZERO_RANGE_SIZE, size)
+        if image_writer.zero_device_range(fd, 0, first):
+            progress.add(first)
+
+            def _zero(start, length):
+                if not image_writer.zero_device_range(fd, start, length):
+                    raise OSError(errno.EOPNOTSUPP,
+                                  'Zeroing stopped being supported')
+                progress.add(length)
+
+            _run_streams(_split(first, size, ZERO_RANGE_SIZE), streams,
+                         _zero)
+            return
+    _write_pass(fd, size, streams, progress, random_data=False)
+
+
+def erase(path, iterations=1, zeroize=True, streams=4, callback=None):
+    """Overwrite a block device, like shred does.
+
+    The device is overwritten with random data the given number of times,
+    then optionally with zeroes. Each pass is split between several
+    streams writing large page-aligned buffers with O_DIRECT in parallel.
+    The zero pass uses BLKZEROOUT if the device offloads it, and writes
+    zeroes otherwise.
+
+    :param path: Path to the device.
+    :param iterations: Number of passes of random data.
+    :param zeroize: Whether to finish with a pass of zeroes.
+    :param streams: Number of writes in flight at the same time.
+    :param callback: Optional callable receiving the progress as keyword
+        arguments bytes_written, total_bytes and throughput (in bytes per
+        second).
+    :raises: OSError if the device cannot be overwritten.
+    """
+    fd = _open(path)
+    try:
+        st = os.fstat(fd)
+        is_device = stat.S_ISBLK(st.st_mode)
+        size = os.lseek(fd, 0, os.SEEK_END) if is_device else st.st_size
+        passes = iterations + (1 if zeroize else 0)
+        progress = _Progress(size * passes, callback)
+        LOG.info('Erasing %(path)s of %(size)s bytes with %(passes)s '
+                 'passes using %(streams)s streams',
+                 {'path': path, 'size': size, 'passes': passes,
+                  'streams': streams})
+        for iteration in range(iterations):
+            LOG.debug('Writing random data to %(path)s, pass %(pass)s of '
+                      '%(passes)s', {'path': path, 'pass': iteration + 1,
+                                     'passes': passes})
+            _write_pass(fd, size, streams, progress, random_data=True)
+        if zeroize:
+            LOG.debug('Zeroing %s', path)
+            _zero_pass(fd, size, streams, progress,
+                       is_device and image_writer.write_zeroes_offloaded(
+                           st.st_rdev))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    progress.add(0, force=True)
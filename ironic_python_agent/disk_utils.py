@@ -34,6 +34,7 @@ import tenacity
 
 from ironic_python_agent import disk_partitioner
 from ironic_python_agent import errors
+from ironic_python_agent import image_writer
 from ironic_python_agent import qemu_img
 from ironic_python_agent import utils
 
@@ -480,7 +481,15 @@ def populate_image(src, dst, conv_flags=None, source_format=None, is_raw=False,
             #  are actually in need of conversion. Those cases can no longer
             #  be transparently handled safely.
             LOG.info('Writing raw image %s to device %s', src, dst)
-            dd(src, dst, conv_flags=conv_flags)
+            if CONF.image_write_sparse:
+                # NOTE: dd's conv=sparse merely seeks over zero blocks,
+                # leaving whatever was on the device before in place.
+                # Skipped blocks have to be explicitly zeroed instead.
+                skipped = image_writer.copy_sparse(src, dst)
+                LOG.debug('Skipped writing %(size)s bytes of zeroes to '
+                          '%(dst)s', {'size': skipped, 'dst': dst})
+            else:
+                dd(src, dst, conv_flags=conv_flags)
         else:
             qemu_img.convert_image(src, dst,
                                    out_format=out_format,
@@ -489,6 +498,8 @@ def populate_image(src, dst, conv_flags=None, source_format=None, is_raw=False,
                                    **convert_args)
     except processutils.ProcessExecutionError as e:
         raise errors.ImageWriteError(dst, e.exit_code, e.stdout, e.stderr)
+    except OSError as e:
+        raise errors.ImageWriteError(dst, e.errno, None, e.strerror)
 
 
 def block_uuid(dev):
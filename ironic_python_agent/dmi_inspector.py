@@ -15,12 +15,14 @@
 from oslo_concurrency import processutils
 from oslo_log import log as logging
 
+from ironic_python_agent import inspector
 from ironic_python_agent import utils
 
 
 LOG = logging.getLogger(__name__)
 
 
+@inspector.requires()
 def collect_dmidecode_info(data, failures):
     """Collect detailed processor, memory and bios info.
 
@@ -191,6 +191,11 @@ class ImageDownloadFatalError(ImageDownloadError):
     pass
 
 
+class ImageDownloadRangeError(ImageDownloadError):
+    """Raised when the image server does not honour a byte range request."""
+    pass
+
+
 class ImageChecksumError(RESTError):
     """Error raised when an image fails to verify against its checksum."""
 
@@ -248,6 +253,24 @@ class BlockDeviceError(RESTError):
         super(BlockDeviceError, self).__init__(details)
 
 
+class InventoryCollectionError(RESTError):
+    """Error raised when the hardware inventory cannot be collected."""
+
+    message = 'Error collecting hardware inventory'
+
+    def __init__(self, details):
+        super(InventoryCollectionError, self).__init__(details)
+
+
+class IPMIError(RESTError):
+    """Error raised when communicating with the BMC fails."""
+
+    message = 'Error communicating with the BMC'
+
+    def __init__(self, details):
+        super(IPMIError, self).__init__(details)
+
+
 class SoftwareRAIDError(RESTError):
     """Error raised when a Software RAID causes an error."""
 
@@ -461,3 +484,13 @@ class ServiceLookupFailure(RESTError):
         details = f"Cannot find {service} service through multicast."
         self.message = details
         super(RESTError, self).__init__(details)
+
+
+class ServiceRegistrationFailure(RESTError):
+    """Error raised when an mdns service registration fails."""
+
+    def __init__(self, service="unknown", error=None):
+        details = f"Cannot register {service} service through multicast: "
+        details += str(error)
+        self.message = details
+        super(RESTError, self).__init__(details)
@@ -16,7 +16,9 @@ import collections
 import functools
 import inspect
 import threading
+import time
 
+from oslo_config import cfg
 from oslo_log import log
 from oslo_utils import uuidutils
 from stevedore import extension
@@ -26,8 +28,63 @@ from ironic_python_agent import errors
 from ironic_python_agent import utils
 
 
+CONF = cfg.CONF
 LOG = log.getLogger(__name__)
 
+_CURRENT_COMMAND = threading.local()
+
+# Number of the most recent events of a command kept for new listeners
+_MAX_EVENTS = 100
+
+# Parameters of finished commands longer than this are summarized
+_MAX_PARAM_LENGTH = 256
+
+_ENCODER = encoding.RESTJSONEncoder()
+
+
+def get_current_command():
+    """Get the asynchronous command executed by the calling thread.
+
+    :returns: an AsyncCommandResult or None if the calling thread does not
+              execute an asynchronous command.
+    """
+    return getattr(_CURRENT_COMMAND, 'command', None)
+
+
+def report_progress(**fields):
+    """Update the progress of the command executed by the calling thread.
+
+    Does nothing if the calling thread does not execute an asynchronous
+    command.
+
+    :param fields: the fields of the progress to update, e.g. ``step``.
+    """
+    command = get_current_command()
+    if command is not None:
+        command.update_progress(**fields)
+
+
+def _summarize(value):
+    """Replace large values in command parameters by short descriptions."""
+    if isinstance(value, dict):
+        return {key: _summarize(item) for key, item in value.items()}
+    elif isinstance(value, (list, tuple)):
+        if len(value) > _MAX_PARAM_LENGTH:
+            return '<%d items>' % len(value)
+        return [_summarize(item) for item in value]
+    elif isinstance(value, (str, bytes)) and len(value) > _MAX_PARAM_LENGTH:
+        return '<%d %s>' % (len(value),
+                            'characters' if isinstance(value, str)
+                            else 'bytes')
+    return value
+
+
+def _estimate_size(value):
+    try:
+        return len(_ENCODER.encode(value))
+    except (TypeError, ValueError):
+        return len(str(value))
+
 
 class AgentCommandStatus(object):
     """Mapping of agent command statuses."""
@@ -58,6 +115,12 @@ class BaseCommandResult(encoding.SerializableComparable):
         self.command_status = AgentCommandStatus.RUNNING
         self.command_error = None
         self.command_result = None
+        self._progress = {}
+        self._events = collections.deque(maxlen=_MAX_EVENTS)
+        self._last_event_id = 0
+        self._status_event_id = None
+        self._event_condition = threading.Condition()
+        self._size = None
 
     def __str__(self):
         return ("Command name: %(name)s, "
@@ -75,6 +138,104 @@ class BaseCommandResult(encoding.SerializableComparable):
         """
         return self.command_status != AgentCommandStatus.RUNNING
 
+    def compact(self):
+        """Replace the large parameters of a finished command by summaries.
+
+        Long strings (e.g. configuration drives) and lists in the parameters
+        are replaced by their length. Does nothing if the command is still
+        running.
+
+        :returns: the approximate size of the serialized command in bytes,
+                  or None if the command is still running.
+        """
+        if self._size is None and self.is_done():
+            self.command_params = _summarize(self.command_params)
+            self._size = (_estimate_size(self)
+                          + _estimate_size(self.command_params))
+        return self._size
+
+    def publish_event(self, event, **data):
+        """Publish a structured event of the command to its listeners.
+
+        :param event: the type of the event, e.g. ``progress``.
+        :param data: serializable fields of the event.
+        :returns: the ID of the event.
+        """
+        with self._event_condition:
+            self._last_event_id += 1
+            data.update(id=self._last_event_id, event=event,
+                        time=time.time())
+            self._events.append(data)
+            self._event_condition.notify_all()
+            return self._last_event_id
+
+    def has_final_status(self):
+        """Check if the final status of the command has been published.
+
+        The command is done before its ``status`` event is published,
+        listeners must wait for the event rather than for is_done().
+
+        :returns: True if the ``status`` event has been published.
+        """
+        with self._event_condition:
+            return self._status_event_id is not None
+
+    def get_events(self, after=0, timeout=None):
+        """Get the events published after the given one.
+
+        :param after: the ID of the last event already received.
+        :param timeout: if there is no such event and the final status of
+                        the command has not been published, wait for a new
+                        event for at most this number of seconds.
+        :returns: a list of events, the oldest ones may be missing.
+        """
+        with self._event_condition:
+            if (timeout and self._last_event_id <= after
+                    and self._status_event_id is None):
+                self._event_condition.wait(timeout)
+            return [event for event in self._events if event['id'] > after]
+
+    def _publish_status(self):
+        error = self.command_error
+        with self._event_condition:
+            self._status_event_id = self.publish_event(
+                'status', command_status=self.command_status,
+                command_error=None if error is None else str(error))
+
+    def _store_progress(self, progress):
+        if self.command_status != AgentCommandStatus.RUNNING:
+            return False
+        self.command_result = {'progress': progress}
+        return True
+
+    def set_progress(self, progress):
+        """Publish the progress of the command while it is running.
+
+        The progress is exposed as the command result until the command
+        completes and its actual result replaces it. It is also published
+        as a ``progress`` event.
+
+        :param progress: a serializable object describing the progress.
+        """
+        with self._event_condition:
+            self._progress = progress
+            if self._store_progress(progress):
+                self.publish_event('progress', progress=progress)
+
+    def update_progress(self, **fields):
+        """Update some fields of the progress of the command.
+
+        For example, ``bytes_written`` for image downloads, ``devices`` for
+        disk erasure or ``step`` for the current step.
+
+        :param fields: the fields of the progress to update.
+        """
+        with self._event_condition:
+            progress = (dict(self._progress)
+                        if isinstance(self._progress, dict) else {})
+            progress.update(fields)
+            self.set_progress(progress)
+
     def join(self):
         """:returns: result of completed command."""
         return self
@@ -115,6 +276,8 @@ class SyncCommandResult(BaseCommandResult):
         else:
             self.command_status = AgentCommandStatus.FAILED
             self.command_error = result_or_error
+        self._publish_status()
+        self.compact()
 
 
 class AsyncCommandResult(BaseCommandResult):
@@ -168,10 +331,16 @@ class AsyncCommandResult(BaseCommandResult):
         with self.command_state_lock:
             return super(AsyncCommandResult, self).is_done()
 
+    def _store_progress(self, progress):
+        with self.command_state_lock:
+            return super(AsyncCommandResult, self)._store_progress(progress)
+
     def run(self):
         """Run a command."""
+        _CURRENT_COMMAND.command = self
         try:
-            result = self.execute_method(**self.command_params)
+            with utils.execution_step(self.command_name):
+                result = self.execute_method(**self.command_params)
 
             if isinstance(result, (bytes, str)):
                 result = {'result': '{}: {}'.format(self.command_name, result)}
@@ -198,6 +367,9 @@ class AsyncCommandResult(BaseCommandResult):
                 self.command_error = e
                 self.command_status = AgentCommandStatus.FAILED
         finally:
+            _CURRENT_COMMAND.command = None
+            self._publish_status()
+            self.compact()
             if self.agent:
                 self.agent.force_heartbeat()
 
@@ -239,6 +411,24 @@ class ExecuteCommandMixin(object):
         ext.ext_mgr = self.ext_mgr
         return ext
 
+    def _prune_command_results(self):
+        """Make room for a new command result.
+
+        Removes the oldest results while there are too many of them or
+        their total size is over the limit. Must be called with the command
+        lock held and when no command is running.
+        """
+        total = sum(result.compact() or 0
+                    for result in self.command_results.values())
+        while self.command_results and (
+                len(self.command_results) >= CONF.command_history_size
+                or (CONF.command_history_max_bytes
+                    and total > CONF.command_history_max_bytes)):
+            _id, result = self.command_results.popitem(last=False)
+            total -= result.compact() or 0
+            LOG.debug('Removing the result of command %s from the history',
+                      result.command_name)
+
     def split_command(self, command_name):
         command_parts = command_name.split('.', 1)
         if len(command_parts) != 2:
@@ -262,6 +452,7 @@ class ExecuteCommandMixin(object):
                               'executing %(last)s', {'command': command_name,
                                                      'last': last_command})
                     raise errors.AgentIsBusy(last_command.command_name)
+            self._prune_command_results()
 
             try:
                 ext = self.get_extension(extension_part)
@@ -17,6 +17,7 @@ from oslo_log import log
 from ironic_python_agent import errors
 from ironic_python_agent.extensions import base
 from ironic_python_agent import hardware
+from ironic_python_agent import utils
 
 LOG = log.getLogger(__name__)
 
@@ -72,9 +73,11 @@ class ServiceExtension(base.BaseAgentExtension):
             LOG.error(msg)
             raise ValueError(msg)
         kwargs.update(step.get('args') or {})
+        base.report_progress(step=step['step'])
         try:
-            result = hardware.dispatch_to_managers(step['step'], node, ports,
-                                                   **kwargs)
+            with utils.execution_step(step['step']):
+                result = hardware.dispatch_to_managers(step['step'], node,
+                                                       ports, **kwargs)
         except errors.RESTError:
             LOG.exception('Error performing service step %s', step['step'])
             raise
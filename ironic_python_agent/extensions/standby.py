@@ -13,12 +13,17 @@
 # limitations under the License.
 
 import base64
+import collections
+from concurrent import futures
 import errno
+import functools
 import hashlib
+import itertools
 import json
 import os
 import re
 import tempfile
+import threading
 import time
 from urllib import parse as urlparse
 
@@ -32,7 +37,12 @@ from ironic_python_agent import disk_utils
 from ironic_python_agent import errors
 from ironic_python_agent.extensions import base
 from ironic_python_agent import hardware
+from ironic_python_agent import image_cache
+from ironic_python_agent import image_writer
+from ironic_python_agent.metrics_lib import metrics_utils
 from ironic_python_agent import partition_utils
+from ironic_python_agent import qcow2
+from ironic_python_agent import swarm
 from ironic_python_agent import utils
 
 CONF = cfg.CONF
@@ -40,6 +50,17 @@ LOG = log.getLogger(__name__)
 
 IMAGE_CHUNK_SIZE = 1024 * 1024  # 1MB
 
+# Amount of data read from the start of an image streamed for conversion
+# to inspect its format before anything is written.
+IMAGE_HEADER_SIZE = 2 * 1024 * 1024
+
+# Minimum interval (in seconds) between two reports of the download progress
+_PROGRESS_INTERVAL = 1
+
+# URLs of images advertising byte range support without honouring it, later
+# attempts to download them use a single connection.
+_RANGES_IGNORED = set()
+
 
 def _image_location(image_info):
     """Get the location of the image in the local file system.
@@ -167,12 +188,18 @@ def _gen_auth_from_oslo_conf_user_pass(image_id):
                                        image_server_password)
 
 
-def _download_with_proxy(image_info, url, image_id):
+def _download_with_proxy(image_info, url, image_id, session=None,
+                         headers=None):
     """Opens a download stream for the given URL.
 
     :param image_info: Image information dictionary.
     :param url: The URL string to request the image from.
     :param image_id: Image ID or URL for logging.
+    :param session: An optional requests session to reuse. A new
+                    TLS-enforcing session is created if not provided.
+    :param headers: Optional additional request headers. If a ``Range``
+                    header is present, the server is expected to reply
+                    with 206 Partial Content.
 
     :raises: ImageDownloadError if the download stream was not started
              properly.
@@ -200,9 +227,15 @@ def _download_with_proxy(image_info, url, image_id):
         auth_object = _gen_auth_from_oslo_conf_user_pass(image_id)
     if auth_object is not None:
         image_download_attributes['auth'] = auth_object
+    expected_status = 200
+    if headers:
+        image_download_attributes['headers'] = headers
+        if 'Range' in headers:
+            expected_status = 206
 
-    # Create TLS-enforcing session for image downloads
-    session = utils.get_requests_session()
+    if session is None:
+        # Create TLS-enforcing session for image downloads
+        session = utils.get_requests_session()
 
     for attempt in range(CONF.image_download_connection_retries + 1):
         try:
@@ -221,10 +254,17 @@ def _download_with_proxy(image_info, url, image_id):
             # processing the incoming data.
             # B113 issue is covered is the image_download_attributs list
             resp = session.get(url, **image_download_attributes)  # nosec
-            if resp.status_code != 200:
-                msg = ('Received status code {} from {}, expected 200. '
+            if expected_status == 206 and resp.status_code == 200:
+                # Never read the body here, it would be the whole image.
+                resp.close()
+                raise errors.ImageDownloadRangeError(
+                    image_id, 'Server {} ignored the byte range request '
+                    '{}'.format(url, headers['Range']))
+            if resp.status_code != expected_status:
+                msg = ('Received status code {} from {}, expected {}. '
                        'Response body: {} Response headers: {}').format(
-                    resp.status_code, url, resp.text, resp.headers)
+                    resp.status_code, url, expected_status, resp.text,
+                    resp.headers)
                 if resp.status_code < 500:
                     raise errors.ImageDownloadFatalError(image_id, msg)
                 raise errors.ImageDownloadError(image_id, msg)
@@ -242,6 +282,19 @@ def _download_with_proxy(image_info, url, image_id):
     return resp
 
 
+def _ranges_accepted(headers):
+    """Check if a response advertises support for byte range requests.
+
+    :param headers: The headers of an image download response.
+    :returns: True if the image can be requested in byte ranges.
+    """
+    if headers.get('Accept-Ranges', '').lower() != 'bytes':
+        return False
+    # Ranges apply to the encoded representation, which requests
+    # transparently decodes, so only plain bodies can be split.
+    return headers.get('Content-Encoding', 'identity') == 'identity'
+
+
 def _is_checksum_url(checksum):
     """Identify if checksum is not a url"""
     if (checksum.startswith('http://') or checksum.startswith('https://')):
@@ -400,6 +453,53 @@ def _write_whole_disk_image(image, image_info, device, source_format=None,
     disk_utils.trigger_device_rescan(device)
 
 
+def _read_image_header(chunks, size=IMAGE_HEADER_SIZE):
+    """Reads the start of an image from an iterator of chunks.
+
+    :param chunks: An iterator of chunks of the image.
+    :param size: The minimum number of bytes to read.
+    :returns: The first size bytes of the image or more, or the whole
+              image if it is shorter.
+    """
+    header = bytearray()
+    for chunk in chunks:
+        header += chunk.encode() if isinstance(chunk, str) else chunk
+        if len(header) >= size:
+            break
+    return bytes(header)
+
+
+def _inspect_image_header(image_info, header):
+    """Runs the image format safety check on the start of an image.
+
+    :param image_info: Image information dictionary.
+    :param header: The first bytes of the image.
+    :raises: InvalidImage if the image does not pass security inspection.
+    :returns: tuple of the detected image format and its virtual size.
+    """
+    with tempfile.NamedTemporaryFile(prefix='ipa-image-header-') as f:
+        f.write(header)
+        f.flush()
+        return disk_utils.get_and_validate_image_format(
+            f.name, image_info.get('disk_format'))
+
+
+def _can_stream_convert(image_info):
+    """Check if an image may be converted while it is downloaded.
+
+    :param image_info: Image information dictionary.
+    :returns: True if the image is a whole disk image in a format needing
+              conversion and streaming conversion is enabled.
+    """
+    # NOTE: the inspection of the image header relies on the format
+    # inspector, the legacy qemu-img based inspection needs the whole file.
+    return (CONF.image_stream_convert
+            and not CONF.disable_deep_image_inspection
+            and not _is_partition_image(image_info)
+            and image_info.get('disk_format')
+            not in disk_utils.RAW_LIKE_IMAGETYPES)
+
+
 def _is_partition_image(image_info: dict) -> bool:
     """Check if an image is a partition image based on it's image_info.
 
@@ -411,7 +511,7 @@ def _is_partition_image(image_info: dict) -> bool:
     return image_info.get('image_type') == 'partition'
 
 
-def _write_image(image_info, device, configdrive=None):
+def _write_image(image_info, device, configdrive=None, image_location=None):
     """Writes an image to the specified device.
 
     :param image_info: Image information dictionary.
@@ -420,12 +520,14 @@ def _write_image(image_info, device, configdrive=None):
     :param configdrive: A string containing the location of the config
                         drive as a URL OR the contents (as gzip/base64)
                         of the configdrive. Optional, defaults to None.
+    :param image_location: The local copy of the image. Defaults to the
+                           location images are downloaded to.
     :raises: ImageWriteError if the command to write the image encounters an
              error.
     :raises: InvalidImage if the image does not pass security inspection
     """
     starttime = time.time()
-    image = _image_location(image_info)
+    image = image_location or _image_location(image_info)
     ironic_disk_format = image_info.get('disk_format')
     is_raw = ironic_disk_format == 'raw'
     # NOTE(JayF): The below method call performs a required security check
@@ -547,8 +649,19 @@ class ImageDownload(object):
         self._time = time_obj or time.time()
         self._image_info = image_info
         self._request = None
+        self._url = None
+        self._validator = None
+        self._accepts_ranges = False
+        self._offset = 0
         self._bytes_transferred = 0
+        self._hash_position = 0
+        self._hash_states = collections.deque()
+        self._checkpoint = (0, None)
         self._expected_size = None
+        # The image may be written from another thread, report the progress
+        # to the command downloading it.
+        self._command = base.get_current_command()
+        self._reported = None
         checksum = image_info.get('checksum')
         retrieved_checksum = False
 
@@ -632,8 +745,15 @@ class ImageDownload(object):
                 LOG.info("Attempting to download image from %s", url)
                 self._request = _download_with_proxy(image_info, url,
                                                      image_info['id'])
-                self._expected_size = self._request.headers.get(
-                    'Content-Length')
+                self._url = url
+                headers = self._request.headers
+                self._expected_size = headers.get('Content-Length')
+                self._accepts_ranges = (_ranges_accepted(headers)
+                                        and url not in _RANGES_IGNORED)
+                # NOTE: resumed requests carry If-Range, so that a changed
+                # image is sent in full instead of being spliced.
+                self._validator = (headers.get('ETag')
+                                   or headers.get('Last-Modified'))
             except errors.ImageDownloadFatalError:
                 raise
             except errors.ImageDownloadError as e:
@@ -653,13 +773,29 @@ class ImageDownload(object):
     def __iter__(self):
         """Downloads and returns the next chunk of the image.
 
+        :returns: A chunk of the image. Size of chunk is IMAGE_CHUNK_SIZE
+                  which is a constant in this module.
+        """
+        return self.iter_chunks()
+
+    def iter_chunks(self, update_hash=True):
+        """Downloads and returns the next chunk of the image.
+
+        :param update_hash: Whether to update the checksum with each chunk.
+                            If False, the caller is responsible for passing
+                            every chunk, in order, to update_hash().
         :returns: A chunk of the image. Size of chunk is IMAGE_CHUNK_SIZE
                   which is a constant in this module.
         """
         self._last_chunk_time = None
         start_time = self._time
 
-        for chunk in self._request.iter_content(IMAGE_CHUNK_SIZE):
+        if self._ranges_supported():
+            chunks = self._iter_ranges()
+        else:
+            chunks = self._request.iter_content(IMAGE_CHUNK_SIZE)
+
+        for chunk in chunks:
 
             max_download_duration = CONF.image_download_max_duration
             if max_download_duration:
@@ -684,10 +820,12 @@ class ImageDownload(object):
                 self._last_chunk_time = time.time()
                 if isinstance(chunk, str):
                     encoded_data = chunk.encode()
-                    self._hash_algo.update(encoded_data)
+                    if update_hash:
+                        self.update_hash(encoded_data)
                     self._bytes_transferred += len(encoded_data)
                 else:
-                    self._hash_algo.update(chunk)
+                    if update_hash:
+                        self.update_hash(chunk)
                     self._bytes_transferred += len(chunk)
                 yield chunk
             elif (time.time() - self._last_chunk_time
@@ -698,6 +836,257 @@ class ImageDownload(object):
                     self._image_info['id'],
                     'Timed out reading next chunk from webserver')
 
+    def _ranges_supported(self):
+        """Check if the image can be fetched over several range requests.
+
+        :returns: True if parallel downloads are enabled and the server
+                  advertised byte range support for an image of known size
+                  spanning more than one range.
+        """
+        if (CONF.image_download_parallel_streams < 2
+                or not self._accepts_ranges):
+            return False
+        try:
+            size = int(self._expected_size)
+        except (TypeError, ValueError):
+            return False
+        return (size - self._offset
+                > CONF.image_download_range_size * units.Mi)
+
+    def _fetch_range(self, session, start, end, abort):
+        """Downloads one byte range of the image into memory.
+
+        :param session: The requests session shared by all ranges.
+        :param start: Offset of the first byte of the range.
+        :param end: Offset of the last byte of the range (inclusive).
+        :param abort: A threading.Event set when the download is abandoned.
+        :raises: ImageDownloadError if the range cannot be downloaded.
+        :returns: A bytearray with the content of the range.
+        """
+        image_id = self._image_info['id']
+        headers = {'Range': 'bytes={}-{}'.format(start, end)}
+        if self._validator:
+            headers['If-Range'] = self._validator
+        resp = _download_with_proxy(self._image_info, self._url, image_id,
+                                    session=session, headers=headers)
+        data = bytearray()
+        try:
+            for chunk in resp.iter_content(IMAGE_CHUNK_SIZE):
+                if abort.is_set():
+                    return data
+                data += chunk
+        except requests.RequestException as e:
+            raise errors.ImageDownloadError(
+                image_id, 'Failed to download bytes {}-{}: {}'.format(
+                    start, end, e))
+        finally:
+            resp.close()
+        if len(data) != end - start + 1:
+            raise errors.ImageDownloadError(
+                image_id, 'Received {} bytes for range {}-{}'.format(
+                    len(data), start, end))
+        return data
+
+    def _iter_ranges(self):
+        """Downloads the image as byte ranges over concurrent connections.
+
+        Up to image_download_parallel_streams ranges are requested at the
+        same time over a pooled session. Ranges are yielded strictly in
+        order, so consumers see the same byte stream as with a single
+        connection. If the server does not honour the range requests, the
+        image is downloaded over a single connection instead, or, if part
+        of it has already been returned, the next attempt is.
+
+        :raises: ImageDownloadRangeError if the server stops honouring range
+                 requests after part of the image has been returned.
+
+        :returns: A generator of bytes-like chunks of at most
+                  IMAGE_CHUNK_SIZE.
+        """
+        size = int(self._expected_size)
+        range_size = CONF.image_download_range_size * units.Mi
+        streams = CONF.image_download_parallel_streams
+        # The initial response only served to discover range support.
+        self._request.close()
+        LOG.info('Downloading %(size)s bytes of image %(image)s in ranges '
+                 'of %(range)s bytes over %(streams)s connections',
+                 {'size': size - self._offset,
+                  'image': self._image_info['id'],
+                  'range': range_size, 'streams': streams})
+
+        session = utils.get_requests_session(pool_connections=1,
+                                             pool_maxsize=streams)
+        offsets = iter(range(self._offset, size, range_size))
+        pending = collections.deque()
+        abort = threading.Event()
+        yielded = ranges_ignored = False
+
+        def _submit_next():
+            start = next(offsets, None)
+            if start is not None:
+                end = min(start + range_size, size) - 1
+                pending.append(executor.submit(self._fetch_range, session,
+                                               start, end, abort))
+
+        executor = futures.ThreadPoolExecutor(
+            max_workers=streams, thread_name_prefix='image-range')
+        try:
+            for _ in range(streams):
+                _submit_next()
+            while pending:
+                try:
+                    data = memoryview(pending.popleft().result())
+                except errors.ImageDownloadRangeError:
+                    self._accepts_ranges = False
+                    _RANGES_IGNORED.add(self._url)
+                    # A new attempt will download the image in one stream
+                    if yielded or self._offset:
+                        raise
+                    ranges_ignored = True
+                    break
+                _submit_next()
+                for pos in range(0, len(data), IMAGE_CHUNK_SIZE):
+                    yielded = True
+                    yield data[pos:pos + IMAGE_CHUNK_SIZE]
+        finally:
+            abort.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+            session.close()
+
+        if ranges_ignored:
+            LOG.warning('Server %s advertises byte range support but does '
+                        'not honour range requests, downloading image '
+                        '%s over a single connection', self._url,
+                        self._image_info['id'])
+            self._request = _download_with_proxy(
+                self._image_info, self._url, self._image_info['id'])
+            yield from self._request.iter_content(IMAGE_CHUNK_SIZE)
+
+    def update_hash(self, data):
+        """Updates the checksum with a chunk of downloaded data.
+
+        :param data: A bytes-like object.
+        """
+        self._hash_algo.update(data)
+        self._hash_position += len(data)
+        if self._accepts_ranges and CONF.image_download_resume:
+            try:
+                state = self._hash_algo.copy()
+            except (AttributeError, ValueError):
+                state = None
+            self._hash_states.append((self._hash_position, state))
+
+    def checkpoint(self, offset=None):
+        """Records that the start of the image has been written out.
+
+        A failed download can later be resumed from the last checkpoint
+        with resume().
+
+        :param offset: The number of bytes of the image written to the
+                       target. Defaults to all bytes returned so far.
+        """
+        if offset is None:
+            offset = self._bytes_transferred
+        states = self._hash_states
+        while states and states[0][0] < offset:
+            states.popleft()
+        if states and states[0][0] == offset:
+            self._checkpoint = states[0]
+        else:
+            self._checkpoint = (offset, None)
+        self._report_progress(offset)
+
+    def _report_progress(self, written):
+        if self._command is None:
+            return
+        now = time.monotonic()
+        if (self._reported is not None
+                and now - self._reported < _PROGRESS_INTERVAL):
+            return
+        self._reported = now
+        progress = {'image': self._image_info['id'],
+                    'bytes_downloaded': self._bytes_transferred,
+                    'bytes_written': written}
+        try:
+            progress['total_bytes'] = int(self._expected_size)
+        except (TypeError, ValueError):
+            pass
+        self._command.update_progress(**progress)
+
+    @property
+    def resumable(self):
+        """Whether resume() can continue the download after a failure."""
+        return (CONF.image_download_resume and self._accepts_ranges
+                and self._checkpoint[0] > 0)
+
+    @property
+    def offset(self):
+        """Offset in the image at which the current stream starts."""
+        return self._offset
+
+    def _rehash(self, image_location, size):
+        """Calculates the checksum of the start of a local image.
+
+        :param image_location: The file or device holding the image.
+        :param size: The number of bytes to hash.
+        :raises: ImageDownloadError if the data cannot be read back.
+        :returns: A hash object covering the first size bytes.
+        """
+        hash_algo = hashlib.new(self._hash_algo.name)
+        remaining = size
+        with open(image_location, 'rb') as f:
+            while remaining:
+                data = f.read(min(remaining, IMAGE_CHUNK_SIZE))
+                if not data:
+                    raise errors.ImageDownloadError(
+                        self._image_info['id'],
+                        'Only {} of {} bytes could be read back from {}'
+                        .format(size - remaining, size, image_location))
+                hash_algo.update(data)
+                remaining -= len(data)
+        return hash_algo
+
+    def resume(self, image_location):
+        """Re-opens the download at the last checkpoint.
+
+        The running checksum is restored from the state saved at the
+        checkpoint. If no state could be saved, the already written part
+        of the image is hashed again from the local copy.
+
+        :param image_location: The file or device holding the image.
+        :raises: ImageDownloadRangeError if the server does not continue
+                 the same image at the checkpoint.
+        :raises: ImageDownloadError if the download cannot be re-opened.
+        """
+        offset, hash_algo = self._checkpoint
+        image_id = self._image_info['id']
+        if hash_algo is None:
+            LOG.debug('No checksum state saved at offset %(offset)s, '
+                      'hashing the first %(offset)s bytes of %(location)s',
+                      {'offset': offset, 'location': image_location})
+            hash_algo = self._rehash(image_location, offset)
+
+        headers = {'Range': 'bytes={}-'.format(offset)}
+        if self._validator:
+            headers['If-Range'] = self._validator
+        LOG.info('Resuming download of image %(image)s from %(url)s at '
+                 'offset %(offset)s', {'image': image_id, 'url': self._url,
+                                       'offset': offset})
+        request = _download_with_proxy(self._image_info, self._url,
+                                       image_id, headers=headers)
+        content_range = request.headers.get('Content-Range', '')
+        if not content_range.startswith('bytes {}-'.format(offset)):
+            request.close()
+            raise errors.ImageDownloadRangeError(
+                image_id, 'Unexpected Content-Range "{}" when resuming at '
+                'offset {}'.format(content_range, offset))
+
+        self._request = request
+        self._hash_algo = hash_algo
+        self._hash_states.clear()
+        self._offset = self._hash_position = offset
+        self._bytes_transferred = offset
+
     def verify_image(self, image_location):
         """Verifies the checksum of the local images matches expectations.
 
@@ -738,10 +1127,141 @@ class ImageDownload(object):
         return self._expected_size
 
 
-def _download_image(image_info):
+def _write_pipelined(image_download, location, image_id, sparse=False):
+    """Writes an image through the pipelined image writer.
+
+    :param image_download: An ImageDownload instance.
+    :param location: The file or device to write the image to.
+    :param image_id: Image ID for error reporting.
+    :param sparse: Whether to skip writing blocks of zeroes.
+    :raises: ImageDownloadOutofSpaceError if the target runs out of space.
+    :raises: ImageDownloadError if downloading or writing the image fails.
+    """
+    writer = image_writer.ImageWriter(location, image_download.update_hash,
+                                      offset=image_download.offset,
+                                      progress=image_download.checkpoint,
+                                      sparse=sparse)
+    try:
+        writer.write(image_download.iter_chunks(update_hash=False))
+    except Exception as e:
+        msg = 'Unable to write image to {}. Error: {}'.format(location, e)
+        if isinstance(e, OSError) and e.errno == errno.ENOSPC:
+            raise errors.ImageDownloadOutofSpaceError(image_id, msg)
+        raise errors.ImageDownloadError(image_id, msg)
+
+
+def _start_download(image_info, image_download, image_location, starttime):
+    """Starts the next attempt to download an image.
+
+    :param image_info: Image information dictionary.
+    :param image_download: The ImageDownload of the previous attempt or
+                           None. It is resumed if possible.
+    :param image_location: The file or device the image is written to.
+    :param starttime: The time the first attempt started.
+    :raises: ImageDownloadError if the download cannot be started.
+    :returns: An ImageDownload instance.
+    """
+    if image_download is not None and image_download.resumable:
+        try:
+            image_download.resume(image_location)
+        except errors.ImageDownloadError as e:
+            LOG.warning('Unable to resume the download of image %(image)s, '
+                        'starting over: %(error)s',
+                        {'image': image_info['id'], 'error': e})
+        else:
+            return image_download
+    return ImageDownload(image_info, time_obj=starttime)
+
+
+def _fetch_image_range(image_info, session, start, end):
+    """Downloads one byte range of an image from the image server.
+
+    :param image_info: Image information dictionary.
+    :param session: A requests session to use.
+    :param start: Offset of the first byte of the range.
+    :param end: Offset of the last byte of the range (inclusive).
+    :raises: ImageDownloadError if the range cannot be downloaded from any
+             of the image URLs.
+    :returns: The content of the range as bytes.
+    """
+    details = []
+    for url in image_info['urls']:
+        try:
+            resp = _download_with_proxy(
+                image_info, url, image_info['id'], session=session,
+                headers={'Range': 'bytes={}-{}'.format(start, end)})
+            try:
+                data = resp.content
+            finally:
+                resp.close()
+        except (errors.ImageDownloadError, requests.RequestException) as e:
+            details.append('URL: {}; Error: {}'.format(url, e))
+            continue
+        if len(data) == end - start + 1:
+            return data
+        details.append('URL: {}; Received {} bytes for range {}-{}'.format(
+            url, len(data), start, end))
+    raise errors.ImageDownloadError(image_info['id'], '\n '.join(details))
+
+
+def _fetch_image_size(image_info, session):
+    """Get the size of an image from the image server.
+
+    :param image_info: Image information dictionary.
+    :param session: The requests session to use.
+    :returns: The size in bytes or None if no image URL reports it.
+    """
+    for url in image_info['urls']:
+        try:
+            resp = _download_with_proxy(image_info, url, image_info['id'],
+                                        session=session,
+                                        headers={'Range': 'bytes=0-0'})
+            resp.close()
+        except (errors.ImageDownloadError, requests.RequestException) as e:
+            LOG.debug('Unable to get the size of image %(image)s from '
+                      '%(url)s: %(error)s',
+                      {'image': image_info['id'], 'url': url, 'error': e})
+            continue
+        # Content-Range: bytes 0-0/<size>
+        total = resp.headers.get('Content-Range', '').rpartition('/')[2]
+        if total.isdigit():
+            return int(total)
+    return None
+
+
+def _download_from_swarm(image_info, image_location):
+    """Tries to download an image from other agents.
+
+    :param image_info: Image information dictionary.
+    :param image_location: The file to download the image to.
+    :returns: True if the image was downloaded and verified, False if it
+              has to be downloaded from the image server.
+    """
+    key = image_cache.image_key(image_info)
+    if key is None:
+        return False
+    session = utils.get_requests_session()
+    fetch_origin = functools.partial(_fetch_image_range, image_info, session)
+    try:
+        image_size = _fetch_image_size(image_info, session)
+        return swarm.download(image_info, key, image_location, fetch_origin,
+                              image_size=image_size)
+    except (swarm.SwarmError, errors.RESTError, OSError) as e:
+        LOG.warning('Unable to download image %(image)s from peers, '
+                    'falling back to the image server: %(error)s',
+                    {'image': image_info['id'], 'error': e})
+        return False
+    finally:
+        session.close()
+
+
+def _download_image(image_info, image_location=None):
     """Downloads the specified image to the local file system.
 
     :param image_info: Image information dictionary.
+    :param image_location: The file to download the image to. Defaults to
+                           a file named after the image in the temporary
+                           directory.
     :raises: ImageDownloadError if the image download fails for any reason.
     :raises: ImageDownloadOutofSpaceError if the image download fails
              due to insufficient storage space.
@@ -749,35 +1269,56 @@ def _download_image(image_info):
              match the one reported in image_info.
     """
     starttime = time.time()
-    image_location = _image_location(image_info)
+    image_location = image_location or _image_location(image_info)
+    if swarm.enabled() and _download_from_swarm(image_info, image_location):
+        LOG.info('Image %(image)s downloaded from peers in %(totaltime)s '
+                 'seconds', {'image': image_info['id'],
+                             'totaltime': time.time() - starttime})
+        return
+
+    image_download = None
     for attempt in range(CONF.image_download_connection_retries + 1):
         try:
-            image_download = ImageDownload(image_info, time_obj=starttime)
+            image_download = _start_download(image_info, image_download,
+                                             image_location, starttime)
 
-            with open(image_location, 'wb') as f:
-                try:
-                    for chunk in image_download:
-                        try:
-                            f.write(chunk)
-                        except OSError as e:
-                            if e.errno == errno.ENOSPC:
-                                msg = ('Unable to write image to {}. Error: {}'
-                                       ).format(image_location, e)
-                                raise errors.ImageDownloadOutofSpaceError(
-                                    image_info['id'], msg)
-                            raise
-                except errors.ImageDownloadOutofSpaceError:
-                    raise
-                except Exception as e:
-                    msg = 'Unable to write image to {}. Error: {}'.format(
-                        image_location, str(e))
-                    raise errors.ImageDownloadError(image_info['id'], msg)
+            if CONF.image_write_pipeline:
+                _write_pipelined(image_download, image_location,
+                                 image_info['id'])
+            else:
+                offset = image_download.offset
+                with open(image_location, 'r+b' if offset else 'wb') as f:
+                    if offset:
+                        f.seek(offset)
+                    try:
+                        for chunk in image_download:
+                            try:
+                                f.write(chunk)
+                                image_download.checkpoint()
+                            except OSError as e:
+                                if e.errno == errno.ENOSPC:
+                                    msg = ('Unable to write image to {}. '
+                                           'Error: {}').format(image_location,
+                                                               e)
+                                    raise errors.ImageDownloadOutofSpaceError(
+                                        image_info['id'], msg)
+                                raise
+                    except errors.ImageDownloadOutofSpaceError:
+                        raise
+                    except Exception as e:
+                        msg = ('Unable to write image to {}. '
+                               'Error: {}').format(image_location, str(e))
+                        raise errors.ImageDownloadError(image_info['id'],
+                                                        msg)
             image_download.verify_image(image_location)
         except (errors.ImageDownloadOutofSpaceError,
                 errors.ImageDownloadFatalError):
             raise
         except (errors.ImageDownloadError,
                 errors.ImageChecksumError) as e:
+            if isinstance(e, errors.ImageChecksumError):
+                # Never resume on top of corrupted data
+                image_download = None
             if attempt == CONF.image_download_connection_retries:
                 raise
             else:
@@ -913,35 +1454,173 @@ class StandbyExtension(base.BaseAgentExtension):
                   match the one reported in image_info.
         :raises: ImageWriteError if writing the image fails.
         """
-        _download_image(image_info)
-        self.partition_uuids = _write_image(image_info, device, configdrive)
+        key = image_cache.image_key(image_info)
+        cache = image_cache.get_cache() if key else None
+        location = partial = None
+        if cache is not None:
+            location = cache.get(key)
+            if location is not None:
+                LOG.info('Using image %(image)s from the image cache at '
+                         '%(location)s', {'image': image_info['id'],
+                                          'location': location})
+            else:
+                partial = cache.partial_path(key)
+                try:
+                    _download_image(image_info, partial)
+                except Exception:
+                    utils.unlink_without_raise(partial)
+                    raise
+                location = cache.add(key, partial)
+        else:
+            _download_image(image_info)
+
+        if key is not None and (partial is None or location != partial):
+            swarm.share(key, location or _image_location(image_info))
+
+        kwargs = {'image_location': location} if location else {}
+        try:
+            self.partition_uuids = _write_image(image_info, device,
+                                                configdrive, **kwargs)
+        finally:
+            if location is not None and location == partial:
+                # Too large to be cached
+                utils.unlink_without_raise(partial)
         self.cached_image_id = image_info['id']
 
-    def _stream_raw_image_onto_device(self, image_info, device):
-        """Streams raw image data to specified local device.
+    def _stream_convert_image_onto_device(self, image_info, device):
+        """Converts a QCOW2 image onto a device while downloading it.
 
         :param image_info: Image information dictionary.
         :param device: The disk name, as a string, on which to store the
                        image.  Example: '/dev/sda'
 
+        :raises: UnsupportedImage if the image cannot be converted while it
+                 is downloaded.
+        :raises: InvalidImage if the image does not pass security inspection
+                 or is malformed.
         :raises: ImageDownloadError if the image download encounters an error.
         :raises: ImageChecksumError if the checksum of the local image does not
              match the checksum as reported by glance in image_info.
         """
         starttime = time.time()
         total_retries = CONF.image_download_connection_retries
+        metadata_destroyed = False
         for attempt in range(total_retries + 1):
             try:
                 image_download = ImageDownload(image_info, time_obj=starttime)
-
-                with open(device, 'wb+') as f:
+                chunks = iter(image_download)
+                header = _read_image_header(chunks)
+                # NOTE: The below call performs the required security check
+                # (see bug #2071740) before anything is written. It is
+                # repeated for every attempt, as the header is received
+                # again.
+                img_format, size = _inspect_image_header(image_info, header)
+                if img_format != 'qcow2':
+                    raise qcow2.UnsupportedImage(
+                        'Images in format %s are not supported' % img_format)
+                device_size = disk_utils.get_dev_byte_size(device)
+                if size > device_size:
+                    raise errors.InvalidImage(
+                        details='Image virtual size {} exceeds the size {} '
+                        'of device {}'.format(size, device_size, device))
+
+                if not metadata_destroyed:
+                    # FIXME(dtantsur): pass the real node UUID for logging
+                    disk_utils.destroy_disk_metadata(device, '')
+                    disk_utils.udev_settle()
+                    metadata_destroyed = True
+
+                image_size = image_download.content_length
+                with open(device, 'r+b') as f:
+                    converter = qcow2.StreamConverter(
+                        f.fileno(), CONF.image_stream_spill_size * units.Mi,
+                        image_size=int(image_size) if image_size else None)
                     try:
-                        for chunk in image_download:
-                            f.write(chunk)
+                        converter.write(itertools.chain([header], chunks))
+                    except (qcow2.UnsupportedImage, errors.InvalidImage,
+                            errors.ImageDownloadError):
+                        raise
                     except Exception as e:
                         msg = ('Unable to write image to device {}. '
                                'Error: {}').format(device, str(e))
                         raise errors.ImageDownloadError(image_info['id'], msg)
+                image_download.verify_image(device)
+            except errors.ImageDownloadFatalError:
+                raise
+            except (errors.ImageDownloadError,
+                    errors.ImageChecksumError) as e:
+                if attempt == total_retries:
+                    raise
+                LOG.warning('Image download failed, %(attempt)s of '
+                            '%(total)s: %(error)s',
+                            {'attempt': attempt, 'total': total_retries,
+                             'error': e})
+                time.sleep(CONF.image_download_connection_retry_interval)
+            else:
+                break
+
+        disk_utils.trigger_device_rescan(device)
+        totaltime = time.time() - starttime
+        LOG.info("Image converted onto device %(device)s in %(totaltime)s "
+                 "seconds for %(size)s bytes. Server originally reported "
+                 "%(reported)s.",
+                 {'device': device, 'totaltime': totaltime,
+                  'size': image_download.bytes_transferred,
+                  'reported': image_download.content_length})
+        try:
+            disk_utils.fix_gpt_partition(device, node_uuid=None)
+        except errors.DeploymentError:
+            # Note: the catch internal to the helper method logs any errors.
+            pass
+
+    def _stream_raw_image_onto_device(self, image_info, device):
+        """Streams raw image data to specified local device.
+
+        :param image_info: Image information dictionary.
+        :param device: The disk name, as a string, on which to store the
+                       image.  Example: '/dev/sda'
+
+        :raises: ImageDownloadError if the image download encounters an error.
+        :raises: ImageChecksumError if the checksum of the local image does not
+             match the checksum as reported by glance in image_info.
+        """
+        starttime = time.time()
+        total_retries = CONF.image_download_connection_retries
+        image_download = None
+        for attempt in range(total_retries + 1):
+            try:
+                image_download = _start_download(image_info, image_download,
+                                                 device, starttime)
+
+                if CONF.image_write_pipeline:
+                    _write_pipelined(image_download, device,
+                                     image_info['id'],
+                                     sparse=CONF.image_write_sparse)
+                else:
+                    offset = image_download.offset
+                    with open(device, 'r+b' if offset else 'wb+') as f:
+                        if offset:
+                            f.seek(offset)
+                        sparse = None
+                        if CONF.image_write_sparse:
+                            sparse = image_writer.SparseWriter(f.fileno(),
+                                                               offset)
+                        try:
+                            for chunk in image_download:
+                                if sparse is None:
+                                    f.write(chunk)
+                                    image_download.checkpoint()
+                                else:
+                                    sparse.write(chunk)
+                                    image_download.checkpoint(
+                                        sparse.committed)
+                            if sparse is not None:
+                                sparse.flush()
+                        except Exception as e:
+                            msg = ('Unable to write image to device {}. '
+                                   'Error: {}').format(device, str(e))
+                            raise errors.ImageDownloadError(
+                                image_info['id'], msg)
                 # Verify the checksum of the streamed image is correct while
                 # still in the retry loop, so we can retry should a checksum
                 # failure be detected.
@@ -950,6 +1629,9 @@ class StandbyExtension(base.BaseAgentExtension):
                 raise
             except (errors.ImageDownloadError,
                     errors.ImageChecksumError) as e:
+                if isinstance(e, errors.ImageChecksumError):
+                    # Never resume on top of corrupted data
+                    image_download = None
                 if attempt == CONF.image_download_connection_retries:
                     raise
                 else:
@@ -1026,6 +1708,7 @@ class StandbyExtension(base.BaseAgentExtension):
             configdrive = image_info.pop('configdrive', None)
         device = hardware.dispatch_to_managers('get_os_install_device',
                                                permit_refresh=True)
+        image_cache.check_device(device)
 
         requested_disk_format = image_info.get('disk_format')
 
@@ -1037,7 +1720,11 @@ class StandbyExtension(base.BaseAgentExtension):
                 LOG.debug('Already had %s cached, overwriting',
                           self.cached_image_id)
 
-            if stream_raw_images and requested_disk_format == 'raw':
+            if image_cache.lookup(image_info) is not None:
+                # NOTE: A verified copy of the image is available locally,
+                # skip the network entirely.
+                self._cache_and_write_image(image_info, device, configdrive)
+            elif stream_raw_images and requested_disk_format == 'raw':
                 if _is_partition_image(image_info):
                     # NOTE(JayF): This only creates partitions due to image
                     #             being None
@@ -1054,6 +1741,18 @@ class StandbyExtension(base.BaseAgentExtension):
                 #             all, as they never interact with qemu-img and are
                 #             streamed directly to disk unmodified.
                 self._stream_raw_image_onto_device(image_info, stream_to)
+            elif _can_stream_convert(image_info):
+                self.partition_uuids = {}
+                try:
+                    self._stream_convert_image_onto_device(image_info,
+                                                           device)
+                except qcow2.UnsupportedImage as e:
+                    LOG.warning('Unable to convert image %(image)s while '
+                                'downloading it, caching it first: '
+                                '%(error)s',
+                                {'image': image_info['id'], 'error': e})
+                    self._cache_and_write_image(image_info, device,
+                                                configdrive)
             else:
                 self._cache_and_write_image(image_info, device, configdrive)
 
@@ -1103,6 +1802,8 @@ class StandbyExtension(base.BaseAgentExtension):
             hardware.dispatch_to_all_managers('full_sync')
         except Exception as e:
             LOG.warning('Failed to sync file system buffers: % s', e)
+        # The buffered metrics would be lost with the machine
+        metrics_utils.flush_metrics()
 
         try:
             _, stderr = utils.execute(command, use_standard_locale=True)
@@ -15,7 +15,9 @@
 import abc
 import binascii
 import collections
+from concurrent import futures
 import contextlib
+import copy
 import functools
 import glob
 import io
@@ -28,6 +30,7 @@ import shlex
 import shutil
 import stat
 import string
+import threading
 import time
 from typing import List
 
@@ -42,14 +45,18 @@ import yaml
 
 from ironic_python_agent import burnin
 from ironic_python_agent import device_hints
+from ironic_python_agent import disk_erase
 from ironic_python_agent import disk_utils
 from ironic_python_agent import efi_utils
 from ironic_python_agent import encoding
 from ironic_python_agent import errors
 from ironic_python_agent.extensions import base as ext_base
 from ironic_python_agent import inject_files
+from ironic_python_agent import inventory_monitor
+from ironic_python_agent import ipmi
 from ironic_python_agent import netutils
 from ironic_python_agent import raid_utils
+from ironic_python_agent import sysfs
 from ironic_python_agent import tls_utils
 from ironic_python_agent import utils
 
@@ -109,18 +116,19 @@ DEPLOY_CLEAN_UEFI_NVRAM_ARGSINFO = {
 
 MULTIPATH_ENABLED = None
 
+SYS_CLASS_BLOCK = '/sys/class/block'
+
 
 def _get_device_info(dev, devclass, field):
     """Get the device info according to device class and field."""
-    try:
-        devname = os.path.basename(dev)
-        with open('/sys/class/%s/%s/device/%s' % (devclass, devname, field),
-                  'r') as f:
-            return f.read().strip()
-    except IOError:
+    devname = os.path.basename(dev)
+    value = sysfs.read('/sys/class/%s/%s/device/%s'
+                       % (devclass, devname, field))
+    if value is None:
         LOG.warning("Can't find field %(field)s for "
                     "device %(dev)s in device class %(class)s",
                     {'field': field, 'dev': dev, 'class': devclass})
+    return value
 
 
 def _load_ipmi_modules():
@@ -246,59 +254,6 @@ def _enable_multipath():
     return True
 
 
-def _get_multipath_parent_device(device):
-    """Check and return a multipath device."""
-    if not device:
-        # if lsblk provides invalid output, this can be None.
-        return
-    check_device = os.path.join('/dev', str(device))
-    try:
-        # Explicitly run the check as regardless of if the device is mpath or
-        # not, multipath tools when using list always exits with a return
-        # code of 0.
-        utils.execute('multipath', '-c', check_device)
-        # path check with return an exit code of 1 if you send it a multipath
-        # device mapper device, like dm-0.
-        # NOTE(TheJulia): -ll is supposed to load from all available
-        # information, but may not force a rescan. It may be -f if we need
-        # that. That being said, it has been about a decade since I was
-        # running multipath tools on SAN connected gear, so my memory is
-        # definitely fuzzy.
-        out, _ = utils.execute('multipath', '-ll', check_device)
-    except processutils.ProcessExecutionError as e:
-        # FileNotFoundError if the utility does not exist.
-        # -1 return code if the device is not valid.
-        LOG.debug('Checked device %(dev)s and determined it was '
-                  'not a multipath device. %(error)s',
-                  {'dev': check_device,
-                   'error': e})
-        return
-    except FileNotFoundError:
-        # This should never happen, as MULTIPATH_ENABLED would be False
-        # before this occurs.
-        LOG.warning('Attempted to check multipathing status, however '
-                    'the \'multipath\' binary is missing or not in the '
-                    'execution PATH.')
-        return
-    # Data format:
-    # MPATHDEVICENAME dm-0 TYPE,HUMANNAME
-    # size=56G features='1 retain_attached_hw_handler' hwhandler='0' wp=rw
-    # `-+- policy='service-time 0' prio=1 status=active
-    #   `- 0:0:0:0 sda 8:0  active ready running
-    # Other format:
-    # mpathat (wwid/alias) device_name vendor,product
-    try:
-        lines = out.splitlines()
-        mpath_device_out = lines[0].split(' ')
-        for mpath_device in mpath_device_out:
-            if mpath_device.startswith("dm"):
-                # give back something like dm-0 so we can log it.
-                return mpath_device
-    except IndexError:
-        # We didn't get any command output, so Nope.
-        pass
-
-
 def get_component_devices(raid_device):
     """Get the component devices of a Software RAID device.
 
@@ -483,6 +438,84 @@ def _md_scan_and_assemble():
         LOG.info('No new RAID devices assembled during start-up')
 
 
+def _get_udev_block_devices(context):
+    """Enumerate the block devices known to udev at once.
+
+    :param context: A pyudev Context.
+    :returns: A dictionary mapping device paths (e.g. /dev/sda) to pyudev
+              Device objects.
+    """
+    return {dev.device_node: dev
+            for dev in context.list_devices(subsystem='block')
+            if dev.device_node}
+
+
+def _read_sysfs_attribute(path):
+    return sysfs.read(path) or None
+
+
+def _list_sysfs_directory(path):
+    try:
+        return [entry.name for entry in sysfs.list_directory(path)]
+    except OSError:
+        return []
+
+
+def _scan_sysfs_block_devices():
+    """Collect the sysfs attributes of all block devices in one sweep.
+
+    :returns: A dictionary mapping kernel device names to dictionaries with
+              the vendor, the SCSI address (HCTL), the holders, the device
+              mapper UUID and, for partitions, the disk of the device.
+              Missing values are None.
+    """
+    devices = {}
+    try:
+        entries = sysfs.list_directory(SYS_CLASS_BLOCK)
+    except OSError as e:
+        LOG.warning('Unable to list block devices in %(path)s: %(error)s',
+                    {'path': SYS_CLASS_BLOCK, 'error': e})
+        return devices
+
+    for entry in entries:
+        scsi_devices = _list_sysfs_directory(
+            os.path.join(entry.path, 'device', 'scsi_device'))
+        parent = None
+        if 'partition' in _list_sysfs_directory(entry.path):
+            # The entry links to .../block/<disk>/<partition>
+            parent = os.path.basename(
+                os.path.dirname(os.path.realpath(entry.path)))
+        devices[entry.name] = {
+            'vendor': _read_sysfs_attribute(
+                os.path.join(entry.path, 'device', 'vendor')),
+            'hctl': scsi_devices[0] if scsi_devices else None,
+            'holders': _list_sysfs_directory(
+                os.path.join(entry.path, 'holders')),
+            'dm_uuid': _read_sysfs_attribute(
+                os.path.join(entry.path, 'dm', 'uuid')),
+            'parent': parent,
+        }
+    return devices
+
+
+def _get_multipath_holder(kname, sysfs_devices):
+    """Find the multipath device built on top of a device, if any.
+
+    :param kname: Kernel name of a device.
+    :param sysfs_devices: The result of _scan_sysfs_block_devices.
+    :returns: The kernel name of the multipath device (e.g. dm-0) built on
+              top of the device, or of the disk holding the partition, or
+              None.
+    """
+    device = sysfs_devices.get(kname, {})
+    for holder in device.get('holders', ()):
+        dm_uuid = sysfs_devices.get(holder, {}).get('dm_uuid') or ''
+        if dm_uuid.startswith('mpath-'):
+            return holder
+    if device.get('parent'):
+        return _get_multipath_holder(device['parent'], sysfs_devices)
+
+
 def list_all_block_devices(block_type='disk',
                            ignore_raid=False,
                            ignore_floppy=True,
@@ -519,13 +552,6 @@ def list_all_block_devices(block_type='disk',
     :returns: A list of BlockDevices
     """
 
-    def _is_known_device(existing, new_device_name):
-        """Return true if device name is already known."""
-        for known_dev in existing:
-            if os.path.join('/dev', new_device_name) == known_dev.name:
-                return True
-        return False
-
     # Normalize block_type to a list
     if isinstance(block_type, str):
         block_types = [block_type]
@@ -534,9 +560,28 @@ def list_all_block_devices(block_type='disk',
     else:
         raise ValueError("block_type must be a string or a list of strings")
 
-    check_multipath = not ignore_multipath and get_multipath_status()
+    args = (block_types, ignore_raid, ignore_floppy, ignore_empty,
+            ignore_multipath, all_serial_and_wwn)
+    monitor = inventory_monitor.get_monitor()
+    if monitor is None:
+        return _list_all_block_devices(*args)
 
+    # NOTE: the udev events of changes made right before this call are only
+    # received once udev has processed them.
     disk_utils.udev_settle()
+    key = ('block_devices', tuple(block_types)) + args[1:]
+    return list(monitor.cached(key, ['block'],
+                               functools.partial(_list_all_block_devices,
+                                                 *args, settle=False)))
+
+
+def _list_all_block_devices(block_types, ignore_raid, ignore_floppy,
+                            ignore_empty, ignore_multipath,
+                            all_serial_and_wwn, settle=True):
+    check_multipath = not ignore_multipath and get_multipath_status()
+
+    if settle:
+        disk_utils.udev_settle()
 
     # map device names to /dev/disk/by-path symbolic links that points to it
 
@@ -571,16 +616,20 @@ def list_all_block_devices(block_type='disk',
     except json.decoder.JSONDecodeError as ex:
         LOG.error("Unable to decode lsblk output, invalid JSON: %s", ex)
 
-    context = pyudev.Context()
+    # NOTE: udev and sysfs are read once for all devices, per-device
+    # lookups do not scale to nodes with many disks and paths.
+    udev_devices = _get_udev_block_devices(pyudev.Context())
+    sysfs_devices = _scan_sysfs_block_devices()
     devices_raw = report_json['blockdevices']
     # Convert raw json output to something useful for us
     devices = []
+    known_devices = set()
     for device_raw in devices_raw:
         # Ignore block types not specified
         devtype = device_raw.get('type')
 
         # We already have devices, we should ensure we don't store duplicates.
-        if _is_known_device(devices, device_raw.get('kname')):
+        if device_raw.get('kname') in known_devices:
             LOG.debug('Ignoring already known device %s', device_raw)
             continue
 
@@ -596,7 +645,8 @@ def list_all_block_devices(block_type='disk',
             # Net effect is we ignore base devices, and their base devices
             # to what would be the mapped device name which would not pass the
             # validation, but would otherwise be match-able.
-            mpath_parent_dev = _get_multipath_parent_device(dev_kname)
+            mpath_parent_dev = _get_multipath_holder(dev_kname,
+                                                     sysfs_devices)
             if mpath_parent_dev:
                 LOG.warning(
                     "We have identified a multipath device %(device)s, this "
@@ -680,15 +730,10 @@ def list_all_block_devices(block_type='disk',
                 extra['serial'] = lsblk_serial
             if lsblk_wwn:
                 extra['wwn'] = lsblk_wwn
-        try:
-            udev = pyudev.Devices.from_device_file(context, name)
-        except pyudev.DeviceNotFoundByFileError as e:
-            LOG.warning("Device %(dev)s is inaccessible, skipping... "
-                        "Error: %(error)s", {'dev': name, 'error': e})
-        except pyudev.DeviceNotFoundByNumberError as e:
-            LOG.warning("Device %(dev)s is not supported by pyudev, "
-                        "skipping... Error: %(error)s",
-                        {'dev': name, 'error': e})
+        udev = udev_devices.get(name)
+        if udev is None:
+            LOG.warning("Device %s is not known to udev, skipping its udev "
+                        "properties", name)
         else:
             # lsblk serial information is prioritized over
             # udev serial information
@@ -720,22 +765,22 @@ def list_all_block_devices(block_type='disk',
         # NOTE(lucasagomes): Newer versions of the lsblk tool supports
         # HCTL as a parameter but let's get it from sysfs to avoid breaking
         # old distros.
-        try:
-            extra['hctl'] = os.listdir(
-                '/sys/block/%s/device/scsi_device' % device_raw['kname'])[0]
-        except (OSError, IndexError):
+        sysfs = sysfs_devices.get(device_raw['kname'], {})
+        if sysfs.get('hctl'):
+            extra['hctl'] = sysfs['hctl']
+        else:
             LOG.warning('Could not find the SCSI address (HCTL) for '
                         'device %s. Skipping', name)
 
         # Not all /dev entries are pointed to from /dev/disk/by-path
         by_path_name = by_path_mapping.get(name)
 
+        known_devices.add(device_raw['kname'])
         devices.append(BlockDevice(name=name,
                                    model=device_raw['model'],
                                    size=int(device_raw['size'] or 0),
                                    rotational=bool(int(device_raw['rota'])),
-                                   vendor=_get_device_info(device_raw['kname'],
-                                                           'block', 'vendor'),
+                                   vendor=sysfs.get('vendor'),
                                    by_path=by_path_name,
                                    uuid=device_raw['uuid'],
                                    partuuid=device_raw['partuuid'],
@@ -830,6 +875,101 @@ class BlockDevice(encoding.SerializableComparable):
         self.tran = tran
 
 
+_ERASE_TRACKING = threading.local()
+
+
+class EraseProgress(object):
+    """Per-device progress of an erasure.
+
+    The progress is published as the result of the asynchronous command
+    running the erasure, if any, so that it can be followed through the
+    agent API while the command is running.
+    """
+
+    PENDING = 'pending'
+    ERASING = 'erasing'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, block_devices):
+        self._command = ext_base.get_current_command()
+        self._lock = threading.Lock()
+        self._devices = {dev.name: {'status': self.PENDING}
+                         for dev in block_devices}
+        self._publish()
+
+    def _publish(self):
+        if self._command is not None:
+            self._command.update_progress(
+                devices=copy.deepcopy(self._devices))
+
+    def update(self, device, **kwargs):
+        """Update the progress of a device.
+
+        :param device: the name of the device.
+        :param kwargs: the fields to update. The percentage of the device
+            erased so far is derived from ``bytes_written`` and
+            ``total_bytes``.
+        """
+        if kwargs.get('total_bytes') and 'bytes_written' in kwargs:
+            kwargs['percent'] = round(
+                100 * kwargs['bytes_written'] / kwargs['total_bytes'], 1)
+        with self._lock:
+            self._devices[device].update(kwargs)
+            self._publish()
+
+    def track(self, device, func, *args, **kwargs):
+        """Call a function erasing a device and record its outcome.
+
+        :param device: the name of the device.
+        :param func: the function to call.
+        :returns: the result of the function.
+        """
+        started = time.monotonic()
+        self.update(device, status=self.ERASING)
+        previous = getattr(_ERASE_TRACKING, 'current', None)
+        _ERASE_TRACKING.current = (self, device)
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.update(device, status=self.FAILED, error=str(e),
+                        elapsed=time.monotonic() - started)
+            raise
+        finally:
+            _ERASE_TRACKING.current = previous
+        self.update(device, status=self.DONE,
+                    elapsed=time.monotonic() - started)
+        return result
+
+
+def _report_erase_progress(**kwargs):
+    """Update the progress of the device erased by the calling thread.
+
+    Does nothing unless called from a function run by EraseProgress.track.
+
+    :param kwargs: the fields to update.
+    """
+    current = getattr(_ERASE_TRACKING, 'current', None)
+    if current is not None:
+        progress, device = current
+        progress.update(device, **kwargs)
+
+
+def _get_erase_disk(device, devices):
+    """Find the disk a device has to be erased with.
+
+    :param device: the name of a device.
+    :param devices: the names of all devices being erased.
+    :returns: the name of the disk the device is a partition of if it is
+        being erased as well, otherwise the name of the device itself.
+    """
+    for other in devices:
+        if other != device and re.fullmatch(re.escape(other) + r'p?\d+',
+                                            device):
+            return other
+    return device
+
+
 class NetworkInterface(encoding.SerializableComparable):
     serializable_fields = ('name', 'mac_address', 'ipv4_address',
                            'ipv6_address', 'has_carrier', 'lldp',
@@ -1090,12 +1230,15 @@ class HardwareManager(object, metaclass=abc.ABCMeta):
         info = node.get('driver_internal_info', {})
         max_pool_size = info.get('disk_erasure_concurrency', 1)
 
+        progress = EraseProgress(block_devices)
         thread_pool = ThreadPool(min(max_pool_size, len(block_devices)))
         for block_device in block_devices:
             params = {'node': node, 'block_device': block_device}
             safety_check_block_device(node, block_device.name)
             erase_results[block_device.name] = thread_pool.apply_async(
-                dispatch_to_managers, ('erase_block_device',), params)
+                utils.in_execution_step(progress.track),
+                (block_device.name, dispatch_to_managers,
+                 'erase_block_device'), params)
         thread_pool.close()
         thread_pool.join()
 
@@ -1145,12 +1288,6 @@ class HardwareManager(object, metaclass=abc.ABCMeta):
         """
         start = time.time()
         LOG.info('Collecting full inventory')
-        # NOTE(dtantsur): don't forget to update docs when extending inventory
-        hardware_info = {}
-        hardware_info['interfaces'] = self.list_network_interfaces()
-        hardware_info['cpu'] = self.get_cpus()
-        hardware_info['disks'] = self.list_block_devices()
-        hardware_info['memory'] = self.get_memory()
 
         # Check if Ironic has indicated BMC detection should be skipped
         # This is set after lookup when using out-of-band
@@ -1158,31 +1295,34 @@ class HardwareManager(object, metaclass=abc.ABCMeta):
         cached_node = get_cached_node()
         skip_bmc = (cached_node and cached_node.get('skip_bmc_detect',
                                                     False))
-
         if skip_bmc:
             LOG.info('Skipping BMC detection as requested by Ironic')
-            hardware_info['bmc_address'] = None
-            hardware_info['bmc_v6address'] = None
-        else:
-            # Cache BMC information to avoid repeated expensive ipmitool calls
-            if not hasattr(self, '_bmc_cache'):
-                LOG.debug('Detecting BMC information (first time)')
-                self._bmc_cache = {
-                    'bmc_address': self.get_bmc_address(),
-                    'bmc_v6address': self.get_bmc_v6address(),
-                    'bmc_mac': None  # Populated below
-                }
-            else:
-                LOG.debug('Using cached BMC information')
 
-            hardware_info['bmc_address'] = self._bmc_cache['bmc_address']
-            hardware_info['bmc_v6address'] = self._bmc_cache['bmc_v6address']
+        # NOTE(dtantsur): don't forget to update docs when extending inventory
+        sections = [
+            ('interfaces', self.list_network_interfaces),
+            ('cpu', self.get_cpus),
+            ('disks', self.list_block_devices),
+            ('memory', self.get_memory),
+            ('bmc', functools.partial(self._get_bmc_info, skip_bmc)),
+            ('system_vendor', self.get_system_vendor_info),
+            ('boot', self.get_boot_info),
+            ('hostname', netutils.get_hostname),
+        ]
+        results, failed = self._collect_inventory_sections(
+            sections, optional={'bmc': (None, None), 'hostname': None})
 
-        hardware_info['system_vendor'] = self.get_system_vendor_info()
-        hardware_info['boot'] = self.get_boot_info()
-        hardware_info['hostname'] = netutils.get_hostname()
+        hardware_info = {}
+        for name, _func in sections:
+            if name == 'bmc':
+                (hardware_info['bmc_address'],
+                 hardware_info['bmc_v6address']) = results[name]
+            else:
+                hardware_info[name] = results[name]
+        if failed:
+            hardware_info['collection_errors'] = failed
 
-        if not skip_bmc:
+        if not skip_bmc and 'bmc' not in failed:
             # Try to get BMC MAC, which may not be cached yet
             if self._bmc_cache['bmc_mac'] is None:
                 try:
@@ -1201,6 +1341,110 @@ class HardwareManager(object, metaclass=abc.ABCMeta):
         LOG.info('Inventory collected in %.2f second(s)', time.time() - start)
         return hardware_info
 
+    def _get_bmc_info(self, skip_bmc):
+        """Get the BMC addresses for the inventory.
+
+        :param skip_bmc: Whether BMC detection was disabled by Ironic.
+        :returns: A tuple with the IPv4 and IPv6 addresses of the BMC.
+        """
+        if skip_bmc:
+            return None, None
+
+        # Cache BMC information to avoid repeated expensive ipmitool calls
+        if not hasattr(self, '_bmc_cache'):
+            LOG.debug('Detecting BMC information (first time)')
+            self._bmc_cache = {
+                'bmc_address': self.get_bmc_address(),
+                'bmc_v6address': self.get_bmc_v6address(),
+                'bmc_mac': None  # Populated by list_hardware_info
+            }
+        else:
+            LOG.debug('Using cached BMC information')
+        return (self._bmc_cache['bmc_address'],
+                self._bmc_cache['bmc_v6address'])
+
+    def _collect_inventory_sections(self, sections, optional=None):
+        """Collect the sections of the inventory.
+
+        The sections are collected one after another, or concurrently if
+        [DEFAULT]inventory_collection_concurrency is greater than 1. In the
+        latter case every section is given
+        [DEFAULT]inventory_collection_timeout seconds from its start.
+
+        :param sections: A list of tuples with the name of each section and
+            the callable returning it.
+        :param optional: A dictionary mapping the names of the sections the
+            inventory can do without to the values used when they time out.
+        :raises: InventoryCollectionError if a section that is not optional
+            is not collected in time.
+        :returns: A tuple with a dictionary mapping the names of the sections
+            to their values and a dictionary mapping the names of the
+            optional sections that timed out to the error messages.
+        """
+        def _collect(name, func):
+            section_start = time.monotonic()
+            try:
+                return func()
+            finally:
+                LOG.debug('Inventory section %(section)s collected in '
+                          '%(time).2f second(s)',
+                          {'section': name,
+                           'time': time.monotonic() - section_start})
+
+        optional = optional or {}
+        concurrency = min(CONF.inventory_collection_concurrency,
+                          len(sections))
+        if concurrency <= 1:
+            return {name: _collect(name, func) for name, func in sections}, {}
+
+        timeout = CONF.inventory_collection_timeout
+        # NOTE: sections that timed out cannot be interrupted and keep their
+        # thread, have a thread for every section so that the rest of the
+        # sections do not queue behind them. Only the configured number of
+        # sections is running at the same time otherwise.
+        executor = futures.ThreadPoolExecutor(
+            max_workers=len(sections), thread_name_prefix='inventory')
+        try:
+            collect = utils.in_execution_step(_collect)
+            queue = list(sections)
+            running = {}
+            results = {}
+            failed = {}
+            while queue or running:
+                while queue and len(running) < concurrency:
+                    name, func = queue.pop(0)
+                    deadline = time.monotonic() + timeout if timeout else None
+                    running[executor.submit(collect, name, func)] = (
+                        name, deadline)
+
+                deadlines = [deadline for _name, deadline in running.values()
+                             if deadline is not None]
+                remaining = (max(0, min(deadlines) - time.monotonic())
+                             if deadlines else None)
+                done, _ = futures.wait(running, timeout=remaining,
+                                       return_when=futures.FIRST_COMPLETED)
+                now = time.monotonic()
+                for future, (name, deadline) in list(running.items()):
+                    if future in done:
+                        del running[future]
+                        results[name] = future.result()
+                    elif deadline is not None and now >= deadline:
+                        del running[future]
+                        msg = ('Collecting the %(section)s section of the '
+                               'inventory took longer than %(timeout)s '
+                               'second(s)' % {'section': name,
+                                              'timeout': timeout})
+                        if name not in optional:
+                            LOG.error(msg)
+                            raise errors.InventoryCollectionError(msg)
+                        LOG.warning('%s, it is left out of the inventory',
+                                    msg)
+                        results[name] = optional[name]
+                        failed[name] = msg
+            return results, failed
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
     def get_clean_steps(self, node, ports):
         """Get a list of clean steps with priority.
 
@@ -1467,7 +1711,9 @@ class GenericHardwareManager(HardwareManager):
 
     @contextlib.contextmanager
     def _cached_lshw(self):
-        if self._lshw_cache:
+        # NOTE: the cache is filled before the inventory sections are
+        # collected, threads collecting them concurrently only read it.
+        if self._lshw_cache is not None:
             yield  # make this context manager reentrant without purging cache
             return
 
@@ -1485,7 +1731,7 @@ class GenericHardwareManager(HardwareManager):
 
         :returns: A python dict from the lshw json output
         """
-        if self._lshw_cache:
+        if self._lshw_cache is not None:
             return self._lshw_cache
 
         out, _e = utils.execute('lshw', '-quiet', '-json', log_stdout=False)
@@ -2055,7 +2301,11 @@ class GenericHardwareManager(HardwareManager):
                 LOG.error(msg)
                 raise errors.IncompatibleHardwareMethodError(msg)
 
-        if self._shred_block_device(node, block_device):
+        if CONF.disk_erase_method == 'native':
+            erased = self._native_erase_block_device(node, block_device)
+        else:
+            erased = self._shred_block_device(node, block_device)
+        if erased:
             return
 
         msg = ('Unable to erase block device {}: device is unsupported.'
@@ -2088,6 +2338,63 @@ class GenericHardwareManager(HardwareManager):
 
         return erasable_devices
 
+    def _erase_devices_concurrently(self, node, devices, erase):
+        """Erase devices in a pool of threads.
+
+        Partitions are erased before and in the same thread as their disk,
+        since erasing the partition table of a disk removes its partitions.
+        The number of disks erased at the same time is limited by the
+        ``disk_erasure_concurrency`` value of the node's driver internal
+        info. No further device is erased once a safety check fails.
+
+        :param node: Ironic node object
+        :param devices: list of BlockDevice objects to erase, partitions
+            first.
+        :param erase: a callable accepting a BlockDevice and returning the
+            error erasing it or None on success.
+        :raises: ProtectedDeviceError if a safety check fails.
+        :returns: a dictionary in the form {device.name: error} for the
+            devices that could not be erased.
+        """
+        disks = collections.OrderedDict()
+        names = [dev.name for dev in devices]
+        for dev in devices:
+            disks.setdefault(_get_erase_disk(dev.name, names), []).append(dev)
+
+        info = node.get('driver_internal_info', {})
+        max_pool_size = info.get('disk_erasure_concurrency', 1)
+        progress = EraseProgress(devices)
+        protected = threading.Event()
+
+        def _erase_disk(disk_devices):
+            disk_errors = {}
+            for dev in disk_devices:
+                if protected.is_set():
+                    break
+                try:
+                    safety_check_block_device(node, dev.name)
+                except errors.ProtectedDeviceError:
+                    protected.set()
+                    raise
+                error = progress.track(dev.name, erase, dev)
+                if error is not None:
+                    progress.update(dev.name, status=progress.FAILED,
+                                    error=str(error))
+                    disk_errors[dev.name] = error
+            return disk_errors
+
+        thread_pool = ThreadPool(min(max_pool_size, len(disks)))
+        erase_disk = utils.in_execution_step(_erase_disk)
+        results = [thread_pool.apply_async(erase_disk, (disk_devices,))
+                   for disk_devices in disks.values()]
+        thread_pool.close()
+        thread_pool.join()
+
+        erase_errors = {}
+        for result in results:
+            erase_errors.update(result.get())
+        return erase_errors
+
     def erase_devices_metadata(self, node, ports):
         """Attempt to erase the disk devices metadata.
 
@@ -2100,16 +2407,16 @@ class GenericHardwareManager(HardwareManager):
                  operational risk which exists as it could also be a sign
                  of an environmental misconfiguration.
         """
-        erase_errors = {}
-        for dev in self._list_erasable_devices(node):
-            safety_check_block_device(node, dev.name)
+        def _erase_metadata(dev):
             try:
                 disk_utils.destroy_disk_metadata(dev.name, node['uuid'])
             except processutils.ProcessExecutionError as e:
                 LOG.error('Failed to erase the metadata on device "%(dev)s". '
                           'Error: %(error)s', {'dev': dev.name, 'error': e})
-                erase_errors[dev.name] = e
+                return e
 
+        erase_errors = self._erase_devices_concurrently(
+            node, self._list_erasable_devices(node), _erase_metadata)
         if erase_errors:
             excpt_msg = ('Failed to erase the metadata on the device(s): %s' %
                          '; '.join(['"%s": %s' % (k, v)
@@ -2131,21 +2438,20 @@ class GenericHardwareManager(HardwareManager):
                  operational risk which exists as it could also be a sign
                  of an environmental misconfiguration.
         """
-        erase_errors = {}
         info = node.get('driver_internal_info', {})
         erasable_devices = self._list_erasable_devices(node)
         if not erasable_devices:
             LOG.debug("No erasable devices have been found.")
             return
-        for dev in erasable_devices:
-            safety_check_block_device(node, dev.name)
+
+        def _express_erase(dev):
             secure_erase_error = None
             try:
                 if self._is_nvme(dev):
                     execute_nvme_erase = info.get(
                         'agent_enable_nvme_secure_erase', True)
                     if execute_nvme_erase and self._nvme_erase(dev):
-                        continue
+                        return
             except errors.BlockDeviceEraseError as e:
                 LOG.error('Failed to securely erase device "%(dev)s". '
                           'Error: %(error)s, falling back to metadata '
@@ -2158,13 +2464,13 @@ class GenericHardwareManager(HardwareManager):
                           '"%(dev)s". Error: %(error)s',
                           {'dev': dev.name, 'error': e})
                 if secure_erase_error:
-                    erase_errors[dev.name] = (
-                        "Secure erase failed: %s. "
-                        "Fallback to metadata erase also failed: %s.",
-                        secure_erase_error, e)
-                else:
-                    erase_errors[dev.name] = e
+                    return ("Secure erase failed: %s. "
+                            "Fallback to metadata erase also failed: %s.",
+                            secure_erase_error, e)
+                return e
 
+        erase_errors = self._erase_devices_concurrently(
+            node, erasable_devices, _express_erase)
         if erase_errors:
             excpt_msg = ('Failed to conduct an express erase on '
                          'the device(s): %s' % '\n'.join('"%s": %s' % item
@@ -2268,6 +2574,28 @@ class GenericHardwareManager(HardwareManager):
 
         return True
 
+    def _native_erase_block_device(self, node, block_device):
+        """Erase a block device by overwriting it from the agent.
+
+        :param node: Ironic node info.
+        :param block_device: a BlockDevice object to be erased
+        :returns: True if the erase succeeds, False if it fails for any reason
+        """
+        info = node.get('driver_internal_info', {})
+        try:
+            disk_erase.erase(
+                block_device.name,
+                iterations=info.get('agent_erase_devices_iterations', 1),
+                zeroize=info.get('agent_erase_devices_zeroize', True),
+                streams=CONF.disk_erase_streams,
+                callback=_report_erase_progress)
+        except OSError as e:
+            LOG.error("Erasing block device %(dev)s failed with error %(err)s",
+                      {'dev': block_device.name, 'err': e})
+            return False
+
+        return True
+
     def _is_virtual_media_device(self, block_device):
         """Check if the block device corresponds to Virtual Media device.
 
@@ -2567,6 +2895,24 @@ class GenericHardwareManager(HardwareManager):
                     ).format(block_device, e))
             raise errors.BlockDeviceEraseError(msg)
 
+    def _get_ipmi_lan_configs(self, ipv6=False):
+        """Get the LAN configuration of all BMC channels in-process.
+
+        :param ipv6: Whether to get the IPv6 configuration.
+        :returns: A list of ipmi.LanConfig objects, or None if the native
+            IPMI client is disabled or fails, in which case ipmitool should
+            be used.
+        """
+        if not CONF.ipmi_native_client:
+            return None
+        try:
+            with ipmi.Session() as session:
+                return ipmi.get_lan_configs(session, ipv6=ipv6)
+        except (errors.IPMIError, OSError) as e:
+            LOG.warning('Cannot get the BMC LAN configuration through the '
+                        'IPMI device, falling back to ipmitool: %s', e)
+            return None
+
     def get_bmc_address(self):
         """Attempt to detect BMC IP address
 
@@ -2576,6 +2922,15 @@ class GenericHardwareManager(HardwareManager):
         if not self.any_ipmi_device_exists():
             return None
 
+        lan_configs = self._get_ipmi_lan_configs()
+        if lan_configs is not None:
+            for config in lan_configs:
+                # In case we get 0.0.0.0 on a valid channel, we need to keep
+                # looking
+                if config.ip_address != '0.0.0.0':
+                    return config.ip_address
+            return '0.0.0.0'
+
         try:
             # From all the channels 0-15, only 1-11 can be assigned to
             # different types of communication media and protocols and
@@ -2617,6 +2972,23 @@ class GenericHardwareManager(HardwareManager):
         if not self.any_ipmi_device_exists():
             return None
 
+        lan_configs = self._get_ipmi_lan_configs(ipv6=True)
+        if lan_configs is not None:
+            for config in lan_configs:
+                # Skip auto-configured link-local addresses and unconfigured
+                # addresses
+                if config.ip_address == '0.0.0.0' and not any(
+                        not addr.address.startswith('::')
+                        and not addr.address.startswith('fe80')
+                        for addr in config.ipv6_addresses):
+                    continue
+                # In case we get 00:00:00:00:00:00 on a valid channel, we need
+                # to keep looking
+                if config.mac_address not in (None, '00:00:00:00:00:00'):
+                    return config.mac_address
+            # no valid mac found, signal this clearly
+            raise errors.IncompatibleHardwareMethodError()
+
         try:
             # From all the channels 0-15, only 1-11 can be assigned to
             # different types of communication media and protocols and
@@ -2693,6 +3065,20 @@ class GenericHardwareManager(HardwareManager):
         if not self.any_ipmi_device_exists():
             return None
 
+        lan_configs = self._get_ipmi_lan_configs(ipv6=True)
+        if lan_configs is not None:
+            for config in lan_configs:
+                if config.addressing not in ('ipv6', 'both'):
+                    continue
+                # Dynamic addresses are preferred, like below
+                addresses = sorted(
+                    config.ipv6_addresses,
+                    key=lambda a: a.source == ipmi.IPV6_SOURCE_STATIC)
+                for addr in addresses:
+                    if addr.active and addr.enabled and addr.address != '::':
+                        return addr.address
+            return '::/0'
+
         null_address_re = re.compile(r'^::(/\d{1,3})*$')
 
         def get_addr(channel, dynamic=False):
@@ -4076,9 +4462,21 @@ _CACHED_HW_INFO = None
 
 
 def list_hardware_info(use_cache=True):
-    """List hardware information with caching."""
+    """List hardware information with caching.
+
+    If the inventory monitor is enabled, the cached information is
+    collected again after udev reports a change to a block or network
+    device.
+    """
     global _CACHED_HW_INFO
 
+    monitor = inventory_monitor.get_monitor()
+    if monitor is not None and use_cache:
+        _CACHED_HW_INFO = monitor.cached(
+            'hardware_info', inventory_monitor.SUBSYSTEMS,
+            functools.partial(dispatch_to_managers, 'list_hardware_info'))
+        return _CACHED_HW_INFO
+
     if _CACHED_HW_INFO is None:
         _CACHED_HW_INFO = dispatch_to_managers('list_hardware_info')
         return _CACHED_HW_INFO
@@ -0,0 +1,274 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Content-addressed cache of verified images."""
+
+import hashlib
+import os
+import re
+import shutil
+import threading
+
+from oslo_concurrency import processutils
+from oslo_config import cfg
+from oslo_log import log
+from oslo_utils import units
+
+from ironic_python_agent import errors
+from ironic_python_agent import utils
+
+CONF = cfg.CONF
+LOG = log.getLogger(__name__)
+
+_PARTIAL_SUFFIX = '.part'
+_READ_SIZE = units.Mi
+_HEX_RE = re.compile('^[0-9a-f]+$')
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def image_key(image_info):
+    """Get the cache key of an image.
+
+    :param image_info: Image information dictionary.
+    :returns: A key derived from the os_hash_algo and os_hash_value of the
+              image, or None if the image cannot be cached, for example
+              because its checksum is only available from a URL.
+    """
+    algo = image_info.get('os_hash_algo')
+    value = (image_info.get('os_hash_value') or '').strip().lower()
+    if (not algo or algo not in hashlib.algorithms_available
+            or not _HEX_RE.match(value)):
+        return None
+    return '%s-%s' % (algo, value)
+
+
+class ImageCache(object):
+    """A directory of verified images, evicted in LRU order.
+
+    Every image is stored under a key derived from its checksum, so
+    identical images requested under different IDs or URLs share the same
+    entry. The modification time of an entry is updated on every hit and
+    serves as the LRU order. Since the cache may persist across deployments
+    on a local device, entries are verified against their checksum on every
+    hit.
+    """
+
+    def __init__(self, path, max_size):
+        """Initialize an instance of the ImageCache class.
+
+        :param path: The directory holding the cache.
+        :param max_size: Maximum total size (in bytes) of cached images.
+        """
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        # Left-overs of downloads interrupted by a restart of the agent
+        for name in os.listdir(path):
+            if name.endswith(_PARTIAL_SUFFIX):
+                utils.unlink_without_raise(os.path.join(path, name))
+
+    def _entry(self, key):
+        return os.path.join(self.path, key)
+
+    def _verify(self, key, path):
+        algo, _sep, expected = key.partition('-')
+        checksum = hashlib.new(algo)
+        try:
+            with open(path, 'rb') as f:
+                while True:
+                    data = f.read(_READ_SIZE)
+                    if not data:
+                        break
+                    checksum.update(data)
+        except FileNotFoundError:
+            return False
+        if checksum.hexdigest() != expected:
+            LOG.warning('Image %s in the image cache does not match its '
+                        'checksum, removing it', key)
+            with self._lock:
+                utils.unlink_without_raise(path)
+            return False
+        return True
+
+    def get(self, key, verify=True):
+        """Look up an image and mark it as recently used.
+
+        :param key: The key of the image, see image_key().
+        :param verify: Whether to verify the image against its checksum.
+                       Images that do not match it are removed.
+        :returns: The path of the cached image or None.
+        """
+        path = self._entry(key)
+        if verify and not self._verify(key, path):
+            return None
+        with self._lock:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                return None
+        return path
+
+    def partial_path(self, key):
+        """Get the path to download an image to before adding it.
+
+        :param key: The key of the image, see image_key().
+        :returns: A path inside the cache directory.
+        """
+        return self._entry(key) + _PARTIAL_SUFFIX
+
+    def add(self, key, path):
+        """Add a verified image to the cache.
+
+        The image is moved into the cache, then the least recently used
+        images are evicted until the cache fits into its size limit.
+
+        :param key: The key of the image, see image_key().
+        :param path: Path to the image. If it is on a different file
+                     system, it is copied instead.
+        :returns: The path of the cached image, or the original path if
+                  the image is too large to be cached.
+        """
+        size = os.path.getsize(path)
+        if size > self.max_size:
+            LOG.info('Image %(key)s of size %(size)s does not fit into the '
+                     'image cache of size %(max)s', {
+                         'key': key, 'size': size, 'max': self.max_size})
+            return path
+
+        entry = self._entry(key)
+        with self._lock:
+            try:
+                os.replace(path, entry)
+            except OSError:
+                partial = self.partial_path(key)
+                try:
+                    shutil.copyfile(path, partial)
+                    os.replace(partial, entry)
+                except OSError as e:
+                    utils.unlink_without_raise(partial)
+                    LOG.warning('Unable to add image %(key)s to the image '
+                                'cache: %(error)s', {'key': key, 'error': e})
+                    return path
+                utils.unlink_without_raise(path)
+            self._evict(keep=entry)
+        LOG.info('Image %(key)s added to the image cache', {'key': key})
+        return entry
+
+    def is_on_device(self, device):
+        """Check whether the cache is stored on a block device.
+
+        :param device: The block device, e.g. /dev/sda.
+        :returns: True if the cache directory is on the device or one of
+                  its partitions.
+        """
+        try:
+            cache_dev = os.stat(self.path).st_dev
+            disk_dev = os.stat(device).st_rdev
+        except OSError:
+            return False
+        # e.g. /sys/devices/.../block/sda and /sys/devices/.../sda/sda1
+        cache_path, disk_path = (
+            os.path.realpath('/sys/dev/block/%d:%d'
+                             % (os.major(dev), os.minor(dev)))
+            for dev in (cache_dev, disk_dev))
+        return (cache_path == disk_path
+                or cache_path.startswith(disk_path + '/'))
+
+    def _evict(self, keep):
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            if name.endswith(_PARTIAL_SUFFIX):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, path, st.st_size))
+            total += st.st_size
+
+        for _mtime, path, size in sorted(entries):
+            if total <= self.max_size:
+                break
+            if path == keep:
+                continue
+            LOG.info('Evicting %s from the image cache', path)
+            utils.unlink_without_raise(path)
+            total -= size
+
+
+def get_cache():
+    """Get the image cache, setting it up on first use.
+
+    :returns: An ImageCache instance, or None if the cache is disabled or
+              could not be set up.
+    """
+    global _CACHE
+
+    if not CONF.image_cache_dir or not CONF.image_cache_size:
+        return None
+
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            path = CONF.image_cache_dir
+            try:
+                if (CONF.image_cache_device
+                        and not os.path.ismount(path)):
+                    os.makedirs(path, exist_ok=True)
+                    utils.execute('mount', CONF.image_cache_device, path)
+                _CACHE = ImageCache(path, CONF.image_cache_size * units.Mi)
+            except (OSError, processutils.ProcessExecutionError) as e:
+                LOG.warning('Unable to set up the image cache in %(path)s, '
+                            'images will not be cached: %(error)s',
+                            {'path': path, 'error': e})
+                return None
+    return _CACHE
+
+
+def check_device(device):
+    """Make sure that the image cache is not stored on a device.
+
+    :param device: The block device an image is going to be written to.
+    :raises: DeploymentError if the image cache is mounted from the device
+             or one of its partitions.
+    """
+    if not CONF.image_cache_device:
+        return
+    cache = get_cache()
+    if cache is not None and cache.is_on_device(device):
+        raise errors.DeploymentError(
+            'The image cache device %s is located on the target device %s, '
+            'writing an image would overwrite it. Use a different '
+            'image_cache_device.' % (CONF.image_cache_device, device))
+
+
+def lookup(image_info):
+    """Look up an image in the image cache.
+
+    The image is not verified against its checksum, ImageCache.get()
+    does it before the image is used.
+
+    :param image_info: Image information dictionary.
+    :returns: The path of the cached image, or None if the cache is
+              disabled or does not contain the image.
+    """
+    key = image_key(image_info)
+    if key is None:
+        return None
+    cache = get_cache()
+    if cache is None:
+        return None
+    return cache.get(key, verify=False)
@@ -0,0 +1,471 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pipelined writing of image data to files and block devices."""
+
+import errno
+import fcntl
+import mmap
+import os
+import queue
+import stat
+import struct
+import threading
+
+from oslo_config import cfg
+from oslo_log import log
+from oslo_utils import units
+
+CONF = cfg.CONF
+LOG = log.getLogger(__name__)
+
+# Offsets and lengths of O_DIRECT writes must be aligned to the logical
+# block size of the device. 4 KiB covers both 512e and 4Kn devices.
+DIRECT_IO_ALIGNMENT = 4096
+
+# Granularity at which zero blocks are detected and skipped in sparse mode.
+SPARSE_BLOCK_SIZE = 64 * 1024
+
+# ioctl request number from linux/fs.h
+_BLKZEROOUT = 0x127f
+
+_ZERO_BLOCK = bytes(SPARSE_BLOCK_SIZE)
+
+# How long (in seconds) a stage blocks on a queue before checking whether
+# another stage has failed.
+_POLL_INTERVAL = 0.1
+
+
+class _Aborted(Exception):
+    """Raised inside a stage when another stage has failed."""
+
+
+def pwrite_all(fd, data, offset):
+    """Write all of the data at an offset, retrying short writes.
+
+    :param fd: A file descriptor open for writing.
+    :param data: A bytes-like object.
+    :param offset: Offset at which to write the data.
+    """
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def write_zeroes_offloaded(rdev):
+    """Check if the device offloads zeroing ranges with BLKZEROOUT.
+
+    BLKZEROOUT is turned into WRITE ZEROES (or WRITE SAME) commands, which
+    let the device unmap the range if it guarantees that it reads back as
+    zeroes, when the device reports a non-zero write_zeroes_max_bytes. The
+    kernel writes pages of zeroes otherwise. Since Linux 4.12 there is no
+    way to tell if discarded blocks read back as zeroes, discard_zeroes_data
+    is always 0, so BLKDISCARD is never used to zero ranges.
+
+    :param rdev: Device number of the block device.
+    :returns: True if the device, or the disk holding the partition,
+              reports a non-zero write_zeroes_max_bytes.
+    """
+    sysfs = '/sys/dev/block/%d:%d' % (os.major(rdev), os.minor(rdev))
+    for path in (os.path.join(sysfs, 'queue', 'write_zeroes_max_bytes'),
+                 os.path.join(sysfs, '..', 'queue',
+                              'write_zeroes_max_bytes')):
+        try:
+            with open(path) as f:
+                return int(f.read().strip() or 0) > 0
+        except (OSError, ValueError):
+            continue
+    return False
+
+
+def zero_device_range(fd, start, length):
+    """Zero a range of a block device with BLKZEROOUT.
+
+    :param fd: A file descriptor of a block device open for writing.
+    :param start: Offset of the range.
+    :param length: Length of the range.
+    :raises: OSError if the ioctl fails for another reason than being
+             unsupported.
+    :returns: True if the range was zeroed, False if the device does not
+              support it and zeroes have to be written instead.
+    """
+    try:
+        fcntl.ioctl(fd, _BLKZEROOUT, struct.pack('QQ', start, length))
+        return True
+    except OSError as e:
+        if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL):
+            raise
+        LOG.debug('Unable to zero %(length)s bytes at %(start)s with an '
+                  'ioctl, writing zeroes: %(error)s',
+                  {'length': length, 'start': start, 'error': e})
+        return False
+
+
+class SparseWriter(object):
+    """Writes data sequentially, skipping blocks consisting only of zeroes.
+
+    Runs of zero blocks are not written. On block devices they are zeroed
+    with BLKZEROOUT if the device offloads it (see write_zeroes_offloaded),
+    and written out as zeroes otherwise, so no stale data is left behind.
+    Regular files get holes past their original size. The checksum is not
+    affected, since the caller hashes the data before it is passed here.
+    """
+
+    def __init__(self, fd, offset=0, pwrite=None,
+                 block_size=SPARSE_BLOCK_SIZE):
+        """Initialize an instance of the SparseWriter class.
+
+        :param fd: A file descriptor open for writing.
+        :param offset: Offset at which to start writing.
+        :param pwrite: Optional callable with the signature of os.pwrite
+                       that writes all of the data it is given.
+        :param block_size: Size and alignment of the blocks checked for
+                           zeroes.
+        """
+        self._fd = fd
+        self._offset = offset
+        self._pwrite = pwrite or pwrite_all
+        self._block_size = block_size
+        self._zero_block = (_ZERO_BLOCK if block_size == SPARSE_BLOCK_SIZE
+                            else bytes(block_size))
+        self._zero_start = self._zero_end = None
+        # Page-aligned, as required by O_DIRECT.
+        self._pending_buf = memoryview(mmap.mmap(-1, block_size))
+        self._pending = 0
+        self.zeroes_skipped = 0
+        st = os.fstat(fd)
+        self._is_device = stat.S_ISBLK(st.st_mode)
+        self._zeroout = (self._is_device
+                         and write_zeroes_offloaded(st.st_rdev))
+        # Regular files read as zeroes past their current end.
+        self._size = None if self._is_device else st.st_size
+
+    @property
+    def committed(self):
+        """Offset up to which all data has reached the target."""
+        if self._zero_start is not None:
+            return self._zero_start
+        return self._offset - self._pending
+
+    def _zero(self, start, length):
+        if self._zeroout:
+            if zero_device_range(self._fd, start, length):
+                return
+            self._zeroout = False
+        if not self._is_device:
+            if start >= self._size:
+                return
+            length = min(length, self._size - start)
+        # Anonymous mappings are zero-filled and suitable for O_DIRECT.
+        zeroes = memoryview(mmap.mmap(-1, self._block_size))
+        while length:
+            size = min(length, self._block_size)
+            self._pwrite(self._fd, zeroes[:size], start)
+            start += size
+            length -= size
+
+    def zero(self, start, length):
+        """Zero a range of the target outside of the sequential stream.
+
+        :param start: Offset of the range.
+        :param length: Length of the range.
+        """
+        self._zero(start, length)
+        self.zeroes_skipped += length
+
+    def _flush_zeroes(self):
+        if self._zero_start is not None:
+            start, self._zero_start = self._zero_start, None
+            self._zero(start, self._zero_end - start)
+            self.zeroes_skipped += self._zero_end - start
+
+    def _write_data(self, view, offset):
+        self._flush_zeroes()
+        self._pwrite(self._fd, view, offset)
+
+    def _write_blocks(self, view, offset):
+        pos = run_start = 0
+        while pos < len(view):
+            end = min(len(view), pos + self._block_size
+                      - (offset + pos) % self._block_size)
+            # Compares the buffer in place, without copying the block.
+            if (end - pos == self._block_size
+                    and self._zero_block.startswith(view[pos:end])):
+                if run_start < pos:
+                    self._write_data(view[run_start:pos], offset + run_start)
+                if self._zero_start is None:
+                    self._zero_start = offset + pos
+                self._zero_end = offset + end
+                run_start = end
+            pos = end
+        if run_start < len(view):
+            self._write_data(view[run_start:], offset + run_start)
+
+    def write(self, data):
+        """Write data at the current offset.
+
+        A trailing incomplete block is kept back until it is completed by
+        the next call or flush() is called.
+
+        :param data: A bytes-like object or a string.
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        view = memoryview(data).cast('B')
+        if self._pending:
+            size = min(len(view),
+                       self._block_size - self._offset % self._block_size)
+            self._pending_buf[self._pending:self._pending + size] = (
+                view[:size])
+            self._pending += size
+            self._offset += size
+            view = view[size:]
+            if self._offset % self._block_size:
+                return
+            self._write_blocks(self._pending_buf[:self._pending],
+                               self._offset - self._pending)
+            self._pending = 0
+
+        tail = min(len(view), (self._offset + len(view)) % self._block_size)
+        self._write_blocks(view[:len(view) - tail], self._offset)
+        self._offset += len(view)
+        if tail:
+            self._pending_buf[:tail] = view[len(view) - tail:]
+            self._pending = tail
+
+    def flush(self):
+        """Write out all pending data and extend the target if needed."""
+        if self._pending:
+            self._write_data(self._pending_buf[:self._pending],
+                             self._offset - self._pending)
+            self._pending = 0
+        self._flush_zeroes()
+        if self._size is not None and self._offset > self._size:
+            os.ftruncate(self._fd, self._offset)
+            self._size = self._offset
+
+
+def copy_sparse(src, dst):
+    """Copy a file to a file or block device, skipping zero blocks.
+
+    :param src: Path to the source file.
+    :param dst: Path to the destination.
+    :returns: Number of bytes that did not have to be written.
+    """
+    chunk_size = CONF.image_write_chunk_size * units.Mi
+    with open(src, 'rb') as f_in, open(dst, 'r+b') as f_out:
+        writer = SparseWriter(f_out.fileno())
+        while True:
+            data = f_in.read(chunk_size)
+            if not data:
+                break
+            writer.write(data)
+        writer.flush()
+        os.fsync(f_out.fileno())
+    return writer.zeroes_skipped
+
+
+class ImageWriter(object):
+    """Writes a stream of image data through a three-stage pipeline.
+
+    The calling thread reads the source iterator and copies the data into
+    a bounded pool of reusable, page-aligned buffers. A hashing thread
+    feeds each buffer to the checksum callback in order, and a writer
+    thread writes it out using O_DIRECT, so that network receive, hashing
+    and disk writes overlap instead of adding up.
+    """
+
+    def __init__(self, path, update_hash, chunk_size=None, queue_depth=None,
+                 offset=0, progress=None, sparse=False):
+        """Initialize an instance of the ImageWriter class.
+
+        :param path: The file or block device to write to.
+        :param update_hash: A callable receiving every chunk of data, in
+                            order, before it is written.
+        :param chunk_size: Size (in bytes) of the buffers. Defaults to
+                           the image_write_chunk_size option.
+        :param queue_depth: Number of buffers in flight. Defaults to the
+                            image_write_queue_depth option.
+        :param offset: Offset in the target at which to start writing.
+                       The target is truncated on open if it is 0.
+        :param progress: An optional callable receiving the offset up to
+                         which the target has been written after each
+                         buffer.
+        :param sparse: Whether to skip blocks consisting only of zeroes,
+                       see SparseWriter.
+        """
+        self._path = path
+        self._update_hash = update_hash
+        self._chunk_size = (chunk_size
+                            or CONF.image_write_chunk_size * units.Mi)
+        self._queue_depth = queue_depth or CONF.image_write_queue_depth
+        self._offset = offset
+        self._progress = progress
+        self._sparse = sparse
+        self._direct = False
+        self._bytes_written = 0
+        self._error = None
+        self._abort = threading.Event()
+        self._free = queue.Queue()
+        self._to_hash = queue.Queue()
+        self._to_write = queue.Queue()
+
+    @property
+    def bytes_written(self):
+        """Number of bytes written to the target so far."""
+        return self._bytes_written
+
+    def _open(self):
+        flags = os.O_WRONLY | os.O_CREAT
+        if not self._offset:
+            flags |= os.O_TRUNC
+        try:
+            return os.open(self._path, flags | os.O_DIRECT, 0o644), True
+        except OSError as e:
+            # Some file systems, e.g. older tmpfs, do not support O_DIRECT.
+            if e.errno != errno.EINVAL:
+                raise
+            LOG.debug('O_DIRECT is not supported for %s, using buffered '
+                      'writes', self._path)
+            return os.open(self._path, flags, 0o644), False
+
+    def _fail(self, exc):
+        if self._error is None:
+            self._error = exc
+        self._abort.set()
+
+    def _get(self, source):
+        while True:
+            if self._abort.is_set():
+                raise _Aborted()
+            try:
+                return source.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+
+    def _hash_stage(self):
+        try:
+            while True:
+                item = self._get(self._to_hash)
+                if item is not None:
+                    buf, length = item
+                    self._update_hash(memoryview(buf)[:length])
+                self._to_write.put(item)
+                if item is None:
+                    return
+        except _Aborted:
+            pass
+        except Exception as e:
+            self._fail(e)
+
+    def _pwrite(self, fd, view, offset):
+        if self._direct and (len(view) % DIRECT_IO_ALIGNMENT
+                             or offset % DIRECT_IO_ALIGNMENT):
+            # Only the tail of the image, or the start of a resumed write,
+            # may be unaligned.
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) & ~os.O_DIRECT)
+            self._direct = False
+        pwrite_all(fd, view, offset)
+
+    def _write_stage(self, fd, direct):
+        self._direct = direct
+        offset = self._offset
+        sparse = None
+        if self._sparse:
+            sparse = SparseWriter(fd, offset, pwrite=self._pwrite)
+        try:
+            while True:
+                item = self._get(self._to_write)
+                if item is None:
+                    break
+                buf, length = item
+                view = memoryview(buf)[:length]
+                if sparse is not None:
+                    sparse.write(view)
+                else:
+                    self._pwrite(fd, view, offset)
+                offset += length
+                self._bytes_written = offset - self._offset
+                self._free.put(buf)
+                if self._progress is not None:
+                    self._progress(offset if sparse is None
+                                   else sparse.committed)
+            if sparse is not None:
+                sparse.flush()
+                if self._progress is not None:
+                    self._progress(sparse.committed)
+                LOG.debug('Skipped writing %(size)s bytes of zeroes to '
+                          '%(path)s', {'size': sparse.zeroes_skipped,
+                                       'path': self._path})
+            os.fsync(fd)
+        except _Aborted:
+            pass
+        except Exception as e:
+            self._fail(e)
+
+    def _read_stage(self, chunks):
+        buf, fill = self._get(self._free), 0
+        for data in chunks:
+            if isinstance(data, str):
+                data = data.encode()
+            data = memoryview(data)
+            while data:
+                size = min(len(data), self._chunk_size - fill)
+                buf[fill:fill + size] = data[:size]
+                data = data[size:]
+                fill += size
+                if fill == self._chunk_size:
+                    self._to_hash.put((buf, fill))
+                    buf, fill = self._get(self._free), 0
+        if fill:
+            self._to_hash.put((buf, fill))
+        self._to_hash.put(None)
+
+    def write(self, chunks):
+        """Write all data from an iterator of chunks.
+
+        :param chunks: An iterable of bytes-like objects, for example an
+                       ImageDownload instance.
+        :raises: The first exception raised by any of the stages.
+        :returns: The number of bytes written.
+        """
+        # Anonymous mappings are page-aligned, as required by O_DIRECT.
+        for _ in range(self._queue_depth):
+            self._free.put(mmap.mmap(-1, self._chunk_size))
+
+        fd, direct = self._open()
+        hasher = threading.Thread(target=self._hash_stage,
+                                  name='image-hash', daemon=True)
+        writer = threading.Thread(target=self._write_stage,
+                                  args=(fd, direct),
+                                  name='image-write', daemon=True)
+        hasher.start()
+        writer.start()
+        try:
+            self._read_stage(chunks)
+        except _Aborted:
+            pass
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            hasher.join()
+            writer.join()
+            os.close(fd)
+
+        if self._error is not None:
+            raise self._error
+        LOG.debug('Wrote %(size)s bytes to %(path)s', {
+            'size': self._bytes_written, 'path': self._path})
+        return self._bytes_written
@@ -13,9 +13,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from concurrent import futures
+import copy
+import gzip
+import hashlib
 from http import client as http_client
 import json
-import os
 import time
 
 from oslo_concurrency import processutils
@@ -31,6 +34,7 @@ from ironic_python_agent import encoding
 from ironic_python_agent import errors
 from ironic_python_agent import hardware
 from ironic_python_agent import mdns
+from ironic_python_agent import sysfs
 from ironic_python_agent import utils
 
 
@@ -40,6 +44,10 @@ CONF = cfg.CONF
 _DHCP_RETRY_INTERVAL = 2
 _COLLECTOR_NS = 'ironic_python_agent.inspector.collectors'
 _NO_LOGGING_FIELDS = ('logs',)
+_PCI_DEVICE_ATTRIBUTES = ('vendor', 'device', 'class', 'revision', 'numa_node')
+
+ALL_COLLECTORS = '*'
+"""Dependency on all the collectors preceding a collector."""
 
 
 def _extension_manager_err_callback(names):
@@ -58,6 +66,85 @@ def _get_collector_names():
     return [x.strip() for x in collectors.split(',') if x.strip()]
 
 
+def requires(*names):
+    """Declare the collectors that must finish before a collector starts.
+
+    Only matters when collectors run concurrently. Dependencies on
+    collectors that are not enabled or that come after the collector in
+    inspection_collectors are ignored, so the configured order always
+    satisfies them. Collectors without this decorator depend on all the
+    collectors preceding them, use it without arguments for collectors
+    that do not read the data collected by others.
+
+    :param names: Names of collectors or ALL_COLLECTORS.
+    """
+    def decorator(collector):
+        collector.inspection_requires = names
+        return collector
+
+    return decorator
+
+
+def _run_collector(name, collector, data, failures):
+    namespace = copy.deepcopy(data)
+    start = time.monotonic()
+    try:
+        collector(namespace, failures)
+    except Exception as exc:
+        # No reraise here, try to keep going
+        failures.add('collector %s failed: %s', name, exc)
+    duration = time.monotonic() - start
+    LOG.debug('Collector %(name)s finished in %(duration).2f seconds',
+              {'name': name, 'duration': duration})
+    return namespace, duration
+
+
+def _run_collectors_concurrently(collectors, data, failures):
+    """Run collectors concurrently, respecting their dependencies.
+
+    Every collector gets its own deep copy of the data collected by the
+    collectors that finished before it started. The keys it adds or
+    changes are merged into the data once it finishes.
+    """
+    names = [name for name, _collector in collectors]
+    pending = {}
+    for index, (name, collector) in enumerate(collectors):
+        required = getattr(collector, 'inspection_requires',
+                           (ALL_COLLECTORS,))
+        preceding = set(names[:index])
+        if ALL_COLLECTORS not in required:
+            preceding &= set(required)
+        pending[name] = (collector, preceding)
+
+    durations = {}
+    finished = set()
+    running = {}
+    run_collector = utils.in_execution_step(_run_collector)
+    with futures.ThreadPoolExecutor(
+            max_workers=CONF.inspection_collectors_concurrency) as executor:
+        while pending or running:
+            for name in names:
+                if name in pending and pending[name][1] <= finished:
+                    collector, _required = pending.pop(name)
+                    base = dict(data)
+                    future = executor.submit(run_collector, name, collector,
+                                             base, failures)
+                    running[future] = (name, base)
+
+            done, _ = futures.wait(running,
+                                   return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                name, base = running.pop(future)
+                namespace, durations[name] = future.result()
+                for key, value in namespace.items():
+                    if key not in base or value != base[key]:
+                        data[key] = value
+                finished.add(name)
+
+    data['collector_durations'] = {name: round(durations[name], 3)
+                                   for name in names}
+
+
 def inspect():
     """Optionally run inspection on the current node.
 
@@ -104,12 +191,18 @@ def inspect():
             failures.add(exc)
             call_inspector(data, failures)
 
-    for name, collector in collectors:
-        try:
-            collector(data, failures)
-        except Exception as exc:
-            # No reraise here, try to keep going
-            failures.add('collector %s failed: %s', name, exc)
+    # Collectors and hardware managers read many of the same sysfs
+    # attributes, read each of them once per inspection run.
+    with sysfs.memoize():
+        if CONF.inspection_collectors_concurrency > 1:
+            _run_collectors_concurrently(collectors, data, failures)
+        else:
+            for name, collector in collectors:
+                try:
+                    collector(data, failures)
+                except Exception as exc:
+                    # No reraise here, try to keep going
+                    failures.add('collector %s failed: %s', name, exc)
 
     resp = call_inspector(data, failures)
 
@@ -128,6 +221,11 @@ _RETRY_WAIT = 5
 _RETRY_WAIT_MAX = 30
 _RETRY_ATTEMPTS = 5
 
+# URLs that rejected compressed data
+_NO_COMPRESSION_URLS = set()
+# Content hashes of the fields of the data last accepted by the inspector
+_POSTED_FIELDS = None
+
 
 def _get_urls():
     urls = CONF.inspection_callback_url or CONF.api_url
@@ -137,15 +235,65 @@ def _get_urls():
     return urls
 
 
+def _encode_delta(data, encoder):
+    """Encode only the fields of the data that changed since the last post.
+
+    :returns: A tuple with the JSON document and the content hashes of all
+        fields of the data.
+    """
+    fields = {key: encoder.encode(value) for key, value in data.items()}
+    hashes = {key: hashlib.sha256(value.encode()).hexdigest()
+              for key, value in fields.items()}
+    if _POSTED_FIELDS is not None:
+        unchanged = sorted(key for key, value in hashes.items()
+                           if key != 'error'
+                           and _POSTED_FIELDS.get(key) == value)
+        LOG.debug('Not posting unchanged fields %s', unchanged)
+        for key in unchanged:
+            del fields[key]
+        fields['unchanged_fields'] = encoder.encode(unchanged)
+    document = '{%s}' % ', '.join('%s: %s' % (json.dumps(key), value)
+                                  for key, value in fields.items())
+    return document, hashes
+
+
+def _post(session, url, data, headers):
+    if not CONF.inspection_compression or url in _NO_COMPRESSION_URLS:
+        return session.post(url, data=data, headers=headers,
+                            timeout=CONF.http_request_timeout)
+
+    resp = session.post(url, data=gzip.compress(data.encode()),
+                        headers=dict(headers, **{'Content-Encoding': 'gzip'}),
+                        timeout=CONF.http_request_timeout)
+    # NOTE: there is no negotiation of request content codings before the
+    # request, servers that do not support them reject the body as invalid
+    # (400) or, when following RFC 7694, as unsupported (415).
+    if resp.status_code in (http_client.BAD_REQUEST,
+                            http_client.UNSUPPORTED_MEDIA_TYPE):
+        LOG.info('%s rejected compressed data with status %d, posting '
+                 'uncompressed data from now on', url, resp.status_code)
+        _NO_COMPRESSION_URLS.add(url)
+        resp = session.post(url, data=data, headers=headers,
+                            timeout=CONF.http_request_timeout)
+    return resp
+
+
 def call_inspector(data, failures):
     """Post data to inspector."""
+    global _POSTED_FIELDS
+
     data['error'] = failures.get_error()
 
     LOG.debug('collected data: %s',
               {k: v for k, v in data.items() if k not in _NO_LOGGING_FIELDS})
 
     encoder = encoding.RESTJSONEncoder()
-    data = encoder.encode(data)
+    if CONF.inspection_delta_posts:
+        data, hashes = _encode_delta(data, encoder)
+        # Post everything again if this post fails
+        _POSTED_FIELDS = None
+    else:
+        data = encoder.encode(data)
 
     headers = {
         'Content-Type': 'application/json',
@@ -171,9 +319,7 @@ def call_inspector(data, failures):
         for url in urls:
             LOG.info('Posting collected data to %s', url)
             try:
-                inspector_resp = session.post(
-                    url, data=data, headers=headers,
-                    timeout=CONF.http_request_timeout)
+                inspector_resp = _post(session, url, data, headers)
             except requests.exceptions.ConnectionError as exc:
                 if url == urls[-1]:
                     raise
@@ -195,6 +341,8 @@ def call_inspector(data, failures):
                   resp.status_code, resp.content.decode('utf-8'))
         return
 
+    if CONF.inspection_delta_posts:
+        _POSTED_FIELDS = hashes
     return resp.json()
 
 
@@ -251,6 +399,7 @@ def wait_for_dhcp():
     return False
 
 
+@requires()
 def collect_default(data, failures):
     """The default inspection collector.
 
@@ -289,6 +438,7 @@ def collect_default(data, failures):
     }
 
 
+@requires(ALL_COLLECTORS)
 def collect_logs(data, failures):
     """Collect system logs from the ramdisk.
 
@@ -311,6 +461,7 @@ def collect_logs(data, failures):
         return
 
 
+@requires()
 def collect_extra_hardware(data, failures):
     """Collect detailed inventory using 'hardware-detect' utility.
 
@@ -342,6 +493,7 @@ def collect_extra_hardware(data, failures):
         failures.add(msg, ex)
 
 
+@requires()
 def collect_pci_devices_info(data, failures):
     """Collect a list of PCI devices.
 
@@ -354,62 +506,44 @@ def collect_pci_devices_info(data, failures):
     :param data: mutable data that we'll send to inspector
     :param failures: AccumulatedFailures object
     """
-    pci_devices_path = '/sys/bus/pci/devices'
     pci_devices_info = []
     try:
-        subdirs = os.listdir(pci_devices_path)
+        entries = sysfs.list_directory(sysfs.PCI_DEVICES)
     except OSError as exc:
         msg = 'Failed to get list of PCI devices: %s'
         failures.add(msg, exc)
         return
-    for subdir in subdirs:
-        if not os.path.isdir(os.path.join(pci_devices_path, subdir)):
+    for entry in entries:
+        if not entry.is_dir:
+            continue
+        subdir = entry.name
+        attrs = sysfs.read_many(entry.path, _PCI_DEVICE_ATTRIBUTES)
+        if any(attrs[name] is None
+               for name in ('vendor', 'device', 'class')):
+            LOG.warning('Failed to gather vendor id, product id or pci class '
+                        'from PCI device %s', subdir)
             continue
         try:
             # note(sborkows): ids located in files inside PCI devices
             # directory are stored in hex format (0x1234 for example) and
             # we only need that part after 'x' delimiter
-            with open(os.path.join(pci_devices_path, subdir,
-                                   'vendor')) as vendor_file:
-                vendor = vendor_file.read().strip().split('x')[1]
-            with open(os.path.join(pci_devices_path, subdir,
-                                   'device')) as vendor_device:
-                device = vendor_device.read().strip().split('x')[1]
-            with open(os.path.join(pci_devices_path, subdir,
-                                   'class')) as vendor_device:
-                pci_class = vendor_device.read().strip().split('x')[1]
-        except IOError as exc:
-            LOG.warning('Failed to gather vendor id, product id or pci class '
-                        'from PCI device %s: %s', subdir, exc)
-            continue
+            vendor = attrs['vendor'].split('x')[1]
+            device = attrs['device'].split('x')[1]
+            pci_class = attrs['class'].split('x')[1]
         except IndexError as exc:
             LOG.warning('Wrong format of vendor id, product id or pci class '
                         'in PCI device %s: %s', subdir, exc)
             continue
 
         pci_revision = None
-        pci_revision_path = os.path.join(pci_devices_path, subdir,
-                                         'revision')
-        if os.path.isfile(pci_revision_path):
+        if attrs['revision'] is not None:
             try:
-                with open(pci_revision_path) as revision_file:
-                    pci_revision = revision_file.read().strip().split('x')[1]
-            except IOError as exc:
-                LOG.warning('Failed to gather PCI revision from PCI '
-                            'device %s: %s', subdir, exc)
+                pci_revision = attrs['revision'].split('x')[1]
             except IndexError as exc:
                 LOG.warning('Wrong format of PCI revision in PCI '
                             'device %s: %s', subdir, exc)
 
-        pci_numa_node_id = None
-        pci_numa_path = os.path.join(pci_devices_path, subdir, 'numa_node')
-        if os.path.isfile(pci_numa_path):
-            try:
-                with open(pci_numa_path) as vendor_numa_node:
-                    pci_numa_node_id = vendor_numa_node.read().strip()
-            except IOError as exc:
-                LOG.warning('Failed to gather numa_node id '
-                            'from PCI device %s: %s', subdir, exc)
+        pci_numa_node_id = attrs['numa_node']
 
         LOG.debug(
             'Found a PCI device with vendor id %s, product id %s, class %s '
@@ -424,15 +558,20 @@ def collect_pci_devices_info(data, failures):
     data['pci_devices'] = pci_devices_info
 
 
+@requires('default')
 def collect_lldp(data, failures):
     """Collect LLDP information for network interfaces.
 
+    Requires the default collector, which waits for the network interfaces
+    to get their IP addresses.
+
     :param data: mutable data that we'll send to inspector
     :param failures: AccumulatedFailures object
     """
     data['lldp_raw'] = hardware.dispatch_to_managers('collect_lldp_data')
 
 
+@requires()
 def collect_usb_devices(data, failures):
     """Collect USB information for connected devices.
 
@@ -0,0 +1,175 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Hardware inventory kept up to date by udev events."""
+
+import collections
+import threading
+
+from oslo_config import cfg
+from oslo_log import log
+import pyudev
+
+CONF = cfg.CONF
+LOG = log.getLogger(__name__)
+
+SUBSYSTEMS = ('block', 'net')
+
+Snapshot = collections.namedtuple('Snapshot', SUBSYSTEMS)
+Snapshot.__doc__ = """Versions of the monitored subsystems.
+
+Every field is increased each time an event is received for a device of
+the corresponding subsystem, two equal snapshots mean that nothing has
+changed in between.
+"""
+
+# Large enough for the events of a whole enclosure of disks appearing
+# between two queries.
+_RECEIVE_BUFFER_SIZE = 4 * 1024 * 1024
+
+_MONITOR = None
+_MONITOR_LOCK = threading.Lock()
+
+
+class InventoryMonitor(object):
+    """Cache of inventory data invalidated by udev events.
+
+    Events are read from the udev monitor socket whenever the inventory is
+    queried rather than from a separate thread: callers wait for udev to
+    settle before querying, after which the events of all the changes they
+    made are already queued on the socket. Without new events a query only
+    costs a non-blocking poll of the socket.
+    """
+
+    def __init__(self, context=None):
+        """Initialize an instance of the InventoryMonitor class.
+
+        :param context: A pyudev Context, a new one by default.
+        """
+        self._lock = threading.Lock()
+        self._versions = dict.fromkeys(SUBSYSTEMS, 0)
+        self._changes = {subsystem: {} for subsystem in SUBSYSTEMS}
+        # Versions at which events were lost
+        self._lost = dict.fromkeys(SUBSYSTEMS, 0)
+        self._cache = {}
+        self._monitor = pyudev.Monitor.from_netlink(
+            context or pyudev.Context())
+        for subsystem in SUBSYSTEMS:
+            self._monitor.filter_by(subsystem)
+        self._monitor.set_receive_buffer_size(_RECEIVE_BUFFER_SIZE)
+        self._monitor.start()
+
+    def _process_events(self):
+        # Called with the lock held
+        while True:
+            try:
+                device = self._monitor.poll(timeout=0)
+            except OSError as e:
+                # Most likely the receive buffer overflowed and events were
+                # lost, nothing can be trusted anymore.
+                LOG.warning('Failed to receive udev events, invalidating '
+                            'the whole inventory: %s', e)
+                for subsystem in SUBSYSTEMS:
+                    self._versions[subsystem] += 1
+                    self._lost[subsystem] = self._versions[subsystem]
+                    self._changes[subsystem].clear()
+                self._cache.clear()
+                return
+            if device is None:
+                return
+            subsystem = device.subsystem
+            if subsystem not in self._versions:
+                continue
+            LOG.debug('Received udev event %(action)s for %(subsystem)s '
+                      'device %(device)s',
+                      {'action': device.action, 'subsystem': subsystem,
+                       'device': device.sys_name})
+            self._versions[subsystem] += 1
+            self._changes[subsystem][device.sys_name] = (
+                self._versions[subsystem])
+
+    def snapshot(self):
+        """Get the current versions of the monitored subsystems.
+
+        :returns: A Snapshot.
+        """
+        with self._lock:
+            self._process_events()
+            return Snapshot(**self._versions)
+
+    def changed_devices(self, snapshot, subsystem):
+        """Get the devices that changed since a snapshot.
+
+        :param snapshot: A Snapshot returned by snapshot().
+        :param subsystem: One of SUBSYSTEMS.
+        :returns: A set of kernel device names (e.g. sda or eth0), or None
+            if the changes cannot be determined, in which case any device
+            may have changed.
+        """
+        with self._lock:
+            self._process_events()
+            since = getattr(snapshot, subsystem)
+            if self._lost[subsystem] > since:
+                return None
+            return {name for name, version in self._changes[subsystem].items()
+                    if version > since}
+
+    def cached(self, key, subsystems, func):
+        """Get a value computed from the inventory, computing it if needed.
+
+        :param key: A hashable key identifying the value.
+        :param subsystems: The subsystems the value depends on, it is
+            recomputed after an event for any of their devices.
+        :param func: A callable computing the value.
+        :returns: The value returned by func, possibly cached.
+        """
+        with self._lock:
+            self._process_events()
+            versions = tuple(self._versions[s] for s in subsystems)
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] == versions:
+                return entry[1]
+
+        value = func()
+        # Events received while computing the value make it outdated, they
+        # are detected by the next call since the versions read before the
+        # computation are stored.
+        with self._lock:
+            self._cache[key] = (versions, value)
+        return value
+
+    def invalidate(self):
+        """Drop all cached values."""
+        with self._lock:
+            self._cache.clear()
+
+
+def get_monitor():
+    """Get the inventory monitor, starting it on first use.
+
+    :returns: An InventoryMonitor instance, or None if the monitor is
+              disabled or could not be started.
+    """
+    global _MONITOR
+
+    if not CONF.inventory_udev_monitor:
+        return None
+
+    with _MONITOR_LOCK:
+        if _MONITOR is None:
+            try:
+                _MONITOR = InventoryMonitor()
+            except OSError as e:
+                LOG.warning('Unable to monitor udev events, the hardware '
+                            'inventory will not be cached: %s', e)
+                return None
+    return _MONITOR
@@ -0,0 +1,311 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Minimal in-process IPMI client using the Linux OpenIPMI device.
+
+Only what is needed to discover the BMC network configuration is
+implemented: requests are sent to the BMC through the system interface
+(KCS, SMIC, BT or SSIF, depending on the driver) of the ``ipmi_devintf``
+character device. Several requests can be in flight at the same time,
+the kernel message handler queues them for the BMC and responses are
+matched to requests using their message ID.
+"""
+
+import ctypes
+import fcntl
+import ipaddress
+import os
+import select
+import time
+
+from oslo_log import log
+
+from ironic_python_agent import errors
+
+LOG = log.getLogger(__name__)
+
+DEVICE_PATHS = ('/dev/ipmi0', '/dev/ipmi/0', '/dev/ipmidev/0')
+
+# From all the channels 0-15, only 1-11 can be assigned to different types
+# of communication media and protocols and effectively used
+LAN_CHANNELS = range(1, 12)
+
+# Network functions and commands from the IPMI v2.0 specification
+NETFN_TRANSPORT = 0x0c
+CMD_GET_LAN_CONFIG = 0x02
+
+# LAN configuration parameters
+LAN_PARAM_IP_ADDRESS = 3
+LAN_PARAM_MAC_ADDRESS = 5
+LAN_PARAM_IP_ADDRESSING_ENABLES = 51
+LAN_PARAM_IPV6_STATUS = 55
+LAN_PARAM_IPV6_STATIC_ADDRESS = 56
+LAN_PARAM_IPV6_DYNAMIC_ADDRESS = 59
+
+# Values of the IPv6/IPv4 Addressing Enables parameter
+ADDRESSING_MODES = {0: 'ipv4', 1: 'ipv6', 2: 'both'}
+
+# Sources of IPv6 addresses
+IPV6_SOURCE_STATIC = 0
+IPV6_SOURCE_SLAAC = 1
+IPV6_SOURCE_DHCPV6 = 2
+
+IPV6_STATUS_ACTIVE = 0
+
+COMPLETION_OK = 0x00
+
+# Definitions from linux/ipmi.h
+_IPMI_SYSTEM_INTERFACE_ADDR_TYPE = 0x0c
+_IPMI_BMC_CHANNEL = 0x0f
+_IPMI_RESPONSE_RECV_TYPE = 1
+_IPMI_MAX_MSG_LENGTH = 272
+
+
+class _SystemInterfaceAddr(ctypes.Structure):
+    _fields_ = [('addr_type', ctypes.c_int),
+                ('channel', ctypes.c_short),
+                ('lun', ctypes.c_ubyte)]
+
+
+class _Msg(ctypes.Structure):
+    _fields_ = [('netfn', ctypes.c_ubyte),
+                ('cmd', ctypes.c_ubyte),
+                ('data_len', ctypes.c_ushort),
+                ('data', ctypes.POINTER(ctypes.c_ubyte))]
+
+
+class _Req(ctypes.Structure):
+    _fields_ = [('addr', ctypes.POINTER(ctypes.c_ubyte)),
+                ('addr_len', ctypes.c_uint),
+                ('msgid', ctypes.c_long),
+                ('msg', _Msg)]
+
+
+class _Recv(ctypes.Structure):
+    _fields_ = [('recv_type', ctypes.c_int),
+                ('addr', ctypes.POINTER(ctypes.c_ubyte)),
+                ('addr_len', ctypes.c_uint),
+                ('msgid', ctypes.c_long),
+                ('msg', _Msg)]
+
+
+def _ioc(direction, number, size):
+    return (direction << 30) | (size << 16) | (ord('i') << 8) | number
+
+
+IPMICTL_RECEIVE_MSG_TRUNC = _ioc(3, 11, ctypes.sizeof(_Recv))
+IPMICTL_SEND_COMMAND = _ioc(2, 13, ctypes.sizeof(_Req))
+
+
+class Session(object):
+    """A session with the local BMC through the OpenIPMI device.
+
+    :param path: Path to the device, the first existing one of
+        DEVICE_PATHS by default.
+    :param timeout: Time (in seconds) to wait for responses.
+    """
+
+    def __init__(self, path=None, timeout=5):
+        if path is None:
+            path = next((p for p in DEVICE_PATHS if os.path.exists(p)),
+                        None)
+            if path is None:
+                raise errors.IPMIError('no IPMI device found')
+        self.path = path
+        self.timeout = timeout
+        self._fd = os.open(path, os.O_RDWR)
+        self._msgid = 0
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _send(self, netfn, cmd, data):
+        self._msgid += 1
+        addr = _SystemInterfaceAddr(
+            addr_type=_IPMI_SYSTEM_INTERFACE_ADDR_TYPE,
+            channel=_IPMI_BMC_CHANNEL, lun=0)
+        buf = (ctypes.c_ubyte * max(1, len(data)))(*data)
+        req = _Req(addr=ctypes.cast(ctypes.pointer(addr),
+                                    ctypes.POINTER(ctypes.c_ubyte)),
+                   addr_len=ctypes.sizeof(addr),
+                   msgid=self._msgid,
+                   msg=_Msg(netfn=netfn, cmd=cmd, data_len=len(data),
+                            data=buf))
+        fcntl.ioctl(self._fd, IPMICTL_SEND_COMMAND, req)
+        return self._msgid
+
+    def _receive(self, timeout):
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return None
+        addr = _SystemInterfaceAddr()
+        buf = (ctypes.c_ubyte * _IPMI_MAX_MSG_LENGTH)()
+        recv = _Recv(addr=ctypes.cast(ctypes.pointer(addr),
+                                      ctypes.POINTER(ctypes.c_ubyte)),
+                     addr_len=ctypes.sizeof(addr),
+                     msg=_Msg(data_len=_IPMI_MAX_MSG_LENGTH, data=buf))
+        fcntl.ioctl(self._fd, IPMICTL_RECEIVE_MSG_TRUNC, recv)
+        if recv.recv_type != _IPMI_RESPONSE_RECV_TYPE:
+            return recv.msgid, None
+        return recv.msgid, bytes(buf[:recv.msg.data_len])
+
+    def request(self, requests):
+        """Send requests to the BMC and wait for all their responses.
+
+        All requests are sent before waiting for the responses, so that the
+        driver can process them without a round trip through this process
+        for each of them.
+
+        :param requests: A list of (netfn, cmd, data) tuples.
+        :raises: IPMIError if a response is not received in time.
+        :returns: A list with the completion code and the data of the
+            response to each request, in the same order.
+        """
+        pending = {self._send(netfn, cmd, bytes(data)): index
+                   for index, (netfn, cmd, data) in enumerate(requests)}
+        responses = [None] * len(requests)
+        deadline = time.monotonic() + self.timeout
+        while pending:
+            result = self._receive(max(0, deadline - time.monotonic()))
+            if result is None:
+                raise errors.IPMIError(
+                    'no response to %d request(s) within %s second(s)'
+                    % (len(pending), self.timeout))
+            msgid, data = result
+            if data is None or msgid not in pending:
+                LOG.debug('Ignoring unexpected IPMI message %s', msgid)
+                continue
+            index = pending.pop(msgid)
+            if not data:
+                raise errors.IPMIError('empty response to request %s'
+                                       % msgid)
+            responses[index] = (data[0], data[1:])
+        return responses
+
+
+class LanConfig(object):
+    """LAN configuration of a BMC channel."""
+
+    def __init__(self, channel, ip_address=None, mac_address=None,
+                 addressing=None, ipv6_addresses=()):
+        self.channel = channel
+        self.ip_address = ip_address
+        self.mac_address = mac_address
+        self.addressing = addressing
+        self.ipv6_addresses = list(ipv6_addresses)
+
+
+class IPv6Address(object):
+    """An IPv6 address of a BMC channel."""
+
+    def __init__(self, address, prefix_length, source, enabled, status):
+        self.address = address
+        self.prefix_length = prefix_length
+        self.source = source
+        self.enabled = enabled
+        self.status = status
+
+    @property
+    def active(self):
+        return self.status == IPV6_STATUS_ACTIVE
+
+
+def _get_lan_param(channel, param, set_selector=0):
+    return (NETFN_TRANSPORT, CMD_GET_LAN_CONFIG,
+            [channel, param, set_selector, 0])
+
+
+def _parse_ipv6_address(data, dynamic):
+    # set selector, source/type, address, prefix length, status
+    if len(data) < 20:
+        return None
+    source = data[1] & 0x0f
+    if dynamic:
+        enabled = source in (IPV6_SOURCE_SLAAC, IPV6_SOURCE_DHCPV6)
+    else:
+        enabled = bool(data[1] & 0x80)
+    return IPv6Address(str(ipaddress.IPv6Address(bytes(data[2:18]))),
+                       data[18], source, enabled, data[19])
+
+
+def get_lan_configs(session, channels=LAN_CHANNELS, ipv6=True):
+    """Get the LAN configuration of all channels of the BMC.
+
+    The parameters of all channels are requested at once, then the IPv6
+    addresses of the channels that have IPv6 enabled.
+
+    :param session: A Session.
+    :param channels: Channels to query.
+    :param ipv6: Whether to get the IPv6 configuration.
+    :raises: IPMIError on communication errors.
+    :returns: A list of LanConfig objects for the valid LAN channels.
+    """
+    params = [LAN_PARAM_IP_ADDRESS, LAN_PARAM_MAC_ADDRESS]
+    if ipv6:
+        params += [LAN_PARAM_IP_ADDRESSING_ENABLES, LAN_PARAM_IPV6_STATUS]
+    requests = [(channel, param) for channel in channels for param in params]
+    responses = dict(zip(requests, session.request(
+        [_get_lan_param(channel, param) for channel, param in requests])))
+
+    configs = []
+    address_requests = []
+    for channel in channels:
+        code, data = responses[(channel, LAN_PARAM_IP_ADDRESS)]
+        if code != COMPLETION_OK or len(data) < 5:
+            # Not a LAN channel
+            LOG.debug('Channel %(channel)s is not a valid LAN channel, '
+                      'completion code %(code)#x',
+                      {'channel': channel, 'code': code})
+            continue
+        config = LanConfig(channel,
+                           ip_address=str(ipaddress.IPv4Address(data[1:5])))
+        code, data = responses[(channel, LAN_PARAM_MAC_ADDRESS)]
+        if code == COMPLETION_OK and len(data) >= 7:
+            config.mac_address = ':'.join('%02x' % b for b in data[1:7])
+        configs.append(config)
+
+        if not ipv6:
+            continue
+        code, data = responses[(channel, LAN_PARAM_IP_ADDRESSING_ENABLES)]
+        if code != COMPLETION_OK or len(data) < 2:
+            continue
+        config.addressing = ADDRESSING_MODES.get(data[1])
+        code, data = responses[(channel, LAN_PARAM_IPV6_STATUS)]
+        if code != COMPLETION_OK or len(data) < 3:
+            continue
+        for param, count in ((LAN_PARAM_IPV6_STATIC_ADDRESS, data[1]),
+                             (LAN_PARAM_IPV6_DYNAMIC_ADDRESS, data[2])):
+            address_requests += [(config, param, index)
+                                 for index in range(count)]
+
+    if address_requests:
+        responses = session.request(
+            [_get_lan_param(config.channel, param, index)
+             for config, param, index in address_requests])
+        for (config, param, _index), (code, data) in zip(address_requests,
+                                                         responses):
+            if code != COMPLETION_OK:
+                continue
+            address = _parse_ipv6_address(
+                data[1:], dynamic=param == LAN_PARAM_IPV6_DYNAMIC_ADDRESS)
+            if address is not None:
+                config.ipv6_addresses.append(address)
+
+    return configs
@@ -18,7 +18,9 @@ https://review.opendev.org/651222.
 
 import ipaddress
 import logging
+import socket
 import time
+from urllib import parse as urlparse
 
 from oslo_config import cfg
 from oslo_config import types as cfg_types
@@ -130,6 +132,12 @@ class Zeroconf(object):
                 time.sleep(delay)
                 delay *= 2
 
+        return self._parse_endpoint(info, service_type,
+                                    skip_loopback=skip_loopback,
+                                    skip_link_local=skip_link_local)
+
+    def _parse_endpoint(self, info, service_type, skip_loopback=True,
+                        skip_link_local=False):
         all_addr = info.parsed_addresses()
 
         # Try to find the first routable address
@@ -203,6 +211,84 @@ class Zeroconf(object):
                                                        path=path),
                 properties)
 
+    def register_service(self, service_type, endpoint, params=None):
+        """Register a service.
+
+        This call announces the new services via multicast and instructs the
+        built-in server to respond to queries about it.
+
+        :param service_type: OpenStack service type, e.g. "baremetal".
+        :param endpoint: full endpoint to reach the service, e.g.
+            "http://192.168.1.1:6385/v1". Must contain an IP address.
+        :param params: optional properties as a dictionary.
+        :raises: :exc:`.ServiceRegistrationFailure` if the service cannot be
+            registered, e.g. because of conflicts.
+        """
+        parsed = urlparse.urlparse(endpoint)
+        properties = dict(params or {}, protocol=parsed.scheme)
+        if parsed.path:
+            properties['path'] = parsed.path
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        # A local host name makes the clients use the address
+        server = '%s.local.' % socket.gethostname().split('.')[0]
+        info = zeroconf.ServiceInfo(_MDNS_DOMAIN,
+                                    '%s.%s' % (service_type, _MDNS_DOMAIN),
+                                    parsed_addresses=[parsed.hostname],
+                                    port=port,
+                                    properties=properties,
+                                    server=server)
+
+        LOG.debug('Registering %s via mDNS', info)
+        try:
+            self._zc.register_service(info)
+        except Exception as exc:
+            raise errors.ServiceRegistrationFailure(
+                service=service_type, error=exc)
+        self._registered.append(info)
+
+    def find_endpoints(self, prefix, timeout, skip_loopback=True):
+        """Find all endpoints of services with a common name prefix.
+
+        :param prefix: Prefix of the service types to look for.
+        :param timeout: How long to wait for announcements, in seconds.
+        :param skip_loopback: Whether to ignore loopback addresses.
+        :returns: list of tuples (service type, endpoint URL, properties).
+        """
+        names = set()
+        removed = zeroconf.ServiceStateChange.Removed
+
+        # NOTE: handlers are called with keyword arguments
+        def _on_change(zeroconf, service_type, name, state_change):
+            if state_change is not removed:
+                names.add(name)
+
+        browser = zeroconf.ServiceBrowser(self._zc, _MDNS_DOMAIN,
+                                          handlers=[_on_change])
+        try:
+            time.sleep(timeout)
+        finally:
+            browser.cancel()
+
+        result = []
+        suffix = '.' + _MDNS_DOMAIN
+        for name in sorted(names):
+            service_type = name[:-len(suffix)]
+            if not name.endswith(suffix) or not service_type.startswith(
+                    prefix):
+                continue
+            info = self._zc.get_service_info(_MDNS_DOMAIN, name)
+            if info is None:
+                LOG.debug('Service %s disappeared', name)
+                continue
+            try:
+                endpoint, properties = self._parse_endpoint(
+                    info, service_type, skip_loopback=skip_loopback)
+            except errors.ServiceLookupFailure as exc:
+                LOG.debug('Ignoring service %s: %s', name, exc)
+                continue
+            result.append((service_type, endpoint, properties))
+        return result
+
     def close(self):
         """Shut down mDNS and unregister services.
 
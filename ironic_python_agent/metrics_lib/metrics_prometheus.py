@@ -0,0 +1,197 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import bisect
+import logging
+import re
+import threading
+
+from oslo_config import cfg
+from oslo_config import types
+
+from ironic_python_agent.metrics_lib import metrics
+
+prometheus_opts = [
+    cfg.ListOpt('histogram_buckets',
+                item_type=types.Float(min=0),
+                default=[0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+                         5, 10, 30, 60, 300, 600, 1800, 3600],
+                help='Upper bounds (in seconds) of the buckets of the '
+                     'histograms the durations of timers are recorded in. '
+                     'Used with the prometheus backend.'),
+]
+
+LOG = logging.getLogger(__name__)
+CONF = cfg.CONF
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_INVALID_NAME_CHARS = re.compile(r'[^a-zA-Z0-9_:]')
+
+
+def _metric_name(name, suffix=''):
+    """Convert a metric name into a valid Prometheus metric name."""
+    name = _INVALID_NAME_CHARS.sub('_', name)
+    if not name or name[0].isdigit():
+        name = '_' + name
+    return name + suffix
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram(object):
+    """Cumulative histogram of observed values."""
+
+    def __init__(self, buckets):
+        self.buckets = sorted(float(bound) for bound in buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def samples(self, name):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield ('%s_bucket{le="%s"}' % (name, _format_value(bound)),
+                   cumulative)
+        yield '%s_bucket{le="+Inf"}' % name, self.count
+        yield '%s_sum' % name, self.sum
+        yield '%s_count' % name, self.count
+
+
+class Registry(object):
+    """Thread-safe storage of counters, gauges and histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def inc(self, name, value=1):
+        """Increment a counter."""
+        name = _metric_name(name, '_total')
+        with self._lock:
+            self._metrics[name] = ('counter',
+                                   self._value(name, 'counter', 0) + value)
+
+    def set(self, name, value):
+        """Set the value of a gauge."""
+        name = _metric_name(name)
+        with self._lock:
+            self._value(name, 'gauge', 0)
+            self._metrics[name] = ('gauge', value)
+
+    def observe(self, name, value, buckets=None):
+        """Record a value in a histogram.
+
+        :param name: Metric name.
+        :param value: The value to record.
+        :param buckets: Upper bounds of the buckets of the histogram,
+            only used when the histogram is created. Defaults to the
+            [metrics_prometheus]histogram_buckets option.
+        """
+        name = _metric_name(name)
+        with self._lock:
+            histogram = self._value(name, 'histogram', None)
+            if histogram is None:
+                histogram = Histogram(
+                    buckets or CONF.metrics_prometheus.histogram_buckets)
+                self._metrics[name] = ('histogram', histogram)
+            histogram.observe(value)
+
+    def _value(self, name, metric_type, default):
+        try:
+            existing_type, value = self._metrics[name]
+        except KeyError:
+            return default
+        if existing_type != metric_type:
+            raise ValueError('Metric %s is a %s, not a %s'
+                             % (name, existing_type, metric_type))
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, (metric_type, value) in sorted(self._metrics.items()):
+                lines.append('# TYPE %s %s' % (name, metric_type))
+                if metric_type == 'histogram':
+                    samples = value.samples(name)
+                else:
+                    samples = [(name, value)]
+                lines.extend('%s %s' % (sample, _format_value(sample_value))
+                             for sample, sample_value in samples)
+        return ''.join(line + '\n' for line in lines)
+
+
+REGISTRY = Registry()
+
+
+class PrometheusMetricLogger(metrics.MetricLogger):
+    """Metric logger that records data for scraping by Prometheus.
+
+    Counters, gauges and timers are recorded in a process-wide registry
+    which is exposed by the agent API. Timers are recorded as histograms
+    of durations in seconds.
+    """
+
+    def __init__(self, prefix, delimiter='.', registry=None):
+        """Initialize a PrometheusMetricLogger.
+
+        :param prefix: Prefix for this metric logger.
+        :param delimiter: Delimiter used to generate the full metric name.
+        :param registry: The Registry to record metrics in, defaults to
+            the process-wide one.
+        """
+        super(PrometheusMetricLogger, self).__init__(prefix,
+                                                     delimiter=delimiter)
+        self._registry = registry or REGISTRY
+
+    def _record(self, func, name, *args):
+        try:
+            func(name, *args)
+        except ValueError as e:
+            LOG.warning("Failed to record the metric value of %(name)s: "
+                        "%(error)s", {'name': name, 'error': e})
+
+    def _gauge(self, name, value):
+        self._record(self._registry.set, name, value)
+
+    def _counter(self, name, value, sample_rate=None):
+        if sample_rate:
+            # Estimate the actual number of events
+            value = value / sample_rate
+        self._record(self._registry.inc, name, value)
+
+    def _timer(self, name, value):
+        # Timers are in milliseconds, Prometheus uses seconds
+        self._record(self._registry.observe, _metric_name(name, '_seconds'),
+                     value / 1000)
+
+
+def list_opts():
+    """Entry point for oslo-config-generator."""
+    return [('metrics_prometheus', prometheus_opts)]
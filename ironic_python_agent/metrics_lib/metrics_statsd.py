@@ -16,6 +16,7 @@
 import contextlib
 import logging
 import socket
+import threading
 
 from oslo_config import cfg
 
@@ -27,12 +28,162 @@ statsd_opts = [
                help='Host for use with the statsd backend.'),
     cfg.PortOpt('statsd_port',
                 default=8125,
-                help='Port to use with the statsd backend.')
+                help='Port to use with the statsd backend.'),
+    cfg.FloatOpt('statsd_flush_interval',
+                 default=0,
+                 min=0,
+                 help='Interval (in seconds) at which buffered metrics are '
+                      'sent to the statsd backend by a background thread. '
+                      'Set to 0 to send every metric as soon as it is '
+                      'recorded.'),
+    cfg.IntOpt('statsd_max_packet_size',
+               default=1432,
+               min=64,
+               max=65507,
+               help='Maximum size (in bytes) of the datagrams buffered '
+                    'metrics are packed into. Should fit in the MTU of the '
+                    'network used to reach the statsd backend.'),
+    cfg.IntOpt('statsd_buffer_size',
+               default=10000,
+               min=1,
+               help='Maximum number of metrics buffered between flushes. '
+                    'Metrics recorded while the buffer is full are dropped, '
+                    'their number is sent in the '
+                    'ironic_python_agent.metrics_lib.metrics_statsd.dropped '
+                    'counter.'),
 ]
 
 LOG = logging.getLogger(__name__)
 CONF = cfg.CONF
 
+# Target (host, port) -> MetricBuffer
+_BUFFERS = {}
+_BUFFERS_LOCK = threading.Lock()
+
+
+class MetricBuffer(threading.Thread):
+    """Buffer statsd metrics and send them in batches in the background.
+
+    Metrics are packed into datagrams of up to max_packet_size bytes,
+    separated by newlines. Metrics recorded while the buffer is full are
+    dropped rather than blocking the caller; their number is sent as a
+    counter with the next batch.
+    """
+
+    def __init__(self, target, interval, max_packet_size, size,
+                 dropped_metric=None):
+        super(MetricBuffer, self).__init__(name='statsd-flusher', daemon=True)
+        self._target = target
+        self._interval = interval
+        self._max_packet_size = max_packet_size
+        self._size = size
+        self._dropped_metric = dropped_metric
+        self._lock = threading.Lock()
+        self._metrics = []
+        self._stopped = threading.Event()
+        self.dropped = 0
+        self._reported_dropped = 0
+
+    def add(self, metric):
+        """Add a formatted metric to the buffer without blocking.
+
+        :param metric: The metric in the statsd line format.
+        :returns: False if the buffer is full and the metric was dropped.
+        """
+        with self._lock:
+            if len(self._metrics) >= self._size:
+                self.dropped += 1
+                return False
+            self._metrics.append(metric)
+            return True
+
+    def _packets(self, metrics):
+        packet = []
+        length = 0
+        for metric in metrics:
+            data = metric.encode()
+            if packet and length + 1 + len(data) > self._max_packet_size:
+                yield b'\n'.join(packet)
+                packet = []
+                length = 0
+            length += len(data) + (1 if packet else 0)
+            packet.append(data)
+        if packet:
+            yield b'\n'.join(packet)
+
+    def flush(self):
+        """Send all buffered metrics."""
+        with self._lock:
+            metrics, self._metrics = self._metrics, []
+            dropped = self.dropped - self._reported_dropped
+            self._reported_dropped = self.dropped
+
+        if dropped:
+            LOG.warning("Dropped %d metrics because the buffer was full",
+                        dropped)
+            if self._dropped_metric:
+                metrics.append('%s:%d|%s' % (self._dropped_metric, dropped,
+                                             StatsdMetricLogger.COUNTER_TYPE))
+        if not metrics:
+            return
+
+        with contextlib.closing(self._open_socket()) as sock:
+            sock.settimeout(0.0)
+            for packet in self._packets(metrics):
+                try:
+                    sock.sendto(packet, self._target)
+                except socket.error as e:
+                    LOG.warning("Failed to send the metric values to host "
+                                "%(host)s, port %(port)s. Error: %(error)s",
+                                {'host': self._target[0],
+                                 'port': self._target[1], 'error': e})
+
+    def _open_socket(self):
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            self.flush()
+        self.flush()
+
+    def stop(self):
+        """Stop the background thread after sending the buffered metrics."""
+        self._stopped.set()
+        self.join()
+
+
+def _get_buffer(target):
+    with _BUFFERS_LOCK:
+        buffer = _BUFFERS.get(target)
+        if buffer is None:
+            dropped_metric = '.'.join(filter(None, [
+                CONF.metrics.global_prefix, __name__, 'dropped']))
+            buffer = MetricBuffer(
+                target, CONF.metrics_statsd.statsd_flush_interval,
+                CONF.metrics_statsd.statsd_max_packet_size,
+                CONF.metrics_statsd.statsd_buffer_size,
+                dropped_metric=dropped_metric)
+            buffer.start()
+            _BUFFERS[target] = buffer
+        return buffer
+
+
+def flush_buffers():
+    """Send the metrics buffered for all targets without waiting."""
+    with _BUFFERS_LOCK:
+        buffers = list(_BUFFERS.values())
+    for buffer in buffers:
+        buffer.flush()
+
+
+def stop_buffers():
+    """Send the metrics buffered for all targets and stop buffering."""
+    with _BUFFERS_LOCK:
+        buffers = list(_BUFFERS.values())
+        _BUFFERS.clear()
+    for buffer in buffers:
+        buffer.stop()
+
 
 class StatsdMetricLogger(metrics.MetricLogger):
     """Metric logger that reports data via the statsd protocol."""
@@ -59,6 +210,11 @@ class StatsdMetricLogger(metrics.MetricLogger):
 
         self._target = (self._host, self._port)
 
+        if CONF.metrics_statsd.statsd_flush_interval:
+            self._buffer = _get_buffer(self._target)
+        else:
+            self._buffer = None
+
     def _send(self, name, value, metric_type, sample_rate=None):
         """Send metrics to the statsd backend
 
@@ -73,6 +229,10 @@ class StatsdMetricLogger(metrics.MetricLogger):
         else:
             metric = '%s:%s|%s@%s' % (name, value, metric_type, sample_rate)
 
+        if self._buffer is not None:
+            self._buffer.add(metric)
+            return
+
         # Ideally, we'd cache a sending socket in self, but that
         # results in a socket getting shared by multiple green threads.
         with contextlib.closing(self._open_socket()) as sock:
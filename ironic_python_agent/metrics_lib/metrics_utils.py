@@ -18,6 +18,7 @@ from oslo_config import cfg
 from ironic_python_agent import errors
 from ironic_python_agent.metrics_lib import metrics
 from ironic_python_agent.metrics_lib import metrics_collector
+from ironic_python_agent.metrics_lib import metrics_prometheus
 from ironic_python_agent.metrics_lib import metrics_statsd
 
 metrics_opts = [
@@ -28,6 +29,10 @@ metrics_opts = [
                    ('statsd', 'Transmits metrics data to a statsd backend.'),
                    ('collector', 'Collects metrics data and saves it in '
                                  'memory for use by the running application.'),
+                   ('prometheus', 'Records counters, gauges and histograms '
+                                  'of timers in memory and exposes them on '
+                                  'the /metrics endpoint of the agent API '
+                                  'for scraping by Prometheus.'),
                ],
                help='Backend to use for the metrics system.'),
     cfg.BoolOpt('prepend_host',
@@ -95,8 +100,26 @@ def get_metrics_logger(prefix='', backend=None, host=None, delimiter='.'):
     elif backend == 'collector':
         return metrics_collector.DictCollectionMetricLogger(
             prefix, delimiter=delimiter)
+    elif backend == 'prometheus':
+        return metrics_prometheus.PrometheusMetricLogger(
+            prefix, delimiter=delimiter)
     else:
         msg = ("The backend is set to an unsupported type: "
                "%s. Value should be 'noop' or 'statsd'."
                % backend)
         raise errors.InvalidMetricConfig(msg)
+
+
+def flush_metrics(stop=False):
+    """Send the metrics buffered by the statsd backend right away.
+
+    Must be called before the agent exits or the machine powers off,
+    otherwise the metrics recorded since the last periodic flush are lost.
+
+    :param stop: Whether to also stop the background threads sending the
+        buffered metrics.
+    """
+    if stop:
+        metrics_statsd.stop_buffers()
+    else:
+        metrics_statsd.flush_buffers()
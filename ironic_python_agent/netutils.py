@@ -19,21 +19,32 @@ import select
 import socket
 import struct
 import sys
+import threading
+import time
 
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import netutils
 import psutil
 
+from ironic_python_agent import sysfs
 from ironic_python_agent import utils
 
 LOG = logging.getLogger(__name__)
 CONF = cfg.CONF
 
 LLDP_ETHERTYPE = 0x88cc
+# Nearest bridge, nearest non-TPMR bridge and nearest customer bridge
+LLDP_MULTICAST_ADDRS = (b'\x01\x80\xc2\x00\x00\x0e',
+                        b'\x01\x80\xc2\x00\x00\x03',
+                        b'\x01\x80\xc2\x00\x00\x00')
 IFF_PROMISC = 0x100
 SIOCGIFFLAGS = 0x8913
 SIOCSIFFLAGS = 0x8914
+# From linux/if_packet.h
+SOL_PACKET = 263
+PACKET_ADD_MEMBERSHIP = 1
+PACKET_MR_MULTICAST = 0
 # SIOCETHTOOL from linux/sockios.h
 SIOCETHTOOL = 0x8946
 # ETHTOOL_GPERMADDR from linux/ethtool.h
@@ -45,12 +56,20 @@ INFINIBAND_ADDR_LEN = 59
 
 # LLDP definitions needed to extract vlan information
 LLDP_TLV_ORG_SPECIFIC = 127
+LLDP_TLV_TTL = 3
 # 802.1Q defines from http://www.ieee802.org/1/pages/802.1Q-2014.html, Annex D
 LLDP_802dot1_OUI = "0080c2"
 # subtypes
 dot1_VLAN_NAME = "03"
 VLAN_ID_LEN = len(LLDP_802dot1_OUI + dot1_VLAN_NAME)
 
+# Time-to-live of LLDP packets without a valid TTL TLV, 4 times the default
+# transmit interval as recommended by 802.1AB.
+_LLDP_DEFAULT_TTL = 120
+
+_LLDP_LISTENER = None
+_LLDP_LISTENER_LOCK = threading.Lock()
+
 
 class ethtoolPermAddr(ctypes.Structure):
     """Class for getting interface permanent MAC address"""
@@ -138,11 +157,17 @@ def get_lldp_info(interface_names):
     parses them. If no LLDP packets are received before lldp_timeout,
     returns a dictionary in the form {'interface': [],...}.
 
+    If the LLDP listener is running, the packets it has received are
+    returned instead, only waiting for the interfaces without packets.
+
     :param interface_names: The interface to listen for packets on. If
                            None, will listen on each interface.
     :return: A dictionary in the form
              {'interface': [(lldp_type, lldp_data)],...}
     """
+    if _LLDP_LISTENER is not None:
+        return _LLDP_LISTENER.get(interface_names, CONF.lldp_timeout)
+
     with RawPromiscuousSockets(interface_names, LLDP_ETHERTYPE) as interfaces:
         try:
             return _get_lldp_info(interfaces)
@@ -236,6 +261,191 @@ def _get_lldp_info(interfaces):
     return lldp_info
 
 
+def _get_lldp_ttl(tlvs):
+    for tlv_type, data in tlvs:
+        if tlv_type == LLDP_TLV_TTL and len(data) == 2:
+            return struct.unpack('!H', data)[0]
+    return _LLDP_DEFAULT_TTL
+
+
+class LLDPListener(threading.Thread):
+    """Receive LLDP packets in the background and keep the latest ones.
+
+    A raw socket is kept open on every interface LLDP packets are requested
+    for. Instead of putting the interfaces in promiscuous mode, the sockets
+    join the LLDP multicast groups, which the kernel leaves when they are
+    closed. The TLVs of the last packet received on an interface are kept
+    for the time-to-live advertised in the packet.
+    """
+
+    def __init__(self):
+        super(LLDPListener, self).__init__(name='lldp-listener', daemon=True)
+        self._lock = threading.Lock()
+        self._received = threading.Condition(self._lock)
+        # Interface name -> socket
+        self._sockets = {}
+        # Interface name -> (expiry time, TLVs)
+        self._packets = {}
+        self._stopped = False
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+
+    def _open_socket(self, interface_name):
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW,
+                             socket.htons(LLDP_ETHERTYPE))
+        try:
+            index = socket.if_nametoindex(interface_name)
+            for address in LLDP_MULTICAST_ADDRS:
+                # struct packet_mreq from linux/if_packet.h
+                mreq = struct.pack('iHH8s', index, PACKET_MR_MULTICAST,
+                                   len(address), address)
+                sock.setsockopt(SOL_PACKET, PACKET_ADD_MEMBERSHIP, mreq)
+            sock.bind((interface_name, LLDP_ETHERTYPE))
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def _wakeup(self):
+        self._wakeup_writer.send(b'\0')
+
+    def listen(self, interface_names):
+        """Listen for LLDP packets on interfaces not listened on yet.
+
+        :param interface_names: A list of interface names.
+        """
+        opened = False
+        for name in interface_names:
+            with self._lock:
+                if name in self._sockets:
+                    continue
+            try:
+                sock = self._open_socket(name)
+            except OSError as e:
+                LOG.warning('Cannot listen for LLDP packets on interface '
+                            '%(interface)s: %(error)s',
+                            {'interface': name, 'error': e})
+                continue
+            with self._lock:
+                if name in self._sockets:
+                    # Opened by another thread in the meantime
+                    duplicate = sock
+                else:
+                    self._sockets[name] = sock
+                    duplicate = None
+                    opened = True
+            if duplicate is not None:
+                duplicate.close()
+        if opened:
+            self._wakeup()
+
+    def _receive(self, name, sock):
+        try:
+            tlvs = _receive_lldp_packets(sock)
+        except OSError as e:
+            LOG.warning('Failed to receive LLDP packets on interface '
+                        '%(interface)s, no longer listening on it: %(error)s',
+                        {'interface': name, 'error': e})
+            with self._lock:
+                sock = self._sockets.pop(name)
+            sock.close()
+            return
+        if not tlvs:
+            return
+
+        ttl = _get_lldp_ttl(tlvs)
+        LOG.debug('Received LLDP packet on interface %(interface)s, valid for '
+                  '%(ttl)d seconds', {'interface': name, 'ttl': ttl})
+        with self._received:
+            if ttl:
+                self._packets[name] = (time.monotonic() + ttl, tlvs)
+            else:
+                # The neighbour is shutting down
+                self._packets.pop(name, None)
+            self._received.notify_all()
+
+    def run(self):
+        while True:
+            with self._lock:
+                if self._stopped:
+                    break
+                sockets = {sock: name
+                           for name, sock in self._sockets.items()}
+            readable, _, _ = select.select(
+                [self._wakeup_reader] + list(sockets), [], [])
+            for sock in readable:
+                if sock is self._wakeup_reader:
+                    sock.recv(64)
+                else:
+                    self._receive(sockets[sock], sock)
+
+        with self._lock:
+            sockets = list(self._sockets.values())
+            self._sockets = {}
+        for sock in sockets:
+            sock.close()
+
+    def stop(self):
+        """Stop listening and close all sockets."""
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+        self._wakeup()
+        self.join()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+
+    def get(self, interface_names, timeout):
+        """Get the TLVs of the last LLDP packets received on interfaces.
+
+        Only waits for the interfaces without a valid packet.
+
+        :param interface_names: A list of interface names.
+        :param timeout: Time (in seconds) to wait for packets.
+        :return: A dictionary in the form
+                 {'interface': [(lldp_type, lldp_data)],...}, with an empty
+                 list for the interfaces without packets.
+        """
+        self.listen(interface_names)
+        deadline = time.monotonic() + timeout
+        with self._received:
+            while True:
+                now = time.monotonic()
+                missing = [name for name in interface_names
+                           if name in self._sockets
+                           and self._packets.get(name, (0,))[0] <= now]
+                if not missing or now >= deadline:
+                    break
+                LOG.info('Waiting on LLDP info for interfaces: '
+                         '%(interfaces)s, timeout: %(timeout).1f',
+                         {'interfaces': missing, 'timeout': deadline - now})
+                self._received.wait(deadline - now)
+
+            if missing:
+                LOG.warning('LLDP timed out, remaining interfaces: %s',
+                            missing)
+            return {name: self._packets[name][1]
+                    if self._packets.get(name, (0,))[0] > now else []
+                    for name in interface_names}
+
+
+def start_lldp_listener(interface_names):
+    """Start the LLDP listener, used by get_lldp_info from then on.
+
+    :param interface_names: A list of interface names to listen on.
+    :returns: The LLDPListener.
+    """
+    global _LLDP_LISTENER
+
+    with _LLDP_LISTENER_LOCK:
+        if _LLDP_LISTENER is None:
+            listener = LLDPListener()
+            listener.start()
+            _LLDP_LISTENER = listener
+    _LLDP_LISTENER.listen(interface_names)
+    return _LLDP_LISTENER
+
+
 def get_default_ip_addr(family, interface_id):
     """Retrieve default IPv4, IPv6 or mac address."""
     try:
@@ -329,19 +539,19 @@ def list_interfaces():
 
 def interface_has_carrier(interface_name):
     path = '/sys/class/net/{}/carrier'.format(interface_name)
-    try:
-        with open(path, 'rt') as fp:
-            return fp.read().strip() == '1'
-    except EnvironmentError:
+    # The carrier changes while waiting for DHCP, never reuse it
+    carrier = sysfs.read(path, memoize=False)
+    if carrier is None:
         LOG.debug('No carrier information for interface %s',
                   interface_name)
         return False
+    return carrier == '1'
 
 
 def get_interface_pci_address(interface_name):
     path = '/sys/class/net/{}/device'.format(interface_name)
     try:
-        return os.path.basename(os.readlink(path))
+        return sysfs.readlink(path)
     except FileNotFoundError:
         LOG.debug('No bus address found for interface %s',
                   interface_name)
@@ -350,7 +560,7 @@ def get_interface_pci_address(interface_name):
 def get_interface_driver(interface_name):
     path = '/sys/class/net/{}/device/driver'.format(interface_name)
     try:
-        return os.path.basename(os.readlink(path))
+        return sysfs.readlink(path)
     except FileNotFoundError:
         LOG.debug('No driver found for interface %s',
                   interface_name)
@@ -19,6 +19,8 @@ from oslo_log import log
 import pint
 
 from ironic_python_agent import errors
+from ironic_python_agent import inspector
+from ironic_python_agent import sysfs
 
 LOG = log.getLogger(__name__)
 
@@ -63,20 +65,17 @@ def get_nodes_memory_info(numa_node_dirs):
     for numa_node_dir in numa_node_dirs:
         numa_node_memory = {}
         numa_node_id = get_numa_node_id(numa_node_dir)
-        try:
-            with open(os.path.join(numa_node_dir,
-                      'meminfo')) as meminfo_file:
-                for line in meminfo_file:
-                    if 'MemTotal' in line:
-                        break
-                else:
-                    msg = ('Memory information is not available for '
-                           '%(node)s' % {'node': numa_node_dir})
-                    raise errors.IncompatibleNumaFormatError(msg)
-        except IOError as exc:
-            msg = ('Failed to get memory information '
-                   'for %(node)s: %(error)s' %
-                   {'node': numa_node_dir, 'error': exc})
+        meminfo = sysfs.read(os.path.join(numa_node_dir, 'meminfo'))
+        if meminfo is None:
+            msg = ('Failed to get memory information for %(node)s: '
+                   'meminfo cannot be read' % {'node': numa_node_dir})
+            raise errors.IncompatibleNumaFormatError(msg)
+        for line in meminfo.splitlines():
+            if 'MemTotal' in line:
+                break
+        else:
+            msg = ('Memory information is not available for '
+                   '%(node)s' % {'node': numa_node_dir})
             raise errors.IncompatibleNumaFormatError(msg)
         try:
             # To get memory size with unit from memory info line
@@ -125,30 +124,28 @@ def get_nodes_cores_info(numa_node_dirs):
     for numa_node_dir in numa_node_dirs:
         numa_node_id = get_numa_node_id(numa_node_dir)
         try:
-            thread_dirs = os.listdir(numa_node_dir)
+            thread_dirs = sysfs.list_directory(numa_node_dir)
         except OSError as exc:
             msg = ('Failed to get list of threads for %(node)s: '
                    '%(error)s' % {'node': numa_node_dir, 'error': exc})
             raise errors.IncompatibleNumaFormatError(msg)
         for thread_dir in thread_dirs:
-            if (not os.path.isdir(os.path.join(numa_node_dir, thread_dir))
-                or not thread_dir.startswith("cpu")):
+            if not thread_dir.is_dir or not thread_dir.name.startswith("cpu"):
                 continue
             try:
-                thread_id = int(thread_dir[3:])
+                thread_id = int(thread_dir.name[3:])
             except (ValueError, IndexError) as exc:
                 msg = ('Failed to get cores information for '
                        '%(node)s: %(error)s' %
                        {'node': numa_node_dir, 'error': exc})
                 raise errors.IncompatibleNumaFormatError(msg)
             try:
-                with open(os.path.join(numa_node_dir, thread_dir, 'topology',
-                          'core_id')) as core_id_file:
-                    cpu_id = int(core_id_file.read().strip())
-            except (IOError, ValueError) as exc:
+                cpu_id = int(sysfs.read(os.path.join(thread_dir.path,
+                                                     'topology', 'core_id')))
+            except (TypeError, ValueError) as exc:
                 msg = ('Failed to gather cpu_id for thread'
                        '%(thread)s NUMA node %(node)s: %(error)s' %
-                       {'thread': thread_dir, 'node': numa_node_dir,
+                       {'thread': thread_dir.name, 'node': numa_node_dir,
                         'error': exc})
                 raise errors.IncompatibleNumaFormatError(msg)
             # CPU and NUMA node together forms a unique value, as cpu_id is
@@ -187,32 +184,34 @@ def get_nodes_nics_info(nic_device_path):
     :return: A list of nics information with NUMA node id
     """
     nics = []
-    if not os.path.isdir(nic_device_path):
+    try:
+        nic_dirs = sysfs.list_directory(nic_device_path)
+    except OSError:
         msg = ('Failed to get list of NIC\'s, NIC device path '
                'does not exist: %(nic_device_path)s' %
                {'nic_device_path': nic_device_path})
         raise errors.IncompatibleNumaFormatError(msg)
-    for nic_dir in os.listdir(nic_device_path):
-        if not os.path.isfile(os.path.join(nic_device_path,
-                                           nic_dir, 'device', 'numa_node')):
+    for nic_dir in nic_dirs:
+        numa_node = sysfs.read(os.path.join(nic_dir.path, 'device',
+                                            'numa_node'))
+        if numa_node is None:
             continue
         try:
-            with open(os.path.join(nic_device_path, nic_dir, 'device',
-                                   'numa_node')) as nicsinfo_file:
-                numa_node_id = int(nicsinfo_file.read().strip())
-        except (IOError, ValueError) as exc:
+            numa_node_id = int(numa_node)
+        except ValueError as exc:
             msg = ('Failed to gather NIC\'s for NUMA node %(node)s: '
-                   '%(error)s' % {'node': nic_dir, 'error': exc})
+                   '%(error)s' % {'node': nic_dir.name, 'error': exc})
             raise errors.IncompatibleNumaFormatError(msg)
         numa_node_nics = {}
-        numa_node_nics['name'] = nic_dir
+        numa_node_nics['name'] = nic_dir.name
         numa_node_nics['numa_node'] = numa_node_id
-        LOG.debug('Found a NIC %s in NUMA node %d', nic_dir,
+        LOG.debug('Found a NIC %s in NUMA node %d', nic_dir.name,
                   numa_node_id)
         nics.append(numa_node_nics)
     return nics
 
 
+@inspector.requires()
 def collect_numa_topology_info(data, failures):
     """Collect the NUMA topology information.
 
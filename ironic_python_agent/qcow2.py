@@ -0,0 +1,341 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Conversion of QCOW2 images to raw while they are being received."""
+
+import array
+import os
+import stat
+import struct
+import tempfile
+
+from oslo_log import log
+
+from ironic_python_agent import errors
+from ironic_python_agent import image_writer
+
+LOG = log.getLogger(__name__)
+
+MAGIC = b'QFI\xfb'
+
+# magic, version, backing_file_offset, backing_file_size, cluster_bits,
+# size, crypt_method, l1_size, l1_table_offset, refcount_table_offset,
+# refcount_table_clusters, nb_snapshots, snapshots_offset
+_HEADER = struct.Struct('>4sIQIIQIIQQIIQ')
+# incompatible_features, compatible_features, autoclear_features,
+# refcount_order, header_length
+_HEADER_V3 = struct.Struct('>QQQII')
+
+# Number of bytes needed to parse the header.
+HEADER_SIZE = _HEADER.size + _HEADER_V3.size
+
+_INCOMPAT_DIRTY = 1 << 0
+# Only relevant for compressed clusters, which are rejected separately.
+_INCOMPAT_COMPRESSION_TYPE = 1 << 3
+_SUPPORTED_INCOMPAT = _INCOMPAT_DIRTY | _INCOMPAT_COMPRESSION_TYPE
+
+_OFFSET_MASK = 0x00fffffffffffe00
+_L2_COMPRESSED = 1 << 62
+_L2_ZERO = 1
+
+
+class UnsupportedImage(Exception):
+    """Raised when an image cannot be converted while it is streamed."""
+
+
+class StreamConverter(object):
+    """Writes a QCOW2 image received as a stream to a raw target.
+
+    QCOW2 images cannot be converted by qemu-img without random access to
+    the whole file. This converter relies on the L1 and L2 tables usually
+    preceding the data clusters they reference: every data cluster is
+    written to its guest offset as soon as it is received. Clusters that
+    arrive before the L2 table referencing them are held back in a spill
+    file of bounded size. Guest ranges not backed by any data cluster are
+    zeroed once the whole image has been received.
+
+    Compressed clusters, encryption, backing files and incompatible
+    features other than the dirty bit are not supported.
+    """
+
+    def __init__(self, fd, spill_size, image_size=None, spill_dir=None):
+        """Initialize an instance of the StreamConverter class.
+
+        :param fd: A file descriptor of the target, open for writing.
+        :param spill_size: Maximum number of bytes held back in the spill
+                           file before giving up.
+        :param image_size: Size of the QCOW2 file, if known.
+        :param spill_dir: Directory to create the spill file in.
+        """
+        self._fd = fd
+        self._spill_size = spill_size
+        self._image_size = image_size
+        self._spill_dir = spill_dir
+        self._spill = None
+        self._spilled = {}
+        self._spill_free = []
+        self._spill_end = 0
+        self._buf = bytearray()
+        self._next = 0
+        self._bits = None
+        self._l1_data = None
+        self._l2_pending = {}
+        self._host_map = array.array('q')
+        self._pending_data = 0
+        self._written = None
+        self.virtual_size = None
+
+    def _parse_header(self, data):
+        (magic, version, backing_offset, _, bits, size, crypt, l1_size,
+         l1_offset, refcount_offset, refcount_clusters, _,
+         _) = _HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise errors.InvalidImage(details='Not a QCOW2 image')
+        if version not in (2, 3):
+            raise UnsupportedImage('QCOW2 version %d' % version)
+        if backing_offset:
+            raise errors.InvalidImage(details='Image has a backing file')
+        if crypt:
+            raise UnsupportedImage('Encrypted images are not supported')
+        if not 9 <= bits <= 21:
+            raise errors.InvalidImage(
+                details='Invalid cluster size 2^%d' % bits)
+        incompatible = 0
+        if version == 3:
+            incompatible = _HEADER_V3.unpack_from(data, _HEADER.size)[0]
+        if incompatible & ~_SUPPORTED_INCOMPAT:
+            raise UnsupportedImage('Incompatible features %#x are not '
+                                   'supported' % incompatible)
+
+        cluster_size = 1 << bits
+        l2_entries = cluster_size // 8
+        guest_clusters = -(-size // cluster_size)
+        if l1_offset % cluster_size or l1_size * l2_entries < guest_clusters:
+            raise errors.InvalidImage(details='Invalid L1 table')
+
+        self._bits = bits
+        self._cluster_size = cluster_size
+        self._l2_entries = l2_entries
+        self._zero_flag = version == 3
+        self._l1_size = l1_size
+        self._l1_start = l1_offset >> bits
+        self._l1_end = self._l1_start + -(-l1_size * 8 // cluster_size)
+        self._refcount_start = refcount_offset >> bits
+        self._refcount_end = self._refcount_start + refcount_clusters
+        if self._image_size:
+            self._max_cluster = self._image_size >> bits
+        else:
+            # Metadata and leaked clusters aside, an image is not much
+            # larger than its virtual size.
+            self._max_cluster = 2 * guest_clusters + 1024
+        self._written = bytearray(guest_clusters)
+        self.virtual_size = size
+        self._l1_data = bytearray()
+        if not l1_size:
+            self._parse_l1(b'')
+
+    @property
+    def _mapping_complete(self):
+        return self._l1_data is None and not self._l2_pending
+
+    def _cluster(self, index, data):
+        if index == 0:
+            return
+        if self._refcount_start <= index < self._refcount_end:
+            return
+        if self._l1_start <= index < self._l1_end:
+            self._l1_data += data
+            if index == self._l1_end - 1:
+                self._parse_l1(self._l1_data[:self._l1_size * 8])
+            return
+        l1_index = self._l2_pending.pop(index, None)
+        if l1_index is not None:
+            self._parse_l2(l1_index, data)
+            self._check_complete()
+            return
+        guest = self._take_guest(index)
+        if guest is not None:
+            self._write_guest(guest, data)
+        elif not self._mapping_complete:
+            self._spill_cluster(index, data)
+
+    def _parse_l1(self, table):
+        self._l1_data = None
+        entries = struct.unpack('>%dQ' % self._l1_size, table)
+        for l1_index, entry in enumerate(entries):
+            offset = entry & _OFFSET_MASK
+            if not offset:
+                continue
+            if offset % self._cluster_size:
+                raise errors.InvalidImage(details='Unaligned L2 table')
+            index = offset >> self._bits
+            if index < self._next:
+                self._parse_l2(l1_index, self._unspill(index))
+            else:
+                self._l2_pending[index] = l1_index
+        self._check_complete()
+
+    def _parse_l2(self, l1_index, data):
+        base = l1_index * self._l2_entries
+        entries = struct.unpack('>%dQ' % self._l2_entries, data)
+        for l2_index, entry in enumerate(entries):
+            if not entry:
+                continue
+            if entry & _L2_COMPRESSED:
+                raise UnsupportedImage('Compressed clusters are not '
+                                       'supported')
+            offset = entry & _OFFSET_MASK
+            if (self._zero_flag and entry & _L2_ZERO) or not offset:
+                # Reads as zeroes
+                continue
+            guest = base + l2_index
+            if guest >= len(self._written):
+                raise errors.InvalidImage(
+                    details='Cluster mapped beyond the virtual size')
+            index = offset >> self._bits
+            if index < self._next:
+                self._write_guest(guest, self._unspill(index))
+            else:
+                self._map(index, guest)
+
+    def _check_complete(self):
+        if self._mapping_complete and self._spill is not None:
+            # Nothing received so far can be referenced any more.
+            self._spill.close()
+            self._spill = None
+            self._spilled.clear()
+
+    def _map(self, index, guest):
+        host_map = self._host_map
+        if index >= len(host_map):
+            if index > self._max_cluster:
+                raise UnsupportedImage('Cluster at offset %d is beyond the '
+                                       'end of the image' % (index
+                                                             << self._bits))
+            grow = max(index + 1, 2 * len(host_map)) - len(host_map)
+            host_map.extend(array.array('q', bytes(8 * grow)))
+        if host_map[index]:
+            raise UnsupportedImage('Clusters shared between guest offsets '
+                                   'are not supported')
+        host_map[index] = guest + 1
+        self._pending_data += 1
+
+    def _take_guest(self, index):
+        if index >= len(self._host_map) or not self._host_map[index]:
+            return None
+        guest = self._host_map[index] - 1
+        self._host_map[index] = 0
+        self._pending_data -= 1
+        return guest
+
+    def _write_guest(self, guest, data):
+        offset = guest << self._bits
+        length = min(len(data), self.virtual_size - offset)
+        image_writer.pwrite_all(self._fd, memoryview(data)[:length], offset)
+        self._written[guest] = 1
+
+    def _spill_cluster(self, index, data):
+        if self._spill_free:
+            slot = self._spill_free.pop()
+        else:
+            if self._spill_end + self._cluster_size > self._spill_size:
+                raise UnsupportedImage(
+                    'More than %d bytes of the image arrived before the '
+                    'tables referencing them' % self._spill_size)
+            slot = self._spill_end
+            self._spill_end += self._cluster_size
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile(prefix='ipa-qcow2-spill-',
+                                                 dir=self._spill_dir)
+        image_writer.pwrite_all(self._spill.fileno(), data, slot)
+        self._spilled[index] = slot
+
+    def _unspill(self, index):
+        slot = self._spilled.pop(index, None)
+        if slot is None:
+            raise UnsupportedImage('Cluster at offset %d is referenced after '
+                                   'it was received' % (index << self._bits))
+        data = os.pread(self._spill.fileno(), self._cluster_size, slot)
+        self._spill_free.append(slot)
+        return data
+
+    def _feed(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self._buf += data
+        if self._bits is None:
+            if len(self._buf) < HEADER_SIZE:
+                return
+            self._parse_header(self._buf)
+        pos = 0
+        view = memoryview(self._buf)
+        try:
+            while len(view) - pos >= self._cluster_size:
+                self._cluster(self._next, view[pos:pos + self._cluster_size])
+                self._next += 1
+                pos += self._cluster_size
+        finally:
+            view.release()
+        del self._buf[:pos]
+
+    def _finish(self):
+        if self._bits is None:
+            raise errors.InvalidImage(details='Image is too short')
+        if self._buf:
+            # The file may end in the middle of the last cluster.
+            self._feed(bytes(self._cluster_size - len(self._buf)))
+        if not self._mapping_complete or self._pending_data:
+            raise errors.InvalidImage(
+                details='Image ended before all clusters referenced by it '
+                        'were received')
+
+        zeroes = image_writer.SparseWriter(self._fd)
+        written, pos = self._written, 0
+        while True:
+            start = written.find(0, pos)
+            if start < 0:
+                break
+            pos = written.find(1, start)
+            if pos < 0:
+                pos = len(written)
+            offset = start << self._bits
+            zeroes.zero(offset,
+                        min(pos << self._bits, self.virtual_size) - offset)
+
+        st = os.fstat(self._fd)
+        if not stat.S_ISBLK(st.st_mode) and st.st_size < self.virtual_size:
+            os.ftruncate(self._fd, self.virtual_size)
+        os.fsync(self._fd)
+        LOG.debug('Converted QCOW2 image of virtual size %(size)s, '
+                  '%(zeroes)s bytes of which were zeroed', {
+                      'size': self.virtual_size,
+                      'zeroes': zeroes.zeroes_skipped})
+
+    def write(self, chunks):
+        """Convert an image from an iterator of chunks.
+
+        :param chunks: An iterable of bytes-like objects making up the
+                       QCOW2 image, for example an ImageDownload instance.
+        :raises: UnsupportedImage if the image cannot be converted while
+                 it is streamed.
+        :raises: InvalidImage if the image is malformed.
+        :returns: The virtual size of the image.
+        """
+        try:
+            for data in chunks:
+                self._feed(data)
+            self._finish()
+        finally:
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+        return self.virtual_size
@@ -0,0 +1,498 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Peer-to-peer distribution of images between agents.
+
+Agents holding a verified image, or verified chunks of an image they are
+still downloading, serve them to other agents through their API. Every
+image is described by a manifest listing the hash of each of its chunks,
+so that chunks can be fetched from any peer and verified independently.
+Since the manifest itself is received from a peer, the whole image is
+verified against its checksum once all chunks have been received.
+
+Requests between agents are signed with a key shared by all agents of the
+deployment, agents without the key can neither fetch nor serve images.
+"""
+
+import collections
+from concurrent import futures
+import hashlib
+import hmac
+import os
+import random
+import re
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log
+from oslo_utils import units
+import requests
+
+from ironic_python_agent import errors
+from ironic_python_agent import mdns
+from ironic_python_agent import utils
+
+CONF = cfg.CONF
+LOG = log.getLogger(__name__)
+
+# Prefix of the mDNS service types announced by agents.
+SERVICE_PREFIX = 'baremetal-agent-swarm-'
+MANIFEST_ALGO = 'sha256'
+AUTH_SCHEME = 'IPA-Swarm'
+
+_DISCOVERY_TIME = 2
+_PEER_TIMEOUT = 60
+_READ_SIZE = units.Mi
+# Maximum difference in seconds between the clocks of two agents
+_AUTH_MAX_SKEW = 300
+
+_IMAGES = {}
+_LOCK = threading.Lock()
+_ZEROCONF = None
+_SELF_URL = None
+
+
+class SwarmError(Exception):
+    """Raised when an image cannot be downloaded from peers."""
+
+
+class _SharedImage(object):
+
+    def __init__(self, path, manifest, available):
+        self.path = path
+        self.manifest = manifest
+        self.available = available
+
+
+def enabled():
+    """Whether images are shared with peers.
+
+    :returns: True if image sharing is enabled and the shared key is set.
+    """
+    return bool(CONF.image_swarm and CONF.image_swarm_key)
+
+
+def _signature(timestamp, path):
+    message = '%s %s' % (timestamp, path)
+    return hmac.new(CONF.image_swarm_key.encode(), message.encode(),
+                    hashlib.sha256).hexdigest()
+
+
+def sign(path):
+    """Calculate the Authorization header of a request to a peer.
+
+    :param path: The path of the request, e.g. /v1/swarm/<key>.
+    :returns: The value of the Authorization header.
+    """
+    timestamp = int(time.time())
+    return '%s %d:%s' % (AUTH_SCHEME, timestamp, _signature(timestamp, path))
+
+
+def verify(authorization, path):
+    """Check the Authorization header of a request from a peer.
+
+    :param authorization: The value of the Authorization header or None.
+    :param path: The path of the request.
+    :returns: True if the request is signed with the shared key and recent
+              enough, False otherwise.
+    """
+    if not enabled() or not authorization:
+        return False
+    scheme, _sep, credentials = authorization.partition(' ')
+    timestamp, _sep, signature = credentials.partition(':')
+    if scheme != AUTH_SCHEME or not timestamp.isdigit():
+        return False
+    if abs(time.time() - int(timestamp)) > _AUTH_MAX_SKEW:
+        return False
+    return hmac.compare_digest(signature, _signature(int(timestamp), path))
+
+
+def build_manifest(path, chunk_size):
+    """Calculate the manifest of a local image.
+
+    :param path: Path to the image.
+    :param chunk_size: Size of the chunks in bytes.
+    :raises: OSError if the image cannot be read.
+    :returns: The manifest as a dictionary.
+    """
+    chunks = []
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            chunks.append(hashlib.new(MANIFEST_ALGO, data).hexdigest())
+            size += len(data)
+    return {'algo': MANIFEST_ALGO, 'chunk_size': chunk_size, 'size': size,
+            'chunks': chunks}
+
+
+def _validate_manifest(manifest):
+    """Check that a manifest received from a peer is usable.
+
+    :param manifest: The manifest.
+    :raises: SwarmError if the manifest is malformed.
+    """
+    try:
+        algo = manifest['algo']
+        chunk_size = manifest['chunk_size']
+        size = manifest['size']
+        chunks = manifest['chunks']
+    except (KeyError, TypeError):
+        raise SwarmError('Malformed manifest')
+    if (algo not in hashlib.algorithms_available
+            or not isinstance(chunk_size, int)
+            or not 0 < chunk_size <= 256 * units.Mi
+            or not isinstance(size, int) or size < 0
+            or not isinstance(chunks, list)
+            or len(chunks) != -(-size // chunk_size)
+            or not all(isinstance(c, str) for c in chunks)):
+        raise SwarmError('Invalid manifest')
+
+
+def _check_size(manifest, location, image_size):
+    """Check that an image described by a peer can be stored.
+
+    :param manifest: The manifest received from the peers.
+    :param location: The file the image is downloaded to.
+    :param image_size: The size reported by the image server or None.
+    :raises: SwarmError if the size does not match the image server or
+             exceeds the free space at the location.
+    """
+    size = manifest['size']
+    if image_size is not None and size != image_size:
+        raise SwarmError('Peers report a size of %d bytes, the image server '
+                         'reports %d bytes' % (size, image_size))
+    stat = os.statvfs(os.path.dirname(os.path.abspath(location)))
+    if size > stat.f_bavail * stat.f_frsize:
+        raise SwarmError('Peers report a size of %d bytes, exceeding the '
+                         'free space at %s' % (size, location))
+
+
+def _share(key, path, manifest, available=None):
+    if available is None:
+        available = bytearray(b'\x01' * len(manifest['chunks']))
+    with _LOCK:
+        _IMAGES[key] = _SharedImage(path, manifest, available)
+
+
+def _share_in_background(key, path):
+    chunk_size = CONF.image_swarm_chunk_size * units.Mi
+    try:
+        manifest = build_manifest(path, chunk_size)
+    except OSError as e:
+        LOG.warning('Unable to share image %(key)s with peers: %(error)s',
+                    {'key': key, 'error': e})
+        return
+    _share(key, path, manifest)
+    LOG.info('Sharing image %(key)s of %(size)s bytes with peers',
+             {'key': key, 'size': manifest['size']})
+
+
+def share(key, path):
+    """Offer a verified local image to peers.
+
+    The manifest of the image is calculated in the background, unless it
+    is already known from downloading the image from peers.
+
+    :param key: The key of the image, see image_cache.image_key().
+    :param path: Path to the image.
+    :returns: The thread calculating the manifest or None.
+    """
+    if not enabled():
+        return None
+    with _LOCK:
+        image = _IMAGES.get(key)
+        if image is not None:
+            image.path = path
+            image.available = bytearray(b'\x01' * len(image.available))
+            return None
+    thread = threading.Thread(target=_share_in_background, args=(key, path),
+                              name='swarm-manifest', daemon=True)
+    thread.start()
+    return thread
+
+
+def unshare(key):
+    """Stop offering an image to peers.
+
+    :param key: The key of the image.
+    """
+    with _LOCK:
+        _IMAGES.pop(key, None)
+
+
+def describe(key):
+    """Describe a shared image to a peer.
+
+    :param key: The key of the image.
+    :returns: A dictionary with the manifest of the image and the indexes
+              of the chunks available locally, or None if the image is not
+              shared.
+    """
+    with _LOCK:
+        image = _IMAGES.get(key)
+        if image is None:
+            return None
+        if not os.path.exists(image.path):
+            # Evicted from the image cache or cleaned up
+            del _IMAGES[key]
+            return None
+        available = [index for index, have in enumerate(image.available)
+                     if have]
+    return {'manifest': image.manifest, 'available': available}
+
+
+def read_chunk(key, index):
+    """Read a chunk of a shared image.
+
+    :param key: The key of the image.
+    :param index: The index of the chunk.
+    :returns: The chunk as bytes, or None if it is not available.
+    """
+    with _LOCK:
+        image = _IMAGES.get(key)
+        if (image is None or not 0 <= index < len(image.available)
+                or not image.available[index]):
+            return None
+        path = image.path
+    chunk_size = image.manifest['chunk_size']
+    try:
+        with open(path, 'rb') as f:
+            return os.pread(f.fileno(), chunk_size, index * chunk_size)
+    except FileNotFoundError:
+        return None
+
+
+def announce(url):
+    """Announce the local agent to peers via mDNS.
+
+    :param url: The URL of the agent API.
+    :raises: ServiceRegistrationFailure if the announcement fails.
+    """
+    global _ZEROCONF, _SELF_URL
+
+    _SELF_URL = url.rstrip('/')
+    name = re.sub('[^a-zA-Z0-9]+', '-', _SELF_URL.split('://', 1)[-1])
+    if _ZEROCONF is None:
+        _ZEROCONF = mdns.Zeroconf()
+    _ZEROCONF.register_service(SERVICE_PREFIX + name.strip('-'), _SELF_URL)
+    LOG.info('Announced image sharing at %s', _SELF_URL)
+
+
+def withdraw():
+    """Stop announcing the local agent."""
+    global _ZEROCONF
+
+    if _ZEROCONF is not None:
+        _ZEROCONF.close()
+        _ZEROCONF = None
+
+
+def discover_peers():
+    """Find other agents sharing images.
+
+    :returns: A list of URLs of the API of the peers.
+    """
+    peers = [url.rstrip('/') for url in CONF.image_swarm_peers if url]
+    zc = _ZEROCONF
+    try:
+        if zc is None:
+            zc = mdns.Zeroconf()
+        # NOTE: loopback addresses are allowed to support several agents
+        # on the same host.
+        for _service, url, _props in zc.find_endpoints(
+                SERVICE_PREFIX, _DISCOVERY_TIME, skip_loopback=False):
+            peers.append(url.rstrip('/'))
+    except Exception as e:
+        LOG.warning('Unable to discover peers via mDNS: %s', e)
+    finally:
+        if zc is not None and zc is not _ZEROCONF:
+            zc.close()
+    return [peer for peer in dict.fromkeys(peers) if peer != _SELF_URL]
+
+
+def _query_peers(session, peers, key):
+    """Collect the manifest of an image and the chunks held by peers.
+
+    :returns: A tuple (manifest, dictionary of chunk index to a list of
+              peers holding the chunk). The manifest is None if no peer
+              holds the image.
+    """
+    manifest = None
+    holders = collections.defaultdict(list)
+    for peer in peers:
+        path = '/v1/swarm/%s' % key
+        try:
+            resp = session.get(peer + path, timeout=_PEER_TIMEOUT,
+                               headers={'Authorization': sign(path)})
+            if resp.status_code != 200:
+                continue
+            info = resp.json()
+            _validate_manifest(info['manifest'])
+            available = list(info['available'])
+        except (requests.RequestException, ValueError, KeyError, TypeError,
+                SwarmError) as e:
+            LOG.debug('Ignoring peer %(peer)s: %(error)s',
+                      {'peer': peer, 'error': e})
+            continue
+        if manifest is None:
+            manifest = info['manifest']
+        elif info['manifest'] != manifest:
+            LOG.warning('Peer %s has a different manifest for image %s',
+                        peer, key)
+            continue
+        for index in available:
+            if isinstance(index, int) and 0 <= index < len(
+                    manifest['chunks']):
+                holders[index].append(peer)
+    return manifest, holders
+
+
+def _fetch_chunk(session, key, manifest, index, peers, fetch_origin, fd,
+                 available):
+    """Fetch and verify a chunk, write it out and offer it to peers.
+
+    :returns: The peer the chunk was received from or None for the image
+              server.
+    """
+    chunk_size = manifest['chunk_size']
+    start = index * chunk_size
+    length = min(chunk_size, manifest['size'] - start)
+    expected = manifest['chunks'][index]
+
+    source = None
+    path = '/v1/swarm/%s/%d' % (key, index)
+    for peer in random.sample(peers, len(peers)):
+        try:
+            resp = session.get(peer + path, timeout=_PEER_TIMEOUT,
+                               headers={'Authorization': sign(path)})
+            data = resp.content if resp.status_code == 200 else None
+        except requests.RequestException as e:
+            LOG.debug('Unable to fetch chunk %(index)s from %(peer)s: '
+                      '%(error)s', {'index': index, 'peer': peer,
+                                    'error': e})
+            continue
+        if data is None:
+            continue
+        if (len(data) == length and hashlib.new(
+                manifest['algo'], data).hexdigest() == expected):
+            source = peer
+            break
+        LOG.warning('Chunk %(index)s of image %(key)s received from '
+                    '%(peer)s does not match the manifest',
+                    {'index': index, 'key': key, 'peer': peer})
+    else:
+        data = fetch_origin(start, start + length - 1)
+        if hashlib.new(manifest['algo'], data).hexdigest() != expected:
+            raise SwarmError('Chunk %d received from the image server does '
+                             'not match the manifest' % index)
+
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, start)
+        view = view[written:]
+        start += written
+    with _LOCK:
+        available[index] = 1
+    return source
+
+
+def _verify(image_info, location):
+    algo = hashlib.new(image_info['os_hash_algo'])
+    with open(location, 'rb') as f:
+        while True:
+            data = f.read(_READ_SIZE)
+            if not data:
+                break
+            algo.update(data)
+    checksum = algo.hexdigest()
+    expected = image_info['os_hash_value'].strip().lower()
+    if checksum != expected:
+        raise errors.ImageChecksumError(image_info['id'], location,
+                                        expected, checksum)
+
+
+def download(image_info, key, location, fetch_origin, image_size=None):
+    """Download an image from peers.
+
+    Chunks are fetched in random order to spread the load over the
+    peers, and are offered to other peers as soon as they are verified.
+    Chunks that no peer can deliver are requested from the image server.
+
+    :param image_info: Image information dictionary.
+    :param key: The key of the image, see image_cache.image_key().
+    :param location: The file to download the image to.
+    :param fetch_origin: A callable accepting the offsets of the first and
+                         the last byte of a range and returning the range
+                         downloaded from the image server.
+    :param image_size: The size of the image according to the image
+                       server. If known, manifests of a different size are
+                       rejected before anything is written.
+    :raises: SwarmError if the image cannot be downloaded from peers.
+    :raises: ImageChecksumError if the image does not match its checksum.
+    :raises: ImageDownloadError if downloading from the image server fails.
+    :returns: False if no peer holds the image, True if it was downloaded
+              and verified.
+    """
+    peers = discover_peers()
+    if not peers:
+        return False
+
+    session = utils.get_requests_session(
+        pool_connections=len(peers),
+        pool_maxsize=CONF.image_swarm_concurrency)
+    try:
+        manifest, holders = _query_peers(session, peers, key)
+        if manifest is None:
+            LOG.debug('None of the peers %s holds image %s', peers, key)
+            return False
+        _check_size(manifest, location, image_size)
+
+        count = len(manifest['chunks'])
+        LOG.info('Downloading image %(image)s of %(size)s bytes in '
+                 '%(count)s chunks from %(peers)s peers',
+                 {'image': image_info['id'], 'size': manifest['size'],
+                  'count': count, 'peers': len(peers)})
+        available = bytearray(count)
+        order = random.sample(range(count), count)
+        sources = collections.Counter()
+        with open(location, 'wb') as f:
+            f.truncate(manifest['size'])
+            _share(key, location, manifest, available)
+            executor = futures.ThreadPoolExecutor(
+                max_workers=CONF.image_swarm_concurrency,
+                thread_name_prefix='swarm')
+            try:
+                pending = [executor.submit(_fetch_chunk, session, key,
+                                           manifest, index, holders[index],
+                                           fetch_origin, f.fileno(),
+                                           available)
+                           for index in order]
+                for future in futures.as_completed(pending):
+                    sources[future.result()] += 1
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+        _verify(image_info, location)
+    except Exception:
+        unshare(key)
+        raise
+    finally:
+        session.close()
+
+    LOG.info('Downloaded image %(image)s from peers, %(origin)s of '
+             '%(count)s chunks were requested from the image server',
+             {'image': image_info['id'], 'origin': sources[None],
+              'count': count})
+    return True
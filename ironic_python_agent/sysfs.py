@@ -0,0 +1,184 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Access to the sysfs and procfs pseudo file systems.
+
+Hardware helpers read many small attributes from /sys and /proc, often the
+same ones several times during an inspection run. The functions of this
+module read them with as few system calls as possible: directories are
+listed with a single os.scandir sweep and several attributes of the same
+directory are read relative to a single directory descriptor.
+
+Inside a memoize() block, the results of all reads are additionally kept
+until the outermost block exits, so that different collectors and hardware
+managers share them. Values that are expected to change while the block is
+active (e.g. the carrier of a network interface) must be read with
+``memoize=False``.
+"""
+
+import collections
+import contextlib
+import os
+import threading
+
+PCI_DEVICES = '/sys/bus/pci/devices'
+
+Entry = collections.namedtuple('Entry', ['name', 'path', 'is_dir'])
+Entry.__doc__ = """A directory entry, directories behind symlinks included."""
+
+_CACHE = None
+_CACHE_DEPTH = 0
+_CACHE_LOCK = threading.Lock()
+
+
+@contextlib.contextmanager
+def memoize():
+    """Keep the results of all reads until the outermost block exits.
+
+    The cache is shared by all threads, blocks can be nested.
+    """
+    global _CACHE, _CACHE_DEPTH
+
+    with _CACHE_LOCK:
+        if _CACHE_DEPTH == 0:
+            _CACHE = {}
+        _CACHE_DEPTH += 1
+    try:
+        yield
+    finally:
+        with _CACHE_LOCK:
+            _CACHE_DEPTH -= 1
+            if _CACHE_DEPTH == 0:
+                _CACHE = None
+
+
+def _cached(key, func, memoize):
+    cache = _CACHE if memoize else None
+    if cache is None:
+        return func()
+    try:
+        result = cache[key]
+    except KeyError:
+        try:
+            result = (func(), None)
+        except OSError as exc:
+            result = (None, exc)
+        cache[key] = result
+    value, exc = result
+    if exc is not None:
+        raise exc
+    return value
+
+
+def _read(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def read(path, memoize=True):
+    """Read a pseudo-file.
+
+    :param path: Path to the file.
+    :param memoize: Whether the result can be reused inside memoize().
+    :returns: The content of the file without the surrounding whitespace,
+              or None if it cannot be read.
+    """
+    return _cached(('read', path), lambda: _read(path), memoize)
+
+
+def _read_fd(name, dir_fd):
+    try:
+        fd = os.open(name, os.O_RDONLY, dir_fd=dir_fd)
+    except OSError:
+        return None
+    try:
+        chunks = []
+        while True:
+            # Attributes are at most a page long, usually a single read is
+            # enough.
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    return b''.join(chunks).decode('utf-8', 'replace').strip()
+
+
+def _read_many(path, names):
+    try:
+        dir_fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return dict.fromkeys(names)
+    try:
+        return {name: _read_fd(name, dir_fd) for name in names}
+    finally:
+        os.close(dir_fd)
+
+
+def read_many(path, names, memoize=True):
+    """Read several pseudo-files of the same directory.
+
+    The files are opened relative to the directory, so that its path is
+    only resolved once.
+
+    :param path: Path to the directory.
+    :param names: Names of the files in the directory.
+    :param memoize: Whether the result can be reused inside memoize().
+    :returns: A dictionary mapping the names to the content of the files
+              without the surrounding whitespace, or to None for the files
+              that cannot be read.
+    """
+    names = tuple(names)
+    return dict(_cached(('read_many', path, names),
+                        lambda: _read_many(path, names), memoize))
+
+
+def _list(path):
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            entries.append(Entry(entry.name, entry.path, is_dir))
+    entries.sort()
+    return entries
+
+
+def list_directory(path, memoize=True):
+    """List a directory with a single scan.
+
+    :param path: Path to the directory.
+    :param memoize: Whether the result can be reused inside memoize().
+    :raises: OSError if the directory cannot be listed.
+    :returns: A list of Entry tuples sorted by name.
+    """
+    return list(_cached(('list', path), lambda: _list(path), memoize))
+
+
+def readlink(path, memoize=True):
+    """Get the name of the target of a symbolic link.
+
+    :param path: Path to the link.
+    :param memoize: Whether the result can be reused inside memoize().
+    :raises: OSError if the link cannot be read.
+    :returns: The last component of the target of the link.
+    """
+    return _cached(('readlink', path),
+                   lambda: os.path.basename(os.readlink(path)), memoize)
@@ -0,0 +1,147 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import contextlib
+import hashlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from oslo_config import cfg
+from oslo_config import fixture as config_fixture
+from oslotest import base as test_base
+import requests
+
+from ironic_python_agent import agent
+from ironic_python_agent.api import app
+# NOTE: This import is needed to register the configuration options
+from ironic_python_agent import config  # noqa
+from ironic_python_agent import swarm
+
+CONF = cfg.CONF
+
+IMAGE_SIZE = 5 * 1024 * 1024 + 12345
+
+
+def _no_origin(start, end):
+    raise AssertionError('Range %d-%d requested from the image server'
+                         % (start, end))
+
+
+def _start_peer(port, image_info, path, peers, discovery):
+    """Run an agent API sharing an image in a subprocess.
+
+    If the image does not exist, it is downloaded from peers first, the
+    same way an agent deploying it would. With discovery, the agent finds
+    its peers and announces itself via mDNS on the loopback interface,
+    otherwise only the given peers are used.
+    """
+    CONF.set_override('image_swarm', True)
+    CONF.set_override('image_swarm_key', 'secret')
+    CONF.set_override('image_swarm_chunk_size', 1)
+    CONF.set_override('image_swarm_peers', peers)
+    CONF.set_override('interfaces', ['127.0.0.1'], group='mdns')
+    key = '%s-%s' % (image_info['os_hash_algo'], image_info['os_hash_value'])
+    with contextlib.ExitStack() as stack:
+        if not discovery:
+            # Only the given peers are used, not whatever runs on the network
+            stack.enter_context(mock.patch.object(swarm.mdns, 'Zeroconf',
+                                                  autospec=True))
+        if not os.path.exists(path):
+            assert swarm.download(image_info, key, path, _no_origin)
+        thread = swarm.share(key, path)
+        if thread is not None:
+            thread.join()
+
+    url = 'http://127.0.0.1:%d' % port
+    if discovery:
+        swarm.announce(url)
+    api = app.Application(mock.Mock(listen_address=agent.Host('127.0.0.1',
+                                                              port)), CONF)
+    api.start()
+    while True:
+        time.sleep(1)
+
+
+class TestSwarm(test_base.BaseTestCase):
+
+    def setUp(self):
+        super(TestSwarm, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.tempdir))
+        self.port = int(os.environ.get('TEST_PORT', '9999')) + 1
+        self.data = os.urandom(IMAGE_SIZE)
+        self.image_info = {
+            'id': 'fake-image',
+            'urls': ['http://127.0.0.1:1/image'],
+            'os_hash_algo': 'sha256',
+            'os_hash_value': hashlib.sha256(self.data).hexdigest(),
+        }
+        self.key = 'sha256-%s' % self.image_info['os_hash_value']
+        self.seed = os.path.join(self.tempdir, 'seed')
+        with open(self.seed, 'wb') as f:
+            f.write(self.data)
+        self.config = self.useFixture(config_fixture.Config(CONF))
+        self.config.config(image_swarm=True, image_swarm_key='secret')
+        self.config.config(interfaces=['127.0.0.1'], group='mdns')
+
+    def _start(self, index, path, peers=(), discovery=False):
+        port = self.port + index
+        process = multiprocessing.Process(
+            target=_start_peer,
+            args=(port, self.image_info, path, list(peers), discovery))
+        process.start()
+        self.addCleanup(process.terminate)
+        url = 'http://127.0.0.1:%d' % port
+        path = '/v1/swarm/%s' % self.key
+        for _ in range(int(os.environ.get('IPA_WAIT_TRIES', '100'))):
+            try:
+                if requests.get(url + path, headers={
+                        'Authorization': swarm.sign(path)}).ok:
+                    return url
+            except requests.ConnectionError:
+                pass
+            time.sleep(0.1)
+        raise IOError('Peer %s did not start' % url)
+
+    def test_download_through_peers(self):
+        # The seed holds the image, the second agent downloads it from the
+        # seed, and the local agent only knows about the second one.
+        seed = self._start(0, self.seed)
+        relay = self._start(1, os.path.join(self.tempdir, 'relay'), [seed])
+
+        self.config.config(image_swarm_peers=[relay])
+        location = os.path.join(self.tempdir, 'image')
+        with mock.patch.object(swarm.mdns, 'Zeroconf', autospec=True):
+            self.assertTrue(swarm.download(self.image_info, self.key,
+                                           location, _no_origin))
+        self.addCleanup(swarm.unshare, self.key)
+        with open(location, 'rb') as f:
+            self.assertEqual(self.data, f.read())
+
+    def test_download_through_discovered_peers(self):
+        # Same as above, but the agents only find each other via mDNS on
+        # the loopback interface.
+        seed = self._start(2, self.seed, discovery=True)
+        relay = self._start(3, os.path.join(self.tempdir, 'relay'),
+                            discovery=True)
+
+        self.assertEqual({seed, relay}, set(swarm.discover_peers()))
+        location = os.path.join(self.tempdir, 'image')
+        self.assertTrue(swarm.download(self.image_info, self.key, location,
+                                       _no_origin))
+        self.addCleanup(swarm.unshare, self.key)
+        with open(location, 'rb') as f:
+            self.assertEqual(self.data, f.read())
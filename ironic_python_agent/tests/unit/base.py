@@ -25,7 +25,12 @@ from oslotest import base as test_base
 
 from ironic_python_agent import config
 from ironic_python_agent.extensions import base as ext_base
+from ironic_python_agent.extensions import standby
 from ironic_python_agent import hardware
+from ironic_python_agent import inventory_monitor
+from ironic_python_agent.metrics_lib import metrics_prometheus
+from ironic_python_agent.metrics_lib import metrics_statsd
+from ironic_python_agent import netutils
 from ironic_python_agent import utils
 
 CONF = cfg.CONF
@@ -64,6 +69,13 @@ class IronicAgentTest(test_base.BaseTestCase):
         ext_base._EXT_MANAGER = None
         hardware._CACHED_HW_INFO = None
         hardware._global_managers = None
+        inventory_monitor._MONITOR = None
+        netutils._LLDP_LISTENER = None
+        utils._EXECUTE_CACHE = utils._ExecuteCache()
+        utils._EXECUTIONS.clear()
+        metrics_prometheus.REGISTRY.clear()
+        metrics_statsd._BUFFERS.clear()
+        standby._RANGES_IGNORED.clear()
 
     def _set_config(self):
         self.cfg_fixture = self.useFixture(config_fixture.Config(CONF))
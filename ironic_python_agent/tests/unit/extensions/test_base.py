@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import threading
 from unittest import mock
 
 from stevedore import extension
@@ -128,6 +129,62 @@ class TestExecuteCommandMixin(test_base.IronicAgentTest):
         self.assertRaises(errors.AgentIsBusy,
                           self.agent.execute_command, 'fake.fake_sync_command')
 
+    def test_history_size(self):
+        self.config(command_history_size=3)
+        results = [self.agent.execute_command('fake.fake_sync_command',
+                                              param=str(index))
+                   for index in range(5)]
+
+        self.assertEqual([result.id for result in results[2:]],
+                         list(self.agent.command_results))
+
+    def test_history_max_bytes(self):
+        results = [self.agent.execute_command('fake.fake_sync_command',
+                                              param='x' * 100)
+                   for _i in range(3)]
+        size = results[0].compact()
+        self.config(command_history_max_bytes=2 * size - 1)
+
+        result = self.agent.execute_command('fake.fake_sync_command',
+                                            param='x' * 100)
+
+        self.assertEqual([results[2].id, result.id],
+                         list(self.agent.command_results))
+
+    def test_history_keeps_latest(self):
+        self.config(command_history_max_bytes=1)
+        for _i in range(3):
+            result = self.agent.execute_command('fake.fake_sync_command',
+                                                param='x' * 100)
+        self.assertEqual([result.id], list(self.agent.command_results))
+
+
+class TestCommandResultCompact(test_base.IronicAgentTest):
+
+    def test_compact(self):
+        params = {'image_info': {'id': 'image', 'urls': ['http://a'] * 300},
+                  'configdrive': 'x' * 1000,
+                  'blob': b'x' * 1000,
+                  'small': 'value'}
+        result = base.SyncCommandResult('fake', params, True, None)
+
+        self.assertEqual({'image_info': {'id': 'image',
+                                         'urls': '<300 items>'},
+                          'configdrive': '<1000 characters>',
+                          'blob': '<1000 bytes>',
+                          'small': 'value'}, result.command_params)
+        self.assertGreater(result.compact(), 0)
+
+    def test_compact_running(self):
+        params = {'configdrive': 'x' * 1000}
+        result = base.AsyncCommandResult('fake', params, lambda **kw: None)
+        self.assertIsNone(result.compact())
+        self.assertEqual({'configdrive': 'x' * 1000}, result.command_params)
+
+        result.start().join()
+        self.assertEqual({'configdrive': '<1000 characters>'},
+                         result.command_params)
+
 
 class TestExtensionDecorators(test_base.IronicAgentTest):
     def setUp(self):
@@ -155,6 +212,98 @@ class TestExtensionDecorators(test_base.IronicAgentTest):
         result = result.wait()
         self.assertEqual({'result': 'fake_async_command: v1'}, result)
 
+    def test_async_command_progress(self):
+        progress = []
+
+        def _execute():
+            command = base.get_current_command()
+            command.set_progress({'step': 1})
+            progress.append(command.serialize()['command_result'])
+            return 'done'
+
+        result = base.AsyncCommandResult('fake', {}, _execute).start()
+        result.join()
+        self.assertEqual([{'progress': {'step': 1}}], progress)
+        self.assertEqual({'result': 'fake: done'}, result.command_result)
+        self.assertIsNone(base.get_current_command())
+
+    def test_async_command_events(self):
+        def _execute():
+            base.report_progress(step='erase')
+            base.report_progress(bytes_written=42)
+            return 'done'
+
+        result = base.AsyncCommandResult('fake', {}, _execute).start()
+        result.join()
+
+        events = result.get_events()
+        self.assertEqual([1, 2, 3], [event['id'] for event in events])
+        self.assertEqual(['progress', 'progress', 'status'],
+                         [event['event'] for event in events])
+        self.assertEqual({'step': 'erase'}, events[0]['progress'])
+        self.assertEqual({'step': 'erase', 'bytes_written': 42},
+                         events[1]['progress'])
+        self.assertEqual('SUCCEEDED', events[2]['command_status'])
+        self.assertIsNone(events[2]['command_error'])
+        self.assertEqual(events[2:], result.get_events(after=2))
+        self.assertEqual([], result.get_events(after=3, timeout=10))
+
+    def test_async_command_events_failure(self):
+        def _execute():
+            raise ExecutionError()
+
+        result = base.AsyncCommandResult('fake', {}, _execute).start()
+        result.join()
+        result.set_progress({'step': 1})
+
+        events = result.get_events()
+        self.assertEqual(['status'], [event['event'] for event in events])
+        self.assertEqual('FAILED', events[0]['command_status'])
+        self.assertIn('failed', events[0]['command_error'])
+        self.assertIsNone(result.command_result)
+
+    def test_async_command_events_wait(self):
+        event = threading.Event()
+        result = base.AsyncCommandResult('fake', {}, event.wait).start()
+        self.addCleanup(result.execution_thread.join)
+        self.addCleanup(event.set)
+
+        self.assertEqual([], result.get_events(timeout=0.01))
+        threading.Timer(0.1, result.update_progress, kwargs={'step': 1}
+                        ).start()
+        events = result.get_events(timeout=10)
+        self.assertEqual([{'step': 1}], [e['progress'] for e in events])
+
+    def test_async_command_events_wait_for_status(self):
+        result = base.AsyncCommandResult('fake', {}, None)
+        # The command is done, but its status is not published yet
+        result.command_status = base.AgentCommandStatus.SUCCEEDED
+        self.assertFalse(result.has_final_status())
+
+        threading.Timer(0.1, result._publish_status).start()
+        events = result.get_events(timeout=10)
+
+        self.assertEqual(['status'], [event['event'] for event in events])
+        self.assertTrue(result.has_final_status())
+
+    def test_async_command_events_limit(self):
+        result = base.AsyncCommandResult('fake', {}, None)
+        for index in range(base._MAX_EVENTS + 10):
+            result.update_progress(index=index)
+
+        events = result.get_events()
+        self.assertEqual(base._MAX_EVENTS, len(events))
+        self.assertEqual(11, events[0]['id'])
+
+    def test_report_progress_without_command(self):
+        base.report_progress(step='erase')
+
+    def test_sync_command_events(self):
+        result = base.SyncCommandResult('fake', {}, True, 'done')
+        events = result.get_events(timeout=10)
+        self.assertEqual(['status'], [event['event'] for event in events])
+        self.assertEqual('SUCCEEDED', events[0]['command_status'])
+
     def test_async_command_success_without_agent(self):
         extension = FakeExtension(agent=None)
         result = extension.execute('fake_async_command', param='v1')
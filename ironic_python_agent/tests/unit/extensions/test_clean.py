@@ -17,6 +17,7 @@ from unittest import mock
 from ironic_python_agent import errors
 from ironic_python_agent.extensions import clean
 from ironic_python_agent.tests.unit import base
+from ironic_python_agent import utils
 
 
 @mock.patch('ironic_python_agent.hardware.cache_node', autospec=True)
@@ -145,6 +146,43 @@ class TestCleanExtension(base.IronicAgentTest):
                          async_results.join().command_result)
         mock_cache_node.assert_called_once_with(self.node)
 
+    @mock.patch('ironic_python_agent.hardware.dispatch_to_managers',
+                autospec=True)
+    @mock.patch('ironic_python_agent.hardware.check_versions',
+                autospec=True)
+    def test_execute_clean_step_execution_step(self, mock_version,
+                                               mock_dispatch,
+                                               mock_cache_node):
+        steps = []
+        mock_dispatch.side_effect = lambda *args: steps.append(
+            utils._EXECUTION_STEP.name)
+
+        self.agent_extension.execute_clean_step(
+            step=self.step['GenericHardwareManager'][0],
+            node=self.node, ports=self.ports,
+            clean_version=self.version).join()
+
+        self.assertEqual([self.step['GenericHardwareManager'][0]['step']],
+                         steps)
+
+    @mock.patch('ironic_python_agent.hardware.dispatch_to_managers',
+                autospec=True)
+    @mock.patch('ironic_python_agent.hardware.check_versions',
+                autospec=True)
+    def test_execute_clean_step_progress(self, mock_version, mock_dispatch,
+                                         mock_cache_node):
+        result = self.agent_extension.execute_clean_step(
+            step=self.step['GenericHardwareManager'][0],
+            node=self.node, ports=self.ports,
+            clean_version=self.version).join()
+
+        events = result.get_events()
+        self.assertEqual(['progress', 'status'],
+                         [event['event'] for event in events])
+        self.assertEqual(
+            {'step': self.step['GenericHardwareManager'][0]['step']},
+            events[0]['progress'])
+
     @mock.patch('ironic_python_agent.hardware.dispatch_to_managers',
                 autospec=True)
     @mock.patch('ironic_python_agent.hardware.check_versions',
@@ -13,7 +13,10 @@
 # limitations under the License.
 
 import errno
+import functools
+import hashlib
 import os
+import shutil
 import tempfile
 import time
 from unittest import mock
@@ -27,6 +30,7 @@ from ironic_python_agent import disk_utils
 from ironic_python_agent import errors
 from ironic_python_agent.extensions import standby
 from ironic_python_agent import hardware
+from ironic_python_agent import image_cache
 from ironic_python_agent import partition_utils
 from ironic_python_agent.tests.unit import base
 from ironic_python_agent import utils
@@ -73,6 +77,51 @@ def _build_fake_partition_image_info():
     }
 
 
+class _FakeImageServer(object):
+    """Serves an image from memory, optionally honouring byte ranges."""
+
+    def __init__(self, content, accept_ranges=True, ignore_ranges=False,
+                 fail_at=None):
+        self.content = content
+        self.accept_ranges = accept_ranges
+        self.ignore_ranges = ignore_ranges
+        # Offset at which the first response is cut off
+        self.fail_at = fail_at
+        self.ranges = []
+        self.headers = []
+
+    def _iter_content(self, content, size, fail_at):
+        for pos in range(0, len(content), size):
+            if fail_at is not None and pos >= fail_at:
+                raise requests.exceptions.ChunkedEncodingError(
+                    'Connection broken')
+            yield content[pos:pos + size]
+
+    def get(self, url, stream, proxies, timeout, headers=None):
+        content = self.content
+        status_code = 200
+        self.headers.append(headers)
+        response = mock.Mock()
+        response.headers = {'ETag': '"fake-etag"'}
+        byte_range = (headers or {}).get('Range')
+        if byte_range and not self.ignore_ranges:
+            start, end = byte_range[len('bytes='):].split('-')
+            end = int(end or len(content) - 1)
+            self.ranges.append((int(start), end))
+            response.headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                start, end, len(content))
+            content = content[int(start):end + 1]
+            status_code = 206
+        response.status_code = status_code
+        response.headers['Content-Length'] = str(len(content))
+        if self.accept_ranges:
+            response.headers['Accept-Ranges'] = 'bytes'
+        fail_at, self.fail_at = self.fail_at, None
+        response.iter_content.side_effect = functools.partial(
+            self._iter_content, content, fail_at=fail_at)
+        return response
+
+
 class TestStandbyExtension(base.IronicAgentTest):
     def setUp(self):
         super(TestStandbyExtension, self).setUp()
@@ -645,6 +694,270 @@ class TestStandbyExtension(base.IronicAgentTest):
                           standby._download_image,
                           image_info)
 
+    @mock.patch('ironic_python_agent.utils.get_requests_session',
+                autospec=True)
+    def test_image_download_parallel_ranges(self, session_mock):
+        self.config(image_download_parallel_streams=3,
+                    image_download_range_size=1)
+        content = os.urandom(int(2.5 * units.Mi))
+        server = _FakeImageServer(content)
+        session_mock.return_value.get.side_effect = server.get
+        image_info = _build_fake_image_info()
+        image_info['os_hash_value'] = hashlib.sha256(content).hexdigest()
+
+        image_download = standby.ImageDownload(image_info)
+        self.assertEqual(content, b''.join(image_download))
+        image_download.verify_image('/dev/fake')
+        self.assertEqual(len(content), image_download.bytes_transferred)
+        self.assertEqual([(0, units.Mi - 1),
+                          (units.Mi, 2 * units.Mi - 1),
+                          (2 * units.Mi, len(content) - 1)],
+                         sorted(server.ranges))
+        session_mock.assert_called_with(pool_connections=1, pool_maxsize=3)
+
+    @mock.patch('ironic_python_agent.utils.get_requests_session',
+                autospec=True)
+    def test_image_download_parallel_no_range_support(self, session_mock):
+        self.config(image_download_parallel_streams=3,
+                    image_download_range_size=1)
+        content = os.urandom(2 * units.Mi + 1)
+        server = _FakeImageServer(content, accept_ranges=False)
+        session_mock.return_value.get.side_effect = server.get
+        image_info = _build_fake_image_info()
+        image_info['os_hash_value'] = hashlib.sha256(content).hexdigest()
+
+        image_download = standby.ImageDownload(image_info)
+        self.assertEqual(content, b''.join(image_download))
+        image_download.verify_image('/dev/fake')
+        self.assertEqual([], server.ranges)
+        session_mock.return_value.get.assert_called_once_with(
+            image_info['urls'][0], stream=True, proxies={}, timeout=60)
+
+    @mock.patch('ironic_python_agent.utils.get_requests_session',
+                autospec=True)
+    def test_image_download_parallel_range_ignored(self, session_mock):
+        self.config(image_download_parallel_streams=2,
+                    image_download_range_size=1)
+        content = os.urandom(2 * units.Mi + 1)
+        server = _FakeImageServer(content, ignore_ranges=True)
+        session_mock.return_value.get.side_effect = server.get
+        image_info = _build_fake_image_info()
+
+        image_info['os_hash_value'] = hashlib.sha256(content).hexdigest()
+
+        image_download = standby.ImageDownload(image_info)
+        self.assertEqual(content, b''.join(image_download))
+        image_download.verify_image('/dev/fake')
+        self.assertEqual(len(content), image_download.bytes_transferred)
+        self.assertEqual({image_info['urls'][0]}, standby._RANGES_IGNORED)
+        # Initial request, ranges answered with 200 and a single stream
+        self.assertIsNone(server.headers[-1])
+
+    @mock.patch.object(standby, '_image_location', autospec=True)
+    @mock.patch('ironic_python_agent.utils.get_requests_session',
+                autospec=True)
+    def test_download_image_pipeline(self, session_mock, location_mock):
+        self.config(image_write_pipeline=True, image_write_chunk_size=1,
+                    image_write_queue_depth=2)
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(tempdir))
+        location_mock.return_value = os.path.join(tempdir, 'fake_id')
+        content = os.urandom(int(2.5 * units.Mi))
+        server = _FakeImageServer(content)
+        session_mock.return_value.get.side_effect = server.get
+        image_info = _build_fake_image_info()
+        image_info['os_hash_value'] = hashlib.sha256(content).hexdigest()
+
+        standby._download_image(image_info)
+        with open(location_mock.return_value, 'rb') as f:
+            self.assertEqual(content, f.read())
+
+    def _resume_setup(self, location_mock, session_mock, **kwargs):
+        self.config(image_download_connection_retry_interval=0)
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(tempdir))
+        location_mock.return_value = os.path.join(tempdir, 'fake_id')
+        content = os.urandom(int(3.5 * units.Mi))
+        server = _FakeImageServer(content, **kwargs)
+        session_mock.return_value.get.side_effect = server.get
+        image_info = _build_fake_image_info()
+        image_info['os_hash_value'] = hashlib.sha256(content).hexdigest()
+        return server, image_info
+
+    @mock.patch.object(standby, '_image_location', autospec=True)
+    @mock.patch('ironic_python_agent.utils.get_requests_session',
+                autospec=True)
+    def test_download_image_resume(self, session_mock, location_mock):
+        server, image_info = self._resume_setup(location_mock, session_mock,
+                                                fail_at=2 * units.Mi)
+
+        standby._download_image(image_info)
+        with open(location_mock.return_value, 'rb') as f:
+            self.assertEqual(server.content, f.read())
+        self.assertEqual([(2 * units.Mi, len(server.content) - 1)],
+                         server.ranges)
+        self.assertEqual({'Range': 'bytes=%d-' % (2 * units.Mi),
+                          'If-Range': '"fake-etag"'}, server.headers[-1])
+
+    @mock.patch.object(standby, '_image_location', autospec=True)
+    @mock.patch('ironic_python_agent.utils.get_requests_session',
+                autospec=True)
+    def test_download_image_resume_pipeline(self, session_mock,
+                                            location_mock):
+        self.config(image_write_pipeline=True, image_write_chunk_size=1,
+                    image_write_queue_depth=2)
+        server, image_info = self._resume_setup(location_mock, session_mock,
+                                                fail_at=2 * units.Mi)
+
+        standby._download_image(image_info)
+        with open(location_mock.return_value, 'rb') as f:
+            self.assertEqual(server.content, f.read())
+        self.assertEqual([(2 * units.Mi, len(server.content) - 1)],
+                         server.ranges)
+
+    @mock.patch.object(standby, '_image_location', autospec=True)
+    @mock.patch('ironic_python_agent.utils.get_requests_session',
+                autospec=True)
+    def test_download_image_resume_disabled(self, session_mock,
+                                            location_mock):
+        self.config(image_download_resume=False)
+        server, image_info = self._resume_setup(location_mock, session_mock,
+                                                fail_at=2 * units.Mi)
+
+        standby._download_image(image_info)
+        with open(location_mock.return_value, 'rb') as f:
+            self.assertEqual(server.content, f.read())
+        self.assertEqual([], server.ranges)
+        self.assertEqual([None, None], server.headers)
+
+    @mock.patch.object(standby, '_image_location', autospec=True)
+    @mock.patch('ironic_python_agent.utils.get_requests_session',
+                autospec=True)
+    def test_download_image_resume_range_ignored(self, session_mock,
+                                                 location_mock):
+        server, image_info = self._resume_setup(location_mock, session_mock,
+                                                fail_at=2 * units.Mi,
+                                                ignore_ranges=True)
+
+        standby._download_image(image_info)
+        with open(location_mock.return_value, 'rb') as f:
+            self.assertEqual(server.content, f.read())
+        # Resume attempt answered with 200, then a fresh download
+        self.assertEqual(3, len(server.headers))
+        self.assertIsNone(server.headers[-1])
+
+    @mock.patch.object(standby, '_image_location', autospec=True)
+    @mock.patch('ironic_python_agent.utils.get_requests_session',
+                autospec=True)
+    def test_download_image_ranges_ignored_later(self, session_mock,
+                                                 location_mock):
+        self.config(image_download_parallel_streams=2,
+                    image_download_range_size=1)
+        server, image_info = self._resume_setup(location_mock, session_mock)
+
+        def _get(*args, **kwargs):
+            response = server.get(*args, **kwargs)
+            # Only the first range is honoured
+            server.ignore_ranges = bool(server.ranges)
+            return response
+
+        session_mock.return_value.get.side_effect = _get
+
+        standby._download_image(image_info)
+        with open(location_mock.return_value, 'rb') as f:
+            self.assertEqual(server.content, f.read())
+        self.assertEqual([(0, units.Mi - 1)], server.ranges)
+        # The new attempt downloads the image over a single connection
+        self.assertIsNone(server.headers[-1])
+        self.assertEqual(1, sum(1 for headers in server.headers[1:]
+                                if headers is None))
+
+    @mock.patch('ironic_python_agent.utils.get_requests_session',
+                autospec=True)
+    def test_image_download_resume_rehash(self, session_mock):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(tempdir))
+        location = os.path.join(tempdir, 'fake_id')
+        content = os.urandom(3 * units.Mi)
+        server = _FakeImageServer(content)
+        session_mock.return_value.get.side_effect = server.get
+        image_info = _build_fake_image_info()
+        image_info['os_hash_value'] = hashlib.sha256(content).hexdigest()
+
+        image_download = standby.ImageDownload(image_info)
+        self.assertFalse(image_download.resumable)
+        with open(location, 'wb') as f:
+            f.write(content[:100])
+        # No checksum state is saved in the middle of a chunk
+        image_download.checkpoint(100)
+        self.assertTrue(image_download.resumable)
+
+        image_download.resume(location)
+        self.assertEqual(100, image_download.offset)
+        with open(location, 'r+b') as f:
+            f.seek(100)
+            for chunk in image_download:
+                f.write(chunk)
+        image_download.verify_image(location)
+        self.assertEqual(len(content), image_download.bytes_transferred)
+        self.assertEqual([(100, len(content) - 1)], server.ranges)
+
+    @mock.patch('ironic_python_agent.utils.get_requests_session',
+                autospec=True)
+    def test_image_download_resume_wrong_range(self, session_mock):
+        server = _FakeImageServer(b'content')
+        session_mock.return_value.get.side_effect = server.get
+        image_download = standby.ImageDownload(_build_fake_image_info())
+        list(image_download)
+        image_download.checkpoint()
+        server.content = b'other content'
+        server.ignore_ranges = True
+        self.assertRaisesRegex(errors.ImageDownloadRangeError,
+                               'bytes=7-', image_download.resume,
+                               '/dev/fake')
+
+    @mock.patch.object(standby.base, 'get_current_command', autospec=True)
+    @mock.patch.object(standby.time, 'monotonic', autospec=True)
+    @mock.patch('ironic_python_agent.utils.get_requests_session',
+                autospec=True)
+    def test_image_download_progress(self, session_mock, mock_monotonic,
+                                     mock_get_command):
+        mock_monotonic.side_effect = [100, 100.5, 101]
+        session_mock.return_value.get.side_effect = _FakeImageServer(
+            b'content').get
+        image_download = standby.ImageDownload(_build_fake_image_info())
+        list(image_download)
+
+        for offset in (3, 5, 7):
+            image_download.checkpoint(offset)
+
+        command = mock_get_command.return_value
+        # The second checkpoint is within the report interval
+        self.assertEqual([
+            mock.call(image='fake_id', bytes_downloaded=7, bytes_written=3,
+                      total_bytes=7),
+            mock.call(image='fake_id', bytes_downloaded=7, bytes_written=7,
+                      total_bytes=7),
+        ], command.update_progress.call_args_list)
+
+    @mock.patch.object(standby.image_writer, 'ImageWriter', autospec=True)
+    @mock.patch('ironic_python_agent.utils.get_requests_session',
+                autospec=True)
+    def test_download_image_pipeline_out_of_space(self, session_mock,
+                                                  writer_mock):
+        self.config(image_write_pipeline=True)
+        session_mock.return_value.get.side_effect = _FakeImageServer(
+            b'content').get
+        writer_mock.return_value.write.side_effect = OSError(
+            errno.ENOSPC, 'No space left on device')
+        image_info = _build_fake_image_info()
+
+        self.assertRaises(errors.ImageDownloadOutofSpaceError,
+                          standby._download_image, image_info)
+        writer_mock.assert_called_once_with(
+            standby._image_location(image_info), mock.ANY, offset=0,
+            progress=mock.ANY, sparse=False)
+
     @mock.patch('hashlib.new', autospec=True)
     @mock.patch('builtins.open', autospec=True)
     @mock.patch('ironic_python_agent.utils.get_requests_session',
@@ -1310,6 +1623,89 @@ class TestStandbyExtension(base.IronicAgentTest):
         image_info['stream_raw_images'] = False
         self._test_prepare_image_raw(image_info, partition=True)
 
+    @mock.patch('ironic_python_agent.utils.execute', mock.Mock())
+    @mock.patch('ironic_python_agent.disk_utils.list_partitions',
+                lambda _dev: [mock.Mock()])
+    @mock.patch('ironic_python_agent.disk_utils.get_disk_identifier',
+                lambda dev: 'ROOT')
+    @mock.patch.object(partition_utils, 'create_config_drive_partition',
+                       autospec=True)
+    @mock.patch('ironic_python_agent.hardware.dispatch_to_managers',
+                autospec=True)
+    @mock.patch('ironic_python_agent.extensions.standby.StandbyExtension'
+                '._cache_and_write_image', autospec=True)
+    @mock.patch('ironic_python_agent.extensions.standby.StandbyExtension'
+                '._stream_convert_image_onto_device', autospec=True)
+    def _test_prepare_image_stream_convert(self, image_info, convert_mock,
+                                           cache_write_mock, dispatch_mock,
+                                           configdrive_copy_mock,
+                                           converted=True, error=None):
+        dispatch_mock.return_value = '/dev/foo'
+        convert_mock.side_effect = error
+
+        async_result = self.agent_extension.prepare_image(
+            image_info=image_info, configdrive=None)
+        async_result.join()
+
+        self.assertEqual('SUCCEEDED', async_result.command_status)
+        if converted:
+            convert_mock.assert_called_once_with(mock.ANY, image_info,
+                                                 '/dev/foo')
+        else:
+            convert_mock.assert_not_called()
+        if not converted or error:
+            cache_write_mock.assert_called_once_with(mock.ANY, image_info,
+                                                     '/dev/foo', None)
+        else:
+            cache_write_mock.assert_not_called()
+
+    def test_prepare_image_stream_convert(self):
+        self.config(image_stream_convert=True)
+        self._test_prepare_image_stream_convert(_build_fake_image_info())
+
+    def test_prepare_image_stream_convert_fallback(self):
+        self.config(image_stream_convert=True)
+        self._test_prepare_image_stream_convert(
+            _build_fake_image_info(),
+            error=standby.qcow2.UnsupportedImage('compressed'))
+
+    def test_prepare_image_stream_convert_disabled(self):
+        self._test_prepare_image_stream_convert(_build_fake_image_info(),
+                                                converted=False)
+
+    def test_prepare_image_stream_convert_raw(self):
+        self.config(image_stream_convert=True)
+        image_info = _build_fake_image_info()
+        image_info['disk_format'] = 'raw'
+        self._test_prepare_image_stream_convert(image_info, converted=False)
+
+    @mock.patch.object(image_cache, 'lookup', autospec=True)
+    def test_prepare_image_stream_convert_cached(self, lookup_mock):
+        self.config(image_stream_convert=True)
+        lookup_mock.return_value = '/cache/sha256-abcd'
+        image_info = _build_fake_image_info()
+        self._test_prepare_image_stream_convert(image_info, converted=False)
+        lookup_mock.assert_called_once_with(image_info)
+
+    @mock.patch.object(standby.StandbyExtension, '_cache_and_write_image',
+                       autospec=True)
+    @mock.patch.object(image_cache, 'check_device', autospec=True)
+    @mock.patch('ironic_python_agent.hardware.dispatch_to_managers',
+                autospec=True)
+    def test_prepare_image_cache_on_target(self, dispatch_mock, check_mock,
+                                           write_mock):
+        dispatch_mock.return_value = '/dev/sda'
+        check_mock.side_effect = errors.DeploymentError('cache on target')
+        async_result = self.agent_extension.prepare_image(
+            image_info=_build_fake_image_info())
+        async_result.join()
+
+        self.assertEqual('FAILED', async_result.command_status)
+        self.assertIsInstance(async_result.command_error,
+                              errors.DeploymentError)
+        check_mock.assert_called_once_with('/dev/sda')
+        write_mock.assert_not_called()
+
     @mock.patch('ironic_python_agent.utils.execute', autospec=True)
     def test_run_shutdown_command_invalid(self, execute_mock):
         self.assertRaises(errors.InvalidCommandParamsError,
@@ -1323,9 +1719,12 @@ class TestStandbyExtension(base.IronicAgentTest):
                           self.agent_extension._run_shutdown_command, 'reboot')
         dispatch_mock.assert_called_once_with('full_sync')
 
+    @mock.patch.object(standby.metrics_utils, 'flush_metrics',
+                       autospec=True)
     @mock.patch('ironic_python_agent.utils.execute', autospec=True)
     @mock.patch.object(hardware, 'dispatch_to_all_managers', autospec=True)
-    def test_run_shutdown_command_valid(self, dispatch_mock, execute_mock):
+    def test_run_shutdown_command_valid(self, dispatch_mock, execute_mock,
+                                        flush_mock):
         execute_mock.return_value = ('', '')
 
         self.agent_extension._run_shutdown_command('poweroff')
@@ -1333,6 +1732,7 @@ class TestStandbyExtension(base.IronicAgentTest):
                  mock.call('poweroff', use_standard_locale=True)]
         execute_mock.assert_has_calls(calls)
         dispatch_mock.assert_called_once_with('full_sync')
+        flush_mock.assert_called_once_with()
 
     @mock.patch('ironic_python_agent.utils.execute', autospec=True)
     @mock.patch.object(hardware, 'dispatch_to_all_managers', autospec=True)
@@ -1475,6 +1875,276 @@ class TestStandbyExtension(base.IronicAgentTest):
         write_mock.assert_called_once_with(image_info, device,
                                            'configdrive_data')
 
+    def _setup_image_cache(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(tempdir))
+        self.config(image_cache_dir=tempdir, image_cache_size=1)
+        self.addCleanup(setattr, image_cache, '_CACHE', None)
+        image_info = _build_fake_image_info()
+        image_info['os_hash_value'] = 'abcd'
+        return tempdir, image_info
+
+    @mock.patch('ironic_python_agent.extensions.standby._write_image',
+                autospec=True)
+    @mock.patch('ironic_python_agent.extensions.standby._download_image',
+                autospec=True)
+    def test_cache_and_write_image_cache_miss(self, download_mock,
+                                              write_mock):
+        tempdir, image_info = self._setup_image_cache()
+
+        def _download(image_info, location):
+            with open(location, 'wb') as f:
+                f.write(b'image')
+
+        download_mock.side_effect = _download
+        self.agent_extension._cache_and_write_image(image_info, '/dev/foo')
+
+        entry = os.path.join(tempdir, 'sha256-abcd')
+        download_mock.assert_called_once_with(image_info, entry + '.part')
+        write_mock.assert_called_once_with(image_info, '/dev/foo', None,
+                                           image_location=entry)
+        self.assertEqual(['sha256-abcd'], os.listdir(tempdir))
+        self.assertEqual('fake_id', self.agent_extension.cached_image_id)
+
+    @mock.patch('ironic_python_agent.extensions.standby._write_image',
+                autospec=True)
+    @mock.patch('ironic_python_agent.extensions.standby._download_image',
+                autospec=True)
+    def test_cache_and_write_image_cache_hit(self, download_mock,
+                                             write_mock):
+        tempdir, image_info = self._setup_image_cache()
+        image_info['os_hash_value'] = hashlib.sha256(b'image').hexdigest()
+        entry = os.path.join(tempdir,
+                             'sha256-%s' % image_info['os_hash_value'])
+        with open(entry, 'wb') as f:
+            f.write(b'image')
+        # The same image under a different ID
+        image_info['id'] = 'other_id'
+
+        self.agent_extension._cache_and_write_image(image_info, '/dev/foo')
+
+        download_mock.assert_not_called()
+        write_mock.assert_called_once_with(image_info, '/dev/foo', None,
+                                           image_location=entry)
+        self.assertEqual('other_id', self.agent_extension.cached_image_id)
+
+    @mock.patch('ironic_python_agent.extensions.standby._write_image',
+                autospec=True)
+    @mock.patch('ironic_python_agent.extensions.standby._download_image',
+                autospec=True)
+    def test_cache_and_write_image_cache_hit_corrupted(self, download_mock,
+                                                       write_mock):
+        tempdir, image_info = self._setup_image_cache()
+        image_info['os_hash_value'] = hashlib.sha256(b'image').hexdigest()
+        entry = os.path.join(tempdir,
+                             'sha256-%s' % image_info['os_hash_value'])
+        with open(entry, 'wb') as f:
+            f.write(b'tampered')
+
+        def _download(image_info, location):
+            with open(location, 'wb') as f:
+                f.write(b'image')
+
+        download_mock.side_effect = _download
+
+        self.agent_extension._cache_and_write_image(image_info, '/dev/foo')
+
+        download_mock.assert_called_once_with(image_info, entry + '.part')
+        write_mock.assert_called_once_with(image_info, '/dev/foo', None,
+                                           image_location=entry)
+        with open(entry, 'rb') as f:
+            self.assertEqual(b'image', f.read())
+
+    @mock.patch('ironic_python_agent.extensions.standby._write_image',
+                autospec=True)
+    @mock.patch('ironic_python_agent.extensions.standby._download_image',
+                autospec=True)
+    def test_cache_and_write_image_cache_download_fails(self, download_mock,
+                                                        write_mock):
+        tempdir, image_info = self._setup_image_cache()
+
+        def _download(image_info, location):
+            with open(location, 'wb') as f:
+                f.write(b'ima')
+            raise errors.ImageChecksumError('fake_id', location, 'abcd', 'x')
+
+        download_mock.side_effect = _download
+        self.assertRaises(errors.ImageChecksumError,
+                          self.agent_extension._cache_and_write_image,
+                          image_info, '/dev/foo')
+        write_mock.assert_not_called()
+        self.assertEqual([], os.listdir(tempdir))
+
+    @mock.patch('ironic_python_agent.extensions.standby._write_image',
+                autospec=True)
+    @mock.patch('ironic_python_agent.extensions.standby._download_image',
+                autospec=True)
+    def test_cache_and_write_image_too_large_for_cache(self, download_mock,
+                                                       write_mock):
+        tempdir, image_info = self._setup_image_cache()
+
+        def _download(image_info, location):
+            with open(location, 'wb') as f:
+                f.truncate(units.Mi + 1)
+
+        download_mock.side_effect = _download
+        self.agent_extension._cache_and_write_image(image_info, '/dev/foo')
+
+        partial = os.path.join(tempdir, 'sha256-abcd.part')
+        write_mock.assert_called_once_with(image_info, '/dev/foo', None,
+                                           image_location=partial)
+        self.assertEqual([], os.listdir(tempdir))
+
+    @mock.patch.object(standby.swarm, 'share', autospec=True)
+    @mock.patch('ironic_python_agent.extensions.standby._write_image',
+                autospec=True)
+    @mock.patch('ironic_python_agent.extensions.standby._download_image',
+                autospec=True)
+    def test_cache_and_write_image_shared(self, download_mock, write_mock,
+                                          share_mock):
+        image_info = _build_fake_image_info()
+        image_info['os_hash_value'] = 'abcd'
+        self.agent_extension._cache_and_write_image(image_info, '/dev/foo')
+        share_mock.assert_called_once_with(
+            'sha256-abcd', standby._image_location(image_info))
+        write_mock.assert_called_once_with(image_info, '/dev/foo', None)
+
+    @mock.patch.object(standby.swarm, 'share', autospec=True)
+    @mock.patch('ironic_python_agent.extensions.standby._write_image',
+                autospec=True)
+    @mock.patch('ironic_python_agent.extensions.standby._download_image',
+                autospec=True)
+    def test_cache_and_write_image_cache_hit_shared(self, download_mock,
+                                                    write_mock, share_mock):
+        tempdir, image_info = self._setup_image_cache()
+        image_info['os_hash_value'] = hashlib.sha256(b'').hexdigest()
+        key = 'sha256-%s' % image_info['os_hash_value']
+        entry = os.path.join(tempdir, key)
+        open(entry, 'wb').close()
+        self.agent_extension._cache_and_write_image(image_info, '/dev/foo')
+        share_mock.assert_called_once_with(key, entry)
+
+    @mock.patch('ironic_python_agent.utils.get_requests_session',
+                autospec=True)
+    @mock.patch.object(standby, '_fetch_image_size', autospec=True)
+    @mock.patch.object(standby, '_start_download', autospec=True)
+    @mock.patch.object(standby.swarm, 'download', autospec=True)
+    def test_download_image_from_swarm(self, swarm_mock, start_mock,
+                                       size_mock, session_mock):
+        self.config(image_swarm=True, image_swarm_key='secret')
+        swarm_mock.return_value = True
+        size_mock.return_value = 42
+        image_info = _build_fake_image_info()
+        image_info['os_hash_value'] = 'abcd'
+
+        standby._download_image(image_info, '/tmp/image')
+
+        size_mock.assert_called_once_with(image_info,
+                                          session_mock.return_value)
+        swarm_mock.assert_called_once_with(image_info, 'sha256-abcd',
+                                           '/tmp/image', mock.ANY,
+                                           image_size=42)
+        start_mock.assert_not_called()
+        session_mock.return_value.close.assert_called_once_with()
+
+    @mock.patch('ironic_python_agent.utils.get_requests_session',
+                autospec=True)
+    @mock.patch.object(standby, '_fetch_image_size', autospec=True)
+    @mock.patch.object(standby, '_start_download', autospec=True)
+    @mock.patch.object(standby.swarm, 'download', autospec=True)
+    def _test_download_image_swarm_fallback(self, swarm_mock, start_mock,
+                                            size_mock, session_mock,
+                                            image_info, result=False,
+                                            error=None):
+        self.config(image_swarm=True, image_swarm_key='secret')
+        swarm_mock.return_value = result
+        swarm_mock.side_effect = error
+        start_mock.side_effect = errors.ImageDownloadFatalError('fake_id',
+                                                                'origin')
+        self.assertRaisesRegex(errors.ImageDownloadFatalError, 'origin',
+                               standby._download_image, image_info)
+        start_mock.assert_called_once_with(image_info, None, mock.ANY,
+                                           mock.ANY)
+        return swarm_mock
+
+    def test_download_image_swarm_not_found(self):
+        image_info = _build_fake_image_info()
+        image_info['os_hash_value'] = 'abcd'
+        swarm_mock = self._test_download_image_swarm_fallback(
+            image_info=image_info)
+        swarm_mock.assert_called_once_with(image_info, 'sha256-abcd',
+                                           mock.ANY, mock.ANY,
+                                           image_size=mock.ANY)
+
+    def test_download_image_swarm_fails(self):
+        image_info = _build_fake_image_info()
+        image_info['os_hash_value'] = 'abcd'
+        self._test_download_image_swarm_fallback(
+            image_info=image_info,
+            error=standby.swarm.SwarmError('bad chunk'))
+
+    def test_download_image_swarm_checksum(self):
+        image_info = _build_fake_image_info()
+        image_info['os_hash_value'] = 'abcd'
+        self._test_download_image_swarm_fallback(
+            image_info=image_info,
+            error=errors.ImageChecksumError('fake_id', '/tmp/image', 'abcd',
+                                            'ef'))
+
+    def test_download_image_swarm_no_key(self):
+        swarm_mock = self._test_download_image_swarm_fallback(
+            image_info=_build_fake_image_info())
+        swarm_mock.assert_not_called()
+
+    @mock.patch.object(standby, '_download_with_proxy', autospec=True)
+    def test_fetch_image_range(self, download_mock):
+        image_info = _build_fake_image_info()
+        image_info['urls'] = ['http://a', 'http://b', 'http://c']
+        response = mock.Mock(content=b'0123')
+        download_mock.side_effect = [
+            errors.ImageDownloadError('fake_id', 'down'),
+            mock.Mock(content=b'01'),
+            response,
+        ]
+        session = mock.Mock()
+        self.assertEqual(b'0123', standby._fetch_image_range(
+            image_info, session, 10, 13))
+        download_mock.assert_called_with(image_info, 'http://c', 'fake_id',
+                                         session=session,
+                                         headers={'Range': 'bytes=10-13'})
+        response.close.assert_called_once_with()
+
+    @mock.patch.object(standby, '_download_with_proxy', autospec=True)
+    def test_fetch_image_size(self, download_mock):
+        image_info = _build_fake_image_info()
+        image_info['urls'] = ['http://a', 'http://b', 'http://c']
+        response = mock.Mock(headers={'Content-Range': 'bytes 0-0/1234'})
+        download_mock.side_effect = [
+            requests.ConnectionError('refused'),
+            mock.Mock(headers={'Content-Range': 'bytes 0-0/*'}),
+            response,
+        ]
+        session = mock.Mock()
+        self.assertEqual(1234, standby._fetch_image_size(image_info, session))
+        download_mock.assert_called_with(image_info, 'http://c', 'fake_id',
+                                         session=session,
+                                         headers={'Range': 'bytes=0-0'})
+        response.close.assert_called_once_with()
+
+    @mock.patch.object(standby, '_download_with_proxy', autospec=True)
+    def test_fetch_image_size_unknown(self, download_mock):
+        download_mock.side_effect = errors.ImageDownloadError('fake_id',
+                                                              'down')
+        self.assertIsNone(standby._fetch_image_size(_build_fake_image_info(),
+                                                    mock.Mock()))
+
+    @mock.patch.object(standby, '_download_with_proxy', autospec=True)
+    def test_fetch_image_range_fails(self, download_mock):
+        download_mock.side_effect = requests.ConnectionError('refused')
+        self.assertRaisesRegex(errors.ImageDownloadError, 'refused',
+                               standby._fetch_image_range,
+                               _build_fake_image_info(), mock.Mock(), 0, 9)
+
     @mock.patch('ironic_python_agent.extensions.standby.LOG', autospec=True)
     @mock.patch('ironic_python_agent.disk_utils.block_uuid', autospec=True)
     @mock.patch('ironic_python_agent.disk_utils.fix_gpt_partition',
@@ -1641,6 +2311,153 @@ class TestStandbyExtension(base.IronicAgentTest):
         file_mock.write.assert_has_calls(write_calls)
         fix_gpt_mock.assert_not_called()
 
+    @mock.patch('ironic_python_agent.disk_utils.block_uuid', autospec=True)
+    @mock.patch('ironic_python_agent.disk_utils.fix_gpt_partition',
+                autospec=True)
+    @mock.patch('ironic_python_agent.utils.get_requests_session',
+                autospec=True)
+    def test_stream_raw_image_onto_device_pipeline(self, session_mock,
+                                                   fix_gpt_mock,
+                                                   block_uuid_mock):
+        self.config(image_write_pipeline=True, image_write_chunk_size=1,
+                    image_write_queue_depth=2)
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(tempdir))
+        device = os.path.join(tempdir, 'device')
+        content = os.urandom(units.Mi + 512)
+        session_mock.return_value.get.side_effect = _FakeImageServer(
+            content).get
+        image_info = _build_fake_image_info()
+        image_info['os_hash_value'] = hashlib.sha256(content).hexdigest()
+        block_uuid_mock.return_value = 'aaaabbbb'
+        self.agent_extension.partition_uuids = {}
+
+        self.agent_extension._stream_raw_image_onto_device(image_info,
+                                                           device)
+        with open(device, 'rb') as f:
+            self.assertEqual(content, f.read())
+        fix_gpt_mock.assert_called_once_with(device, node_uuid=None)
+        self.assertEqual('aaaabbbb',
+                         self.agent_extension.partition_uuids['root uuid'])
+
+    @mock.patch('ironic_python_agent.disk_utils.block_uuid', autospec=True)
+    @mock.patch('ironic_python_agent.disk_utils.fix_gpt_partition',
+                autospec=True)
+    @mock.patch('ironic_python_agent.utils.get_requests_session',
+                autospec=True)
+    def _test_stream_raw_image_onto_device_sparse(self, session_mock,
+                                                  fix_gpt_mock,
+                                                  block_uuid_mock):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(tempdir))
+        device = os.path.join(tempdir, 'device')
+        # Stale data in the area covered by zero blocks must be cleared
+        with open(device, 'wb') as f:
+            f.write(b'x' * 3 * units.Mi)
+        content = (os.urandom(1000) + bytes(2 * units.Mi)
+                   + os.urandom(units.Mi))
+        session_mock.return_value.get.side_effect = _FakeImageServer(
+            content).get
+        image_info = _build_fake_image_info()
+        image_info['os_hash_value'] = hashlib.sha256(content).hexdigest()
+        self.agent_extension.partition_uuids = {}
+
+        self.agent_extension._stream_raw_image_onto_device(image_info,
+                                                           device)
+        with open(device, 'rb') as f:
+            self.assertEqual(content, f.read())
+
+    def test_stream_raw_image_onto_device_sparse(self):
+        self.config(image_write_sparse=True)
+        self._test_stream_raw_image_onto_device_sparse()
+
+    def test_stream_raw_image_onto_device_sparse_pipeline(self):
+        self.config(image_write_sparse=True, image_write_pipeline=True,
+                    image_write_chunk_size=1, image_write_queue_depth=2)
+        self._test_stream_raw_image_onto_device_sparse()
+
+    def test_inspect_image_header(self):
+        header = standby.qcow2._HEADER.pack(
+            standby.qcow2.MAGIC, 3, 0, 0, 16, 10 * units.Gi, 0, 20,
+            3 * 65536, 65536, 1, 0, 0)
+        header += standby.qcow2._HEADER_V3.pack(0, 0, 0, 4, 104)
+        self.assertEqual(('qcow2', 10 * units.Gi),
+                         standby._inspect_image_header(
+                             _build_fake_image_info(),
+                             header.ljust(65536, b'\0')))
+
+    def test_read_image_header(self):
+        chunks = iter(['abc', b'def', b'ghi'])
+        self.assertEqual(b'abcdef', standby._read_image_header(chunks, 4))
+        self.assertEqual([b'ghi'], list(chunks))
+
+    @mock.patch('ironic_python_agent.disk_utils.fix_gpt_partition',
+                autospec=True)
+    @mock.patch('ironic_python_agent.disk_utils.trigger_device_rescan',
+                autospec=True)
+    @mock.patch('ironic_python_agent.disk_utils.udev_settle', autospec=True)
+    @mock.patch('ironic_python_agent.disk_utils.destroy_disk_metadata',
+                autospec=True)
+    @mock.patch('ironic_python_agent.disk_utils.get_dev_byte_size',
+                autospec=True)
+    @mock.patch.object(standby, '_inspect_image_header', autospec=True)
+    @mock.patch.object(standby.qcow2, 'StreamConverter', autospec=True)
+    @mock.patch('ironic_python_agent.utils.get_requests_session',
+                autospec=True)
+    def _test_stream_convert_image_onto_device(
+            self, session_mock, converter_mock, inspect_mock, dev_size_mock,
+            destroy_mock, settle_mock, rescan_mock, fix_gpt_mock,
+            img_format='qcow2', virtual_size=units.Mi, fail=False):
+        self.config(image_download_connection_retry_interval=0)
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(tempdir))
+        device = os.path.join(tempdir, 'device')
+        open(device, 'wb').close()
+        content = os.urandom(5 * units.Mi)
+        server = _FakeImageServer(
+            content, fail_at=3 * units.Mi if fail else None)
+        session_mock.return_value.get.side_effect = server.get
+        image_info = _build_fake_image_info()
+        image_info['os_hash_value'] = hashlib.sha256(content).hexdigest()
+        inspect_mock.return_value = (img_format, virtual_size)
+        dev_size_mock.return_value = 2 * units.Mi
+        received = []
+        converter_mock.return_value.write.side_effect = (
+            lambda chunks: received.append(b''.join(chunks)))
+
+        self.agent_extension._stream_convert_image_onto_device(image_info,
+                                                               device)
+        inspect_mock.assert_called_with(image_info,
+                                        content[:standby.IMAGE_HEADER_SIZE])
+        self.assertEqual(content, received[-1])
+        converter_mock.assert_called_with(mock.ANY, 256 * units.Mi,
+                                          image_size=len(content))
+        destroy_mock.assert_called_once_with(device, '')
+        rescan_mock.assert_called_once_with(device)
+        fix_gpt_mock.assert_called_once_with(device, node_uuid=None)
+        return inspect_mock, received
+
+    def test_stream_convert_image_onto_device(self):
+        self._test_stream_convert_image_onto_device()
+
+    def test_stream_convert_image_onto_device_retry(self):
+        inspect_mock, received = (
+            self._test_stream_convert_image_onto_device(fail=True))
+        # The header is inspected again, the disk metadata is only
+        # destroyed once
+        self.assertEqual(2, inspect_mock.call_count)
+        self.assertEqual(1, len(received))
+
+    def test_stream_convert_image_onto_device_unsupported(self):
+        self.assertRaisesRegex(standby.qcow2.UnsupportedImage, 'vmdk',
+                               self._test_stream_convert_image_onto_device,
+                               img_format='vmdk')
+
+    def test_stream_convert_image_onto_device_too_large(self):
+        self.assertRaisesRegex(errors.InvalidImage, 'exceeds',
+                               self._test_stream_convert_image_onto_device,
+                               virtual_size=3 * units.Mi)
+
     def test__message_format_partition_bios(self):
         image_info = _build_fake_partition_image_info()
         msg = ('image ({}) already present on device {} ')
@@ -0,0 +1,116 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+
+from ironic_python_agent.metrics_lib import metrics_prometheus
+from ironic_python_agent.tests.unit import base
+
+
+class TestRegistry(base.IronicAgentTest):
+    def setUp(self):
+        super(TestRegistry, self).setUp()
+        self.registry = metrics_prometheus.Registry()
+
+    def test_counter(self):
+        self.registry.inc('agent.clean.erase')
+        self.registry.inc('agent.clean.erase', 2)
+        self.assertEqual('# TYPE agent_clean_erase_total counter\n'
+                         'agent_clean_erase_total 3\n',
+                         self.registry.render())
+
+    def test_gauge(self):
+        self.registry.set('queue-length', 4)
+        self.registry.set('queue-length', 2.5)
+        self.assertEqual('# TYPE queue_length gauge\n'
+                         'queue_length 2.5\n',
+                         self.registry.render())
+
+    def test_histogram(self):
+        for value in (0.5, 1, 3, 100):
+            self.registry.observe('9deploy', value, buckets=[10, 1])
+        self.assertEqual('# TYPE _9deploy histogram\n'
+                         '_9deploy_bucket{le="1.0"} 2\n'
+                         '_9deploy_bucket{le="10.0"} 3\n'
+                         '_9deploy_bucket{le="+Inf"} 4\n'
+                         '_9deploy_sum 104.5\n'
+                         '_9deploy_count 4\n',
+                         self.registry.render())
+
+    def test_histogram_configured_buckets(self):
+        self.config(histogram_buckets=[0.5], group='metrics_prometheus')
+        self.registry.observe('clean', 0.1)
+        self.assertIn('clean_bucket{le="0.5"} 1\n', self.registry.render())
+
+    def test_type_conflict(self):
+        self.registry.set('metric', 1)
+        self.assertRaises(ValueError, self.registry.observe, 'metric', 1)
+        self.registry.inc('metric')
+        self.assertEqual(['metric', 'metric_total'],
+                         [line.split()[2] for line in
+                          self.registry.render().splitlines()
+                          if line.startswith('# TYPE')])
+
+    def test_concurrent_updates(self):
+        def _update():
+            for _i in range(1000):
+                self.registry.inc('requests')
+                self.registry.observe('duration', 0.1, buckets=[1])
+
+        threads = [threading.Thread(target=_update) for _i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        rendered = self.registry.render()
+        self.assertIn('requests_total 8000\n', rendered)
+        self.assertIn('duration_count 8000\n', rendered)
+        self.assertIn('duration_bucket{le="1.0"} 8000\n', rendered)
+
+
+class TestPrometheusMetricLogger(base.IronicAgentTest):
+    def setUp(self):
+        super(TestPrometheusMetricLogger, self).setUp()
+        self.registry = metrics_prometheus.Registry()
+        self.ml = metrics_prometheus.PrometheusMetricLogger(
+            'prefix', '.', registry=self.registry)
+
+    def test_metrics(self):
+        self.ml.send_counter('prefix.counter', 1)
+        self.ml.send_counter('prefix.sampled', 1, sample_rate=1.0)
+        self.ml.send_gauge('prefix.gauge', 7)
+        with self.ml.timer('timer'):
+            pass
+
+        rendered = self.registry.render()
+        self.assertIn('prefix_counter_total 1\n', rendered)
+        self.assertIn('prefix_sampled_total 1.0\n', rendered)
+        self.assertIn('prefix_gauge 7\n', rendered)
+        self.assertIn('# TYPE prefix_timer_seconds histogram\n', rendered)
+        self.assertIn('prefix_timer_seconds_count 1\n', rendered)
+
+    def test_timer_in_seconds(self):
+        self.ml.send_timer('deploy', 1500)
+        self.assertIn('deploy_seconds_sum 1.5\n', self.registry.render())
+
+    def test_type_conflict(self):
+        self.ml.send_gauge('metric_seconds', 1)
+        self.ml.send_timer('metric', 1)
+        self.assertEqual('# TYPE metric_seconds gauge\nmetric_seconds 1\n',
+                         self.registry.render())
+
+    def test_default_registry(self):
+        ml = metrics_prometheus.PrometheusMetricLogger('prefix')
+        ml.send_gauge('gauge', 1)
+        self.assertEqual('# TYPE gauge gauge\ngauge 1\n',
+                         metrics_prometheus.REGISTRY.render())
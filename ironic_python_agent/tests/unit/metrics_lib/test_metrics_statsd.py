@@ -102,3 +102,145 @@ class TestStatsdMetricLogger(base.IronicAgentTest):
             b'part1.part2:5|type@0.5',
             ('test-host', 4321))
         mock_socket.close.assert_called_once_with()
+
+
+class TestBufferedStatsdMetricLogger(base.IronicAgentTest):
+    def setUp(self):
+        super(TestBufferedStatsdMetricLogger, self).setUp()
+        self.config(statsd_flush_interval=1, group='metrics_statsd')
+        patcher = mock.patch.object(metrics_statsd.MetricBuffer, 'start',
+                                    autospec=True)
+        self.mock_start = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_shared_buffer(self):
+        ml = metrics_statsd.StatsdMetricLogger('prefix', '.', 'test-host',
+                                               4321)
+        other = metrics_statsd.StatsdMetricLogger('other', '.', 'test-host',
+                                                  4321)
+
+        self.assertIs(ml._buffer, other._buffer)
+        self.mock_start.assert_called_once_with(ml._buffer)
+        self.assertEqual(('test-host', 4321), ml._buffer._target)
+        self.assertEqual(1, ml._buffer._interval)
+        self.assertEqual(
+            'ironic_python_agent.metrics_lib.metrics_statsd.dropped',
+            ml._buffer._dropped_metric)
+
+    @mock.patch('socket.socket', autospec=connect)
+    def test_send_buffered(self, mock_socket_constructor):
+        ml = metrics_statsd.StatsdMetricLogger('prefix', '.', 'test-host',
+                                               4321)
+        ml._send('part1.part2', 2, 'type')
+        ml._send('part1.part2', 5, 'type', sample_rate=0.5)
+
+        mock_socket_constructor.assert_not_called()
+        self.assertEqual(['part1.part2:2|type', 'part1.part2:5|type@0.5'],
+                         ml._buffer._metrics)
+
+    @mock.patch.object(metrics_statsd.MetricBuffer, 'flush', autospec=True)
+    def test_flush_buffers(self, mock_flush):
+        ml = metrics_statsd.StatsdMetricLogger('prefix', '.', 'test-host',
+                                               4321)
+        other = metrics_statsd.StatsdMetricLogger('other', '.', 'other-host',
+                                                  4321)
+
+        metrics_statsd.flush_buffers()
+
+        mock_flush.assert_has_calls([mock.call(ml._buffer),
+                                     mock.call(other._buffer)],
+                                    any_order=True)
+        self.assertEqual(2, len(metrics_statsd._BUFFERS))
+
+    @mock.patch.object(metrics_statsd.MetricBuffer, 'stop', autospec=True)
+    def test_stop_buffers(self, mock_stop):
+        ml = metrics_statsd.StatsdMetricLogger('prefix', '.', 'test-host',
+                                               4321)
+
+        metrics_statsd.stop_buffers()
+
+        mock_stop.assert_called_once_with(ml._buffer)
+        self.assertEqual({}, metrics_statsd._BUFFERS)
+
+
+@mock.patch('socket.socket', autospec=connect)
+class TestMetricBuffer(base.IronicAgentTest):
+    def setUp(self):
+        super(TestMetricBuffer, self).setUp()
+        self.buffer = metrics_statsd.MetricBuffer(
+            ('test-host', 4321), 1, 64, 10, dropped_metric='dropped')
+
+    def test_flush(self, mock_socket_constructor):
+        mock_socket = mock_socket_constructor.return_value
+        self.buffer.add('part1.part2:2|c')
+        self.buffer.add('part1.part2:5|ms')
+
+        self.buffer.flush()
+
+        mock_socket.settimeout.assert_called_once_with(0.0)
+        mock_socket.sendto.assert_called_once_with(
+            b'part1.part2:2|c\npart1.part2:5|ms', ('test-host', 4321))
+        mock_socket.close.assert_called_once_with()
+        self.assertEqual([], self.buffer._metrics)
+
+    def test_flush_empty(self, mock_socket_constructor):
+        self.buffer.flush()
+        mock_socket_constructor.assert_not_called()
+
+    def test_flush_packet_size(self, mock_socket_constructor):
+        mock_socket = mock_socket_constructor.return_value
+        metrics = ['metric%d:%s|ms' % (i, 'x' * 20) for i in range(5)]
+        metrics.append('long:%s|g' % ('x' * 100))
+        for metric in metrics:
+            self.buffer.add(metric)
+
+        self.buffer.flush()
+
+        packets = [call[0][0] for call in mock_socket.sendto.call_args_list]
+        self.assertEqual([b'\n'.join(m.encode() for m in metrics[:2]),
+                          b'\n'.join(m.encode() for m in metrics[2:4]),
+                          metrics[4].encode(),
+                          metrics[5].encode()],
+                         packets)
+        self.assertTrue(all(len(p) <= 64 for p in packets[:3]))
+
+    def test_flush_send_error(self, mock_socket_constructor):
+        mock_socket = mock_socket_constructor.return_value
+        mock_socket.sendto.side_effect = socket.error('boom')
+        self.buffer.add('a:1|c')
+
+        self.buffer.flush()
+
+        mock_socket.sendto.assert_called_once_with(b'a:1|c',
+                                                   ('test-host', 4321))
+        mock_socket.close.assert_called_once_with()
+
+    def test_drop_when_full(self, mock_socket_constructor):
+        mock_socket = mock_socket_constructor.return_value
+        for i in range(12):
+            self.buffer.add('m:%d|c' % i)
+        self.assertEqual(10, len(self.buffer._metrics))
+        self.assertEqual(2, self.buffer.dropped)
+        self.assertFalse(self.buffer.add('m:12|c'))
+
+        self.buffer.flush()
+
+        packets = b'\n'.join(call[0][0]
+                             for call in mock_socket.sendto.call_args_list)
+        self.assertTrue(packets.endswith(b'\ndropped:3|c'))
+        self.assertTrue(self.buffer.add('m:13|c'))
+
+        mock_socket.reset_mock()
+        self.buffer.flush()
+        mock_socket.sendto.assert_called_once_with(b'm:13|c',
+                                                   ('test-host', 4321))
+        self.assertEqual(3, self.buffer.dropped)
+
+    def test_run(self, mock_socket_constructor):
+        mock_socket = mock_socket_constructor.return_value
+        self.buffer.add('a:1|c')
+        self.buffer.start()
+        self.buffer.stop()
+
+        mock_socket.sendto.assert_called_once_with(b'a:1|c',
+                                                   ('test-host', 4321))
@@ -17,6 +17,7 @@ from oslo_config import cfg
 
 from ironic_python_agent import errors
 from ironic_python_agent.metrics_lib import metrics as metricslib
+from ironic_python_agent.metrics_lib import metrics_prometheus
 from ironic_python_agent.metrics_lib import metrics_statsd
 from ironic_python_agent.metrics_lib import metrics_utils
 from ironic_python_agent.tests.unit import base
@@ -39,6 +40,13 @@ class TestGetLogger(base.IronicAgentTest):
         self.assertIsInstance(metrics, metrics_statsd.StatsdMetricLogger)
         CONF.clear_override('backend', group='metrics')
 
+    def test_prometheus_backend(self):
+        self.config(backend='prometheus', group='metrics')
+
+        metrics = metrics_utils.get_metrics_logger('foo')
+        self.assertIsInstance(metrics,
+                              metrics_prometheus.PrometheusMetricLogger)
+
     def test_nonexisting_backend(self):
         self.assertRaises(errors.InvalidMetricConfig,
                           metrics_utils.get_metrics_logger, 'foo', 'test')
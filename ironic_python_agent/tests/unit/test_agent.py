@@ -290,6 +290,113 @@ class TestBaseAgent(ironic_agent_base.IronicAgentTest):
         self.agent.heartbeater.start.assert_called_once_with()
         self.assertFalse(CONF.md5_enabled)
 
+    @mock.patch(
+        'ironic_python_agent.hardware_managers.cna._detect_cna_card',
+        mock.Mock())
+    @mock.patch.object(netutils, 'start_lldp_listener', autospec=True)
+    @mock.patch.object(netutils, 'list_interfaces', autospec=True)
+    @mock.patch.object(hardware, 'dispatch_to_managers', autospec=True)
+    @mock.patch.object(agent.IronicPythonAgent,
+                       '_wait_for_interface', autospec=True)
+    @mock.patch.object(hardware, 'get_managers', autospec=True)
+    def test_run_lldp_listener(self, mock_get_managers, mock_wait,
+                               mock_dispatch, mock_list_interfaces,
+                               mock_start_lldp):
+        CONF.set_override('inspection_callback_url', '')
+        self.config(lldp_listener=True)
+        mock_list_interfaces.return_value = ['lo', 'eth0', 'eth1']
+
+        def set_serve_api(*args, **kwargs):
+            self.agent.serve_api = False
+
+        self.agent.api.start = mock.Mock(side_effect=set_serve_api)
+        self.agent.heartbeater = mock.Mock()
+        self.agent.api_client.lookup_node = mock.Mock()
+        self.agent.api_client.lookup_node.return_value = {
+            'node': {
+                'uuid': 'deadbeef-dabb-ad00-b105-f00d00bab10c'
+            },
+            'config': {
+                'heartbeat_timeout': 300,
+            }
+        }
+
+        self.agent.run()
+
+        mock_start_lldp.assert_called_once_with(['eth0', 'eth1'])
+
+    @mock.patch.object(agent.IronicPythonAgent, '_start_auto_tls',
+                       lambda self: (None, None))
+    @mock.patch.object(agent.metrics_utils, 'flush_metrics', autospec=True)
+    def test_serve_ipa_api_flushes_metrics(self, mock_flush):
+        self.agent.heartbeater = mock.Mock()
+        self.agent.api = mock.Mock()
+        self.agent.api.start.side_effect = lambda *args: setattr(
+            self.agent, 'serve_api', False)
+        stopped = []
+        self.agent.api.stop.side_effect = lambda: stopped.append('api')
+        mock_flush.side_effect = lambda stop: stopped.append('metrics')
+
+        self.agent.serve_ipa_api()
+
+        self.assertEqual(['api', 'metrics'], stopped)
+        mock_flush.assert_called_once_with(stop=True)
+
+    @mock.patch.object(agent.IronicPythonAgent, '_start_auto_tls',
+                       lambda self: (None, None))
+    @mock.patch.object(agent.swarm, 'withdraw', autospec=True)
+    @mock.patch.object(agent.swarm, 'announce', autospec=True)
+    def test_serve_ipa_api_swarm(self, mock_announce, mock_withdraw):
+        CONF.set_override('image_swarm', True)
+        CONF.set_override('image_swarm_key', 'secret')
+        self.agent.heartbeater = mock.Mock()
+        self.agent.api = mock.Mock()
+        self.agent.api.start.side_effect = lambda *args: setattr(
+            self.agent, 'serve_api', False)
+        self.agent.advertise_address = agent.Host('fd00::1', 9999)
+
+        self.agent.serve_ipa_api()
+
+        mock_announce.assert_called_once_with('http://[fd00::1]:9999')
+        mock_withdraw.assert_called_once_with()
+        self.agent.api.stop.assert_called_once_with()
+
+    @mock.patch.object(agent.IronicPythonAgent, '_start_auto_tls',
+                       lambda self: (None, None))
+    @mock.patch.object(agent.swarm, 'withdraw', autospec=True)
+    @mock.patch.object(agent.swarm, 'announce', autospec=True)
+    def test_serve_ipa_api_swarm_announce_fails(self, mock_announce,
+                                                mock_withdraw):
+        CONF.set_override('image_swarm', True)
+        CONF.set_override('image_swarm_key', 'secret')
+        mock_announce.side_effect = errors.ServiceRegistrationFailure(
+            'swarm', 'conflict')
+        self.agent.heartbeater = mock.Mock()
+        self.agent.api = mock.Mock()
+        self.agent.api.start.side_effect = lambda *args: setattr(
+            self.agent, 'serve_api', False)
+
+        self.agent.serve_ipa_api()
+
+        mock_announce.assert_called_once_with('http://203.0.113.1:9990')
+        self.agent.api.stop.assert_called_once_with()
+
+    @mock.patch.object(agent.IronicPythonAgent, '_start_auto_tls',
+                       lambda self: (None, None))
+    @mock.patch.object(agent.swarm, 'withdraw', autospec=True)
+    @mock.patch.object(agent.swarm, 'announce', autospec=True)
+    def test_serve_ipa_api_swarm_no_key(self, mock_announce, mock_withdraw):
+        CONF.set_override('image_swarm', True)
+        self.agent.heartbeater = mock.Mock()
+        self.agent.api = mock.Mock()
+        self.agent.api.start.side_effect = lambda *args: setattr(
+            self.agent, 'serve_api', False)
+
+        self.agent.serve_ipa_api()
+
+        mock_announce.assert_not_called()
+        self.agent.api.stop.assert_called_once_with()
+
     @mock.patch(
         'ironic_python_agent.hardware_managers.cna._detect_cna_card',
         mock.Mock())
@@ -12,8 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import ssl
 import tempfile
+import threading
 import time
 from unittest import mock
 
@@ -24,7 +26,10 @@ from werkzeug import wrappers
 from ironic_python_agent import agent
 from ironic_python_agent.api import app
 from ironic_python_agent.extensions import base
+from ironic_python_agent.metrics_lib import metrics_utils
+from ironic_python_agent import swarm
 from ironic_python_agent.tests.unit import base as ironic_agent_base
+from ironic_python_agent import utils
 
 
 PATH_PREFIX = '/v1'
@@ -262,6 +267,79 @@ class TestIronicAPI(ironic_agent_base.IronicAgentTest):
             ],
         }, response.json)
 
+    def test_metrics_not_enabled(self):
+        response = self.get_json('/metrics', path_prefix='',
+                                 expect_errors=True)
+        self.assertEqual(404, response.status_code)
+
+    def test_metrics(self):
+        self.config(backend='prometheus', group='metrics')
+        metrics_utils.get_metrics_logger('agent').send_counter('deploys', 1)
+
+        response = self.get_json('/metrics', path_prefix='')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/plain; version=0.0.4; charset=utf-8',
+                         response.headers['Content-Type'])
+        self.assertEqual('# TYPE deploys_total counter\ndeploys_total 1\n',
+                         response.get_data(as_text=True))
+
+    def test_server_timing(self):
+        self._command_results(1)
+        response = self.get_json('/commands')
+        self.assertRegex(response.headers['Server-Timing'],
+                         r'^serialize;dur=\d+\.\d$')
+
+    def _command_results(self, count):
+        results = [base.SyncCommandResult('do_things', {}, True, index)
+                   for index in range(count)]
+        self.mock_agent.list_command_results.return_value = results
+        return results
+
+    def test_list_command_results_paginated(self):
+        results = self._command_results(5)
+
+        response = self.get_json('/commands?limit=2')
+        self.assertEqual([r.serialize() for r in results[:2]],
+                         response.json['commands'])
+        self.assertEqual('http://localhost/v1/commands/?limit=2&marker=%s'
+                         % results[1].id, response.json['next'])
+
+        response = self.get_json('/commands?limit=2&marker=%s'
+                                 % results[3].id)
+        self.assertEqual([results[4].serialize()], response.json['commands'])
+        self.assertNotIn('next', response.json)
+
+        response = self.get_json('/commands?marker=%s' % results[1].id)
+        self.assertEqual([r.serialize() for r in results[2:]],
+                         response.json['commands'])
+
+    def test_list_command_results_latest(self):
+        results = self._command_results(3)
+
+        response = self.get_json('/commands?latest=true')
+        self.assertEqual({'commands': [results[2].serialize()]},
+                         response.json)
+
+    def test_list_command_results_latest_empty(self):
+        self._command_results(0)
+
+        response = self.get_json('/commands?latest=true')
+        self.assertEqual({'commands': []}, response.json)
+
+    def test_list_command_results_invalid_limit(self):
+        self._command_results(3)
+        for limit in ('0', '-1', 'x'):
+            response = self.get_json('/commands?limit=%s' % limit,
+                                     expect_errors=True)
+            self.assertEqual(400, response.status_code)
+
+    def test_list_command_results_unknown_marker(self):
+        self._command_results(3)
+        response = self.get_json('/commands?marker=unknown',
+                                 expect_errors=True)
+        self.assertEqual(404, response.status_code)
+
     def test_list_commands_with_token(self):
         agent_token = str('0123456789' * 10)
         cmd_result = base.SyncCommandResult('do_things',
@@ -302,6 +380,221 @@ class TestIronicAPI(ironic_agent_base.IronicAgentTest):
         data = response.json
         self.assertEqual(serialized_cmd_result, data)
 
+    def _running_command(self, event):
+        def execute_method(**params):
+            event.wait()
+            return {'test': 'result'}
+
+        result = base.AsyncCommandResult('do_things', {}, execute_method)
+        result.start()
+        self.addCleanup(result.execution_thread.join)
+        self.addCleanup(event.set)
+        return result
+
+    def _mock_running_command(self):
+        result = mock.Mock(spec=base.AsyncCommandResult, id='abc123')
+        result.is_done.return_value = False
+        result.serialize.return_value = {}
+        return result
+
+    def test_get_command_result_wait_seconds(self):
+        event = threading.Event()
+        cmd_result = self._running_command(event)
+        self.mock_agent.get_command_result.return_value = cmd_result
+        threading.Timer(0.1, event.set).start()
+
+        response = self.get_json('/commands/abc123?wait=10')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('SUCCEEDED', response.json['command_status'])
+        self.assertEqual({'test': 'result'}, response.json['command_result'])
+
+    def test_get_command_result_wait_timeout(self):
+        cmd_result = self._running_command(threading.Event())
+        self.mock_agent.get_command_result.return_value = cmd_result
+
+        response = self.get_json('/commands/abc123?wait=0.1')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('RUNNING', response.json['command_status'])
+
+    def test_get_command_result_wait_capped(self):
+        self.config(api_max_command_wait=5)
+        self.app = app.Application(self.mock_agent, cfg.CONF)
+        self.client = http_test.Client(self.app, Response)
+        cmd_result = self._mock_running_command()
+        self.mock_agent.get_command_result.return_value = cmd_result
+
+        response = self.get_json('/commands/abc123?wait=3600')
+
+        self.assertEqual(200, response.status_code)
+        cmd_result.join.assert_called_once_with(5)
+
+    def test_get_command_result_wait_zero(self):
+        cmd_result = self._mock_running_command()
+        self.mock_agent.get_command_result.return_value = cmd_result
+
+        response = self.get_json('/commands/abc123?wait=0')
+
+        self.assertEqual(200, response.status_code)
+        cmd_result.join.assert_not_called()
+
+    def test_get_command_result_wait_done(self):
+        cmd_result = base.SyncCommandResult('do_things', {}, True, None)
+        self.mock_agent.get_command_result.return_value = cmd_result
+
+        response = self.get_json('/commands/abc123?wait=10')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(cmd_result.serialize(), response.json)
+
+    def test_get_command_result_wait_invalid(self):
+        for wait in ('yes', '-1', 'nan', 'inf'):
+            response = self.get_json('/commands/abc123?wait=%s' % wait,
+                                     expect_errors=True)
+            self.assertEqual(400, response.status_code)
+        self.mock_agent.get_command_result.assert_not_called()
+
+    def test_get_command_result_too_many_waiters(self):
+        self.config(api_max_waiting_requests=1)
+        self.app = app.Application(self.mock_agent, cfg.CONF)
+        self.client = http_test.Client(self.app, Response)
+        cmd_result = self._mock_running_command()
+        self.mock_agent.get_command_result.return_value = cmd_result
+        # Another request is already waiting
+        self.app._waiters.acquire()
+
+        response = self.get_json('/commands/abc123?wait=10')
+
+        self.assertEqual(200, response.status_code)
+        cmd_result.join.assert_not_called()
+        self.app._waiters.release()
+
+        response = self.get_json('/commands/abc123?wait=10')
+
+        cmd_result.join.assert_called_once_with(10)
+        # The slot has been released
+        self.assertTrue(self.app._waiters.acquire(blocking=False))
+
+    def test_get_command_result_waiting_disabled(self):
+        self.config(api_max_waiting_requests=0)
+        self.app = app.Application(self.mock_agent, cfg.CONF)
+        self.client = http_test.Client(self.app, Response)
+        cmd_result = self._mock_running_command()
+        self.mock_agent.get_command_result.return_value = cmd_result
+
+        response = self.get_json('/commands/abc123?wait=10')
+
+        self.assertEqual(200, response.status_code)
+        cmd_result.join.assert_not_called()
+
+    def test_list_command_results_wait_seconds(self):
+        event = threading.Event()
+        done = base.SyncCommandResult('do_things', {}, True, None)
+        running = self._running_command(event)
+        self.mock_agent.list_command_results.return_value = [done, running]
+        threading.Timer(0.1, event.set).start()
+
+        response = self.get_json('/commands?wait=10')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(['SUCCEEDED', 'SUCCEEDED'],
+                         [r['command_status']
+                          for r in response.json['commands']])
+
+    def _parse_events(self, response):
+        events = []
+        for block in response.get_data(as_text=True).split('\n\n'):
+            fields = dict(line.split(': ', 1)
+                          for line in block.splitlines()
+                          if line and not line.startswith(':'))
+            if fields:
+                self.assertEqual(str(json.loads(fields['data'])['id']),
+                                 fields['id'])
+                events.append((fields['event'], json.loads(fields['data'])))
+        return events
+
+    def test_command_events(self):
+        event = threading.Event()
+        cmd_result = self._running_command(event)
+        self.mock_agent.get_command_result.return_value = cmd_result
+
+        def _finish():
+            cmd_result.update_progress(step='erase_devices')
+            cmd_result.update_progress(bytes_written=42)
+            event.set()
+
+        threading.Timer(0.1, _finish).start()
+        response = self.get_json('/commands/abc123/events')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/event-stream', response.mimetype)
+        events = self._parse_events(response)
+        self.assertEqual(['progress', 'progress', 'status'],
+                         [name for name, _data in events])
+        self.assertEqual({'step': 'erase_devices', 'bytes_written': 42},
+                         events[1][1]['progress'])
+        self.assertEqual('SUCCEEDED', events[2][1]['command_status'])
+        # The slot of the stream is released when the server closes it
+        response.close()
+        for _i in range(cfg.CONF.api_max_waiting_requests):
+            self.assertTrue(self.app._waiters.acquire(blocking=False))
+
+    def test_command_events_last_event_id(self):
+        cmd_result = base.AsyncCommandResult('do_things', {}, lambda: None)
+        cmd_result.update_progress(step=1)
+        cmd_result.update_progress(step=2)
+        cmd_result.start().join()
+        self.mock_agent.get_command_result.return_value = cmd_result
+
+        response = self.get_json('/commands/abc123/events',
+                                 headers={'Last-Event-ID': '1'})
+        events = self._parse_events(response)
+        self.assertEqual([2, 3], [data['id'] for _name, data in events])
+
+        response = self.get_json('/commands/abc123/events?last_event_id=2')
+        events = self._parse_events(response)
+        self.assertEqual([3], [data['id'] for _name, data in events])
+
+    def test_command_events_done_before_status(self):
+        cmd_result = base.AsyncCommandResult('do_things', {}, lambda: None)
+        # The command is done, but its status is not published yet
+        cmd_result.command_status = base.AgentCommandStatus.SUCCEEDED
+        self.mock_agent.get_command_result.return_value = cmd_result
+
+        threading.Timer(0.1, cmd_result._publish_status).start()
+        response = self.get_json('/commands/abc123/events')
+
+        events = self._parse_events(response)
+        self.assertEqual(['status'], [name for name, _data in events])
+        self.assertEqual('SUCCEEDED', events[0][1]['command_status'])
+
+    def test_command_events_invalid_last_event_id(self):
+        response = self.get_json('/commands/abc123/events?last_event_id=x',
+                                 expect_errors=True)
+        self.assertEqual(400, response.status_code)
+
+    def test_command_events_too_many_waiters(self):
+        self.config(api_max_waiting_requests=0)
+        self.app = app.Application(self.mock_agent, cfg.CONF)
+        self.client = http_test.Client(self.app, Response)
+        self.mock_agent.get_command_result.return_value = (
+            base.SyncCommandResult('do_things', {}, True, None))
+
+        response = self.get_json('/commands/abc123/events',
+                                 expect_errors=True)
+        self.assertEqual(503, response.status_code)
+
+    def test_command_events_token_invalid(self):
+        self.mock_agent.validate_agent_token.return_value = False
+
+        response = self.get_json(
+            '/commands/abc123/events?agent_token=%s' % ('0123456789' * 10),
+            expect_errors=True)
+
+        self.assertEqual(401, response.status_code)
+        self.mock_agent.get_command_result.assert_not_called()
+
     def test_get_command_with_token(self):
         agent_token = str('0123456789' * 10)
         cmd_result = base.SyncCommandResult('do_things',
@@ -416,6 +709,119 @@ class TestIronicAPI(ironic_agent_base.IronicAgentTest):
         self.assertEqual(0, self.mock_agent.execute_command.call_count)
         self.assertEqual(1, self.mock_agent.validate_agent_token.call_count)
 
+    def _get_swarm(self, path, expect_errors=False, sign=True):
+        headers = {'Authorization': swarm.sign('/v1' + path)} if sign else {}
+        return self.get_json(path, expect_errors=expect_errors,
+                             headers=headers)
+
+    @mock.patch('ironic_python_agent.swarm.describe', autospec=True)
+    def test_swarm_image(self, mock_describe):
+        self.config(image_swarm=True, image_swarm_key='secret')
+        mock_describe.return_value = {'manifest': {'chunks': ['ab']},
+                                      'available': [0]}
+        response = self._get_swarm('/swarm/sha256-abcd')
+        self.assertEqual(mock_describe.return_value, response.json)
+        mock_describe.assert_called_once_with('sha256-abcd')
+        self.mock_agent.validate_agent_token.assert_not_called()
+
+    @mock.patch('ironic_python_agent.swarm.describe', autospec=True)
+    def test_swarm_image_not_shared(self, mock_describe):
+        self.config(image_swarm=True, image_swarm_key='secret')
+        mock_describe.return_value = None
+        response = self._get_swarm('/swarm/sha256-abcd', expect_errors=True)
+        self.assertEqual(404, response.status_code)
+
+    @mock.patch('ironic_python_agent.swarm.describe', autospec=True)
+    def test_swarm_image_not_signed(self, mock_describe):
+        self.config(image_swarm=True, image_swarm_key='secret')
+        response = self._get_swarm('/swarm/sha256-abcd', expect_errors=True,
+                                   sign=False)
+        self.assertEqual(401, response.status_code)
+        mock_describe.assert_not_called()
+
+    @mock.patch('ironic_python_agent.swarm.describe', autospec=True)
+    def test_swarm_image_wrong_path(self, mock_describe):
+        self.config(image_swarm=True, image_swarm_key='secret')
+        response = self.get_json(
+            '/swarm/sha256-abcd', expect_errors=True,
+            headers={'Authorization': swarm.sign('/v1/swarm/sha256-ef')})
+        self.assertEqual(401, response.status_code)
+        mock_describe.assert_not_called()
+
+    @mock.patch('ironic_python_agent.swarm.describe', autospec=True)
+    def test_swarm_image_disabled(self, mock_describe):
+        response = self.get_json('/swarm/sha256-abcd', expect_errors=True)
+        self.assertEqual(404, response.status_code)
+        mock_describe.assert_not_called()
+
+    @mock.patch('ironic_python_agent.swarm.describe', autospec=True)
+    def test_swarm_image_no_key(self, mock_describe):
+        self.config(image_swarm=True)
+        response = self.get_json('/swarm/sha256-abcd', expect_errors=True)
+        self.assertEqual(404, response.status_code)
+        mock_describe.assert_not_called()
+
+    @mock.patch('ironic_python_agent.swarm.read_chunk', autospec=True)
+    def test_swarm_chunk(self, mock_read):
+        self.config(image_swarm=True, image_swarm_key='secret')
+        mock_read.return_value = b'chunk'
+        response = self._get_swarm('/swarm/sha256-abcd/3')
+        self.assertEqual(b'chunk', response.data)
+        self.assertEqual('application/octet-stream', response.content_type)
+        mock_read.assert_called_once_with('sha256-abcd', 3)
+
+    @mock.patch('ironic_python_agent.swarm.read_chunk', autospec=True)
+    def test_swarm_chunk_not_signed(self, mock_read):
+        self.config(image_swarm=True, image_swarm_key='secret')
+        response = self._get_swarm('/swarm/sha256-abcd/3',
+                                   expect_errors=True, sign=False)
+        self.assertEqual(401, response.status_code)
+        mock_read.assert_not_called()
+
+    @mock.patch('ironic_python_agent.swarm.read_chunk', autospec=True)
+    def test_swarm_chunk_not_available(self, mock_read):
+        self.config(image_swarm=True, image_swarm_key='secret')
+        mock_read.return_value = None
+        response = self._get_swarm('/swarm/sha256-abcd/3',
+                                   expect_errors=True)
+        self.assertEqual(404, response.status_code)
+
+    @mock.patch.object(utils, 'get_execution_history', autospec=True)
+    def test_executions(self, mock_history):
+        mock_history.return_value = [
+            {'command': 'lsblk -J', 'program': 'lsblk', 'step': None,
+             'started_at': 1.0, 'duration': 0.5, 'exit_code': 0,
+             'stdout_size': 10, 'stderr_size': 0},
+            {'command': 'shred /dev/sda', 'program': 'shred',
+             'step': 'erase_devices', 'started_at': 2.0, 'duration': 60.0,
+             'exit_code': 1, 'stdout_size': 0, 'stderr_size': 5},
+        ]
+        self.mock_agent.validate_agent_token.return_value = True
+
+        response = self.get_json('/executions?agent_token=token')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(mock_history.return_value,
+                         response.json['executions'])
+        self.assertEqual(
+            {'shred': {'count': 1, 'failures': 1, 'total_duration': 60.0,
+                       'max_duration': 60.0},
+             'lsblk': {'count': 1, 'failures': 0, 'total_duration': 0.5,
+                       'max_duration': 0.5}},
+            response.json['summary'])
+        self.mock_agent.validate_agent_token.assert_called_once_with('token')
+
+        response = self.get_json('/executions?step=erase_devices')
+        self.assertEqual(['shred /dev/sda'],
+                         [entry['command']
+                          for entry in response.json['executions']])
+        self.assertEqual(['shred'], list(response.json['summary']))
+
+    def test_executions_token_invalid(self):
+        self.mock_agent.validate_agent_token.return_value = False
+        response = self.get_json('/executions', expect_errors=True)
+        self.assertEqual(401, response.status_code)
+
 
 class TestApplicationStart(ironic_agent_base.IronicAgentTest):
     """Tests for Application.start() method."""
@@ -0,0 +1,131 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import errno
+import os
+import shutil
+import stat
+import tempfile
+from unittest import mock
+
+from ironic_python_agent import disk_erase
+from ironic_python_agent import image_writer
+from ironic_python_agent.tests.unit import base
+
+
+@mock.patch.object(disk_erase, 'BUFFER_SIZE', 4096)
+class TestErase(base.IronicAgentTest):
+
+    def setUp(self):
+        super(TestErase, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.tempdir))
+        self.path = os.path.join(self.tempdir, 'device')
+        self.data = b'x' * (10 * 4096 + 512)
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+    def _read(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_erase(self):
+        callback = mock.Mock()
+        disk_erase.erase(self.path, iterations=2, streams=3,
+                         callback=callback)
+        self.assertEqual(bytes(len(self.data)), self._read())
+        callback.assert_called_with(bytes_written=3 * len(self.data),
+                                    total_bytes=3 * len(self.data),
+                                    throughput=mock.ANY)
+
+    @mock.patch.object(disk_erase, '_zero_pass', autospec=True)
+    def test_erase_no_zeroize(self, mock_zero):
+        disk_erase.erase(self.path, iterations=1, zeroize=False)
+        data = self._read()
+        self.assertEqual(len(self.data), len(data))
+        self.assertNotEqual(self.data, data)
+        self.assertNotEqual(bytes(len(self.data)), data)
+        mock_zero.assert_not_called()
+
+    def test_erase_zeroize_only(self):
+        disk_erase.erase(self.path, iterations=0, streams=16)
+        self.assertEqual(bytes(len(self.data)), self._read())
+
+    @mock.patch.object(image_writer, 'pwrite_all', autospec=True)
+    def test_erase_error(self, mock_pwrite):
+        mock_pwrite.side_effect = OSError(errno.EIO, 'I/O error')
+        self.assertRaises(OSError, disk_erase.erase, self.path)
+        self.assertEqual(self.data, self._read())
+
+    def test_erase_missing(self):
+        self.assertRaises(FileNotFoundError, disk_erase.erase,
+                          os.path.join(self.tempdir, 'missing'))
+
+
+@mock.patch.object(disk_erase, 'ZERO_RANGE_SIZE', 4096)
+@mock.patch.object(image_writer, 'write_zeroes_offloaded', autospec=True)
+@mock.patch.object(image_writer, 'zero_device_range', autospec=True)
+@mock.patch.object(disk_erase, '_write_pass', autospec=True)
+@mock.patch.object(os, 'fsync', autospec=True)
+@mock.patch.object(os, 'lseek', autospec=True)
+@mock.patch.object(os, 'fstat', autospec=True)
+@mock.patch.object(disk_erase, '_open', autospec=True)
+class TestEraseDevice(base.IronicAgentTest):
+
+    def _erase(self, mock_open, mock_fstat, mock_lseek):
+        fd = os.open(os.devnull, os.O_WRONLY)
+        mock_open.return_value = fd
+        mock_fstat.return_value = mock.Mock(st_mode=stat.S_IFBLK,
+                                            st_rdev=os.makedev(8, 0))
+        mock_lseek.return_value = 3 * 4096
+        callback = mock.Mock()
+        disk_erase.erase('/dev/sda', iterations=1, streams=2,
+                         callback=callback)
+        callback.assert_called_with(bytes_written=mock.ANY,
+                                    total_bytes=6 * 4096,
+                                    throughput=mock.ANY)
+        mock_lseek.assert_called_once_with(fd, 0, os.SEEK_END)
+        return fd
+
+    def test_zeroout(self, mock_open, mock_fstat, mock_lseek, mock_fsync,
+                     mock_write, mock_zero, mock_offloaded):
+        mock_offloaded.return_value = True
+        mock_zero.return_value = True
+        fd = self._erase(mock_open, mock_fstat, mock_lseek)
+        mock_write.assert_called_once_with(fd, 3 * 4096, 2, mock.ANY,
+                                           random_data=True)
+        self.assertCountEqual(
+            [mock.call(fd, offset, 4096) for offset in (0, 4096, 2 * 4096)],
+            mock_zero.call_args_list)
+        mock_fsync.assert_called_once_with(fd)
+        mock_offloaded.assert_called_once_with(os.makedev(8, 0))
+
+    def test_not_offloaded(self, mock_open, mock_fstat, mock_lseek,
+                           mock_fsync, mock_write, mock_zero,
+                           mock_offloaded):
+        mock_offloaded.return_value = False
+        fd = self._erase(mock_open, mock_fstat, mock_lseek)
+        mock_zero.assert_not_called()
+        mock_write.assert_has_calls([
+            mock.call(fd, 3 * 4096, 2, mock.ANY, random_data=True),
+            mock.call(fd, 3 * 4096, 2, mock.ANY, random_data=False)])
+
+    def test_not_supported(self, mock_open, mock_fstat, mock_lseek,
+                           mock_fsync, mock_write, mock_zero,
+                           mock_offloaded):
+        mock_offloaded.return_value = True
+        mock_zero.return_value = False
+        fd = self._erase(mock_open, mock_fstat, mock_lseek)
+        mock_zero.assert_called_once_with(fd, 0, 4096)
+        mock_write.assert_has_calls([
+            mock.call(fd, 3 * 4096, 2, mock.ANY, random_data=True),
+            mock.call(fd, 3 * 4096, 2, mock.ANY, random_data=False)])
@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import errno
 import json
 import os
 import stat
@@ -26,6 +27,7 @@ from oslo_utils import units
 
 from ironic_python_agent import disk_utils
 from ironic_python_agent import errors
+from ironic_python_agent import image_writer
 from ironic_python_agent import qemu_img
 from ironic_python_agent.tests.unit import base
 from ironic_python_agent import utils
@@ -531,6 +533,25 @@ class PopulateImageTestCase(base.IronicAgentTest):
         mock_dd.assert_called_once_with('src', 'dst', conv_flags=None)
         self.assertFalse(mock_cg.called)
 
+    @mock.patch.object(image_writer, 'copy_sparse', autospec=True)
+    def test_populate_raw_image_sparse(self, mock_copy, mock_cg, mock_dd):
+        self.config(image_write_sparse=True)
+        mock_copy.return_value = 42
+        disk_utils.populate_image('src', 'dst', source_format='raw',
+                                  is_raw=True)
+        mock_copy.assert_called_once_with('src', 'dst')
+        self.assertFalse(mock_dd.called)
+        self.assertFalse(mock_cg.called)
+
+    @mock.patch.object(image_writer, 'copy_sparse', autospec=True)
+    def test_populate_raw_image_sparse_fails(self, mock_copy, mock_cg,
+                                             mock_dd):
+        self.config(image_write_sparse=True)
+        mock_copy.side_effect = OSError(errno.EIO, 'I/O error')
+        self.assertRaisesRegex(errors.ImageWriteError, 'I/O error',
+                               disk_utils.populate_image, 'src', 'dst',
+                               is_raw=True)
+
     def test_populate_qcow2_image(self, mock_cg, mock_dd):
         source_format = 'qcow2'
         disk_utils.populate_image('src', 'dst',
@@ -114,6 +114,8 @@ class TestErrors(base.IronicAgentTest):
                   DIFF_CL_DETAILS),
                  (errors.BlockDeviceEraseError(DETAILS), SAME_DETAILS),
                  (errors.BlockDeviceError(DETAILS), SAME_DETAILS),
+                 (errors.InventoryCollectionError(DETAILS), SAME_DETAILS),
+                 (errors.IPMIError(DETAILS), SAME_DETAILS),
                  (errors.VirtualMediaBootError(DETAILS), SAME_DETAILS),
                  (errors.UnknownNodeError(), DEFAULT_DETAILS),
                  (errors.UnknownNodeError(DETAILS), SAME_DETAILS),
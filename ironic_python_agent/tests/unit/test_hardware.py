@@ -14,6 +14,7 @@
 
 import binascii
 from collections import namedtuple
+import errno
 import glob
 import json
 import logging
@@ -22,6 +23,8 @@ import re
 import shutil
 import socket
 import stat
+import tempfile
+import threading
 import time
 from unittest import mock
 
@@ -31,11 +34,14 @@ from oslo_utils import units
 import pyudev
 from stevedore import extension
 
+from ironic_python_agent import disk_erase
 from ironic_python_agent import disk_utils
 from ironic_python_agent import efi_utils
 from ironic_python_agent import errors
 from ironic_python_agent.extensions import base as ext_base
 from ironic_python_agent import hardware
+from ironic_python_agent import inventory_monitor
+from ironic_python_agent import ipmi
 from ironic_python_agent import netutils
 from ironic_python_agent import raid_utils
 from ironic_python_agent.tests.unit import base
@@ -151,6 +157,25 @@ BLK_DEVICE_TEMPLATE_PARTUUID_DEVICE = [
 ]
 
 
+def _sysfs_block_devices(knames, vendor='Super Vendor', hctl='1:0:0:0',
+                         multipath=None):
+    """Build a fake result of hardware._scan_sysfs_block_devices.
+
+    :param multipath: A dictionary mapping disks to the multipath device
+        holding them.
+    """
+    devices = {}
+    for kname in knames:
+        match = re.match(r'(sd[a-z]+)\d+$', kname)
+        devices[kname] = {'vendor': vendor, 'hctl': hctl, 'holders': [],
+                          'dm_uuid': None,
+                          'parent': match.group(1) if match else None}
+    for path, holder in (multipath or {}).items():
+        devices[path]['holders'].append(holder)
+        devices[holder]['dm_uuid'] = 'mpath-%s' % holder
+    return devices
+
+
 class FakeHardwareManager(hardware.HardwareManager):
     def evaluate_hardware_support(self):
         return self.support
@@ -253,6 +278,13 @@ class TestGenericHardwareManager(base.IronicAgentTest):
         self.get_managers = self.mock_get_managers.start()
         self.get_managers.return_value = [self.hardware]
 
+        self.udev_devices = mock.patch.object(
+            hardware, '_get_udev_block_devices', autospec=True).start()
+        self.udev_devices.return_value = {}
+        self.sysfs_devices = mock.patch.object(
+            hardware, '_scan_sysfs_block_devices', autospec=True).start()
+        self.sysfs_devices.return_value = {}
+
     def test_get_clean_steps(self):
         expected_clean_steps = [
             {
@@ -497,70 +529,17 @@ class TestGenericHardwareManager(base.IronicAgentTest):
         mocked_readlink.return_value = '../../sda'
         mocked_listdir.return_value = ['1:0:0:0']
         mock_cached_node.return_value = None
-        mocked_execute.side_effect = [
-            (hws.MULTIPATH_BLK_DEVICE_TEMPLATE, ''),
-            (hws.MULTIPATH_VALID_PATH % '/dev/sda', ''),
-            (hws.MULTIPATH_LINKS_DM % 'dm-0', ''),
-            (hws.MULTIPATH_VALID_PATH % '/dev/sda2', ''),
-            (hws.MULTIPATH_LINKS_DM % 'dm-0', ''),
-            (hws.MULTIPATH_VALID_PATH % '/dev/sda3', ''),
-            (hws.MULTIPATH_LINKS_DM % 'dm-0', ''),
-            (hws.MULTIPATH_VALID_PATH % '/dev/sda1', ''),
-            (hws.MULTIPATH_LINKS_DM % 'dm-0', ''),
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # dm-0
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # dm-4
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # dm-2
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # dm-3
-            (hws.MULTIPATH_VALID_PATH % '/dev/sdb', ''),
-            (hws.MULTIPATH_LINKS_DM % 'dm-0', ''),
-            (hws.MULTIPATH_VALID_PATH % '/dev/sdb2', ''),
-            (hws.MULTIPATH_LINKS_DM % 'dm-0', ''),
-            (hws.MULTIPATH_VALID_PATH % '/dev/sdb3', ''),
-            (hws.MULTIPATH_LINKS_DM % 'dm-0', ''),
-            (hws.MULTIPATH_VALID_PATH % '/dev/sdb1', ''),
-            (hws.MULTIPATH_LINKS_DM % 'dm-0', ''),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sdc'),  # sdc
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sdc1'),  # sdc1
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # dm-1
-        ]
-        expected = [
-            mock.call('lsblk', '-bia', '--json',
-                      '-oKNAME,MODEL,SIZE,ROTA,TYPE,UUID,PARTUUID,SERIAL,WWN,'
-                      'LOG-SEC,PHY-SEC,TRAN',
-                      check_exit_code=[0]),
-            mock.call('multipath', '-c', '/dev/sda'),
-            mock.call('multipath', '-ll', '/dev/sda'),
-            mock.call('multipath', '-c', '/dev/sda2'),
-            mock.call('multipath', '-ll', '/dev/sda2'),
-            mock.call('multipath', '-c', '/dev/sda3'),
-            mock.call('multipath', '-ll', '/dev/sda3'),
-            mock.call('multipath', '-c', '/dev/sda1'),
-            mock.call('multipath', '-ll', '/dev/sda1'),
-            mock.call('multipath', '-c', '/dev/dm-0'),
-            mock.call('multipath', '-c', '/dev/dm-4'),
-            mock.call('multipath', '-c', '/dev/dm-2'),
-            mock.call('multipath', '-c', '/dev/dm-3'),
-            mock.call('multipath', '-c', '/dev/sdb'),
-            mock.call('multipath', '-ll', '/dev/sdb'),
-            mock.call('multipath', '-c', '/dev/sdb2'),
-            mock.call('multipath', '-ll', '/dev/sdb2'),
-            mock.call('multipath', '-c', '/dev/sdb3'),
-            mock.call('multipath', '-ll', '/dev/sdb3'),
-            mock.call('multipath', '-c', '/dev/sdb1'),
-            mock.call('multipath', '-ll', '/dev/sdb1'),
-            mock.call('multipath', '-c', '/dev/sdc'),
-            mock.call('multipath', '-c', '/dev/sdc1'),
-            mock.call('multipath', '-c', '/dev/dm-1'),
-        ]
+        mocked_execute.return_value = (hws.MULTIPATH_BLK_DEVICE_TEMPLATE, '')
+        self.sysfs_devices.return_value = _sysfs_block_devices(
+            ['sda', 'sda1', 'sda2', 'sda3', 'sdb', 'sdb1', 'sdb2', 'sdb3',
+             'sdc', 'sdc1', 'dm-0', 'dm-1', 'dm-2', 'dm-3', 'dm-4'],
+            multipath={'sda': 'dm-0', 'sdb': 'dm-0'})
         self.assertEqual('/dev/dm-0', self.hardware.get_os_install_device())
-        mocked_execute.assert_has_calls(expected)
+        mocked_execute.assert_called_once_with(
+            'lsblk', '-bia', '--json',
+            '-oKNAME,MODEL,SIZE,ROTA,TYPE,UUID,PARTUUID,SERIAL,WWN,'
+            'LOG-SEC,PHY-SEC,TRAN',
+            check_exit_code=[0])
         mock_cached_node.assert_called_once_with()
 
     @mock.patch.object(hardware, 'get_multipath_status', autospec=True)
@@ -578,70 +557,17 @@ class TestGenericHardwareManager(base.IronicAgentTest):
         mock_cached_node.return_value = {'properties': {'root_device': hint},
                                          'uuid': 'node1',
                                          'instance_info': {}}
-        mocked_execute.side_effect = [
-            (hws.MULTIPATH_BLK_DEVICE_TEMPLATE, ''),
-            (hws.MULTIPATH_VALID_PATH % '/dev/sda', ''),
-            (hws.MULTIPATH_LINKS_DM % 'dm-0', ''),
-            (hws.MULTIPATH_VALID_PATH % '/dev/sda2', ''),
-            (hws.MULTIPATH_LINKS_DM % 'dm-0', ''),
-            (hws.MULTIPATH_VALID_PATH % '/dev/sda3', ''),
-            (hws.MULTIPATH_LINKS_DM % 'dm-0', ''),
-            (hws.MULTIPATH_VALID_PATH % '/dev/sda1', ''),
-            (hws.MULTIPATH_LINKS_DM % 'dm-0', ''),
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # dm-0
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # dm-4
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # dm-2
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # dm-3
-            (hws.MULTIPATH_VALID_PATH % '/dev/sdb', ''),
-            (hws.MULTIPATH_LINKS_DM % 'dm-0', ''),
-            (hws.MULTIPATH_VALID_PATH % '/dev/sdb2', ''),
-            (hws.MULTIPATH_LINKS_DM % 'dm-0', ''),
-            (hws.MULTIPATH_VALID_PATH % '/dev/sdb3', ''),
-            (hws.MULTIPATH_LINKS_DM % 'dm-0', ''),
-            (hws.MULTIPATH_VALID_PATH % '/dev/sdb1', ''),
-            (hws.MULTIPATH_LINKS_DM % 'dm-0', ''),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sdc'),  # sdc
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sdc1'),  # sdc1
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # dm-1
-        ]
-        expected = [
-            mock.call('lsblk', '-bia', '--json',
-                      '-oKNAME,MODEL,SIZE,ROTA,TYPE,UUID,PARTUUID,SERIAL,WWN,'
-                      'LOG-SEC,PHY-SEC,TRAN',
-                      check_exit_code=[0]),
-            mock.call('multipath', '-c', '/dev/sda'),
-            mock.call('multipath', '-ll', '/dev/sda'),
-            mock.call('multipath', '-c', '/dev/sda2'),
-            mock.call('multipath', '-ll', '/dev/sda2'),
-            mock.call('multipath', '-c', '/dev/sda3'),
-            mock.call('multipath', '-ll', '/dev/sda3'),
-            mock.call('multipath', '-c', '/dev/sda1'),
-            mock.call('multipath', '-ll', '/dev/sda1'),
-            mock.call('multipath', '-c', '/dev/dm-0'),
-            mock.call('multipath', '-c', '/dev/dm-4'),
-            mock.call('multipath', '-c', '/dev/dm-2'),
-            mock.call('multipath', '-c', '/dev/dm-3'),
-            mock.call('multipath', '-c', '/dev/sdb'),
-            mock.call('multipath', '-ll', '/dev/sdb'),
-            mock.call('multipath', '-c', '/dev/sdb2'),
-            mock.call('multipath', '-ll', '/dev/sdb2'),
-            mock.call('multipath', '-c', '/dev/sdb3'),
-            mock.call('multipath', '-ll', '/dev/sdb3'),
-            mock.call('multipath', '-c', '/dev/sdb1'),
-            mock.call('multipath', '-ll', '/dev/sdb1'),
-            mock.call('multipath', '-c', '/dev/sdc'),
-            mock.call('multipath', '-c', '/dev/sdc1'),
-            mock.call('multipath', '-c', '/dev/dm-1'),
-        ]
+        mocked_execute.return_value = (hws.MULTIPATH_BLK_DEVICE_TEMPLATE, '')
+        self.sysfs_devices.return_value = _sysfs_block_devices(
+            ['sda', 'sda1', 'sda2', 'sda3', 'sdb', 'sdb1', 'sdb2', 'sdb3',
+             'sdc', 'sdc1', 'dm-0', 'dm-1', 'dm-2', 'dm-3', 'dm-4'],
+            multipath={'sda': 'dm-0', 'sdb': 'dm-0'})
         self.assertEqual('/dev/sdc', self.hardware.get_os_install_device())
-        mocked_execute.assert_has_calls(expected)
+        mocked_execute.assert_called_once_with(
+            'lsblk', '-bia', '--json',
+            '-oKNAME,MODEL,SIZE,ROTA,TYPE,UUID,PARTUUID,SERIAL,WWN,'
+            'LOG-SEC,PHY-SEC,TRAN',
+            check_exit_code=[0])
         mock_cached_node.assert_called_once_with()
         mocked_mpath.assert_called_once_with()
 
@@ -1509,6 +1435,143 @@ class TestGenericHardwareManager(base.IronicAgentTest):
         self.assertEqual('mock_hostname', hardware_info['hostname'])
         mocked_lshw.assert_called_once_with(self.hardware)
 
+    @mock.patch.object(hardware.GenericHardwareManager,
+                       '_get_system_lshw_dict', autospec=True,
+                       return_value={'id': 'host'})
+    @mock.patch.object(netutils, 'get_hostname', autospec=True)
+    def test_list_hardware_info_concurrent(self, mocked_get_hostname,
+                                           mocked_lshw):
+        threads = set()
+
+        def _section(value):
+            def _collect():
+                # The lshw output is shared with the workers
+                self.assertEqual({'id': 'host'}, self.hardware._lshw_cache)
+                threads.add(threading.current_thread().name)
+                return value
+            return mock.Mock(side_effect=_collect)
+
+        self.hardware.list_network_interfaces = _section(
+            [hardware.NetworkInterface('eth0', '00:0c:29:8c:11:b1')])
+        self.hardware.get_cpus = _section(
+            hardware.CPU('Awesome CPU x14 9001', 9001, 14, 'x86_64'))
+        self.hardware.get_memory = _section(hardware.Memory(1017012))
+        self.hardware.list_block_devices = _section(
+            [hardware.BlockDevice('/dev/sdj', 'big', 1073741824, True)])
+        self.hardware.get_boot_info = _section(hardware.BootInfo(
+            current_boot_mode='bios', pxe_interface='boot:if'))
+        self.hardware.get_system_vendor_info = _section(
+            hardware.SystemVendorInfo('Virtual', '1234', 'Awesome', None))
+        self.hardware.get_bmc_address = _section('192.0.2.1')
+        self.hardware.get_bmc_v6address = _section('::/0')
+        self.hardware.get_bmc_mac = mock.Mock(return_value='aa:bb:cc:dd')
+        mocked_get_hostname.return_value = 'mock_hostname'
+
+        serial_info = self.hardware.list_hardware_info()
+        self.assertEqual({'MainThread'}, threads)
+        threads.clear()
+        self.config(inventory_collection_concurrency=4,
+                    inventory_collection_timeout=60)
+        concurrent_info = self.hardware.list_hardware_info()
+
+        self.assertEqual(serial_info, concurrent_info)
+        self.assertEqual(list(serial_info), list(concurrent_info))
+        self.assertNotIn('MainThread', threads)
+        self.assertEqual(2, mocked_lshw.call_count)
+        self.assertIsNone(self.hardware._lshw_cache)
+
+    @mock.patch.object(hardware.GenericHardwareManager,
+                       '_get_system_lshw_dict', autospec=True,
+                       return_value={'id': 'host'})
+    @mock.patch.object(netutils, 'get_hostname', autospec=True)
+    def test_list_hardware_info_concurrent_timeout(self, mocked_get_hostname,
+                                                   mocked_lshw):
+        unblock = threading.Event()
+        self.addCleanup(unblock.set)
+        self.hardware.list_network_interfaces = mock.Mock(return_value=[])
+        self.hardware.get_cpus = mock.Mock(
+            side_effect=lambda: unblock.wait(30))
+        self.hardware.get_memory = mock.Mock()
+        self.hardware.list_block_devices = mock.Mock(return_value=[])
+        self.hardware.get_boot_info = mock.Mock()
+        self.hardware.get_system_vendor_info = mock.Mock()
+        self.hardware.get_bmc_address = mock.Mock()
+        self.hardware.get_bmc_v6address = mock.Mock()
+        self.config(inventory_collection_concurrency=8,
+                    inventory_collection_timeout=1)
+
+        self.assertRaisesRegex(errors.InventoryCollectionError,
+                               'cpu section',
+                               self.hardware.list_hardware_info)
+        self.hardware.get_memory.assert_called_once_with()
+
+    @mock.patch.object(hardware.GenericHardwareManager,
+                       '_get_system_lshw_dict', autospec=True,
+                       return_value={'id': 'host'})
+    @mock.patch.object(netutils, 'get_hostname', autospec=True)
+    def test_list_hardware_info_concurrent_timeout_optional(
+            self, mocked_get_hostname, mocked_lshw):
+        unblock = threading.Event()
+        self.addCleanup(unblock.set)
+        self.hardware.list_network_interfaces = mock.Mock(return_value=[])
+        self.hardware.get_cpus = mock.Mock(return_value='cpu')
+        self.hardware.get_memory = mock.Mock(return_value='memory')
+        self.hardware.list_block_devices = mock.Mock(return_value=[])
+        self.hardware.get_boot_info = mock.Mock(return_value='boot')
+        self.hardware.get_system_vendor_info = mock.Mock(
+            return_value='vendor')
+        self.hardware.get_bmc_address = mock.Mock(
+            side_effect=lambda: unblock.wait(30))
+        self.hardware.get_bmc_v6address = mock.Mock()
+        self.hardware.get_bmc_mac = mock.Mock()
+        mocked_get_hostname.return_value = 'mock_hostname'
+        self.config(inventory_collection_concurrency=2,
+                    inventory_collection_timeout=1)
+
+        info = self.hardware.list_hardware_info()
+
+        self.assertIsNone(info['bmc_address'])
+        self.assertIsNone(info['bmc_v6address'])
+        self.assertNotIn('bmc_mac', info)
+        self.assertEqual(['bmc'], list(info['collection_errors']))
+        self.assertIn('bmc section', info['collection_errors']['bmc'])
+        self.assertEqual('cpu', info['cpu'])
+        self.assertEqual('vendor', info['system_vendor'])
+        self.assertEqual('boot', info['boot'])
+        self.assertEqual('mock_hostname', info['hostname'])
+        self.hardware.get_bmc_mac.assert_not_called()
+
+    @mock.patch.object(hardware.GenericHardwareManager,
+                       '_get_system_lshw_dict', autospec=True,
+                       return_value={'id': 'host'})
+    @mock.patch.object(netutils, 'get_hostname', autospec=True)
+    def test_list_hardware_info_concurrent_timeout_per_section(
+            self, mocked_get_hostname, mocked_lshw):
+        def _slow(value):
+            def _collect():
+                time.sleep(0.6)
+                return value
+            return mock.Mock(side_effect=_collect)
+
+        # Together the sections take longer than the timeout
+        self.hardware.list_network_interfaces = _slow([])
+        self.hardware.get_cpus = _slow('cpu')
+        self.hardware.get_memory = _slow('memory')
+        self.hardware.list_block_devices = _slow([])
+        self.hardware.get_boot_info = mock.Mock()
+        self.hardware.get_system_vendor_info = mock.Mock()
+        self.hardware.get_bmc_address = mock.Mock()
+        self.hardware.get_bmc_v6address = mock.Mock()
+        self.hardware.get_bmc_mac = mock.Mock()
+        self.config(inventory_collection_concurrency=2,
+                    inventory_collection_timeout=1)
+
+        info = self.hardware.list_hardware_info()
+
+        self.assertNotIn('collection_errors', info)
+        self.assertEqual('cpu', info['cpu'])
+        self.assertEqual('memory', info['memory'])
+
     @mock.patch.object(hardware, 'get_cached_node', autospec=True)
     @mock.patch.object(hardware.GenericHardwareManager,
                        '_get_system_lshw_dict', autospec=True,
@@ -1842,11 +1905,8 @@ class TestGenericHardwareManager(base.IronicAgentTest):
     @mock.patch.object(hardware, 'get_multipath_status', lambda *_: True)
     @mock.patch.object(os, 'readlink', autospec=True)
     @mock.patch.object(os, 'listdir', autospec=True)
-    @mock.patch.object(hardware, '_get_device_info', autospec=True)
-    @mock.patch.object(pyudev.Devices, 'from_device_file', autospec=False)
     @mock.patch.object(utils, 'execute', autospec=True)
-    def test_list_all_block_device(self, mocked_execute, mocked_udev,
-                                   mocked_dev_vendor, mock_listdir,
+    def test_list_all_block_device(self, mocked_execute, mock_listdir,
                                    mock_readlink):
         by_path_map = {
             '/dev/disk/by-path/1:0:0:0': '../../dev/sda',
@@ -1857,40 +1917,12 @@ class TestGenericHardwareManager(base.IronicAgentTest):
         mock_readlink.side_effect = lambda x, m=by_path_map: m[x]
         mock_listdir.return_value = [os.path.basename(x)
                                      for x in sorted(by_path_map)]
-        mocked_execute.side_effect = [
-            (hws.BLK_DEVICE_TEMPLATE, ''),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sda'),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sdb'),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sdc'),
-            # Pretend sdd is a multipath device... because why not.
-            (hws.MULTIPATH_VALID_PATH % '/dev/sdd', ''),
-            (hws.MULTIPATH_LINKS_DM % 'dm-0', ''),
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # loop0
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # zram0
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # ram0
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # ram1
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # ram2
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # ram3
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sdf'),
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # dm-0
-        ]
-        mocked_udev.side_effect = [pyudev.DeviceNotFoundByFileError(),
-                                   pyudev.DeviceNotFoundByNumberError('block',
-                                                                      1234),
-                                   pyudev.DeviceNotFoundByFileError(),
-                                   pyudev.DeviceNotFoundByFileError()]
-        mocked_dev_vendor.return_value = 'Super Vendor'
+        mocked_execute.return_value = (hws.BLK_DEVICE_TEMPLATE, '')
+        # Pretend sdd is a multipath device... because why not.
+        self.sysfs_devices.return_value = _sysfs_block_devices(
+            ['sda', 'sdb', 'sdc', 'sdd', 'loop0', 'zram0', 'ram0', 'ram1',
+             'ram2', 'ram3', 'fd1', 'sdf', 'dm-0'],
+            multipath={'sdd': 'dm-0'})
         devices = hardware.list_all_block_devices()
         expected_devices = [
             hardware.BlockDevice(name='/dev/sda',
@@ -1936,42 +1968,24 @@ class TestGenericHardwareManager(base.IronicAgentTest):
                          'wwn', 'vendor', 'serial', 'hctl']:
                 self.assertEqual(getattr(expected, attr),
                                  getattr(device, attr))
-        expected_calls = [mock.call('/sys/block/%s/device/scsi_device' % dev)
-                          for dev in ('sda', 'sdb', 'sdc', 'dm-0')]
-        mock_listdir.assert_has_calls(expected_calls)
+        mock_listdir.assert_called_once_with('/dev/disk/by-path')
 
         expected_calls = [mock.call('/dev/disk/by-path/1:0:0:%d' % dev)
                           for dev in range(3)]
         mock_readlink.assert_has_calls(expected_calls)
-        expected_calls = [
-            mock.call('lsblk', '-bia', '--json',
-                      '-oKNAME,MODEL,SIZE,ROTA,TYPE,UUID,PARTUUID,SERIAL,WWN,'
-                      'LOG-SEC,PHY-SEC,TRAN',
-                      check_exit_code=[0]),
-            mock.call('multipath', '-c', '/dev/sda'),
-            mock.call('multipath', '-c', '/dev/sdb'),
-            mock.call('multipath', '-c', '/dev/sdc'),
-            mock.call('multipath', '-c', '/dev/sdd'),
-            mock.call('multipath', '-ll', '/dev/sdd'),
-            mock.call('multipath', '-c', '/dev/loop0'),
-            mock.call('multipath', '-c', '/dev/zram0'),
-            mock.call('multipath', '-c', '/dev/ram0'),
-            mock.call('multipath', '-c', '/dev/ram1'),
-            mock.call('multipath', '-c', '/dev/ram2'),
-            mock.call('multipath', '-c', '/dev/ram3'),
-            mock.call('multipath', '-c', '/dev/sdf'),
-            mock.call('multipath', '-c', '/dev/dm-0')
-        ]
-        mocked_execute.assert_has_calls(expected_calls)
+        mocked_execute.assert_called_once_with(
+            'lsblk', '-bia', '--json',
+            '-oKNAME,MODEL,SIZE,ROTA,TYPE,UUID,PARTUUID,SERIAL,WWN,'
+            'LOG-SEC,PHY-SEC,TRAN',
+            check_exit_code=[0])
+        self.udev_devices.assert_called_once_with(mock.ANY)
+        self.sysfs_devices.assert_called_once_with()
 
     @mock.patch.object(hardware, 'get_multipath_status', lambda *_: True)
     @mock.patch.object(os, 'readlink', autospec=True)
     @mock.patch.object(os, 'listdir', autospec=True)
-    @mock.patch.object(hardware, '_get_device_info', autospec=True)
-    @mock.patch.object(pyudev.Devices, 'from_device_file', autospec=False)
     @mock.patch.object(utils, 'execute', autospec=True)
     def test_list_all_block_device_all_serial(self, mocked_execute,
-                                              mocked_udev, mocked_dev_vendor,
                                               mock_listdir, mock_readlink):
         by_path_map = {
             '/dev/disk/by-path/1:0:0:0': '../../dev/sda',
@@ -1982,44 +1996,24 @@ class TestGenericHardwareManager(base.IronicAgentTest):
         mock_readlink.side_effect = lambda x, m=by_path_map: m[x]
         mock_listdir.return_value = [os.path.basename(x)
                                      for x in sorted(by_path_map)]
-        mocked_execute.side_effect = [
-            (hws.BLK_DEVICE_TEMPLATE, ''),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sda'),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sdb'),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sdc'),
-            # Pretend sdd is a multipath device... because why not.
-            (hws.MULTIPATH_VALID_PATH % '/dev/sdd', ''),
-            (hws.MULTIPATH_LINKS_DM % 'dm-0', ''),
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # loop0
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # zram0
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # ram0
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # ram1
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # ram2
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # ram3
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sdf'),
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # dm-0
-        ]
-        mocked_udev.side_effect = [
-            {'ID_WWN': 'badwwn%d' % i, 'ID_SERIAL_SHORT': 'badserial%d' % i,
-             'ID_SERIAL': 'longserial%d' % i,
-             'ID_WWN_WITH_EXTENSION': 'wwn-ext%d' % i,
-             'ID_WWN_VENDOR_EXTENSION': 'wwn-vendor-ext%d' % i}
-            for i in range(3)
-        ] + [
-            {'DM_WWN': 'wwn3', 'DM_SERIAL': 'serial3'}
-        ]
-        mocked_dev_vendor.return_value = 'Super Vendor'
+        mocked_execute.return_value = (hws.BLK_DEVICE_TEMPLATE, '')
+        # Pretend sdd is a multipath device... because why not.
+        self.sysfs_devices.return_value = _sysfs_block_devices(
+            ['sda', 'sdb', 'sdc', 'sdd', 'loop0', 'zram0', 'ram0', 'ram1',
+             'ram2', 'ram3', 'fd1', 'sdf', 'dm-0'],
+            multipath={'sdd': 'dm-0'})
+        self.udev_devices.return_value = dict(zip(
+            ['/dev/sda', '/dev/sdb', '/dev/sdc', '/dev/dm-0'],
+            [
+                {'ID_WWN': 'badwwn%d' % i,
+                 'ID_SERIAL_SHORT': 'badserial%d' % i,
+                 'ID_SERIAL': 'longserial%d' % i,
+                 'ID_WWN_WITH_EXTENSION': 'wwn-ext%d' % i,
+                 'ID_WWN_VENDOR_EXTENSION': 'wwn-vendor-ext%d' % i}
+                for i in range(3)
+            ] + [
+                {'DM_WWN': 'wwn3', 'DM_SERIAL': 'serial3'}
+            ]))
         devices = hardware.list_all_block_devices(all_serial_and_wwn=True)
         expected_devices = [
             hardware.BlockDevice(name='/dev/sda',
@@ -2069,125 +2063,65 @@ class TestGenericHardwareManager(base.IronicAgentTest):
                          'wwn', 'vendor', 'serial', 'hctl']:
                 self.assertEqual(getattr(expected, attr),
                                  getattr(device, attr))
-        expected_calls = [mock.call('/sys/block/%s/device/scsi_device' % dev)
-                          for dev in ('sda', 'sdb', 'sdc', 'dm-0')]
-        mock_listdir.assert_has_calls(expected_calls)
+        mock_listdir.assert_called_once_with('/dev/disk/by-path')
 
         expected_calls = [mock.call('/dev/disk/by-path/1:0:0:%d' % dev)
                           for dev in range(3)]
         mock_readlink.assert_has_calls(expected_calls)
-        expected_calls = [
-            mock.call('lsblk', '-bia', '--json',
-                      '-oKNAME,MODEL,SIZE,ROTA,TYPE,UUID,PARTUUID,SERIAL,WWN,'
-                      'LOG-SEC,PHY-SEC,TRAN',
-                      check_exit_code=[0]),
-            mock.call('multipath', '-c', '/dev/sda'),
-            mock.call('multipath', '-c', '/dev/sdb'),
-            mock.call('multipath', '-c', '/dev/sdc'),
-            mock.call('multipath', '-c', '/dev/sdd'),
-            mock.call('multipath', '-ll', '/dev/sdd'),
-            mock.call('multipath', '-c', '/dev/loop0'),
-            mock.call('multipath', '-c', '/dev/zram0'),
-            mock.call('multipath', '-c', '/dev/ram0'),
-            mock.call('multipath', '-c', '/dev/ram1'),
-            mock.call('multipath', '-c', '/dev/ram2'),
-            mock.call('multipath', '-c', '/dev/ram3'),
-            mock.call('multipath', '-c', '/dev/sdf'),
-            mock.call('multipath', '-c', '/dev/dm-0')
-        ]
-        mocked_execute.assert_has_calls(expected_calls)
+        mocked_execute.assert_called_once_with(
+            'lsblk', '-bia', '--json',
+            '-oKNAME,MODEL,SIZE,ROTA,TYPE,UUID,PARTUUID,SERIAL,WWN,'
+            'LOG-SEC,PHY-SEC,TRAN',
+            check_exit_code=[0])
+        self.udev_devices.assert_called_once_with(mock.ANY)
+        self.sysfs_devices.assert_called_once_with()
 
     @mock.patch.object(hardware, 'get_multipath_status', autospec=True)
     @mock.patch.object(os, 'listdir', autospec=True)
-    @mock.patch.object(hardware, '_get_device_info', autospec=True)
-    @mock.patch.object(pyudev.Devices, 'from_device_file', autospec=False)
     @mock.patch.object(utils, 'execute', autospec=True)
-    def test_list_all_block_device_hctl_fail(self, mocked_execute, mocked_udev,
-                                             mocked_dev_vendor,
+    def test_list_all_block_device_hctl_fail(self, mocked_execute,
                                              mocked_listdir,
                                              mocked_mpath):
-        mocked_listdir.side_effect = (OSError, OSError, IndexError)
+        mocked_listdir.side_effect = OSError
         mocked_mpath.return_value = False
         mocked_execute.return_value = (hws.BLK_DEVICE_TEMPLATE_SMALL, '')
-        mocked_dev_vendor.return_value = 'Super Vendor'
+        self.sysfs_devices.return_value = _sysfs_block_devices(
+            ['sda', 'sdb'], hctl=None)
         devices = hardware.list_all_block_devices()
         self.assertEqual(2, len(devices))
-        expected_calls = [
-            mock.call('/dev/disk/by-path'),
-            mock.call('/sys/block/sda/device/scsi_device'),
-            mock.call('/sys/block/sdb/device/scsi_device')
-        ]
-        self.assertEqual(expected_calls, mocked_listdir.call_args_list)
+        self.assertEqual([None, None], [dev.hctl for dev in devices])
+        self.assertEqual(['Super Vendor', 'Super Vendor'],
+                         [dev.vendor for dev in devices])
+        mocked_listdir.assert_called_once_with('/dev/disk/by-path')
 
     @mock.patch.object(hardware, 'get_multipath_status', autospec=True)
     @mock.patch.object(os, 'readlink', autospec=True)
     @mock.patch.object(os, 'listdir', autospec=True)
-    @mock.patch.object(hardware, '_get_device_info', autospec=True)
-    @mock.patch.object(pyudev.Devices, 'from_device_file', autospec=False)
     @mock.patch.object(utils, 'execute', autospec=True)
-    def test_list_all_block_device_with_udev(self, mocked_execute, mocked_udev,
-                                             mocked_dev_vendor, mocked_listdir,
-                                             mocked_readlink, mocked_mpath):
+    def test_list_all_block_device_with_udev(self, mocked_execute,
+                                             mocked_listdir, mocked_readlink,
+                                             mocked_mpath):
         mocked_readlink.return_value = '../../sda'
         mocked_listdir.return_value = ['1:0:0:0']
-        mocked_execute.side_effect = [
-            (hws.BLK_DEVICE_TEMPLATE, ''),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sda'),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sdb'),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sdc'),
-            # Pretend sdd is a multipath device... because why not.
-            (hws.MULTIPATH_VALID_PATH % '/dev/sdd', ''),
-            (hws.MULTIPATH_LINKS_DM % 'dm-0', ''),
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # loop0
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # zram0
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # ram0
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # ram1
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # ram2
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # ram3
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sdf'),
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # dm-0
-            ('', ''),
-            ('', ''),
-            ('', ''),
-            ('', ''),
-            ('', ''),
-            ('', ''),
-            ('', ''),
-            ('', ''),
-            ('', ''),
-            ('', ''),
-            ('', ''),
-            ('', ''),
-            ('', ''),
-            ('', ''),
-            ('', ''),
-            ('', ''),
-            ('', ''),
-            ('', ''),
-        ]
+        mocked_execute.return_value = (hws.BLK_DEVICE_TEMPLATE, '')
+        # Pretend sdd is a multipath device... because why not.
+        self.sysfs_devices.return_value = _sysfs_block_devices(
+            ['sda', 'sdb', 'sdc', 'sdd', 'loop0', 'zram0', 'ram0', 'ram1',
+             'ram2', 'ram3', 'fd1', 'sdf', 'dm-0'],
+            multipath={'sdd': 'dm-0'})
 
         mocked_mpath.return_value = True
-        mocked_udev.side_effect = [
-            {'ID_WWN': 'wwn%d' % i, 'ID_SERIAL_SHORT': 'serial%d' % i,
-             'ID_SERIAL': 'do not use me',
-             'ID_WWN_WITH_EXTENSION': 'wwn-ext%d' % i,
-             'ID_WWN_VENDOR_EXTENSION': 'wwn-vendor-ext%d' % i}
-            for i in range(3)
-        ] + [
-            {'DM_WWN': 'wwn3', 'DM_SERIAL': 'serial3'}
-        ]
-        mocked_dev_vendor.return_value = 'Super Vendor'
+        self.udev_devices.return_value = dict(zip(
+            ['/dev/sda', '/dev/sdb', '/dev/sdc', '/dev/dm-0'],
+            [
+                {'ID_WWN': 'wwn%d' % i, 'ID_SERIAL_SHORT': 'serial%d' % i,
+                 'ID_SERIAL': 'do not use me',
+                 'ID_WWN_WITH_EXTENSION': 'wwn-ext%d' % i,
+                 'ID_WWN_VENDOR_EXTENSION': 'wwn-vendor-ext%d' % i}
+                for i in range(3)
+            ] + [
+                {'DM_WWN': 'wwn3', 'DM_SERIAL': 'serial3'}
+            ]))
         devices = hardware.list_all_block_devices()
         expected_devices = [
             hardware.BlockDevice(name='/dev/sda',
@@ -2240,42 +2174,33 @@ class TestGenericHardwareManager(base.IronicAgentTest):
                          'wwn_vendor_extension', 'hctl']:
                 self.assertEqual(getattr(expected, attr),
                                  getattr(device, attr))
-        expected_calls = [mock.call('/sys/block/%s/device/scsi_device' % dev)
-                          for dev in ('sda', 'sdb', 'sdc', 'dm-0')]
-        mocked_listdir.assert_has_calls(expected_calls)
+        mocked_listdir.assert_called_once_with('/dev/disk/by-path')
         mocked_mpath.assert_called_once_with()
 
     @mock.patch.object(hardware, 'get_multipath_status', autospec=True)
     @mock.patch.object(os, 'readlink', autospec=True)
     @mock.patch.object(os, 'listdir', autospec=True)
-    @mock.patch.object(hardware, '_get_device_info', autospec=True)
-    @mock.patch.object(pyudev.Devices, 'from_device_file', autospec=False)
     @mock.patch.object(utils, 'execute', autospec=True)
     def test_list_all_block_device_with_only_udev(self,
                                                   mocked_execute,
-                                                  mocked_udev,
-                                                  mocked_dev_vendor,
                                                   mocked_listdir,
                                                   mocked_readlink,
                                                   mocked_mpath):
         mocked_readlink.return_value = '../../sda'
         mocked_listdir.return_value = ['1:0:0:0']
-        mocked_execute.side_effect = [
-            (hws.BLK_INCOMPLETE_DEVICE_TEMPLATE_SMALL, ''),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sda'),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sdb'),
-        ]
+        mocked_execute.return_value = (
+            hws.BLK_INCOMPLETE_DEVICE_TEMPLATE_SMALL, '')
+        self.sysfs_devices.return_value = _sysfs_block_devices(['sda', 'sdb'])
 
         mocked_mpath.return_value = True
-        mocked_udev.side_effect = [
-            {'ID_WWN': 'wwn%d' % i, 'ID_SERIAL_SHORT': 'serial%d' % i,
-             'ID_SERIAL': 'do not use me',
-             'ID_WWN_WITH_EXTENSION': 'wwn-ext%d' % i,
-             'ID_WWN_VENDOR_EXTENSION': 'wwn-vendor-ext%d' % i}
-            for i in range(2)
-        ]
+        self.udev_devices.return_value = {
+            '/dev/sd%s' % letter: {
+                'ID_WWN': 'wwn%d' % i, 'ID_SERIAL_SHORT': 'serial%d' % i,
+                'ID_SERIAL': 'do not use me',
+                'ID_WWN_WITH_EXTENSION': 'wwn-ext%d' % i,
+                'ID_WWN_VENDOR_EXTENSION': 'wwn-vendor-ext%d' % i}
+            for i, letter in enumerate('ab')
+        }
         devices = hardware.list_all_block_devices()
         expected_devices = [
             hardware.BlockDevice(name='/dev/sda',
@@ -2306,9 +2231,7 @@ class TestGenericHardwareManager(base.IronicAgentTest):
                          'wwn_vendor_extension', 'hctl']:
                 self.assertEqual(getattr(expected, attr),
                                  getattr(device, attr))
-        expected_calls = [mock.call('/sys/block/%s/device/scsi_device' % dev)
-                          for dev in ('sda', 'sdb')]
-        mocked_listdir.assert_has_calls(expected_calls)
+        mocked_listdir.assert_called_once_with('/dev/disk/by-path')
         mocked_mpath.assert_called_once_with()
 
     @mock.patch.object(hardware, 'safety_check_block_device', autospec=True)
@@ -2391,7 +2314,8 @@ class TestGenericHardwareManager(base.IronicAgentTest):
 
         result = self.hardware.erase_devices(self.node, [])
 
-        calls = [mock.call(mock.ANY, mocked_dispatch, ('erase_block_device',),
+        calls = [mock.call(mock.ANY, mock.ANY,
+                           (dev.name, mocked_dispatch, 'erase_block_device'),
                            {'node': self.node, 'block_device': dev})
                  for dev in (blkdev1, blkdev2)]
         mocked_async.assert_has_calls(calls)
@@ -2401,6 +2325,25 @@ class TestGenericHardwareManager(base.IronicAgentTest):
             mock.call(self.node, '/dev/hdaa'),
         ])
 
+    @mock.patch.object(hardware, 'safety_check_block_device', autospec=True)
+    @mock.patch.object(hardware, 'dispatch_to_managers', autospec=True)
+    def test_erase_devices_execution_step(self, mocked_dispatch,
+                                          mock_safety_check):
+        self.node['driver_internal_info']['disk_erasure_concurrency'] = 2
+        steps = []
+        mocked_dispatch.side_effect = lambda *args, **kwargs: steps.append(
+            getattr(utils._EXECUTION_STEP, 'name', None))
+        self.hardware.list_block_devices = mock.Mock()
+        self.hardware.list_block_devices.return_value = [
+            hardware.BlockDevice('/dev/sdj', 'big', 1073741824, True),
+            hardware.BlockDevice('/dev/hdaa', 'small', 65535, False),
+        ]
+
+        with utils.execution_step('erase_devices'):
+            self.hardware.erase_devices(self.node, [])
+
+        self.assertEqual(['erase_devices', 'erase_devices'], steps)
+
     @mock.patch.object(hardware, 'safety_check_block_device', autospec=True)
     @mock.patch.object(hardware, 'ThreadPool', autospec=True)
     def test_erase_devices_concurrency_pool_size(self, mocked_pool,
@@ -2773,6 +2716,66 @@ class TestGenericHardwareManager(base.IronicAgentTest):
             'shred', '--force', '--zero', '--verbose', '--iterations', '1',
             '/dev/sda')
 
+    @mock.patch.object(disk_erase, 'erase', autospec=True)
+    def test_erase_block_device_native(self, mock_erase):
+        CONF.set_override('disk_erase_streams', 8)
+        self.node['driver_internal_info'].update(
+            agent_erase_devices_iterations=2,
+            agent_erase_devices_zeroize=False)
+        block_device = hardware.BlockDevice('/dev/sda', 'big', 1073741824,
+                                            True)
+        res = self.hardware._native_erase_block_device(self.node,
+                                                       block_device)
+        self.assertTrue(res)
+        mock_erase.assert_called_once_with(
+            '/dev/sda', iterations=2, zeroize=False, streams=8,
+            callback=hardware._report_erase_progress)
+
+    @mock.patch.object(disk_erase, 'erase', autospec=True)
+    def test_erase_block_device_native_fail(self, mock_erase):
+        mock_erase.side_effect = OSError(errno.EIO, 'boom')
+        block_device = hardware.BlockDevice('/dev/sda', 'big', 1073741824,
+                                            True)
+        res = self.hardware._native_erase_block_device(self.node,
+                                                       block_device)
+        self.assertFalse(res)
+        mock_erase.assert_called_once_with(
+            '/dev/sda', iterations=1, zeroize=True, streams=4,
+            callback=hardware._report_erase_progress)
+
+    @mock.patch.object(hardware.GenericHardwareManager,
+                       '_shred_block_device', autospec=True)
+    @mock.patch.object(hardware.GenericHardwareManager,
+                       '_native_erase_block_device', autospec=True)
+    @mock.patch.object(hardware.GenericHardwareManager,
+                       '_ata_erase', autospec=True)
+    @mock.patch.object(hardware.GenericHardwareManager,
+                       '_is_nvme', autospec=True)
+    @mock.patch.object(hardware.GenericHardwareManager,
+                       '_is_read_only_device', autospec=True)
+    @mock.patch.object(hardware.GenericHardwareManager,
+                       '_is_virtual_media_device', autospec=True)
+    @mock.patch.object(hardware.GenericHardwareManager,
+                       '_is_linux_raid_member', autospec=True)
+    def test_erase_block_device_native_method(
+            self, mocked_raid_member, mocked_vm_member, mocked_ro_device,
+            mocked_nvme, mocked_ata_erase, mocked_native, mocked_shred):
+        CONF.set_override('disk_erase_method', 'native')
+        mocked_raid_member.return_value = False
+        mocked_vm_member.return_value = False
+        mocked_ro_device.return_value = False
+        mocked_nvme.return_value = False
+        mocked_ata_erase.return_value = False
+        mocked_native.return_value = True
+        block_device = hardware.BlockDevice('/dev/sda', 'big', 1073741824,
+                                            True)
+
+        self.hardware.erase_block_device(self.node, block_device)
+
+        mocked_native.assert_called_once_with(self.hardware, self.node,
+                                              block_device)
+        mocked_shred.assert_not_called()
+
     @mock.patch.object(hardware.GenericHardwareManager,
                        '_is_read_only_device', autospec=True)
     @mock.patch.object(hardware.GenericHardwareManager,
@@ -3406,6 +3409,66 @@ class TestGenericHardwareManager(base.IronicAgentTest):
             mock.call(self.node, '/dev/sda')
         ])
 
+    @mock.patch.object(ext_base, 'get_current_command', autospec=True)
+    @mock.patch.object(hardware, 'safety_check_block_device', autospec=True)
+    @mock.patch.object(hardware.GenericHardwareManager,
+                       '_list_erasable_devices', autospec=True)
+    @mock.patch.object(disk_utils, 'destroy_disk_metadata', autospec=True)
+    def test_erase_devices_metadata_concurrency(
+            self, mock_metadata, mock_list_erasable, mock_safety_check,
+            mock_get_command):
+        self.node['driver_internal_info']['disk_erasure_concurrency'] = 4
+        block_devices = [
+            hardware.BlockDevice('/dev/sdb', 'big', 10737418240, True),
+            hardware.BlockDevice('/dev/sda1', '', 32767, False),
+            hardware.BlockDevice('/dev/sda', 'small', 65535, False),
+            hardware.BlockDevice('/dev/nvme0n1p1', '', 32767, False),
+            hardware.BlockDevice('/dev/nvme0n1', 'nvme', 65535, False),
+        ]
+        mock_list_erasable.return_value = block_devices
+        order = []
+        mock_metadata.side_effect = lambda dev, uuid: order.append(dev)
+
+        with mock.patch.object(hardware, 'ThreadPool',
+                               side_effect=hardware.ThreadPool) as mock_pool:
+            self.hardware.erase_devices_metadata(self.node, [])
+
+        mock_pool.assert_called_once_with(3)
+        self.assertCountEqual([dev.name for dev in block_devices], order)
+        self.assertLess(order.index('/dev/sda1'), order.index('/dev/sda'))
+        self.assertLess(order.index('/dev/nvme0n1p1'),
+                        order.index('/dev/nvme0n1'))
+        command = mock_get_command.return_value
+        progress = command.update_progress.call_args[1]
+        self.assertEqual({dev.name for dev in block_devices},
+                         set(progress['devices']))
+        for device in progress['devices'].values():
+            self.assertEqual('done', device['status'])
+
+    @mock.patch.object(hardware, 'safety_check_block_device', autospec=True)
+    @mock.patch.object(hardware.GenericHardwareManager,
+                       '_list_erasable_devices', autospec=True)
+    @mock.patch.object(disk_utils, 'destroy_disk_metadata', autospec=True)
+    def test_erase_devices_metadata_concurrency_error(
+            self, mock_metadata, mock_list_erasable, mock_safety_check):
+        self.node['driver_internal_info']['disk_erasure_concurrency'] = 2
+        mock_list_erasable.return_value = [
+            hardware.BlockDevice('/dev/sdb', 'big', 10737418240, True),
+            hardware.BlockDevice('/dev/sda', 'small', 65535, False),
+        ]
+
+        def _destroy(dev, uuid):
+            if dev == '/dev/sdb':
+                raise processutils.ProcessExecutionError('boom')
+
+        mock_metadata.side_effect = _destroy
+
+        self.assertRaisesRegex(errors.BlockDeviceEraseError,
+                               '(?s)/dev/sdb.*boom',
+                               self.hardware.erase_devices_metadata,
+                               self.node, [])
+        self.assertEqual(2, mock_metadata.call_count)
+
     @mock.patch.object(utils, 'execute', autospec=True)
     def test__is_linux_raid_member(self, mocked_execute):
         raid_member = hardware.BlockDevice('/dev/sda1', 'small', 65535, False)
@@ -3920,6 +3983,82 @@ class TestGenericHardwareManager(base.IronicAgentTest):
         self.assertIsNone(self.hardware.get_bmc_v6address())
         mock_execute.assert_not_called()
 
+    def _native_lan_configs(self):
+        return [
+            ipmi.LanConfig(1, ip_address='0.0.0.0',
+                           mac_address='00:00:00:00:00:00',
+                           addressing='ipv4'),
+            ipmi.LanConfig(2, ip_address='0.0.0.0',
+                           mac_address='aa:bb:cc:dd:ee:10',
+                           addressing='both', ipv6_addresses=[
+                               ipmi.IPv6Address('::', 64,
+                                                ipmi.IPV6_SOURCE_STATIC,
+                                                False, 1),
+                               ipmi.IPv6Address('2001:db8::1', 64,
+                                                ipmi.IPV6_SOURCE_STATIC,
+                                                True, 0),
+                               ipmi.IPv6Address('2001:db8::2', 64,
+                                                ipmi.IPV6_SOURCE_SLAAC,
+                                                True, 0)]),
+            ipmi.LanConfig(3, ip_address='192.0.2.1',
+                           mac_address='aa:bb:cc:dd:ee:0f',
+                           addressing='ipv4'),
+        ]
+
+    @mock.patch.object(ipmi, 'get_lan_configs', autospec=True)
+    @mock.patch.object(ipmi, 'Session', autospec=True)
+    @mock.patch.object(hardware.GenericHardwareManager,
+                       'any_ipmi_device_exists', autospec=True)
+    @mock.patch.object(utils, 'execute', autospec=True)
+    def test_get_bmc_native(self, mock_execute, mock_ipmi_device_exists,
+                            mock_session, mock_get_lan_configs):
+        self.config(ipmi_native_client=True)
+        mock_get_lan_configs.return_value = self._native_lan_configs()
+
+        self.assertEqual('192.0.2.1', self.hardware.get_bmc_address())
+        self.assertEqual('aa:bb:cc:dd:ee:10', self.hardware.get_bmc_mac())
+        self.assertEqual('2001:db8::2', self.hardware.get_bmc_v6address())
+        session = mock_session.return_value.__enter__.return_value
+        mock_get_lan_configs.assert_has_calls([
+            mock.call(session, ipv6=False),
+            mock.call(session, ipv6=True),
+            mock.call(session, ipv6=True)])
+        mock_execute.assert_not_called()
+
+    @mock.patch.object(ipmi, 'get_lan_configs', autospec=True)
+    @mock.patch.object(ipmi, 'Session', autospec=True)
+    @mock.patch.object(hardware.GenericHardwareManager,
+                       'any_ipmi_device_exists', autospec=True)
+    @mock.patch.object(utils, 'execute', autospec=True)
+    def test_get_bmc_native_not_configured(self, mock_execute,
+                                           mock_ipmi_device_exists,
+                                           mock_session,
+                                           mock_get_lan_configs):
+        self.config(ipmi_native_client=True)
+        mock_get_lan_configs.return_value = [
+            ipmi.LanConfig(1, ip_address='0.0.0.0', addressing='ipv4')]
+
+        self.assertEqual('0.0.0.0', self.hardware.get_bmc_address())
+        self.assertRaises(errors.IncompatibleHardwareMethodError,
+                          self.hardware.get_bmc_mac)
+        self.assertEqual('::/0', self.hardware.get_bmc_v6address())
+        mock_execute.assert_not_called()
+
+    @mock.patch.object(ipmi, 'Session', autospec=True)
+    @mock.patch.object(hardware.GenericHardwareManager,
+                       'any_ipmi_device_exists', autospec=True)
+    @mock.patch.object(utils, 'execute', autospec=True)
+    def test_get_bmc_address_native_fallback(self, mocked_execute,
+                                             mock_ipmi_device_exists,
+                                             mock_session):
+        self.config(ipmi_native_client=True)
+        mock_session.side_effect = errors.IPMIError('no IPMI device found')
+        mocked_execute.return_value = '192.1.2.3\n', ''
+        self.assertEqual('192.1.2.3', self.hardware.get_bmc_address())
+        mocked_execute.assert_called_once_with(
+            "ipmitool lan print 1 | awk '/IP Address[ \\t]*:/ {print $4}'",
+            shell=True)
+
     @mock.patch.object(efi_utils, 'clean_boot_records', autospec=True)
     def test_clean_uefi_nvram_defaults(self, mock_efi_utils):
         self.hardware.clean_uefi_nvram(self.node, [])
@@ -7456,124 +7595,106 @@ class TestInitializeSupport(base.IronicAgentTest):
 @mock.patch.object(utils, 'execute', autospec=True)
 class TestModuleFunctions(base.IronicAgentTest):
 
+    def setUp(self):
+        super(TestModuleFunctions, self).setUp()
+        self.udev_devices = mock.patch.object(
+            hardware, '_get_udev_block_devices', autospec=True).start()
+        self.udev_devices.return_value = {}
+        self.sysfs_devices = mock.patch.object(
+            hardware, '_scan_sysfs_block_devices', autospec=True).start()
+        self.sysfs_devices.return_value = {}
+
     @mock.patch.object(hardware, 'get_multipath_status', autospec=True)
     @mock.patch.object(os, 'readlink', autospec=True)
-    @mock.patch.object(hardware, '_get_device_info',
-                       lambda x, y, z: 'FooTastic')
     @mock.patch.object(disk_utils, 'udev_settle', autospec=True)
-    @mock.patch.object(hardware.pyudev.Devices, "from_device_file",
-                       autospec=False)
-    def test_list_all_block_devices_success(self, mocked_fromdevfile,
-                                            mocked_udev, mocked_readlink,
+    def test_list_all_block_devices_success(self, mocked_udev, mocked_readlink,
                                             mocked_mpath, mocked_execute):
         mocked_mpath.return_value = True
         mocked_readlink.return_value = '../../sda'
-        mocked_fromdevfile.return_value = {}
-        mocked_execute.side_effect = [
-            (hws.BLK_DEVICE_TEMPLATE_SMALL, ''),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sda'),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sdb'),
-        ]
+        mocked_execute.return_value = (hws.BLK_DEVICE_TEMPLATE_SMALL, '')
+        self.sysfs_devices.return_value = _sysfs_block_devices(
+            ['sda', 'sdb'], vendor='FooTastic', hctl=None)
         result = hardware.list_all_block_devices()
-        expected_calls = [
-            mock.call('lsblk', '-bia', '--json',
-                      '-oKNAME,MODEL,SIZE,ROTA,TYPE,UUID,PARTUUID,SERIAL,WWN,'
-                      'LOG-SEC,PHY-SEC,TRAN',
-                      check_exit_code=[0]),
-            mock.call('multipath', '-c', '/dev/sda'),
-            mock.call('multipath', '-c', '/dev/sdb')
-        ]
-
-        mocked_execute.assert_has_calls(expected_calls)
+        mocked_execute.assert_called_once_with(
+            'lsblk', '-bia', '--json',
+            '-oKNAME,MODEL,SIZE,ROTA,TYPE,UUID,PARTUUID,SERIAL,WWN,'
+            'LOG-SEC,PHY-SEC,TRAN',
+            check_exit_code=[0])
         self.assertEqual(BLK_DEVICE_TEMPLATE_SMALL_DEVICES, result)
         mocked_udev.assert_called_once_with()
         mocked_mpath.assert_called_once_with()
 
+    @mock.patch.object(inventory_monitor, 'get_monitor', autospec=True)
     @mock.patch.object(hardware, 'get_multipath_status', autospec=True)
     @mock.patch.object(os, 'readlink', autospec=True)
-    @mock.patch.object(hardware, '_get_device_info',
-                       lambda x, y, z: 'FooTastic')
     @mock.patch.object(disk_utils, 'udev_settle', autospec=True)
-    @mock.patch.object(hardware.pyudev.Devices, "from_device_file",
-                       autospec=False)
-    def test_list_all_block_devices_success_raid(self, mocked_fromdevfile,
-                                                 mocked_udev, mocked_readlink,
+    def test_list_all_block_devices_monitor(self, mocked_udev,
+                                            mocked_readlink, mocked_mpath,
+                                            mocked_get_monitor,
+                                            mocked_execute):
+        mocked_mpath.return_value = False
+        mocked_readlink.return_value = '../../sda'
+        mocked_execute.return_value = (hws.BLK_DEVICE_TEMPLATE_SMALL, '')
+        self.sysfs_devices.return_value = _sysfs_block_devices(
+            ['sda', 'sdb'], vendor='FooTastic', hctl=None)
+        monitor = mocked_get_monitor.return_value
+        monitor.cached.side_effect = lambda key, subsystems, func: func()
+
+        result = hardware.list_all_block_devices(block_type=['disk'])
+        self.assertEqual(BLK_DEVICE_TEMPLATE_SMALL_DEVICES, result)
+        monitor.cached.assert_called_once_with(
+            ('block_devices', ('disk',), False, True, True, False, False),
+            ['block'], mock.ANY)
+        # Only before reading the events, not again before running lsblk
+        mocked_udev.assert_called_once_with()
+        mocked_execute.assert_called_once()
+
+        monitor.cached.side_effect = None
+        monitor.cached.return_value = result
+        cached = hardware.list_all_block_devices()
+        self.assertEqual(result, cached)
+        self.assertIsNot(result, cached)
+        mocked_execute.assert_called_once()
+        self.assertEqual(2, mocked_udev.call_count)
+
+    @mock.patch.object(hardware, 'get_multipath_status', autospec=True)
+    @mock.patch.object(os, 'readlink', autospec=True)
+    @mock.patch.object(disk_utils, 'udev_settle', autospec=True)
+    def test_list_all_block_devices_success_raid(self, mocked_udev,
+                                                 mocked_readlink,
                                                  mocked_mpath, mocked_execute):
         mocked_readlink.return_value = '../../sda'
-        mocked_fromdevfile.return_value = {}
         mocked_mpath.return_value = True
-        mocked_execute.side_effect = [
-            (hws.RAID_BLK_DEVICE_TEMPLATE, ''),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sda'),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sda1'),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sdb'),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sdb1'),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sda'),
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # md0p1
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # md0
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # md0
-            processutils.ProcessExecutionError(
-                stderr='the -c option requires a path to check'),  # md1
-        ]
-        expected_calls = [
-            mock.call('lsblk', '-bia', '--json',
-                      '-oKNAME,MODEL,SIZE,ROTA,TYPE,UUID,PARTUUID,SERIAL,WWN,'
-                      'LOG-SEC,PHY-SEC,TRAN',
-                      check_exit_code=[0]),
-            mock.call('multipath', '-c', '/dev/sda'),
-            mock.call('multipath', '-c', '/dev/sda1'),
-            mock.call('multipath', '-c', '/dev/sdb'),
-            mock.call('multipath', '-c', '/dev/sdb1'),
-            mock.call('multipath', '-c', '/dev/md0p1'),
-            mock.call('multipath', '-c', '/dev/md0'),
-            mock.call('multipath', '-c', '/dev/md1'),
-        ]
+        mocked_execute.return_value = (hws.RAID_BLK_DEVICE_TEMPLATE, '')
+        self.sysfs_devices.return_value = _sysfs_block_devices(
+            ['sda', 'sda1', 'sdb', 'sdb1', 'md0p1', 'md0', 'md1'],
+            vendor='FooTastic', hctl=None)
         result = hardware.list_all_block_devices(ignore_empty=False)
-        mocked_execute.assert_has_calls(expected_calls)
+        mocked_execute.assert_called_once_with(
+            'lsblk', '-bia', '--json',
+            '-oKNAME,MODEL,SIZE,ROTA,TYPE,UUID,PARTUUID,SERIAL,WWN,'
+            'LOG-SEC,PHY-SEC,TRAN',
+            check_exit_code=[0])
         self.assertEqual(RAID_BLK_DEVICE_TEMPLATE_DEVICES, result)
         mocked_udev.assert_called_once_with()
 
     @mock.patch.object(hardware, 'get_multipath_status', autospec=True)
     @mock.patch.object(os, 'readlink', autospec=True)
-    @mock.patch.object(hardware, '_get_device_info',
-                       lambda x, y, z: 'FooTastic')
     @mock.patch.object(disk_utils, 'udev_settle', autospec=True)
-    @mock.patch.object(hardware.pyudev.Devices, "from_device_file",
-                       autospec=False)
     def test_list_all_block_devices_partuuid_success(
-            self, mocked_fromdevfile,
-            mocked_udev, mocked_readlink,
+            self, mocked_udev, mocked_readlink,
             mocked_mpath, mocked_execute):
         mocked_readlink.return_value = '../../sda'
-        mocked_fromdevfile.return_value = {}
         mocked_mpath.return_value = True
-        mocked_execute.side_effect = [
-            (hws.PARTUUID_DEVICE_TEMPLATE, ''),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sda'),
-            processutils.ProcessExecutionError(
-                stderr=hws.MULTIPATH_INVALID_PATH % '/dev/sdb'),
-        ]
+        mocked_execute.return_value = (hws.PARTUUID_DEVICE_TEMPLATE, '')
+        self.sysfs_devices.return_value = _sysfs_block_devices(
+            ['sda', 'sda1'], vendor='FooTastic', hctl=None)
         result = hardware.list_all_block_devices(block_type='part')
-        expected_calls = [
-            mock.call('lsblk', '-bia', '--json',
-                      '-oKNAME,MODEL,SIZE,ROTA,TYPE,UUID,PARTUUID,SERIAL,WWN,'
-                      'LOG-SEC,PHY-SEC,TRAN',
-                      check_exit_code=[0]),
-            mock.call('multipath', '-c', '/dev/sda'),
-            mock.call('multipath', '-c', '/dev/sda1'),
-        ]
-        mocked_execute.assert_has_calls(expected_calls)
+        mocked_execute.assert_called_once_with(
+            'lsblk', '-bia', '--json',
+            '-oKNAME,MODEL,SIZE,ROTA,TYPE,UUID,PARTUUID,SERIAL,WWN,'
+            'LOG-SEC,PHY-SEC,TRAN',
+            check_exit_code=[0])
         self.assertEqual(BLK_DEVICE_TEMPLATE_PARTUUID_DEVICE, result)
         mocked_udev.assert_called_once_with()
         mocked_mpath.assert_called_once_with()
@@ -7658,6 +7779,196 @@ class TestModuleFunctions(base.IronicAgentTest):
         mocked_log.debug.assert_called_once()
 
 
+class TestBlockDeviceScan(base.IronicAgentTest):
+
+    def setUp(self):
+        super(TestBlockDeviceScan, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.tempdir))
+        self.devices_path = os.path.join(self.tempdir, 'devices')
+        self.class_path = os.path.join(self.tempdir, 'class')
+        os.mkdir(self.class_path)
+        mock.patch.object(hardware, 'SYS_CLASS_BLOCK',
+                          self.class_path).start()
+
+    def _add_device(self, name, parent=None, vendor=None, hctl=None,
+                    holders=(), dm_uuid=None):
+        path = os.path.join(self.devices_path, *filter(None, (parent, name)))
+        os.makedirs(os.path.join(path, 'holders'))
+        for holder in holders:
+            os.mkdir(os.path.join(path, 'holders', holder))
+        if parent:
+            with open(os.path.join(path, 'partition'), 'w') as f:
+                f.write('1\n')
+        if vendor:
+            os.makedirs(os.path.join(path, 'device'))
+            with open(os.path.join(path, 'device', 'vendor'), 'w') as f:
+                f.write('%s  \n' % vendor)
+        if hctl:
+            os.makedirs(os.path.join(path, 'device', 'scsi_device', hctl))
+        if dm_uuid:
+            os.mkdir(os.path.join(path, 'dm'))
+            with open(os.path.join(path, 'dm', 'uuid'), 'w') as f:
+                f.write('%s\n' % dm_uuid)
+        os.symlink(path, os.path.join(self.class_path, name))
+
+    def test_scan_sysfs_block_devices(self):
+        self._add_device('sda', vendor='ATA', hctl='0:0:0:0',
+                         holders=['dm-0'])
+        self._add_device('sda1', parent='sda', holders=['dm-1'])
+        self._add_device('dm-0', dm_uuid='mpath-3600508b1001c')
+        self._add_device('dm-1', dm_uuid='part1-mpath-3600508b1001c')
+        self._add_device('nvme0n1')
+        self.assertEqual({
+            'sda': {'vendor': 'ATA', 'hctl': '0:0:0:0', 'holders': ['dm-0'],
+                    'dm_uuid': None, 'parent': None},
+            'sda1': {'vendor': None, 'hctl': None, 'holders': ['dm-1'],
+                     'dm_uuid': None, 'parent': 'sda'},
+            'dm-0': {'vendor': None, 'hctl': None, 'holders': [],
+                     'dm_uuid': 'mpath-3600508b1001c', 'parent': None},
+            'dm-1': {'vendor': None, 'hctl': None, 'holders': [],
+                     'dm_uuid': 'part1-mpath-3600508b1001c', 'parent': None},
+            'nvme0n1': {'vendor': None, 'hctl': None, 'holders': [],
+                        'dm_uuid': None, 'parent': None},
+        }, hardware._scan_sysfs_block_devices())
+
+    def test_scan_sysfs_block_devices_missing(self):
+        shutil.rmtree(self.class_path)
+        self.assertEqual({}, hardware._scan_sysfs_block_devices())
+
+    def test_get_multipath_holder(self):
+        self._add_device('sda', holders=['dm-0'])
+        self._add_device('sda1', parent='sda', holders=['dm-1'])
+        self._add_device('sdb', holders=['dm-2'])
+        self._add_device('sdc')
+        self._add_device('dm-0', dm_uuid='mpath-3600508b1001c')
+        self._add_device('dm-1', dm_uuid='part1-mpath-3600508b1001c')
+        self._add_device('dm-2', dm_uuid='LVM-abcdef')
+        devices = hardware._scan_sysfs_block_devices()
+        self.assertEqual('dm-0', hardware._get_multipath_holder('sda',
+                                                                devices))
+        self.assertEqual('dm-0', hardware._get_multipath_holder('sda1',
+                                                                devices))
+        for kname in ('sdb', 'sdc', 'dm-0', 'missing'):
+            self.assertIsNone(hardware._get_multipath_holder(kname, devices))
+
+    def test_get_udev_block_devices(self):
+        context = mock.Mock(spec=pyudev.Context)
+        sda = mock.Mock(device_node='/dev/sda')
+        context.list_devices.return_value = [
+            sda, mock.Mock(device_node=None)]
+        self.assertEqual({'/dev/sda': sda},
+                         hardware._get_udev_block_devices(context))
+        context.list_devices.assert_called_once_with(subsystem='block')
+
+    @mock.patch.object(hardware, 'get_multipath_status', lambda *_: True)
+    @mock.patch.object(disk_utils, 'udev_settle', lambda *_: None)
+    @mock.patch.object(pyudev, 'Context', autospec=True)
+    @mock.patch.object(utils, 'execute', autospec=True)
+    def test_list_all_block_devices_many_paths(self, mocked_execute,
+                                               mocked_context):
+        # 64 disks seen through two paths each, assembled in multipath
+        # devices: neither udev nor sysfs are queried per device.
+        blockdevices = []
+        udev_devices = []
+        for index in range(64):
+            mpath = 'dm-%d' % index
+            self._add_device(mpath, dm_uuid='mpath-%d' % index)
+            udev_devices.append(mock.Mock(device_node='/dev/%s' % mpath))
+            device = {'kname': mpath, 'model': None, 'size': 1073741824,
+                      'rota': False, 'type': 'mpath', 'uuid': None,
+                      'partuuid': None, 'serial': None, 'wwn': None,
+                      'log-sec': 512, 'phy-sec': 512, 'tran': None}
+            blockdevices.append(device)
+            for path in 'ab':
+                kname = 'sd%s%d' % (path, index)
+                self._add_device(kname, vendor='ACME',
+                                 hctl='%d:0:0:%d' % ('ab'.index(path), index),
+                                 holders=[mpath])
+                udev_devices.append(
+                    mock.Mock(device_node='/dev/%s' % kname))
+                blockdevices.append(dict(device, kname=kname, type='disk',
+                                         tran='sas'))
+        mocked_execute.return_value = (
+            json.dumps({'blockdevices': blockdevices}), '')
+        list_devices = mocked_context.return_value.list_devices
+        list_devices.return_value = udev_devices
+
+        devices = hardware.list_all_block_devices()
+
+        self.assertEqual(['/dev/dm-%d' % index for index in range(64)],
+                         [dev.name for dev in devices])
+        mocked_execute.assert_called_once_with(
+            'lsblk', '-bia', '--json',
+            '-oKNAME,MODEL,SIZE,ROTA,TYPE,UUID,PARTUUID,SERIAL,WWN,'
+            'LOG-SEC,PHY-SEC,TRAN',
+            check_exit_code=[0])
+        list_devices.assert_called_once_with(subsystem='block')
+
+
+class TestEraseProgress(base.IronicAgentTest):
+
+    @mock.patch.object(ext_base, 'get_current_command', autospec=True)
+    def test_track(self, mock_get_command):
+        progress = hardware.EraseProgress([
+            hardware.BlockDevice('/dev/sda', 'small', 65535, False),
+            hardware.BlockDevice('/dev/sdb', 'big', 10737418240, True),
+        ])
+        command = mock_get_command.return_value
+        command.update_progress.assert_called_once_with(
+            devices={'/dev/sda': {'status': 'pending'},
+                     '/dev/sdb': {'status': 'pending'}})
+
+        self.assertEqual(42, progress.track('/dev/sda', lambda: 42))
+        self.assertRaises(RuntimeError, progress.track, '/dev/sdb',
+                          mock.Mock(side_effect=RuntimeError('boom')))
+
+        devices = command.update_progress.call_args[1]['devices']
+        self.assertEqual('done', devices['/dev/sda']['status'])
+        self.assertEqual('failed', devices['/dev/sdb']['status'])
+        self.assertEqual('boom', devices['/dev/sdb']['error'])
+        self.assertIn('elapsed', devices['/dev/sdb'])
+
+    @mock.patch.object(ext_base, 'get_current_command', autospec=True)
+    def test_report_progress(self, mock_get_command):
+        progress = hardware.EraseProgress([
+            hardware.BlockDevice('/dev/sda', 'small', 65535, False)])
+
+        def _erase():
+            hardware._report_erase_progress(bytes_written=42,
+                                            total_bytes=168)
+
+        progress.track('/dev/sda', _erase)
+        hardware._report_erase_progress(bytes_written=43)
+
+        command = mock_get_command.return_value
+        devices = command.update_progress.call_args[1]['devices']
+        self.assertEqual('done', devices['/dev/sda']['status'])
+        self.assertEqual(42, devices['/dev/sda']['bytes_written'])
+        self.assertEqual(25.0, devices['/dev/sda']['percent'])
+
+    @mock.patch.object(ext_base, 'get_current_command', autospec=True)
+    def test_without_command(self, mock_get_command):
+        mock_get_command.return_value = None
+        progress = hardware.EraseProgress([
+            hardware.BlockDevice('/dev/sda', 'small', 65535, False)])
+        progress.update('/dev/sda', status='erasing')
+
+    def test_get_erase_disk(self):
+        devices = ['/dev/sdaa', '/dev/sda2', '/dev/sda1', '/dev/sda',
+                   '/dev/nvme0n1p1', '/dev/nvme0n1', '/dev/md0']
+        self.assertEqual('/dev/sda',
+                         hardware._get_erase_disk('/dev/sda1', devices))
+        self.assertEqual('/dev/sda',
+                         hardware._get_erase_disk('/dev/sda', devices))
+        self.assertEqual('/dev/sdaa',
+                         hardware._get_erase_disk('/dev/sdaa', devices))
+        self.assertEqual('/dev/nvme0n1',
+                         hardware._get_erase_disk('/dev/nvme0n1p1', devices))
+        self.assertEqual('/dev/md0',
+                         hardware._get_erase_disk('/dev/md0', devices))
+
+
 @mock.patch.object(utils, 'execute', autospec=True)
 class TestMultipathEnabled(base.IronicAgentTest):
 
@@ -7842,6 +8153,23 @@ class TestListHardwareInfo(base.IronicAgentTest):
         mock_dispatch.assert_called_with('list_hardware_info')
         self.assertEqual(2, mock_dispatch.call_count)
 
+    @mock.patch.object(pyudev.Monitor, 'from_netlink', autospec=True)
+    def test_caching_monitor(self, mock_from_netlink, mock_dispatch):
+        self.config(inventory_udev_monitor=True)
+        mock_monitor = mock_from_netlink.return_value
+        mock_monitor.poll.return_value = None
+        mock_dispatch.side_effect = [{'info': 1}, {'info': 2}]
+
+        self.assertEqual({'info': 1}, hardware.list_hardware_info())
+        self.assertEqual({'info': 1}, hardware.list_hardware_info())
+        mock_dispatch.assert_called_once_with('list_hardware_info')
+
+        mock_monitor.poll.side_effect = [
+            mock.Mock(subsystem='net', sys_name='eth1'), None, None]
+        self.assertEqual({'info': 2}, hardware.list_hardware_info())
+        self.assertEqual({'info': 2}, hardware.list_hardware_info())
+        self.assertEqual(2, mock_dispatch.call_count)
+
 
 class TestAPIClientSaveAndUse(base.IronicAgentTest):
 
@@ -0,0 +1,256 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from oslo_concurrency import processutils
+from oslo_utils import units
+
+from ironic_python_agent import errors
+from ironic_python_agent import image_cache
+from ironic_python_agent.tests.unit import base
+from ironic_python_agent import utils
+
+
+class TestImageKey(base.IronicAgentTest):
+
+    def test_key(self):
+        self.assertEqual('sha512-abcd',
+                         image_cache.image_key({'os_hash_algo': 'sha512',
+                                                'os_hash_value': ' ABCD\n'}))
+
+    def test_no_algo(self):
+        self.assertIsNone(image_cache.image_key({'os_hash_value': 'abcd'}))
+
+    def test_unknown_algo(self):
+        self.assertIsNone(image_cache.image_key({'os_hash_algo': 'crc',
+                                                 'os_hash_value': 'abcd'}))
+
+    def test_url(self):
+        self.assertIsNone(image_cache.image_key(
+            {'os_hash_algo': 'sha256',
+             'os_hash_value': 'http://example.com/SHA256SUMS'}))
+
+
+def _key(data):
+    return 'sha256-%s' % hashlib.sha256(data).hexdigest()
+
+
+KEY = _key(b'xxxx')
+
+
+class TestImageCache(base.IronicAgentTest):
+
+    def setUp(self):
+        super(TestImageCache, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.tempdir))
+        self.path = os.path.join(self.tempdir, 'cache')
+        self.cache = image_cache.ImageCache(self.path, 10)
+
+    def _image(self, name, size, fill=b'x'):
+        path = os.path.join(self.tempdir, name)
+        with open(path, 'wb') as f:
+            f.write(fill * size)
+        return path
+
+    def _add(self, size, mtime, fill=b'x'):
+        key = _key(fill * size)
+        entry = self.cache.add(key, self._image(key, size, fill))
+        os.utime(entry, (mtime, mtime))
+        return entry
+
+    def test_add_get(self):
+        self.assertIsNone(self.cache.get(KEY))
+        image = self._image('image', 4)
+        entry = self.cache.add(KEY, image)
+        self.assertEqual(os.path.join(self.path, KEY), entry)
+        self.assertFalse(os.path.exists(image))
+        self.assertEqual(entry, self.cache.get(KEY))
+
+    def test_get_updates_mtime(self):
+        entry = self._add(4, 1000)
+        self.cache.get(KEY)
+        self.assertGreater(os.stat(entry).st_mtime, 1000)
+
+    def test_get_checksum_mismatch(self):
+        entry = self._add(4, 1000)
+        with open(entry, 'wb') as f:
+            f.write(b'yyyy')
+        self.assertIsNone(self.cache.get(KEY))
+        self.assertFalse(os.path.exists(entry))
+
+    def test_get_no_verify(self):
+        entry = self._add(4, 1000)
+        with open(entry, 'wb') as f:
+            f.write(b'yyyy')
+        self.assertEqual(entry, self.cache.get(KEY, verify=False))
+
+    def test_evict_lru(self):
+        first = self._add(4, 1000, fill=b'a')
+        second = self._add(4, 2000, fill=b'b')
+        self.cache.get(_key(b'aaaa'))
+        self._add(4, 3000, fill=b'c')
+        self.assertTrue(os.path.exists(first))
+        self.assertFalse(os.path.exists(second))
+
+    def test_evict_keeps_new_entry(self):
+        first = self._add(4, 1000, fill=b'a')
+        # Older than the existing entry, still must not be evicted
+        entry = self._add(10, 500, fill=b'b')
+        self.assertFalse(os.path.exists(first))
+        self.assertTrue(os.path.exists(entry))
+
+    @mock.patch('os.path.realpath', autospec=True)
+    @mock.patch('os.stat', autospec=True)
+    def test_is_on_device(self, mock_stat, mock_realpath):
+        mock_stat.side_effect = lambda path: mock.Mock(
+            st_dev=os.makedev(8, 1), st_rdev=os.makedev(8, 0))
+        mock_realpath.side_effect = {
+            '/sys/dev/block/8:1': '/sys/devices/pci0/block/sda/sda1',
+            '/sys/dev/block/8:0': '/sys/devices/pci0/block/sda',
+        }.get
+        self.assertTrue(self.cache.is_on_device('/dev/sda'))
+        mock_stat.assert_has_calls([mock.call(self.path),
+                                    mock.call('/dev/sda')])
+
+    @mock.patch('os.path.realpath', autospec=True)
+    @mock.patch('os.stat', autospec=True)
+    def test_is_on_other_device(self, mock_stat, mock_realpath):
+        mock_stat.side_effect = lambda path: mock.Mock(
+            st_dev=os.makedev(8, 17), st_rdev=os.makedev(8, 0))
+        mock_realpath.side_effect = {
+            '/sys/dev/block/8:17': '/sys/devices/pci0/block/sdb/sdb1',
+            '/sys/dev/block/8:0': '/sys/devices/pci0/block/sda',
+        }.get
+        self.assertFalse(self.cache.is_on_device('/dev/sda'))
+
+    def test_is_on_device_not_found(self):
+        self.assertFalse(self.cache.is_on_device('/dev/nonexistent'))
+
+    def test_too_large(self):
+        image = self._image('image', 11)
+        self.assertEqual(image, self.cache.add(KEY, image))
+        self.assertTrue(os.path.exists(image))
+        self.assertEqual([], os.listdir(self.path))
+
+    @mock.patch('os.replace', autospec=True)
+    def test_copy_failed(self, replace_mock):
+        replace_mock.side_effect = OSError(18, 'Invalid cross-device link')
+        image = self._image('image', 4)
+        self.assertEqual(image, self.cache.add('sha256-abcd', image))
+        self.assertTrue(os.path.exists(image))
+        self.assertEqual([], os.listdir(self.path))
+
+    def test_copy(self):
+        image = self._image('image', 4)
+        real_replace = os.replace
+
+        def _replace(src, dst):
+            if src == image:
+                raise OSError(18, 'Invalid cross-device link')
+            real_replace(src, dst)
+
+        with mock.patch('os.replace', autospec=True, side_effect=_replace):
+            entry = self.cache.add('sha256-abcd', image)
+
+        self.assertFalse(os.path.exists(image))
+        self.assertEqual(['sha256-abcd'], os.listdir(self.path))
+        with open(entry, 'rb') as f:
+            self.assertEqual(b'xxxx', f.read())
+
+    def test_partial_removed(self):
+        partial = self.cache.partial_path('sha256-abcd')
+        with open(partial, 'wb') as f:
+            f.write(b'xx')
+        entry = self._add(4, 1000, fill=b'e')
+        image_cache.ImageCache(self.path, 10)
+        self.assertEqual([os.path.basename(entry)], os.listdir(self.path))
+
+
+@mock.patch.object(utils, 'execute', autospec=True)
+class TestGetCache(base.IronicAgentTest):
+
+    def setUp(self):
+        super(TestGetCache, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.tempdir))
+        self.addCleanup(setattr, image_cache, '_CACHE', None)
+        self.config(image_cache_dir=self.tempdir, image_cache_size=100)
+
+    def test_disabled(self, mock_execute):
+        self.config(image_cache_size=0)
+        self.assertIsNone(image_cache.get_cache())
+        self.config(image_cache_size=100, image_cache_dir=None)
+        self.assertIsNone(image_cache.get_cache())
+
+    def test_get_cache(self, mock_execute):
+        cache = image_cache.get_cache()
+        self.assertEqual(self.tempdir, cache.path)
+        self.assertEqual(100 * units.Mi, cache.max_size)
+        self.assertIs(cache, image_cache.get_cache())
+        mock_execute.assert_not_called()
+
+    @mock.patch('os.path.ismount', autospec=True)
+    def test_mount(self, mock_ismount, mock_execute):
+        self.config(image_cache_device='/dev/sdb1')
+        mock_ismount.return_value = False
+        self.assertIsNotNone(image_cache.get_cache())
+        mock_execute.assert_called_once_with('mount', '/dev/sdb1',
+                                             self.tempdir)
+
+    @mock.patch('os.path.ismount', autospec=True)
+    def test_already_mounted(self, mock_ismount, mock_execute):
+        self.config(image_cache_device='/dev/sdb1')
+        mock_ismount.return_value = True
+        self.assertIsNotNone(image_cache.get_cache())
+        mock_execute.assert_not_called()
+
+    @mock.patch('os.path.ismount', autospec=True)
+    def test_mount_fails(self, mock_ismount, mock_execute):
+        self.config(image_cache_device='/dev/sdb1')
+        mock_ismount.return_value = False
+        mock_execute.side_effect = processutils.ProcessExecutionError()
+        self.assertIsNone(image_cache.get_cache())
+
+    @mock.patch.object(image_cache.ImageCache, 'is_on_device',
+                       autospec=True)
+    @mock.patch('os.path.ismount', autospec=True)
+    def test_check_device(self, mock_ismount, mock_on_device, mock_execute):
+        self.config(image_cache_device='/dev/sda1')
+        mock_ismount.return_value = True
+        mock_on_device.return_value = True
+        self.assertRaisesRegex(errors.DeploymentError, '/dev/sda1',
+                               image_cache.check_device, '/dev/sda')
+        mock_on_device.assert_called_once_with(image_cache.get_cache(),
+                                               '/dev/sda')
+
+        mock_on_device.return_value = False
+        image_cache.check_device('/dev/sdb')
+
+    @mock.patch.object(image_cache.ImageCache, 'is_on_device',
+                       autospec=True)
+    def test_check_device_in_ram(self, mock_on_device, mock_execute):
+        image_cache.check_device('/dev/sda')
+        mock_on_device.assert_not_called()
+
+    def test_lookup(self, mock_execute):
+        image_info = {'os_hash_algo': 'sha256', 'os_hash_value': 'abcd'}
+        self.assertIsNone(image_cache.lookup(image_info))
+        entry = os.path.join(self.tempdir, 'sha256-abcd')
+        open(entry, 'wb').close()
+        self.assertEqual(entry, image_cache.lookup(image_info))
+        self.assertIsNone(image_cache.lookup({}))
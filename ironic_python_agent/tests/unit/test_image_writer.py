@@ -0,0 +1,287 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import errno
+import hashlib
+import io
+import os
+import shutil
+import stat
+import struct
+import tempfile
+from unittest import mock
+
+from ironic_python_agent import image_writer
+from ironic_python_agent.tests.unit import base
+
+
+def _chunks(data, size):
+    return [data[pos:pos + size] for pos in range(0, len(data), size)]
+
+
+class TestImageWriter(base.IronicAgentTest):
+
+    def setUp(self):
+        super(TestImageWriter, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.tempdir))
+        self.path = os.path.join(self.tempdir, 'image')
+        self.config(image_write_chunk_size=1, image_write_queue_depth=2)
+
+    def _write(self, chunks, **kwargs):
+        checksum = hashlib.sha256()
+        writer = image_writer.ImageWriter(self.path, checksum.update,
+                                          **kwargs)
+        size = writer.write(chunks)
+        return writer, size, checksum
+
+    def test_write(self):
+        data = os.urandom(3 * 8192 + 100)
+        writer, size, checksum = self._write(_chunks(data, 3000),
+                                             chunk_size=8192)
+        self.assertEqual(len(data), size)
+        self.assertEqual(len(data), writer.bytes_written)
+        self.assertEqual(hashlib.sha256(data).hexdigest(),
+                         checksum.hexdigest())
+        with open(self.path, 'rb') as f:
+            self.assertEqual(data, f.read())
+
+    def test_write_str_chunks(self):
+        writer, size, checksum = self._write(['some', 'content'])
+        self.assertEqual(11, size)
+        self.assertEqual(hashlib.sha256(b'somecontent').hexdigest(),
+                         checksum.hexdigest())
+
+    def test_write_truncates(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'x' * 100)
+        self._write([b'abc'])
+        with open(self.path, 'rb') as f:
+            self.assertEqual(b'abc', f.read())
+
+    def test_write_offset(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'x' * 10)
+        progress = mock.Mock()
+        writer, size, checksum = self._write([b'abc'], offset=2,
+                                             progress=progress)
+        self.assertEqual(3, size)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(b'xxabc' + b'x' * 5, f.read())
+        progress.assert_called_once_with(5)
+
+    def test_write_progress(self):
+        progress = mock.Mock()
+        self._write(_chunks(b'a' * 10000, 3000), chunk_size=4096,
+                    progress=progress)
+        progress.assert_has_calls([mock.call(4096), mock.call(8192),
+                                   mock.call(10000)])
+
+    def test_write_empty(self):
+        writer, size, checksum = self._write([])
+        self.assertEqual(0, size)
+        self.assertEqual(0, os.path.getsize(self.path))
+
+    def test_write_sparse(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'x' * 300000)
+        data = b'a' * 1000 + bytes(200000) + b'b' * 1000 + bytes(100000)
+        progress = mock.Mock()
+        writer, size, checksum = self._write(_chunks(data, 3000),
+                                             chunk_size=65536,
+                                             progress=progress, sparse=True)
+        self.assertEqual(len(data), size)
+        self.assertEqual(hashlib.sha256(data).hexdigest(),
+                         checksum.hexdigest())
+        with open(self.path, 'rb') as f:
+            self.assertEqual(data, f.read())
+        # Zero blocks are only reported as written once they are zeroed
+        self.assertEqual([mock.call(65536), mock.call(65536),
+                          mock.call(65536), mock.call(262144),
+                          mock.call(262144), mock.call(302000)],
+                         progress.call_args_list)
+
+    @mock.patch.object(os, 'open', autospec=True)
+    def test_open_direct_not_supported(self, mock_open):
+        mock_open.side_effect = [OSError(errno.EINVAL, 'nope'), 42]
+        writer = image_writer.ImageWriter(self.path, None)
+        self.assertEqual((42, False), writer._open())
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+        mock_open.assert_has_calls([
+            mock.call(self.path, flags | os.O_DIRECT, 0o644),
+            mock.call(self.path, flags, 0o644)])
+
+    def test_source_error(self):
+        def _source():
+            yield b'abc'
+            raise RuntimeError('connection reset')
+
+        self.assertRaisesRegex(RuntimeError, 'connection reset',
+                               self._write, _source())
+
+    def test_hash_error(self):
+        writer = image_writer.ImageWriter(
+            self.path, mock.Mock(side_effect=ValueError('boom')),
+            chunk_size=4096)
+        chunks = _chunks(b'a' * 4096 * 10, 4096)
+        self.assertRaisesRegex(ValueError, 'boom', writer.write, chunks)
+        self.assertEqual(0, writer.bytes_written)
+
+    @mock.patch.object(os, 'pwrite', autospec=True)
+    def test_write_error(self, mock_pwrite):
+        mock_pwrite.side_effect = OSError(errno.ENOSPC, 'No space left')
+        writer = image_writer.ImageWriter(self.path, lambda data: None,
+                                          chunk_size=4096)
+        chunks = _chunks(b'a' * 4096 * 10, 4096)
+        exc = self.assertRaises(OSError, writer.write, chunks)
+        self.assertEqual(errno.ENOSPC, exc.errno)
+        self.assertEqual(0, writer.bytes_written)
+
+
+class TestSparseWriter(base.IronicAgentTest):
+
+    block_size = image_writer.SPARSE_BLOCK_SIZE
+
+    def setUp(self):
+        super(TestSparseWriter, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.tempdir))
+        self.path = os.path.join(self.tempdir, 'image')
+
+    def _write(self, chunks, **kwargs):
+        if not os.path.exists(self.path):
+            open(self.path, 'wb').close()
+        with open(self.path, 'r+b') as f:
+            writer = image_writer.SparseWriter(f.fileno(), **kwargs)
+            for chunk in chunks:
+                writer.write(chunk)
+            writer.flush()
+        with open(self.path, 'rb') as f:
+            return writer, f.read()
+
+    def test_write_holes(self):
+        data = (b'a' * 100 + bytes(3 * self.block_size)
+                + b'b' * 100 + bytes(2 * self.block_size))
+        writer, result = self._write(_chunks(data, 1000))
+        self.assertEqual(data, result)
+        # Blocks only partially covered by zeroes are written out
+        self.assertEqual(3 * self.block_size, writer.zeroes_skipped)
+        self.assertEqual(len(data), writer.committed)
+
+    def test_write_over_existing_data(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'x' * 4 * self.block_size)
+        data = bytes(2 * self.block_size) + b'a' * 10
+        writer, result = self._write([data, 'bc'], offset=self.block_size)
+        self.assertEqual(b'x' * self.block_size + data + b'bc'
+                         + b'x' * (self.block_size - 12), result)
+
+    def test_committed(self):
+        with open(self.path, 'wb') as f:
+            writer = image_writer.SparseWriter(f.fileno())
+            writer.write(b'a' * 10 + bytes(2 * self.block_size))
+            # A zero block, followed by an incomplete one, are pending
+            self.assertEqual(self.block_size, writer.committed)
+            writer.flush()
+            self.assertEqual(2 * self.block_size + 10, writer.committed)
+
+    def test_copy_sparse(self):
+        src = os.path.join(self.tempdir, 'src')
+        data = bytes(self.block_size) + b'a' * 10
+        with open(src, 'wb') as f:
+            f.write(data)
+        with open(self.path, 'wb') as f:
+            f.write(b'x' * 2 * self.block_size)
+        self.assertEqual(self.block_size,
+                         image_writer.copy_sparse(src, self.path))
+        with open(self.path, 'rb') as f:
+            self.assertEqual(data + b'x' * (self.block_size - 10), f.read())
+
+
+@mock.patch.object(image_writer.fcntl, 'ioctl', autospec=True)
+@mock.patch.object(image_writer, 'write_zeroes_offloaded', autospec=True)
+@mock.patch.object(os, 'fstat', autospec=True)
+class TestSparseWriterDevice(base.IronicAgentTest):
+
+    block_size = image_writer.SPARSE_BLOCK_SIZE
+
+    def setUp(self):
+        super(TestSparseWriterDevice, self).setUp()
+        self.pwrite = mock.Mock()
+
+    def _write(self, mock_fstat, data):
+        mock_fstat.return_value = mock.Mock(st_mode=stat.S_IFBLK,
+                                            st_rdev=os.makedev(8, 0))
+        writer = image_writer.SparseWriter(42, pwrite=self.pwrite)
+        writer.write(data)
+        writer.flush()
+        return writer
+
+    def test_zeroout(self, mock_fstat, mock_offloaded, mock_ioctl):
+        mock_offloaded.return_value = True
+        self._write(mock_fstat, bytes(2 * self.block_size) + b'a')
+        mock_ioctl.assert_called_once_with(
+            42, image_writer._BLKZEROOUT,
+            struct.pack('QQ', 0, 2 * self.block_size))
+        self.pwrite.assert_called_once_with(42, mock.ANY,
+                                            2 * self.block_size)
+        mock_offloaded.assert_called_once_with(os.makedev(8, 0))
+
+    def test_not_offloaded(self, mock_fstat, mock_offloaded, mock_ioctl):
+        mock_offloaded.return_value = False
+        self._write(mock_fstat, b'a' * self.block_size
+                    + bytes(self.block_size))
+        mock_ioctl.assert_not_called()
+        self.pwrite.assert_has_calls([
+            mock.call(42, mock.ANY, 0),
+            mock.call(42, mock.ANY, self.block_size)])
+        self.assertEqual(bytes(self.block_size),
+                         self.pwrite.call_args[0][1].tobytes())
+
+    def test_ioctl_not_supported(self, mock_fstat, mock_offloaded,
+                                 mock_ioctl):
+        mock_offloaded.return_value = True
+        mock_ioctl.side_effect = OSError(errno.EOPNOTSUPP, 'nope')
+        self._write(mock_fstat, bytes(2 * self.block_size))
+        self.pwrite.assert_has_calls([
+            mock.call(42, mock.ANY, 0),
+            mock.call(42, mock.ANY, self.block_size)])
+        self.assertEqual(2, self.pwrite.call_count)
+
+    def test_ioctl_error(self, mock_fstat, mock_offloaded, mock_ioctl):
+        mock_offloaded.return_value = True
+        mock_ioctl.side_effect = OSError(errno.EIO, 'I/O error')
+        self.assertRaises(OSError, self._write, mock_fstat,
+                          bytes(self.block_size))
+
+
+@mock.patch('builtins.open', autospec=True)
+class TestWriteZeroesOffloaded(base.IronicAgentTest):
+
+    def test_device(self, mock_open):
+        mock_open.side_effect = [io.StringIO('33550336\n')]
+        self.assertTrue(image_writer.write_zeroes_offloaded(
+            os.makedev(8, 0)))
+        mock_open.assert_called_once_with(
+            '/sys/dev/block/8:0/queue/write_zeroes_max_bytes')
+
+    def test_partition(self, mock_open):
+        mock_open.side_effect = [FileNotFoundError(), io.StringIO('0\n')]
+        self.assertFalse(image_writer.write_zeroes_offloaded(
+            os.makedev(8, 1)))
+        mock_open.assert_called_with(
+            '/sys/dev/block/8:1/../queue/write_zeroes_max_bytes')
+
+    def test_missing(self, mock_open):
+        mock_open.side_effect = FileNotFoundError()
+        self.assertFalse(image_writer.write_zeroes_offloaded(
+            os.makedev(8, 0)))
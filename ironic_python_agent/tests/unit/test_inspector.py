@@ -15,8 +15,13 @@
 
 import collections
 import copy
+import gzip
 import itertools
+import json
 import os
+import shutil
+import tempfile
+import threading
 import time
 from unittest import mock
 
@@ -29,6 +34,7 @@ from ironic_python_agent import config
 from ironic_python_agent import errors
 from ironic_python_agent import hardware
 from ironic_python_agent import inspector
+from ironic_python_agent import sysfs
 from ironic_python_agent.tests.unit import base
 from ironic_python_agent import utils
 
@@ -89,6 +95,18 @@ class TestInspect(base.IronicAgentTest):
             inspector._COLLECTOR_NS, ['default', 'logs'],
             name_order=True, on_missing_entrypoints_callback=mock.ANY)
 
+    def test_sysfs_memoized(self, mock_ext_mgr, mock_call):
+        self.mock_ext.plugin = mock.Mock(
+            side_effect=lambda data, failures: self.assertIsNotNone(
+                sysfs._CACHE))
+        mock_ext_mgr.return_value = [self.mock_ext]
+        mock_call.return_value = {'uuid': 'uuid1'}
+
+        inspector.inspect()
+
+        self.mock_ext.plugin.assert_called_once_with(mock.ANY, mock.ANY)
+        self.assertIsNone(sysfs._CACHE)
+
     def test_ok_with_ironic_url(self, mock_ext_mgr, mock_call):
         CONF.set_override('api_url', 'http://url')
         CONF.set_override('inspection_callback_url', '')
@@ -177,11 +195,161 @@ class TestInspect(base.IronicAgentTest):
         mock_call.assert_called_with_failure()
 
 
+@mock.patch.object(inspector, 'call_inspector', autospec=True)
+@mock.patch.object(stevedore, 'NamedExtensionManager', autospec=True)
+class TestInspectConcurrently(base.IronicAgentTest):
+    def setUp(self):
+        super(TestInspectConcurrently, self).setUp()
+        CONF.set_override('inspection_callback_url', 'http://foo/bar')
+        self.config(inspection_collectors_concurrency=4)
+        self.barrier = threading.Barrier(2, timeout=10)
+
+    def _set_extensions(self, mock_ext_mgr, collectors):
+        extensions = []
+        for name, plugin in collectors:
+            ext = mock.Mock(spec=['plugin', 'name'], plugin=plugin)
+            ext.name = name
+            extensions.append(ext)
+        mock_ext_mgr.return_value = extensions
+
+    def test_ok(self, mock_ext_mgr, mock_call):
+        def collect_default(data, failures):
+            data['inventory'] = {'interfaces': ['eth0']}
+
+        @inspector.requires('default')
+        def collect_lldp(data, failures):
+            data['lldp_raw'] = {iface: [] for iface in
+                                data['inventory']['interfaces']}
+            # Runs at the same time as the pci collector
+            self.barrier.wait()
+
+        @inspector.requires()
+        def collect_pci(data, failures):
+            data['pci_devices'] = []
+            self.barrier.wait()
+
+        @inspector.requires(inspector.ALL_COLLECTORS)
+        def collect_logs(data, failures):
+            self.assertEqual({'inventory', 'lldp_raw', 'pci_devices'},
+                             set(data))
+            data['logs'] = 'logs'
+
+        self._set_extensions(mock_ext_mgr, [('default', collect_default),
+                                            ('lldp', collect_lldp),
+                                            ('pci', collect_pci),
+                                            ('logs', collect_logs)])
+        mock_call.return_value = {'uuid': 'uuid1'}
+
+        self.assertEqual('uuid1', inspector.inspect())
+
+        data, failures = mock_call.call_args[0]
+        self.assertFalse(failures)
+        durations = data.pop('collector_durations')
+        self.assertEqual(['default', 'lldp', 'pci', 'logs'], list(durations))
+        self.assertEqual({'inventory': {'interfaces': ['eth0']},
+                          'lldp_raw': {'eth0': []},
+                          'pci_devices': [],
+                          'logs': 'logs'}, data)
+
+    def test_collector_failed(self, mock_ext_mgr, mock_call):
+        def collect_default(data, failures):
+            raise RuntimeError('boom')
+
+        @inspector.requires('default')
+        def collect_other(data, failures):
+            failures.add('cannot collect %s', 'other')
+            data['other'] = 42
+
+        self._set_extensions(mock_ext_mgr, [('default', collect_default),
+                                            ('other', collect_other)])
+        mock_call.return_value = {'uuid': 'uuid1'}
+
+        self.assertRaisesRegex(errors.InspectionError,
+                               'boom(.|\n)*cannot collect other',
+                               inspector.inspect)
+
+        data, failures = mock_call.call_args[0]
+        self.assertEqual(42, data['other'])
+        self.assertEqual({'default', 'other'},
+                         set(data['collector_durations']))
+
+    def test_dependency_on_following_collector_ignored(self, mock_ext_mgr,
+                                                       mock_call):
+        @inspector.requires('second')
+        def collect_first(data, failures):
+            self.barrier.wait()
+
+        @inspector.requires()
+        def collect_second(data, failures):
+            self.barrier.wait()
+
+        self._set_extensions(mock_ext_mgr, [('first', collect_first),
+                                            ('second', collect_second)])
+        mock_call.return_value = {'uuid': 'uuid1'}
+
+        self.assertEqual('uuid1', inspector.inspect())
+        self.assertFalse(mock_call.call_args[0][1])
+
+    def test_undeclared_dependencies(self, mock_ext_mgr, mock_call):
+        @inspector.requires()
+        def collect_default(data, failures):
+            data['inventory'] = {'interfaces': ['eth0']}
+
+        @inspector.requires()
+        def collect_pci(data, failures):
+            data['pci_devices'] = []
+
+        def collect_custom(data, failures):
+            self.assertEqual({'inventory', 'pci_devices'}, set(data))
+            data['custom'] = len(data['inventory']['interfaces'])
+
+        self._set_extensions(mock_ext_mgr, [('default', collect_default),
+                                            ('pci', collect_pci),
+                                            ('custom', collect_custom)])
+        mock_call.return_value = {'uuid': 'uuid1'}
+
+        self.assertEqual('uuid1', inspector.inspect())
+
+        data, failures = mock_call.call_args[0]
+        self.assertFalse(failures)
+        self.assertEqual(1, data['custom'])
+
+    def test_nested_changes(self, mock_ext_mgr, mock_call):
+        inventory = {'interfaces': ['eth0']}
+
+        @inspector.requires()
+        def collect_default(data, failures):
+            data['inventory'] = inventory
+
+        @inspector.requires('default')
+        def collect_first(data, failures):
+            data['inventory']['interfaces'].append('eth1')
+            self.barrier.wait()
+
+        @inspector.requires('default')
+        def collect_second(data, failures):
+            self.barrier.wait()
+            self.assertEqual(['eth0'], data['inventory']['interfaces'])
+
+        self._set_extensions(mock_ext_mgr, [('default', collect_default),
+                                            ('first', collect_first),
+                                            ('second', collect_second)])
+        mock_call.return_value = {'uuid': 'uuid1'}
+
+        self.assertEqual('uuid1', inspector.inspect())
+
+        data, failures = mock_call.call_args[0]
+        self.assertFalse(failures)
+        self.assertEqual({'interfaces': ['eth0', 'eth1']}, data['inventory'])
+
+
 @mock.patch.object(utils, 'get_requests_session', autospec=True)
 class TestCallInspector(base.IronicAgentTest):
     def setUp(self):
         super(TestCallInspector, self).setUp()
         CONF.set_override('inspection_callback_url', 'url')
+        mock.patch.object(inspector, '_NO_COMPRESSION_URLS', set()).start()
+        mock.patch.object(inspector, '_POSTED_FIELDS', None).start()
 
     def test_ok(self, mock_session):
         failures = utils.AccumulatedFailures()
@@ -343,6 +511,76 @@ class TestCallInspector(base.IronicAgentTest):
             headers=mock.ANY,
             timeout=30)
 
+    def test_compression(self, mock_session):
+        self.config(inspection_compression=True)
+        mock_post = mock_session.return_value.post
+        mock_post.return_value.status_code = 200
+
+        inspector.call_inspector({'data': 42}, utils.AccumulatedFailures())
+
+        mock_post.assert_called_once_with(
+            'url', data=mock.ANY,
+            headers={'Content-Type': 'application/json',
+                     'Accept': 'application/json',
+                     'Content-Encoding': 'gzip'},
+            timeout=30)
+        self.assertEqual(b'{"data": 42, "error": null}',
+                         gzip.decompress(mock_post.call_args[1]['data']))
+
+    def test_compression_rejected(self, mock_session):
+        CONF.set_override('inspection_callback_url', 'url1,url2')
+        self.config(inspection_compression=True)
+        mock_post = mock_session.return_value.post
+        mock_post.side_effect = [mock.Mock(status_code=415),
+                                 mock.Mock(status_code=200),
+                                 mock.Mock(status_code=200)]
+
+        for _ in range(2):
+            inspector.call_inspector({'data': 42},
+                                     utils.AccumulatedFailures())
+
+        self.assertEqual(3, mock_post.call_count)
+        self.assertEqual('gzip', mock_post.call_args_list[0][1]['headers']
+                         ['Content-Encoding'])
+        for call in mock_post.call_args_list[1:]:
+            self.assertEqual(mock.call('url1',
+                                       data='{"data": 42, "error": null}',
+                                       headers={
+                                           'Content-Type': 'application/json',
+                                           'Accept': 'application/json'},
+                                       timeout=30), call)
+        self.assertEqual({'url1'}, inspector._NO_COMPRESSION_URLS)
+
+    def test_delta_posts(self, mock_session):
+        self.config(inspection_delta_posts=True)
+        mock_post = mock_session.return_value.post
+        mock_post.return_value.status_code = 200
+
+        def call(**data):
+            inspector.call_inspector(data, utils.AccumulatedFailures())
+            return json.loads(mock_post.call_args[1]['data'])
+
+        self.assertEqual({'inventory': {'disks': 1}, 'logs': 'aaa',
+                          'error': None},
+                         call(inventory={'disks': 1}, logs='aaa'))
+        self.assertEqual({'inventory': {'disks': 2}, 'error': None,
+                          'unchanged_fields': ['logs']},
+                         call(inventory={'disks': 2}, logs='aaa'))
+        self.assertEqual({'error': None,
+                          'unchanged_fields': ['inventory', 'logs']},
+                         call(inventory={'disks': 2}, logs='aaa'))
+        # Removed fields are neither posted nor listed as unchanged
+        self.assertEqual({'error': None, 'unchanged_fields': ['inventory']},
+                         call(inventory={'disks': 2}))
+
+        # Everything is posted after an error
+        mock_post.return_value.status_code = 400
+        self.assertEqual({'error': None, 'unchanged_fields': ['inventory']},
+                         call(inventory={'disks': 2}))
+        mock_post.return_value.status_code = 200
+        self.assertEqual({'inventory': {'disks': 2}, 'error': None},
+                         call(inventory={'disks': 2}))
+
 
 class BaseDiscoverTest(base.IronicAgentTest):
     def setUp(self):
@@ -510,94 +748,89 @@ class TestCollectExtraHardware(base.IronicAgentTest):
         mock_execute.assert_called_once_with('hardware-detect')
 
 
-@mock.patch.object(os, 'listdir', autospec=True)
 class TestCollectPciDevicesInfo(base.IronicAgentTest):
     def setUp(self):
         super(TestCollectPciDevicesInfo, self).setUp()
         self.data = {}
         self.failures = utils.AccumulatedFailures()
-
-    @mock.patch.object(os.path, 'isfile', autospec=True)
-    @mock.patch.object(os.path, 'isdir', autospec=True)
-    def test_success(self, mock_isdir, mock_isfile, mock_listdir):
-        subdirs = ['foo', 'bar']
-        mock_listdir.return_value = subdirs
-        mock_isfile.return_value = True
-        mock_isdir.return_value = True
-        reads = ['0x1234', '0x5678', '0x060000', '0x01', '-1',
-                 '0x9876', '0x5432', '0x030000', '0x02', '-1']
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.tempdir))
+        self.devices_path = os.path.join(self.tempdir, 'devices')
+        os.mkdir(self.devices_path)
+        mock.patch.object(sysfs, 'PCI_DEVICES', self.devices_path).start()
+
+    def _add_device(self, bus, **attributes):
+        # Entries of /sys/bus/pci/devices are links to the device tree
+        path = os.path.join(self.tempdir, 'pci0000:00', bus)
+        os.makedirs(path)
+        for name, value in attributes.items():
+            with open(os.path.join(path, name), 'w') as f:
+                f.write('%s\n' % value)
+        os.symlink(path, os.path.join(self.devices_path, bus))
+
+    def test_success(self):
+        self._add_device('0000:00:01.0', vendor='0x1234', device='0x5678',
+                         **{'class': '0x060000'}, revision='0x01',
+                         numa_node='-1')
+        self._add_device('0000:00:02.0', vendor='0x9876', device='0x5432',
+                         **{'class': '0x030000'}, revision='0x02',
+                         numa_node='0')
         expected_pci_devices = [{'vendor_id': '1234', 'product_id': '5678',
                                  'class': '060000', 'revision': '01',
-                                 'bus': 'foo', 'numa_node_id': '-1'},
+                                 'bus': '0000:00:01.0', 'numa_node_id': '-1'},
                                 {'vendor_id': '9876', 'product_id': '5432',
                                  'class': '030000', 'revision': '02',
-                                 'bus': 'bar', 'numa_node_id': '-1'}]
+                                 'bus': '0000:00:02.0', 'numa_node_id': '0'}]
 
-        mock_open = mock.mock_open()
-        with mock.patch('builtins.open', mock_open):
-            mock_read = mock_open.return_value.read
-            mock_read.side_effect = reads
-            inspector.collect_pci_devices_info(self.data, self.failures)
+        inspector.collect_pci_devices_info(self.data, self.failures)
 
-        self.assertEqual(5 * len(subdirs), mock_open.call_count)
         self.assertListEqual(expected_pci_devices, self.data['pci_devices'])
+        self.assertFalse(self.failures)
 
-    @mock.patch.object(os.path, 'isdir', autospec=True)
-    @mock.patch.object(os.path, 'isfile', autospec=True)
-    def test_success_numa_ioerror(self, mock_isdir, mock_isfile, mock_listdir):
-        subdirs = ['foo', 'bar']
-        mock_listdir.return_value = subdirs
-        mock_isfile.return_value = True
-        mock_isdir.return_value = True
-        reads = ['0x1234', '0x5678', '0x060000', '0x01', IOError,
-                 '0x9876', '0x5432', '0x030000', '0x00', IOError]
+    def test_success_no_revision_numa(self):
+        self._add_device('0000:00:01.0', vendor='0x1234', device='0x5678',
+                         **{'class': '0x060000'})
+        self._add_device('0000:00:02.0', vendor='0x9876', device='0x5432',
+                         **{'class': '0x030000'}, revision='00')
         expected_pci_devices = [{'vendor_id': '1234', 'product_id': '5678',
-                                 'class': '060000', 'revision': '01',
-                                 'bus': 'foo', 'numa_node_id': None},
+                                 'class': '060000', 'revision': None,
+                                 'bus': '0000:00:01.0', 'numa_node_id': None},
                                 {'vendor_id': '9876', 'product_id': '5432',
-                                 'class': '030000', 'revision': '00',
-                                 'bus': 'bar', 'numa_node_id': None}]
+                                 'class': '030000', 'revision': None,
+                                 'bus': '0000:00:02.0', 'numa_node_id': None}]
 
-        mock_open = mock.mock_open()
-        with mock.patch('builtins.open', mock_open):
-            mock_read = mock_open.return_value.read
-            mock_read.side_effect = reads
-            inspector.collect_pci_devices_info(self.data, self.failures)
+        inspector.collect_pci_devices_info(self.data, self.failures)
 
-        self.assertEqual(5 * len(subdirs), mock_open.call_count)
         self.assertListEqual(expected_pci_devices, self.data['pci_devices'])
 
-    def test_wrong_path(self, mock_listdir):
-        mock_listdir.side_effect = OSError()
+    def test_wrong_path(self):
+        shutil.rmtree(self.devices_path)
 
         inspector.collect_pci_devices_info(self.data, self.failures)
 
         self.assertNotIn('pci_devices', self.data)
         self.assertEqual(1, len(self.failures._failures))
 
-    @mock.patch.object(os.path, 'isfile', autospec=True)
-    @mock.patch.object(os.path, 'isdir', autospec=True)
-    def test_bad_pci_device_info(self, mock_isdir, mock_isfile, mock_listdir):
-        subdirs = ['foo', 'bar', 'baz']
-        mock_listdir.return_value = subdirs
-        mock_isfile.return_value = True
-        mock_isdir.return_value = True
-        reads = ['0x1234', '0x5678', '0x060000', '0x01', '-1',
-                 IOError, IndexError]
+    def test_bad_pci_device_info(self):
+        self._add_device('0000:00:01.0', vendor='0x1234', device='0x5678',
+                         **{'class': '0x060000'}, revision='0x01',
+                         numa_node='-1')
+        # Missing class
+        self._add_device('0000:00:02.0', vendor='0x9876', device='0x5432')
+        # Wrong format of the device id
+        self._add_device('0000:00:03.0', vendor='0x9876', device='5432',
+                         **{'class': '0x030000'})
+        # Not a device
+        with open(os.path.join(self.devices_path, 'README'), 'w') as f:
+            f.write('not a device')
         expected_pci_devices = [{'vendor_id': '1234', 'product_id': '5678',
                                  'class': '060000', 'revision': '01',
-                                 'bus': 'foo', 'numa_node_id': '-1'}]
+                                 'bus': '0000:00:01.0', 'numa_node_id': '-1'}]
 
-        mock_open = mock.mock_open()
-        with mock.patch('builtins.open', mock_open):
-            mock_read = mock_open.return_value.read
-            mock_read.side_effect = reads
-            inspector.collect_pci_devices_info(self.data, self.failures)
+        inspector.collect_pci_devices_info(self.data, self.failures)
 
-        # note(sborkows): due to throwing IOError, the corresponding mock_open
-        # will not be called, so there are 7 mock_open calls in total
-        self.assertEqual(7, mock_open.call_count)
         self.assertListEqual(expected_pci_devices, self.data['pci_devices'])
+        self.assertFalse(self.failures)
 
 
 @mock.patch.object(utils, 'get_agent_params', lambda: {'BOOTIF': '01-cdef'})
@@ -0,0 +1,148 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from unittest import mock
+
+import pyudev
+
+from ironic_python_agent import inventory_monitor
+from ironic_python_agent.tests.unit import base
+
+
+class FakeMonitor(object):
+    """A udev monitor socket with queued events."""
+
+    def __init__(self):
+        self.events = []
+        self.filter_by = mock.Mock()
+        self.set_receive_buffer_size = mock.Mock()
+        self.start = mock.Mock()
+
+    def add(self, subsystem, sys_name, action='change'):
+        self.events.append(mock.Mock(subsystem=subsystem, sys_name=sys_name,
+                                     action=action))
+
+    def poll(self, timeout=None):
+        assert timeout == 0
+        if not self.events:
+            return None
+        event = self.events.pop(0)
+        if isinstance(event, Exception):
+            raise event
+        return event
+
+
+class TestInventoryMonitor(base.IronicAgentTest):
+
+    def setUp(self):
+        super(TestInventoryMonitor, self).setUp()
+        self.fake = FakeMonitor()
+        self.mock_from_netlink = mock.patch.object(
+            pyudev.Monitor, 'from_netlink', autospec=True,
+            return_value=self.fake).start()
+        self.context = mock.Mock(spec=pyudev.Context)
+        self.monitor = inventory_monitor.InventoryMonitor(self.context)
+
+    def test_start(self):
+        self.mock_from_netlink.assert_called_once_with(self.context)
+        self.fake.filter_by.assert_has_calls([mock.call('block'),
+                                              mock.call('net')])
+        self.fake.set_receive_buffer_size.assert_called_once_with(
+            inventory_monitor._RECEIVE_BUFFER_SIZE)
+        self.fake.start.assert_called_once_with()
+
+    def test_snapshot(self):
+        before = self.monitor.snapshot()
+        self.assertEqual(inventory_monitor.Snapshot(block=0, net=0), before)
+        self.assertEqual(before, self.monitor.snapshot())
+
+        self.fake.add('block', 'sda', 'add')
+        self.fake.add('block', 'sda1', 'add')
+        self.fake.add('input', 'event0')
+        after = self.monitor.snapshot()
+        self.assertEqual(inventory_monitor.Snapshot(block=2, net=0), after)
+        self.assertNotEqual(before, after)
+        self.assertEqual([], self.fake.events)
+
+    def test_changed_devices(self):
+        self.fake.add('block', 'sda')
+        snapshot = self.monitor.snapshot()
+        self.fake.add('block', 'sdb', 'add')
+        self.fake.add('net', 'eth0', 'move')
+        self.fake.add('block', 'sdb1', 'add')
+
+        self.assertEqual({'sdb', 'sdb1'},
+                         self.monitor.changed_devices(snapshot, 'block'))
+        self.assertEqual({'eth0'},
+                         self.monitor.changed_devices(snapshot, 'net'))
+        self.assertEqual(set(), self.monitor.changed_devices(
+            self.monitor.snapshot(), 'block'))
+
+    def test_cached(self):
+        func = mock.Mock(side_effect=[1, 2, 3])
+        self.assertEqual(1, self.monitor.cached('key', ['block'], func))
+        self.assertEqual(1, self.monitor.cached('key', ['block'], func))
+
+        self.fake.add('net', 'eth0')
+        self.assertEqual(1, self.monitor.cached('key', ['block'], func))
+
+        self.fake.add('block', 'sda')
+        self.assertEqual(2, self.monitor.cached('key', ['block'], func))
+        self.assertEqual(2, self.monitor.cached('key', ['block'], func))
+
+        self.monitor.invalidate()
+        self.assertEqual(3, self.monitor.cached('key', ['block'], func))
+        self.assertEqual(3, func.call_count)
+
+    def test_cached_event_during_computation(self):
+        def compute():
+            self.fake.add('block', 'sda')
+            return compute.calls.pop(0)
+
+        compute.calls = [1, 2]
+        self.assertEqual(1, self.monitor.cached('key', ['block'], compute))
+        self.assertEqual(2, self.monitor.cached('key', ['block'], compute))
+
+    def test_events_lost(self):
+        func = mock.Mock(side_effect=[1, 2])
+        self.assertEqual(1, self.monitor.cached('key', ['net'], func))
+        snapshot = self.monitor.snapshot()
+
+        self.fake.events.append(OSError(105, 'No buffer space available'))
+        self.fake.add('block', 'sda')
+        self.assertEqual(2, self.monitor.cached('key', ['net'], func))
+        self.assertIsNone(self.monitor.changed_devices(snapshot, 'block'))
+        self.assertIsNone(self.monitor.changed_devices(snapshot, 'net'))
+        self.assertEqual(set(), self.monitor.changed_devices(
+            self.monitor.snapshot(), 'block'))
+
+
+@mock.patch.object(inventory_monitor, 'InventoryMonitor', autospec=True)
+class TestGetMonitor(base.IronicAgentTest):
+
+    def test_disabled(self, mock_monitor):
+        self.assertIsNone(inventory_monitor.get_monitor())
+        mock_monitor.assert_not_called()
+
+    def test_enabled(self, mock_monitor):
+        self.config(inventory_udev_monitor=True)
+        self.assertIs(mock_monitor.return_value,
+                      inventory_monitor.get_monitor())
+        self.assertIs(mock_monitor.return_value,
+                      inventory_monitor.get_monitor())
+        mock_monitor.assert_called_once_with()
+
+    def test_failure(self, mock_monitor):
+        self.config(inventory_udev_monitor=True)
+        mock_monitor.side_effect = [OSError('netlink'), mock.sentinel.monitor]
+        self.assertIsNone(inventory_monitor.get_monitor())
+        self.assertIs(mock.sentinel.monitor, inventory_monitor.get_monitor())
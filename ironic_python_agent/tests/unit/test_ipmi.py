@@ -0,0 +1,167 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import ctypes
+import fcntl
+import ipaddress
+import os
+import select
+import tempfile
+from unittest import mock
+
+from ironic_python_agent import errors
+from ironic_python_agent import ipmi
+from ironic_python_agent.tests.unit import base
+
+
+class FakeMessageLayer(object):
+    """Stand-in for the OpenIPMI message layer of the kernel.
+
+    Answers Get LAN Configuration Parameters requests from a dictionary
+    mapping (channel, parameter, set selector) to the parameter data, and
+    returns the responses in the reverse order of the requests.
+    """
+
+    def __init__(self, params):
+        self.params = params
+        self.responses = []
+        self.calls = []
+
+    def ioctl(self, fd, request, arg):
+        if request == ipmi.IPMICTL_SEND_COMMAND:
+            addr = ctypes.cast(
+                arg.addr, ctypes.POINTER(ipmi._SystemInterfaceAddr)).contents
+            assert addr.addr_type == ipmi._IPMI_SYSTEM_INTERFACE_ADDR_TYPE
+            assert addr.channel == ipmi._IPMI_BMC_CHANNEL
+            data = bytes(arg.msg.data[:arg.msg.data_len])
+            self.calls.append(('send', arg.msgid))
+            self.responses.append((ipmi._IPMI_RESPONSE_RECV_TYPE, arg.msgid,
+                                   self._respond(arg.msg.netfn, arg.msg.cmd,
+                                                 data)))
+        elif request == ipmi.IPMICTL_RECEIVE_MSG_TRUNC:
+            recv_type, msgid, data = self.responses.pop()
+            self.calls.append(('receive', msgid))
+            arg.recv_type = recv_type
+            arg.msgid = msgid
+            ctypes.memmove(arg.msg.data, data, len(data))
+            arg.msg.data_len = len(data)
+        else:
+            raise AssertionError('Unexpected ioctl %#x' % request)
+
+    def select(self, rlist, wlist, xlist, timeout):
+        return (rlist if self.responses else []), [], []
+
+    def _respond(self, netfn, cmd, data):
+        if (netfn, cmd) != (ipmi.NETFN_TRANSPORT, ipmi.CMD_GET_LAN_CONFIG):
+            return bytes([0xc1])  # invalid command
+        value = self.params.get(tuple(data[:3]))
+        if value is None:
+            return bytes([0xcc])  # invalid data field in request
+        return bytes([ipmi.COMPLETION_OK, 0x11]) + value
+
+
+def _ipv6_address(set_selector, address, source, status=0, enabled=True):
+    return (bytes([set_selector, source | (0x80 if enabled else 0)])
+            + ipaddress.IPv6Address(address).packed + bytes([64, status]))
+
+
+class TestIPMI(base.IronicAgentTest):
+
+    def setUp(self):
+        super(TestIPMI, self).setUp()
+        self.layer = FakeMessageLayer({
+            (1, ipmi.LAN_PARAM_IP_ADDRESS, 0): bytes([192, 0, 2, 1]),
+            (1, ipmi.LAN_PARAM_MAC_ADDRESS, 0): bytes(
+                [0xaa, 0xbb, 0xcc, 0xdd, 0xee, 0x0f]),
+            (1, ipmi.LAN_PARAM_IP_ADDRESSING_ENABLES, 0): bytes([0]),
+            (2, ipmi.LAN_PARAM_IP_ADDRESS, 0): bytes(4),
+            (2, ipmi.LAN_PARAM_MAC_ADDRESS, 0): bytes(
+                [0xaa, 0xbb, 0xcc, 0xdd, 0xee, 0x10]),
+            (2, ipmi.LAN_PARAM_IP_ADDRESSING_ENABLES, 0): bytes([2]),
+            (2, ipmi.LAN_PARAM_IPV6_STATUS, 0): bytes([2, 1, 0]),
+            (2, ipmi.LAN_PARAM_IPV6_STATIC_ADDRESS, 0): _ipv6_address(
+                0, '2001:db8::1', ipmi.IPV6_SOURCE_STATIC),
+            (2, ipmi.LAN_PARAM_IPV6_STATIC_ADDRESS, 1): _ipv6_address(
+                1, '::', ipmi.IPV6_SOURCE_STATIC, status=1, enabled=False),
+            (2, ipmi.LAN_PARAM_IPV6_DYNAMIC_ADDRESS, 0): _ipv6_address(
+                0, '2001:db8::2', ipmi.IPV6_SOURCE_DHCPV6, enabled=False),
+        })
+        mock.patch.object(fcntl, 'ioctl', autospec=True,
+                          side_effect=self.layer.ioctl).start()
+        mock.patch.object(select, 'select', autospec=True,
+                          side_effect=self.layer.select).start()
+        fd, self.device = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, self.device)
+
+    def test_get_lan_configs(self):
+        with ipmi.Session(self.device) as session:
+            configs = ipmi.get_lan_configs(session)
+
+        self.assertEqual([1, 2], [config.channel for config in configs])
+        config1, config2 = configs
+        self.assertEqual('192.0.2.1', config1.ip_address)
+        self.assertEqual('aa:bb:cc:dd:ee:0f', config1.mac_address)
+        self.assertEqual('ipv4', config1.addressing)
+        self.assertEqual([], config1.ipv6_addresses)
+
+        self.assertEqual('0.0.0.0', config2.ip_address)
+        self.assertEqual('aa:bb:cc:dd:ee:10', config2.mac_address)
+        self.assertEqual('both', config2.addressing)
+        self.assertEqual(
+            [('2001:db8::1', 64, ipmi.IPV6_SOURCE_STATIC, True, True),
+             ('::', 64, ipmi.IPV6_SOURCE_STATIC, False, False),
+             ('2001:db8::2', 64, ipmi.IPV6_SOURCE_DHCPV6, True, True)],
+            [(addr.address, addr.prefix_length, addr.source, addr.enabled,
+              addr.active) for addr in config2.ipv6_addresses])
+
+        # The parameters of all channels are requested before waiting for
+        # the first response, then the IPv6 addresses.
+        actions = [action for action, _ in self.layer.calls]
+        first_batch = len(ipmi.LAN_CHANNELS) * 4
+        self.assertEqual(['send'] * first_batch + ['receive'] * first_batch
+                         + ['send'] * 3 + ['receive'] * 3, actions)
+
+    def test_get_lan_configs_ipv4(self):
+        with ipmi.Session(self.device) as session:
+            configs = ipmi.get_lan_configs(session, ipv6=False)
+
+        self.assertEqual(['192.0.2.1', '0.0.0.0'],
+                         [config.ip_address for config in configs])
+        self.assertEqual([None, None],
+                         [config.addressing for config in configs])
+        self.assertEqual(len(ipmi.LAN_CHANNELS) * 4, len(self.layer.calls))
+
+    def test_request_ignores_unexpected_messages(self):
+        session = ipmi.Session(self.device)
+        self.addCleanup(session.close)
+        self.layer.responses.append((2, 42, b'event'))
+        self.layer.responses.append((ipmi._IPMI_RESPONSE_RECV_TYPE, 43,
+                                     b'\x00'))
+        responses = session.request(
+            [(ipmi.NETFN_TRANSPORT, ipmi.CMD_GET_LAN_CONFIG,
+              [1, ipmi.LAN_PARAM_IP_ADDRESS, 0, 0]),
+             (0x06, 0x01, [])])
+        self.assertEqual([(0, b'\x11\xc0\x00\x02\x01'), (0xc1, b'')],
+                         responses)
+
+    def test_request_timeout(self):
+        session = ipmi.Session(self.device, timeout=0)
+        self.addCleanup(session.close)
+        self.layer.select = mock.Mock(return_value=([], [], []))
+        select.select.side_effect = self.layer.select
+        self.assertRaisesRegex(errors.IPMIError, 'no response to 1 request',
+                               session.request, [(0x06, 0x01, [])])
+
+    @mock.patch.object(ipmi, 'DEVICE_PATHS', ('/nonexistent/ipmi0',))
+    def test_session_no_device(self):
+        self.assertRaises(errors.IPMIError, ipmi.Session)
@@ -232,3 +232,71 @@ class GetEndpointTestCase(IronicAgentTest):
                                'baremetal service',
                                mdns.get_endpoint, 'baremetal')
         self.assertEqual(CONF.mdns.lookup_attempts - 1, mock_sleep.call_count)
+
+
+@mock.patch('zeroconf.Zeroconf', autospec=True)
+class RegisterServiceTestCase(IronicAgentTest):
+
+    @mock.patch('socket.gethostname', lambda: 'node-1.example.com')
+    def test_register(self, mock_zc):
+        zc = mdns.Zeroconf()
+        zc.register_service('baremetal-agent', 'https://10.0.0.1:9999/api',
+                            params={'a': 'b'})
+        info = mock_zc.return_value.register_service.call_args[0][0]
+        self.assertEqual('_openstack._tcp.local.', info.type)
+        self.assertEqual('baremetal-agent._openstack._tcp.local.', info.name)
+        self.assertEqual(['10.0.0.1'], info.parsed_addresses())
+        self.assertEqual(9999, info.port)
+        self.assertEqual('node-1.local.', info.server)
+        self.assertEqual({b'a': b'b', b'protocol': b'https',
+                          b'path': b'/api'}, info.properties)
+
+        zc.close()
+        mock_zc.return_value.unregister_service.assert_called_once_with(info)
+
+    def test_register_failure(self, mock_zc):
+        mock_zc.return_value.register_service.side_effect = ValueError('dup')
+        zc = mdns.Zeroconf()
+        self.assertRaisesRegex(errors.ServiceRegistrationFailure, 'dup',
+                               zc.register_service, 'baremetal-agent',
+                               'http://10.0.0.1:9999')
+
+
+@mock.patch('ironic_python_agent.utils.get_route_source', autospec=True)
+@mock.patch('time.sleep', autospec=True)
+@mock.patch('zeroconf.ServiceBrowser', autospec=True)
+@mock.patch('zeroconf.Zeroconf', autospec=True)
+class FindEndpointsTestCase(IronicAgentTest):
+
+    def test_find(self, mock_zc, mock_browser, mock_sleep, mock_route):
+        added = mdns.zeroconf.ServiceStateChange.Added
+
+        def _browse(zc, service_type, handlers):
+            for name in ('agent-a._openstack._tcp.local.',
+                         'baremetal._openstack._tcp.local.',
+                         'agent-b._openstack._tcp.local.',
+                         'agent-c._openstack._tcp.local.'):
+                handlers[0](zeroconf=zc, service_type=service_type,
+                            name=name, state_change=added)
+            return mock.DEFAULT
+
+        mock_browser.side_effect = _browse
+        mock_zc.return_value.get_service_info.side_effect = [
+            mock.Mock(port=80, properties={}, server='a.local.',
+                      **{'parsed_addresses.return_value': ['127.0.0.1']}),
+            None,
+            mock.Mock(port=80, properties={}, server='c.local.',
+                      **{'parsed_addresses.return_value': ['invalid']}),
+        ]
+
+        result = mdns.Zeroconf().find_endpoints('agent-', 2,
+                                                skip_loopback=False)
+        self.assertEqual([('agent-a', 'http://127.0.0.1:80', {})], result)
+        mock_sleep.assert_called_once_with(2)
+        mock_browser.return_value.cancel.assert_called_once_with()
+        mock_zc.return_value.get_service_info.assert_has_calls([
+            mock.call('_openstack._tcp.local.',
+                      'agent-a._openstack._tcp.local.'),
+            mock.call('_openstack._tcp.local.',
+                      'agent-b._openstack._tcp.local.'),
+        ])
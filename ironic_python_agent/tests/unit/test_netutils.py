@@ -15,6 +15,9 @@
 import binascii
 from collections import namedtuple
 import socket
+import struct
+import threading
+import time
 from unittest import mock
 
 from oslo_config import cfg
@@ -475,3 +478,156 @@ class TestNetutils(base.IronicAgentTest):
         mock_read.side_effect = FileNotFoundError
         driver = netutils.get_interface_driver('ens160')
         self.assertIsNone(driver)
+
+
+def _lldp_packet(ttl):
+    # Ethernet header, chassis ID, port ID, TTL and end TLVs
+    return (FAKE_LLDP_PACKET[:14]
+            + binascii.unhexlify('020704885a92ec5459'
+                                 '040d0545746865726e6574312f3138'
+                                 '0602%04x' '0000' % ttl))
+
+
+class _TrackedSocket(object):
+    """Socket recording when it is closed."""
+
+    def __init__(self, sock, on_close):
+        self._sock = sock
+        self._on_close = on_close
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def recv(self, size):
+        return self._sock.recv(size)
+
+    def close(self):
+        self._on_close()
+        self._sock.close()
+
+
+class TestLLDPListener(base.IronicAgentTest):
+    def setUp(self):
+        super(TestLLDPListener, self).setUp()
+        self.peers = {}
+        self.closed = []
+        mock.patch.object(netutils.LLDPListener, '_open_socket',
+                          autospec=True,
+                          side_effect=self._open_socket).start()
+        self.listener = netutils.start_lldp_listener(['eth0'])
+        self.addCleanup(self.listener.stop)
+
+    def _open_socket(self, listener, name):
+        if name == 'broken':
+            raise OSError('no such device')
+        sock, peer = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.peers[name] = peer
+        self.addCleanup(peer.close)
+        return _TrackedSocket(sock, lambda: self.closed.append(name))
+
+    def _send(self, name, packet):
+        self.peers[name].send(packet)
+
+    def _tlvs(self, ttl):
+        return netutils._parse_tlv(_lldp_packet(ttl)[14:])
+
+    def test_get(self):
+        self._send('eth0', _lldp_packet(120))
+        self.assertEqual({'eth0': self._tlvs(120)},
+                         netutils.get_lldp_info(['eth0']))
+        # Returned immediately from now on
+        self.assertEqual({'eth0': self._tlvs(120)},
+                         self.listener.get(['eth0'], 0))
+
+    def test_get_waits_for_missing_interfaces(self):
+        self._send('eth0', _lldp_packet(120))
+        self.assertEqual({'eth0': self._tlvs(120)},
+                         self.listener.get(['eth0'], 5))
+        self.listener.listen(['eth1'])
+
+        timer = threading.Timer(0.1, self._send, ('eth1', _lldp_packet(60)))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        start = time.monotonic()
+        self.assertEqual({'eth0': self._tlvs(120), 'eth1': self._tlvs(60)},
+                         self.listener.get(['eth0', 'eth1'], 10))
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_get_timeout(self):
+        self._send('eth0', _lldp_packet(120))
+        self.assertEqual({'eth0': self._tlvs(120), 'eth1': [],
+                          'broken': []},
+                         self.listener.get(['eth0', 'eth1', 'broken'], 0.1))
+        self.assertEqual({'eth0', 'eth1'}, set(self.peers))
+
+    def test_latest_packet_kept(self):
+        self._send('eth0', _lldp_packet(120))
+        self.assertEqual({'eth0': self._tlvs(120)},
+                         self.listener.get(['eth0'], 5))
+        self._send('eth0', _lldp_packet(90))
+        deadline = time.monotonic() + 5
+        while (self.listener.get(['eth0'], 0) != {'eth0': self._tlvs(90)}
+               and time.monotonic() < deadline):
+            time.sleep(0.01)
+        self.assertEqual({'eth0': self._tlvs(90)},
+                         self.listener.get(['eth0'], 0))
+
+    def test_expiry(self):
+        self._send('eth0', _lldp_packet(120))
+        self.assertEqual({'eth0': self._tlvs(120)},
+                         self.listener.get(['eth0'], 5))
+        now = time.monotonic()
+        with mock.patch.object(time, 'monotonic', autospec=True,
+                               return_value=now + 121):
+            self.assertEqual({'eth0': []}, self.listener.get(['eth0'], 0))
+
+    def test_shutdown_packet(self):
+        self._send('eth0', _lldp_packet(120))
+        self.assertEqual({'eth0': self._tlvs(120)},
+                         self.listener.get(['eth0'], 5))
+        self._send('eth0', _lldp_packet(0))
+        deadline = time.monotonic() + 5
+        while (self.listener.get(['eth0'], 0) != {'eth0': []}
+               and time.monotonic() < deadline):
+            time.sleep(0.01)
+        self.assertEqual({'eth0': []}, self.listener.get(['eth0'], 0))
+
+    def test_stop(self):
+        self.listener.listen(['eth1'])
+        self.listener.stop()
+        self.assertEqual({'eth0', 'eth1'}, set(self.closed))
+        self.assertFalse(self.listener.is_alive())
+
+
+@mock.patch('socket.if_nametoindex', autospec=True)
+@mock.patch('socket.socket', autospec=True)
+class TestLLDPListenerSocket(base.IronicAgentTest):
+
+    def setUp(self):
+        super(TestLLDPListenerSocket, self).setUp()
+        self.listener = netutils.LLDPListener()
+        self.addCleanup(self.listener._wakeup_reader.close)
+        self.addCleanup(self.listener._wakeup_writer.close)
+
+    def test_open_socket(self, mock_socket, mock_index):
+        mock_index.return_value = 3
+        sock = self.listener._open_socket('eth0')
+
+        self.assertIs(mock_socket.return_value, sock)
+        mock_socket.assert_called_once_with(socket.AF_PACKET,
+                                            socket.SOCK_RAW,
+                                            socket.htons(0x88cc))
+        sock.setsockopt.assert_has_calls([
+            mock.call(263, 1, struct.pack('iHH8s', 3, 0, 6, address))
+            for address in (b'\x01\x80\xc2\x00\x00\x0e',
+                            b'\x01\x80\xc2\x00\x00\x03',
+                            b'\x01\x80\xc2\x00\x00\x00')])
+        sock.bind.assert_called_once_with(('eth0', 0x88cc))
+        # Interface flags are left untouched
+        sock.fileno.assert_not_called()
+
+    def test_open_socket_fails(self, mock_socket, mock_index):
+        mock_index.side_effect = OSError('no such device')
+        self.assertRaises(OSError, self.listener._open_socket, 'eth0')
+        mock_socket.return_value.close.assert_called_once_with()
+        mock_socket.return_value.bind.assert_not_called()
@@ -14,6 +14,8 @@
 # limitations under the License.
 
 import os
+import shutil
+import tempfile
 from unittest import mock
 
 from ironic_python_agent import errors
@@ -119,6 +121,20 @@ class TestGetNumaTopologyInfo(base.IronicAgentTest):
         super(TestGetNumaTopologyInfo, self).setUp()
         self.data = {}
         self.failures = utils.AccumulatedFailures()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.tempdir))
+        self.node_dirs = [os.path.join(self.tempdir, 'node0'),
+                          os.path.join(self.tempdir, 'node1')]
+
+    def _write(self, *parts):
+        path = os.path.join(self.tempdir, *parts[:-1])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(parts[-1])
+
+    def _add_thread(self, node, thread, core):
+        self._write(node, 'cpu%d' % thread, 'topology', 'core_id',
+                    '%s\n' % core)
 
     def test_get_numa_node_id_valid_format(self):
         numa_node_dir = '/sys/devices/system/node/node0'
@@ -137,71 +153,41 @@ class TestGetNumaTopologyInfo(base.IronicAgentTest):
                           numa_insp.get_numa_node_id,
                           '')
 
-    @mock.patch.object(numa_insp, 'get_numa_node_id', autospec=True)
-    def test_get_nodes_memory_info(self, mock_node_id):
-        numa_node_dirs = ['/sys/devices/system/node/node0',
-                          '/sys/devices/system/node/node1']
-        mock_node_id.side_effect = [0, 1]
-        reads = [['Node 0 Ignored Line',
-                  'Node 0 MemTotal: 1560000 kB'],
-                 ['Node 1 MemTotal: 1200000 kB',
-                  'Node 1 Ignored Line']]
+    def test_get_nodes_memory_info(self):
+        self._write('node0', 'meminfo',
+                    'Node 0 Ignored Line\nNode 0 MemTotal: 1560000 kB\n')
+        self._write('node1', 'meminfo',
+                    'Node 1 MemTotal: 1200000 kB\nNode 1 Ignored Line\n')
         expected_meminfo = [{'numa_node': 0, 'size_kb': 1560000},
                             {'numa_node': 1, 'size_kb': 1200000}]
-        mock_open = mock.mock_open()
-        with mock.patch('builtins.open', mock_open):
-            mock_meminfo_file = mock.MagicMock()
-            mock_meminfo_file.__enter__.side_effect = reads
-            mock_open.return_value = mock_meminfo_file
-            ram = numa_insp.get_nodes_memory_info(numa_node_dirs)
+        ram = numa_insp.get_nodes_memory_info(self.node_dirs)
         self.assertListEqual(expected_meminfo, ram)
 
-    @mock.patch.object(numa_insp, 'get_numa_node_id', autospec=True)
-    def test_bad_nodes_memory_info(self, mock_node_id):
-        numa_node_dirs = ['/sys/devices/system/node/node0',
-                          '/sys/devices/system/node/node1']
-        mock_node_id.side_effect = [0, 1]
-        reads = [['Node 0 MemTotal: 1560000 kB'], IOError]
-        mock_open = mock.mock_open()
-        with mock.patch('builtins.open', mock_open):
-            mock_meminfo_file = mock.MagicMock()
-            mock_meminfo_file.__enter__.side_effect = reads
-            mock_open.return_value = mock_meminfo_file
-            self.assertRaises(errors.IncompatibleNumaFormatError,
-                              numa_insp.get_nodes_memory_info,
-                              numa_node_dirs)
+    def test_bad_nodes_memory_info(self):
+        self._write('node0', 'meminfo', 'Node 0 MemTotal: 1560000 kB\n')
+        self.assertRaises(errors.IncompatibleNumaFormatError,
+                          numa_insp.get_nodes_memory_info,
+                          self.node_dirs)
 
-    @mock.patch.object(numa_insp, 'get_numa_node_id', autospec=True)
-    def test_nodes_invalid_numa_format_memory_info(self, mock_node_id):
-        numa_node_dirs = ['/sys/devices/system/node/node0',
-                          '/sys/devices/system/node/node1']
-        mock_node_id.side_effect = [0, 1]
-        reads = [['Node 0: MemTotal: 1560000 kB'],
-                 ['Node 1 MemTotal: 1200000 kB']]
-        mock_open = mock.mock_open()
-        with mock.patch('builtins.open', mock_open):
-            mock_meminfo_file = mock.MagicMock()
-            mock_meminfo_file.__enter__.side_effect = reads
-            mock_open.return_value = mock_meminfo_file
-            self.assertRaises(errors.IncompatibleNumaFormatError,
-                              numa_insp.get_nodes_memory_info,
-                              numa_node_dirs)
+    def test_nodes_invalid_numa_format_memory_info(self):
+        self._write('node0', 'meminfo', 'Node 0: MemTotal: 1560000 kB\n')
+        self._write('node1', 'meminfo', 'Node 1 MemTotal: 1200000 kB\n')
+        self.assertRaises(errors.IncompatibleNumaFormatError,
+                          numa_insp.get_nodes_memory_info,
+                          self.node_dirs)
 
-    @mock.patch.object(numa_insp, 'get_numa_node_id', autospec=True)
-    def test_nodes_invalid_memory_unit(self, mock_node_id):
-        numa_node_dirs = ['/sys/devices/system/node/node0',
-                          '/sys/devices/system/node/node1']
-        mock_node_id.side_effect = [0, 1]
-        reads = [['Node 0 MemTotal: 1560000 TB'],
-                 ['Node 1 MemTotal: 1200000 kB']]
-        mock_open = mock.mock_open()
-        with mock.patch('builtins.open', mock_open):
-            mock_meminfo_file = mock.MagicMock()
-            mock_meminfo_file.__enter__.side_effect = reads
-            mock_open.return_value = mock_meminfo_file
-            self.assertRaises(errors.IncompatibleNumaFormatError,
-                              numa_insp.get_nodes_memory_info,
-                              numa_node_dirs)
+    def test_nodes_no_memory_info(self):
+        self._write('node0', 'meminfo', 'Node 0 MemFree: 1560000 kB\n')
+        self.assertRaises(errors.IncompatibleNumaFormatError,
+                          numa_insp.get_nodes_memory_info,
+                          self.node_dirs[:1])
+
+    def test_nodes_invalid_memory_unit(self):
+        self._write('node0', 'meminfo', 'Node 0 MemTotal: 1560000 TB\n')
+        self._write('node1', 'meminfo', 'Node 1 MemTotal: 1200000 kB\n')
+        self.assertRaises(errors.IncompatibleNumaFormatError,
+                          numa_insp.get_nodes_memory_info,
+                          self.node_dirs)
 
     @mock.patch.object(numa_insp, 'get_numa_node_id', autospec=True)
     def test_get_numa_node_id_invalid_format_memory_info(self,
@@ -213,52 +199,38 @@ class TestGetNumaTopologyInfo(base.IronicAgentTest):
                           numa_insp.get_nodes_memory_info,
                           numa_node_dirs)
 
-    @mock.patch.object(os.path, 'isdir', autospec=True)
-    @mock.patch.object(os, 'listdir', autospec=True)
-    @mock.patch.object(numa_insp, 'get_numa_node_id', autospec=True)
-    def test_get_nodes_cores_info(self, mock_node_id,
-                                  mock_listdir, mock_isdir):
-        numa_node_dirs = ['/sys/devices/system/node/node0',
-                          '/sys/devices/system/node/node1']
-        mock_node_id.side_effect = [0, 1]
-        mock_listdir.side_effect = [['cpu0', 'cpu1', 'cpu2',
-                                     'cpu3', 'cpu4'],
-                                    ['cpu5', 'cpu6', 'cpu7']]
-        mock_isdir.return_value = True
-        reads = ['0', '0', '1', '1', '1', '0', '0', '0']
+    def test_get_nodes_cores_info(self):
+        for thread, core in [(0, 0), (1, 0), (2, 1), (3, 1), (4, 1)]:
+            self._add_thread('node0', thread, core)
+        for thread in (5, 6, 7):
+            self._add_thread('node1', thread, 0)
+        # Not threads
+        self._write('node0', 'cpulist', '0-4\n')
+        os.mkdir(os.path.join(self.tempdir, 'node1', 'power'))
         expected_cores_info = [{'cpu': 0, 'numa_node': 0,
                                 'thread_siblings': [0, 1]},
                                {'cpu': 1, 'numa_node': 0,
                                 'thread_siblings': [2, 3, 4]},
                                {'cpu': 0, 'numa_node': 1,
                                 'thread_siblings': [5, 6, 7]}]
-        mock_open = mock.mock_open()
-        with mock.patch('builtins.open', mock_open):
-            mock_core_id_file = mock_open.return_value.read
-            mock_core_id_file.side_effect = reads
-            cpus = numa_insp.get_nodes_cores_info(numa_node_dirs)
+        cpus = numa_insp.get_nodes_cores_info(self.node_dirs)
         self.assertEqual(len(cpus), len(expected_cores_info))
         for cpu in cpus:
             self.assertIn(cpu, expected_cores_info)
 
-    @mock.patch.object(os.path, 'isdir', autospec=True)
-    @mock.patch.object(os, 'listdir', autospec=True)
-    @mock.patch.object(numa_insp, 'get_numa_node_id', autospec=True)
-    def test_bad_nodes_cores_info(self, mock_node_id,
-                                  mock_listdir, mock_isdir):
-        numa_node_dirs = ['/sys/devices/system/node/node0']
-        mock_node_id.return_value = 0
-        thread_dirs = ['cpu0', 'cpu1', 'cpu2', 'cpu3', 'cpu4', 'cpu5']
-        mock_listdir.return_value = thread_dirs
-        mock_isdir.return_value = True
-        reads = ['0', '0', '1', '1', '1', IOError]
-        mock_open = mock.mock_open()
-        with mock.patch('builtins.open', mock_open):
-            mock_core_id_file = mock_open.return_value.read
-            mock_core_id_file.side_effect = reads
-            self.assertRaises(errors.IncompatibleNumaFormatError,
-                              numa_insp.get_nodes_cores_info,
-                              numa_node_dirs)
+    def test_bad_nodes_cores_info(self):
+        for thread, core in [(0, 0), (1, 0), (2, 1), (3, 1), (4, 1)]:
+            self._add_thread('node0', thread, core)
+        os.mkdir(os.path.join(self.tempdir, 'node0', 'cpu5'))
+        self.assertRaises(errors.IncompatibleNumaFormatError,
+                          numa_insp.get_nodes_cores_info,
+                          self.node_dirs[:1])
+
+    def test_nodes_invalid_core_id(self):
+        self._add_thread('node0', 0, 'zero')
+        self.assertRaises(errors.IncompatibleNumaFormatError,
+                          numa_insp.get_nodes_cores_info,
+                          self.node_dirs[:1])
 
     @mock.patch.object(numa_insp, 'get_numa_node_id', autospec=True)
     def test_get_numa_node_id_invalid_format_cores_info(self,
@@ -269,81 +241,39 @@ class TestGetNumaTopologyInfo(base.IronicAgentTest):
                           numa_insp.get_nodes_cores_info,
                           numa_node_dirs)
 
-    @mock.patch.object(os.path, 'isdir', autospec=True)
-    @mock.patch.object(os, 'listdir', autospec=True)
-    @mock.patch.object(numa_insp, 'get_numa_node_id', autospec=True)
-    def test_nodes_invalid_threaddir_format_cores_info(self, mock_node_id,
-                                                       mock_listdir,
-                                                       mock_isdir):
-        numa_node_dirs = ['/sys/devices/system/node/node0']
-        mock_node_id.return_value = 0
-        thread_dirs = ['cpuid0', 'cpu1', 'cpu2', 'cpu3', 'cpu4', 'cpu5']
-        mock_listdir.return_value = thread_dirs
-        mock_isdir.return_value = True
-        reads = ['0', '0', '1', '1', '1', '2']
-        mock_open = mock.mock_open()
-        with mock.patch('builtins.open', mock_open):
-            mock_core_id_file = mock_open.return_value.read
-            mock_core_id_file.side_effect = reads
-            self.assertRaises(errors.IncompatibleNumaFormatError,
-                              numa_insp.get_nodes_cores_info,
-                              numa_node_dirs)
+    def test_nodes_invalid_threaddir_format_cores_info(self):
+        for thread, core in [(1, 0), (2, 1)]:
+            self._add_thread('node0', thread, core)
+        os.makedirs(os.path.join(self.tempdir, 'node0', 'cpuid0',
+                                 'topology'))
+        self.assertRaises(errors.IncompatibleNumaFormatError,
+                          numa_insp.get_nodes_cores_info,
+                          self.node_dirs[:1])
 
-    @mock.patch.object(os.path, 'isdir', autospec=True)
-    @mock.patch.object(os, 'listdir', autospec=True)
-    @mock.patch.object(numa_insp, 'get_numa_node_id', autospec=True)
-    def test_bad_nodes_thread_dirs(self, mock_node_id,
-                                   mock_listdir, mock_isdir):
-        numa_node_dirs = ['/sys/devices/system/node/node0']
-        mock_node_id.return_value = 0
-        mock_listdir.side_effect = errors.IncompatibleNumaFormatError("")
-        mock_isdir.return_value = True
+    def test_bad_nodes_thread_dirs(self):
         self.assertRaises(errors.IncompatibleNumaFormatError,
                           numa_insp.get_nodes_cores_info,
-                          numa_node_dirs)
+                          [os.path.join(self.tempdir, 'node2')])
 
-    @mock.patch.object(os.path, 'isfile', autospec=True)
-    @mock.patch.object(os, 'listdir', autospec=True)
-    def test_get_nodes_nics_info(self, mock_listdir, mock_isfile):
-        nic_dirs = ['enp0s01', 'enp0s02']
-        mock_listdir.return_value = nic_dirs
-        mock_isfile.return_value = True
-        reads = ['0', '1']
+    def test_get_nodes_nics_info(self):
+        self._write('net', 'enp0s01', 'device', 'numa_node', '0\n')
+        self._write('net', 'enp0s02', 'device', 'numa_node', '1\n')
+        # Virtual interfaces have no device
+        os.makedirs(os.path.join(self.tempdir, 'net', 'lo'))
         expected_nicsinfo = [{'name': 'enp0s01', 'numa_node': 0},
                              {'name': 'enp0s02', 'numa_node': 1}]
-        mock_open = mock.mock_open()
-        with mock.patch('builtins.open', mock_open):
-            mock_nicsinfo_file = mock_open.return_value.read
-            mock_nicsinfo_file.side_effect = reads
-            nics = numa_insp.get_nodes_nics_info('/sys/class/net/')
+        nics = numa_insp.get_nodes_nics_info(
+            os.path.join(self.tempdir, 'net'))
         self.assertListEqual(expected_nicsinfo, nics)
 
-    @mock.patch.object(os.path, 'isfile', autospec=True)
-    @mock.patch.object(os, 'listdir', autospec=True)
-    def test_bad_nodes_nics_info(self, mock_listdir, mock_isfile):
-        nic_dirs = ['enp0s01', 'enp0s02']
-        mock_listdir.return_value = nic_dirs
-        mock_isfile.return_value = True
-        reads = ['0', IOError]
-        mock_open = mock.mock_open()
-        with mock.patch('builtins.open', mock_open):
-            mock_nicsinfo_file = mock_open.return_value.read
-            mock_nicsinfo_file.side_effect = reads
-            self.assertRaises(errors.IncompatibleNumaFormatError,
-                              numa_insp.get_nodes_nics_info,
-                              '/sys/class/net/')
+    def test_bad_nodes_nics_info(self):
+        self._write('net', 'enp0s01', 'device', 'numa_node', '0\n')
+        self._write('net', 'enp0s02', 'device', 'numa_node', 'one\n')
+        self.assertRaises(errors.IncompatibleNumaFormatError,
+                          numa_insp.get_nodes_nics_info,
+                          os.path.join(self.tempdir, 'net'))
 
-    @mock.patch.object(os, 'listdir', autospec=True)
-    @mock.patch.object(os.path, 'isdir', autospec=True)
-    def test_no_nics_dir(self, mock_isdir, mock_listdir):
-        mock_isdir.return_value = False
-        nic_dirs = ['enp0s01', 'enp0s02']
-        mock_listdir.return_value = nic_dirs
-        reads = ['0', '1']
-        mock_open = mock.mock_open()
-        with mock.patch('builtins.open', mock_open):
-            mock_nicsinfo_file = mock_open.return_value.read
-            mock_nicsinfo_file.side_effect = reads
-            self.assertRaises(errors.IncompatibleNumaFormatError,
-                              numa_insp.get_nodes_nics_info,
-                              '/sys/class/net/')
+    def test_no_nics_dir(self):
+        self.assertRaises(errors.IncompatibleNumaFormatError,
+                          numa_insp.get_nodes_nics_info,
+                          os.path.join(self.tempdir, 'net'))
@@ -0,0 +1,193 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import struct
+import tempfile
+
+from ironic_python_agent import errors
+from ironic_python_agent import qcow2
+from ironic_python_agent.tests.unit import base
+
+CLUSTER_BITS = 9
+CLUSTER_SIZE = 1 << CLUSTER_BITS
+L2_ENTRIES = CLUSTER_SIZE // 8
+
+
+def _build_image(size, data, layout, zero=(), compressed=(), version=3,
+                 crypt=0):
+    """Build a QCOW2 image with the given placement of clusters.
+
+    :param size: Virtual size.
+    :param data: Dictionary of guest cluster index to cluster contents.
+    :param layout: List of ('l1',), ('l2', l1_index) and ('data', guest)
+                   items in the order they appear after the header and
+                   the refcount table.
+    :param zero: Guest clusters marked as reading as zeroes.
+    :param compressed: Guest clusters marked as compressed.
+    """
+    l1_size = -(-size // (CLUSTER_SIZE * L2_ENTRIES))
+    hosts = {item: index + 2 for index, item in enumerate(layout)}
+    l1 = [0] * l1_size
+    l2 = {}
+    for item, host in hosts.items():
+        if item[0] == 'l2':
+            l1[item[1]] = host << CLUSTER_BITS
+            l2[item[1]] = [0] * L2_ENTRIES
+    for item, host in hosts.items():
+        if item[0] == 'data':
+            l1_index, l2_index = divmod(item[1], L2_ENTRIES)
+            entry = host << CLUSTER_BITS
+            if item[1] in zero:
+                entry |= 1
+            if item[1] in compressed:
+                entry |= 1 << 62
+            l2[l1_index][l2_index] = entry
+
+    clusters = [b''] * (len(layout) + 2)
+    clusters[0] = (
+        qcow2._HEADER.pack(qcow2.MAGIC, version, 0, 0, CLUSTER_BITS, size,
+                           crypt, l1_size, hosts[('l1',)] << CLUSTER_BITS,
+                           1 << CLUSTER_BITS, 1, 0, 0)
+        + qcow2._HEADER_V3.pack(0, 0, 0, 4, qcow2.HEADER_SIZE))
+    for item, host in hosts.items():
+        if item[0] == 'l1':
+            clusters[host] = struct.pack('>%dQ' % l1_size, *l1)
+        elif item[0] == 'l2':
+            clusters[host] = struct.pack('>%dQ' % L2_ENTRIES, *l2[item[1]])
+        else:
+            clusters[host] = data[item[1]]
+    return b''.join(c.ljust(CLUSTER_SIZE, b'\0') for c in clusters)
+
+
+def _chunks(data, size):
+    return [data[pos:pos + size] for pos in range(0, len(data), size)]
+
+
+class TestStreamConverter(base.IronicAgentTest):
+
+    def setUp(self):
+        super(TestStreamConverter, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.tempdir))
+        self.path = os.path.join(self.tempdir, 'device')
+        # Stale data on the target must not survive the conversion
+        with open(self.path, 'wb') as f:
+            f.write(b'x' * 200 * CLUSTER_SIZE)
+        # Two L2 tables
+        self.size = 100 * CLUSTER_SIZE
+        self.data = {i: os.urandom(CLUSTER_SIZE) for i in (0, 5, 70, 99)}
+
+    def _expected(self, skip=()):
+        expected = bytearray(self.size)
+        for guest, content in self.data.items():
+            if guest not in skip:
+                offset = guest * CLUSTER_SIZE
+                expected[offset:offset + CLUSTER_SIZE] = content
+        return bytes(expected) + b'x' * 100 * CLUSTER_SIZE
+
+    def _convert(self, image, chunk_size=1000, spill_size=CLUSTER_SIZE * 8):
+        with open(self.path, 'r+b') as f:
+            converter = qcow2.StreamConverter(f.fileno(), spill_size,
+                                              image_size=len(image),
+                                              spill_dir=self.tempdir)
+            size = converter.write(_chunks(image, chunk_size))
+        with open(self.path, 'rb') as f:
+            return size, f.read()
+
+    def _data_items(self):
+        return [('data', guest) for guest in sorted(self.data)]
+
+    def test_tables_first(self):
+        image = _build_image(self.size, self.data,
+                             [('l1',), ('l2', 0), ('l2', 1)]
+                             + self._data_items())
+        self.assertEqual((self.size, self._expected()), self._convert(image))
+        self.assertEqual(['device'], os.listdir(self.tempdir))
+
+    def test_interleaved(self):
+        image = _build_image(self.size, self.data,
+                             [('l1',), ('l2', 0), ('data', 5), ('data', 0),
+                              ('l2', 1), ('data', 99), ('data', 70)])
+        self.assertEqual((self.size, self._expected()),
+                         self._convert(image, chunk_size=7))
+
+    def test_data_before_tables(self):
+        image = _build_image(self.size, self.data,
+                             [('l1',), ('data', 5), ('data', 70),
+                              ('l2', 1), ('data', 99), ('data', 0),
+                              ('l2', 0)])
+        self.assertEqual((self.size, self._expected()), self._convert(image))
+
+    def test_l1_last(self):
+        image = _build_image(self.size, self.data,
+                             [('l2', 0), ('l2', 1)] + self._data_items()
+                             + [('l1',)])
+        self.assertEqual((self.size, self._expected()), self._convert(image))
+
+    def test_spill_exceeded(self):
+        image = _build_image(self.size, self.data,
+                             self._data_items() + [('l1',), ('l2', 0),
+                                                   ('l2', 1)])
+        self.assertRaisesRegex(qcow2.UnsupportedImage, 'arrived before',
+                               self._convert, image,
+                               spill_size=3 * CLUSTER_SIZE)
+
+    def test_zero_clusters(self):
+        image = _build_image(self.size, self.data,
+                             [('l1',), ('l2', 0), ('l2', 1)]
+                             + self._data_items(), zero=(5,))
+        self.assertEqual((self.size, self._expected(skip=(5,))),
+                         self._convert(image))
+
+    def test_compressed(self):
+        image = _build_image(self.size, self.data,
+                             [('l1',), ('l2', 0), ('l2', 1)]
+                             + self._data_items(), compressed=(70,))
+        self.assertRaisesRegex(qcow2.UnsupportedImage, 'Compressed',
+                               self._convert, image)
+
+    def test_encrypted(self):
+        image = _build_image(self.size, self.data,
+                             [('l1',), ('l2', 0), ('l2', 1)]
+                             + self._data_items(), crypt=1)
+        self.assertRaises(qcow2.UnsupportedImage, self._convert, image)
+
+    def test_version_2(self):
+        # Version 2 has no zero flag, the entry is a regular cluster
+        image = _build_image(self.size, self.data,
+                             [('l1',), ('l2', 0), ('l2', 1)]
+                             + self._data_items(), version=2)
+        self.assertEqual((self.size, self._expected()), self._convert(image))
+
+    def test_truncated(self):
+        image = _build_image(self.size, self.data,
+                             [('l1',), ('l2', 0), ('l2', 1)]
+                             + self._data_items())
+        self.assertRaisesRegex(errors.InvalidImage, 'ended before',
+                               self._convert, image[:-CLUSTER_SIZE])
+
+    def test_not_qcow2(self):
+        self.assertRaisesRegex(errors.InvalidImage, 'Not a QCOW2',
+                               self._convert, b'\0' * 4 * CLUSTER_SIZE)
+
+    def test_too_short(self):
+        self.assertRaisesRegex(errors.InvalidImage, 'too short',
+                               self._convert, b'QFI\xfb')
+
+    def test_empty_image(self):
+        self.size = 0
+        self.data = {}
+        image = _build_image(self.size, self.data, [('l1',)])
+        self.assertEqual((0, b'x' * 200 * CLUSTER_SIZE),
+                         self._convert(image))
@@ -13,6 +13,7 @@
 Tests for the RequestLogMiddleware
 """
 
+import itertools
 from unittest import mock
 
 from ironic_python_agent.api import request_log
@@ -44,7 +45,9 @@ class TestRequestLogMiddleware(base.IronicAgentTest):
         self.mock_time = mock.patch.object(
             request_log, 'time', autospec=True
         ).start()
-        self.mock_time.time.side_effect = [1000.0, 1000.5]  # 500ms duration
+        # 500ms duration
+        self.mock_time.time.side_effect = itertools.chain(
+            [1000.0], itertools.repeat(1000.5))
 
     def test_successful_get_request(self):
         """Test logging of a successful GET request."""
@@ -194,11 +197,76 @@ class TestRequestLogMiddleware(base.IronicAgentTest):
 
         response = self.middleware(environ, start_response)
 
-        # Response should be consumed and converted to list
-        self.assertEqual(response, [b'part1', b'part2'])
+        # Response should be passed through and logged once closed
+        self.mock_log.info.assert_not_called()
+        self.assertEqual([b'part1', b'part2'], list(response))
+        response.close()
+        response.close()
 
         self.mock_log.info.assert_called_once()
 
+    def test_event_stream_response(self):
+        """Test that event streams are not consumed."""
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': '/v1/commands/abc/events',
+            'QUERY_STRING': ''
+        }
+
+        def start_response(status, headers, exc_info=None):
+            return None
+
+        closed = []
+
+        def stream():
+            try:
+                while True:
+                    yield b'data: 1\n\n'
+            finally:
+                closed.append(True)
+
+        def mock_app_call(env, sr):
+            sr('200 OK', [('Content-Type', 'text/event-stream')])
+            return stream()
+
+        self.mock_app.side_effect = mock_app_call
+
+        response = self.middleware(environ, start_response)
+        # The client disconnects in the middle of the stream
+        self.assertEqual(b'data: 1\n\n', next(iter(response)))
+        response.close()
+
+        self.assertEqual([True], closed)
+        self.mock_log.info.assert_called_once()
+
+    @mock.patch.object(request_log.metrics_utils, 'get_metrics_logger',
+                       autospec=True)
+    def test_metrics_and_server_timing(self, mock_get_logger):
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': '/v1/commands/abc',
+            'QUERY_STRING': ''
+        }
+        start_response = mock.Mock()
+
+        def mock_app_call(env, sr):
+            env[request_log.ENDPOINT_KEY] = 'get_command'
+            sr('404 Not Found', [('Server-Timing', 'serialize;dur=0.1')])
+            return [b'response']
+
+        self.mock_app.side_effect = mock_app_call
+
+        self.middleware(environ, start_response)
+
+        start_response.assert_called_once_with(
+            '404 Not Found', [('Server-Timing', 'serialize;dur=0.1'),
+                              ('Server-Timing', 'app;dur=500.0')], None)
+        metrics = mock_get_logger.return_value
+        metrics.send_timer.assert_called_once_with('request.get_command',
+                                                   500.0)
+        metrics.send_counter.assert_called_once_with(
+            'status.get_command.404', 1)
+
     def test_missing_environ_values(self):
         """Test handling of missing environ values."""
         environ = {}  # Empty environ
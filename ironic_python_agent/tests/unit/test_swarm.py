@@ -0,0 +1,348 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import requests
+
+from ironic_python_agent import errors
+from ironic_python_agent import swarm
+from ironic_python_agent.tests.unit import base
+from ironic_python_agent import utils
+
+CHUNK_SIZE = 1024
+KEY = 'sha256-abcd'
+
+
+class _FakePeers(object):
+    """Serves an image on behalf of several peers."""
+
+    def __init__(self, data, available, corrupt=()):
+        self.data = data
+        self.manifest = {
+            'algo': 'sha256', 'chunk_size': CHUNK_SIZE, 'size': len(data),
+            'chunks': [hashlib.sha256(data[i:i + CHUNK_SIZE]).hexdigest()
+                       for i in range(0, len(data), CHUNK_SIZE)]}
+        self.available = available
+        self.corrupt = corrupt
+        self.requests = []
+
+    def get(self, url, timeout, headers):
+        self.requests.append(url)
+        peer, path = url.split('/v1/swarm/')
+        assert swarm.verify(headers['Authorization'], '/v1/swarm/' + path)
+        if peer not in self.available:
+            raise requests.ConnectionError('refused')
+        resp = mock.Mock(status_code=200)
+        if '/' not in path:
+            resp.json.return_value = {'manifest': self.manifest,
+                                      'available': self.available[peer]}
+            return resp
+        index = int(path.split('/')[1])
+        if index not in self.available[peer]:
+            resp.status_code = 404
+        elif peer in self.corrupt:
+            resp.content = b'x' * CHUNK_SIZE
+        else:
+            resp.content = self.data[index * CHUNK_SIZE:
+                                     (index + 1) * CHUNK_SIZE]
+        return resp
+
+    def close(self):
+        pass
+
+
+@mock.patch('time.time', autospec=True, return_value=1000000)
+class TestSignature(base.IronicAgentTest):
+
+    def setUp(self):
+        super(TestSignature, self).setUp()
+        self.config(image_swarm=True, image_swarm_key='secret')
+
+    def test_verify(self, mock_time):
+        authorization = swarm.sign('/v1/swarm/%s' % KEY)
+        self.assertTrue(authorization.startswith('IPA-Swarm 1000000:'))
+        self.assertTrue(swarm.verify(authorization, '/v1/swarm/%s' % KEY))
+        mock_time.return_value += 300
+        self.assertTrue(swarm.verify(authorization, '/v1/swarm/%s' % KEY))
+
+    def test_wrong_path(self, mock_time):
+        authorization = swarm.sign('/v1/swarm/%s' % KEY)
+        self.assertFalse(swarm.verify(authorization, '/v1/swarm/%s/0' % KEY))
+
+    def test_wrong_key(self, mock_time):
+        authorization = swarm.sign('/v1/swarm/%s' % KEY)
+        self.config(image_swarm_key='other')
+        self.assertFalse(swarm.verify(authorization, '/v1/swarm/%s' % KEY))
+
+    def test_expired(self, mock_time):
+        authorization = swarm.sign('/v1/swarm/%s' % KEY)
+        mock_time.return_value += 301
+        self.assertFalse(swarm.verify(authorization, '/v1/swarm/%s' % KEY))
+
+    def test_malformed(self, mock_time):
+        for authorization in (None, '', 'Bearer abcd', 'IPA-Swarm abcd',
+                              'IPA-Swarm x:abcd', 'IPA-Swarm 1000000:'):
+            self.assertFalse(swarm.verify(authorization,
+                                          '/v1/swarm/%s' % KEY))
+
+    def test_disabled(self, mock_time):
+        authorization = swarm.sign('/v1/swarm/%s' % KEY)
+        self.config(image_swarm=False)
+        self.assertFalse(swarm.verify(authorization, '/v1/swarm/%s' % KEY))
+
+
+class TestSharing(base.IronicAgentTest):
+
+    def setUp(self):
+        super(TestSharing, self).setUp()
+        self.config(image_swarm=True, image_swarm_chunk_size=1,
+                    image_swarm_key='secret')
+        self.addCleanup(swarm._IMAGES.clear)
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.tempdir))
+        self.path = os.path.join(self.tempdir, 'image')
+        self.data = os.urandom(2 * 1024 * 1024 + 5)
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+    def test_build_manifest(self):
+        manifest = swarm.build_manifest(self.path, 1024 * 1024)
+        self.assertEqual(
+            {'algo': 'sha256', 'chunk_size': 1024 * 1024,
+             'size': len(self.data),
+             'chunks': [hashlib.sha256(self.data[:1024 * 1024]).hexdigest(),
+                        hashlib.sha256(self.data[1024 * 1024:-5]).hexdigest(),
+                        hashlib.sha256(self.data[-5:]).hexdigest()]},
+            manifest)
+
+    def test_share(self):
+        self.assertIsNone(swarm.describe(KEY))
+        swarm.share(KEY, self.path).join()
+        info = swarm.describe(KEY)
+        self.assertEqual([0, 1, 2], info['available'])
+        self.assertEqual(swarm.build_manifest(self.path, 1024 * 1024),
+                         info['manifest'])
+        self.assertEqual(self.data[1024 * 1024:2 * 1024 * 1024],
+                         swarm.read_chunk(KEY, 1))
+        self.assertEqual(self.data[-5:], swarm.read_chunk(KEY, 2))
+        self.assertIsNone(swarm.read_chunk(KEY, 3))
+        self.assertIsNone(swarm.read_chunk('sha256-ef', 0))
+
+    def test_share_disabled(self):
+        self.config(image_swarm=False)
+        self.assertIsNone(swarm.share(KEY, self.path))
+        self.assertIsNone(swarm.describe(KEY))
+
+    def test_share_no_key(self):
+        self.config(image_swarm_key=None)
+        self.assertIsNone(swarm.share(KEY, self.path))
+        self.assertIsNone(swarm.describe(KEY))
+
+    def test_share_known_manifest(self):
+        manifest = swarm.build_manifest(self.path, 1024 * 1024)
+        swarm._share(KEY, '/nonexistent', manifest, bytearray(b'\0\1\0'))
+        self.assertIsNone(swarm.read_chunk(KEY, 0))
+        self.assertIsNone(swarm.share(KEY, self.path))
+        self.assertEqual({'manifest': manifest, 'available': [0, 1, 2]},
+                         swarm.describe(KEY))
+
+    def test_removed(self):
+        swarm.share(KEY, self.path).join()
+        os.unlink(self.path)
+        self.assertIsNone(swarm.read_chunk(KEY, 0))
+        self.assertIsNone(swarm.describe(KEY))
+        self.assertNotIn(KEY, swarm._IMAGES)
+
+
+@mock.patch.object(utils, 'get_requests_session', autospec=True)
+@mock.patch.object(swarm, 'discover_peers', autospec=True)
+class TestDownload(base.IronicAgentTest):
+
+    def setUp(self):
+        super(TestDownload, self).setUp()
+        self.config(image_swarm=True, image_swarm_key='secret')
+        self.addCleanup(swarm._IMAGES.clear)
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.tempdir))
+        self.location = os.path.join(self.tempdir, 'image')
+        self.data = os.urandom(10 * CHUNK_SIZE + 100)
+        self.image_info = {
+            'id': 'fake-image', 'os_hash_algo': 'sha256',
+            'os_hash_value': hashlib.sha256(self.data).hexdigest()}
+        self.origin = mock.Mock(
+            side_effect=lambda start, end: self.data[start:end + 1])
+
+    def _download(self, image_size=None):
+        return swarm.download(self.image_info, KEY, self.location,
+                              self.origin, image_size=image_size)
+
+    def _check(self):
+        with open(self.location, 'rb') as f:
+            self.assertEqual(self.data, f.read())
+        self.assertEqual(list(range(11)), swarm.describe(KEY)['available'])
+
+    def test_no_peers(self, mock_discover, mock_session):
+        mock_discover.return_value = []
+        self.assertFalse(self._download())
+        mock_session.assert_not_called()
+        self.assertFalse(os.path.exists(self.location))
+
+    def test_not_held(self, mock_discover, mock_session):
+        mock_discover.return_value = ['http://peer1', 'http://peer2']
+        mock_session.return_value.get.return_value = mock.Mock(
+            status_code=404)
+        self.assertFalse(self._download())
+        self.assertFalse(os.path.exists(self.location))
+        self.assertIsNone(swarm.describe(KEY))
+
+    def test_download(self, mock_discover, mock_session):
+        mock_discover.return_value = ['http://peer1', 'http://peer2',
+                                      'http://peer3']
+        peers = _FakePeers(self.data, {'http://peer1': list(range(6)),
+                                       'http://peer2': list(range(4, 11))})
+        mock_session.return_value = peers
+        self.assertTrue(self._download())
+        self._check()
+        self.origin.assert_not_called()
+
+    def test_missing_chunks(self, mock_discover, mock_session):
+        mock_discover.return_value = ['http://peer1']
+        peers = _FakePeers(self.data, {'http://peer1': [0, 1, 2]})
+        mock_session.return_value = peers
+        self.assertTrue(self._download())
+        self._check()
+        self.assertEqual(8, self.origin.call_count)
+        self.origin.assert_any_call(10 * CHUNK_SIZE, 10 * CHUNK_SIZE + 99)
+
+    def test_corrupted_chunks(self, mock_discover, mock_session):
+        mock_discover.return_value = ['http://peer1', 'http://peer2']
+        peers = _FakePeers(self.data, {'http://peer1': list(range(11)),
+                                       'http://peer2': list(range(11))},
+                           corrupt=['http://peer2'])
+        mock_session.return_value = peers
+        self.assertTrue(self._download())
+        self._check()
+        self.origin.assert_not_called()
+
+    def test_origin_mismatch(self, mock_discover, mock_session):
+        mock_discover.return_value = ['http://peer1']
+        peers = _FakePeers(self.data, {'http://peer1': []})
+        mock_session.return_value = peers
+        self.origin.side_effect = lambda start, end: b'x' * (end - start + 1)
+        self.assertRaisesRegex(swarm.SwarmError, 'does not match',
+                               self._download)
+        self.assertIsNone(swarm.describe(KEY))
+
+    def test_checksum_mismatch(self, mock_discover, mock_session):
+        mock_discover.return_value = ['http://peer1']
+        peers = _FakePeers(self.data, {'http://peer1': list(range(11))})
+        mock_session.return_value = peers
+        self.image_info['os_hash_value'] = 'abcd'
+        self.assertRaises(errors.ImageChecksumError, self._download)
+        self.assertIsNone(swarm.describe(KEY))
+
+    def test_size_matches(self, mock_discover, mock_session):
+        mock_discover.return_value = ['http://peer1']
+        mock_session.return_value = _FakePeers(
+            self.data, {'http://peer1': list(range(11))})
+        self.assertTrue(self._download(image_size=len(self.data)))
+        self._check()
+
+    def test_size_mismatch(self, mock_discover, mock_session):
+        mock_discover.return_value = ['http://peer1']
+        peers = _FakePeers(self.data, {'http://peer1': list(range(11))})
+        mock_session.return_value = peers
+        self.assertRaisesRegex(swarm.SwarmError, 'image server reports',
+                               self._download, image_size=len(self.data) - 1)
+        self.assertFalse(os.path.exists(self.location))
+        self.assertEqual(['http://peer1/v1/swarm/%s' % KEY], peers.requests)
+        self.assertIsNone(swarm.describe(KEY))
+
+    @mock.patch('os.statvfs', autospec=True)
+    def test_no_space(self, mock_statvfs, mock_discover, mock_session):
+        mock_statvfs.return_value = mock.Mock(f_bavail=10, f_frsize=1024)
+        mock_discover.return_value = ['http://peer1']
+        mock_session.return_value = _FakePeers(
+            self.data, {'http://peer1': list(range(11))})
+        self.assertRaisesRegex(swarm.SwarmError, 'free space',
+                               self._download)
+        self.assertFalse(os.path.exists(self.location))
+        mock_statvfs.assert_called_once_with(self.tempdir)
+
+    def test_invalid_manifest(self, mock_discover, mock_session):
+        mock_discover.return_value = ['http://peer1', 'http://peer2']
+        peers = _FakePeers(self.data, {'http://peer1': list(range(11)),
+                                       'http://peer2': list(range(11))})
+        good_get = peers.get
+
+        def _get(url, timeout, headers):
+            resp = good_get(url, timeout, headers)
+            if url == 'http://peer1/v1/swarm/%s' % KEY:
+                resp.json.return_value = {'manifest': {'chunks': []},
+                                          'available': []}
+            return resp
+
+        peers.get = _get
+        mock_session.return_value = peers
+        self.assertTrue(self._download())
+        self._check()
+        self.assertFalse([url for url in peers.requests
+                          if url.startswith('http://peer1/v1/swarm/%s/'
+                                            % KEY)])
+
+
+@mock.patch.object(swarm.mdns, 'Zeroconf', autospec=True)
+class TestDiscovery(base.IronicAgentTest):
+
+    def setUp(self):
+        super(TestDiscovery, self).setUp()
+        self.addCleanup(setattr, swarm, '_ZEROCONF', None)
+        self.addCleanup(setattr, swarm, '_SELF_URL', None)
+
+    def test_discover(self, mock_zc):
+        self.config(image_swarm_peers=['http://10.0.0.1:9999/'])
+        mock_zc.return_value.find_endpoints.return_value = [
+            ('baremetal-agent-swarm-a', 'http://10.0.0.2:9999', {}),
+            ('baremetal-agent-swarm-b', 'http://10.0.0.1:9999', {}),
+        ]
+        self.assertEqual(['http://10.0.0.1:9999', 'http://10.0.0.2:9999'],
+                         swarm.discover_peers())
+        mock_zc.return_value.find_endpoints.assert_called_once_with(
+            swarm.SERVICE_PREFIX, mock.ANY, skip_loopback=False)
+        mock_zc.return_value.close.assert_called_once_with()
+
+    def test_discover_mdns_fails(self, mock_zc):
+        self.config(image_swarm_peers=['http://10.0.0.1:9999'])
+        mock_zc.side_effect = OSError('no multicast')
+        self.assertEqual(['http://10.0.0.1:9999'], swarm.discover_peers())
+
+    def test_announce(self, mock_zc):
+        swarm.announce('http://[fd00::1]:9999')
+        mock_zc.return_value.register_service.assert_called_once_with(
+            'baremetal-agent-swarm-fd00-1-9999', 'http://[fd00::1]:9999')
+
+        # Discovery reuses the instance and skips the local agent
+        mock_zc.return_value.find_endpoints.return_value = [
+            ('baremetal-agent-swarm-fd00-1-9999', 'http://[fd00::1]:9999',
+             {}),
+        ]
+        self.assertEqual([], swarm.discover_peers())
+        mock_zc.return_value.close.assert_not_called()
+
+        swarm.withdraw()
+        mock_zc.return_value.close.assert_called_once_with()
+        self.assertIsNone(swarm._ZEROCONF)
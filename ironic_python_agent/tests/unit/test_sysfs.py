@@ -0,0 +1,109 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import tempfile
+
+from ironic_python_agent import sysfs
+from ironic_python_agent.tests.unit import base
+
+
+class TestSysfs(base.IronicAgentTest):
+
+    def setUp(self):
+        super(TestSysfs, self).setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.tempdir))
+        self.device = os.path.join(self.tempdir, 'device')
+        os.mkdir(self.device)
+        self._write('vendor', '0x8086\n')
+        self._write('device', '0x1572\n')
+
+    def _write(self, name, value):
+        with open(os.path.join(self.device, name), 'w') as f:
+            f.write(value)
+
+    def test_read(self):
+        self.assertEqual('0x8086',
+                         sysfs.read(os.path.join(self.device, 'vendor')))
+        self.assertIsNone(sysfs.read(os.path.join(self.device, 'missing')))
+        self.assertIsNone(sysfs.read(self.device))
+
+    def test_read_many(self):
+        self.assertEqual({'vendor': '0x8086', 'device': '0x1572',
+                          'missing': None},
+                         sysfs.read_many(self.device,
+                                         ['vendor', 'device', 'missing']))
+
+    def test_read_many_large(self):
+        self._write('modalias', 'x' * 10000 + '\n')
+        self.assertEqual('x' * 10000,
+                         sysfs.read_many(self.device,
+                                         ['modalias'])['modalias'])
+
+    def test_read_many_missing_directory(self):
+        self.assertEqual({'vendor': None},
+                         sysfs.read_many(os.path.join(self.tempdir, 'none'),
+                                         ['vendor']))
+
+    def test_list_directory(self):
+        os.symlink(self.device, os.path.join(self.tempdir, 'link'))
+        self._write('../file', '')
+        self.assertEqual(
+            [sysfs.Entry('device', self.device, True),
+             sysfs.Entry('file', os.path.join(self.tempdir, 'file'), False),
+             sysfs.Entry('link', os.path.join(self.tempdir, 'link'), True)],
+            sysfs.list_directory(self.tempdir))
+        self.assertRaises(OSError, sysfs.list_directory,
+                          os.path.join(self.tempdir, 'none'))
+
+    def test_readlink(self):
+        os.mkdir(os.path.join(self.tempdir, 'drivers'))
+        os.symlink('../drivers/i40e', os.path.join(self.device, 'driver'))
+        self.assertEqual('i40e', sysfs.readlink(
+            os.path.join(self.device, 'driver')))
+        self.assertRaises(FileNotFoundError, sysfs.readlink,
+                          os.path.join(self.device, 'missing'))
+
+    def test_not_memoized(self):
+        path = os.path.join(self.device, 'vendor')
+        self.assertEqual('0x8086', sysfs.read(path))
+        self._write('vendor', '0x15b3\n')
+        self.assertEqual('0x15b3', sysfs.read(path))
+
+    def test_memoize(self):
+        path = os.path.join(self.device, 'vendor')
+        link = os.path.join(self.device, 'driver')
+        with sysfs.memoize():
+            self.assertEqual('0x8086', sysfs.read(path))
+            self.assertEqual({'vendor': '0x8086'},
+                             sysfs.read_many(self.device, ['vendor']))
+            names = [e.name for e in sysfs.list_directory(self.device)]
+            self.assertRaises(FileNotFoundError, sysfs.readlink, link)
+
+            self._write('vendor', '0x15b3\n')
+            self._write('carrier', '1\n')
+            os.symlink('i40e', link)
+            with sysfs.memoize():
+                self.assertEqual('0x8086', sysfs.read(path))
+            self.assertEqual({'vendor': '0x8086'},
+                             sysfs.read_many(self.device, ['vendor']))
+            self.assertEqual(names, [e.name for e in
+                                     sysfs.list_directory(self.device)])
+            self.assertRaises(FileNotFoundError, sysfs.readlink, link)
+            self.assertEqual('0x15b3', sysfs.read(path, memoize=False))
+
+        self.assertEqual('0x15b3', sysfs.read(path))
+        self.assertEqual('i40e', sysfs.readlink(link))
+        self.assertIn('carrier', [e.name for e in
+                                  sysfs.list_directory(self.device)])
@@ -17,11 +17,13 @@ import base64
 import errno
 import glob
 import io
+import multiprocessing.pool
 import os
 import shutil
 import subprocess
 import tarfile
 import tempfile
+import threading
 import time
 from unittest import mock
 
@@ -31,6 +33,7 @@ import testtools
 
 from ironic_python_agent import errors
 from ironic_python_agent import hardware
+from ironic_python_agent.metrics_lib import metrics_utils
 from ironic_python_agent.tests.unit import base
 from ironic_python_agent import utils
 
@@ -336,6 +339,17 @@ class TestFailures(testtools.TestCase):
         f.add('foo')
         self.assertRaisesRegex(FakeException, 'foo', f.raise_if_needed)
 
+    def test_add_from_threads(self):
+        f = utils.AccumulatedFailures()
+        threads = [threading.Thread(target=lambda i=i: [f.add('%d', i)
+                                                        for _ in range(100)])
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(800, f.get_error().count('\n* '))
+
 
 class TestUtils(base.IronicAgentTest):
 
@@ -1560,6 +1574,202 @@ class ExecuteTestCase(base.IronicAgentTest):
         self.assertIn('not found', args[0])
 
 
+@mock.patch.object(processutils, 'execute', autospec=True,
+                   return_value=('stdout', 'stderr'))
+class ExecuteCacheTestCase(base.IronicAgentTest):
+    block_execute = False
+
+    def setUp(self):
+        super(ExecuteCacheTestCase, self).setUp()
+        self.config(execute_cache_ttl=60)
+
+    def test_disabled(self, execute_mock):
+        self.config(execute_cache_ttl=0)
+        utils.execute('lsblk', '-J')
+        utils.execute('lsblk', '-J')
+        self.assertEqual(2, execute_mock.call_count)
+        self.assertEqual({'hits': 0, 'misses': 0, 'invalidations': 0,
+                          'entries': 0}, utils.get_execute_cache_stats())
+
+    def test_cached(self, execute_mock):
+        for _i in range(3):
+            self.assertEqual(('stdout', 'stderr'),
+                             utils.execute('lsblk', '-J'))
+        utils.execute('/usr/sbin/dmidecode', '--type', 'memory')
+        utils.execute('dmidecode', '--type', 'memory')
+        execute_mock.assert_has_calls([
+            mock.call('lsblk', '-J'),
+            mock.call('/usr/sbin/dmidecode', '--type', 'memory'),
+            mock.call('dmidecode', '--type', 'memory')])
+        self.assertEqual(3, execute_mock.call_count)
+        self.assertEqual({'hits': 2, 'misses': 3, 'invalidations': 0,
+                          'entries': 3}, utils.get_execute_cache_stats())
+
+    def test_keyed_by_environment(self, execute_mock):
+        utils.execute('lscpu', env_variables={'LC_ALL': 'C'})
+        utils.execute('lscpu', env_variables={'LC_ALL': 'C.UTF-8'})
+        utils.execute('lscpu', env_variables={'LC_ALL': 'C'})
+        utils.execute('lscpu')
+        self.assertEqual(3, execute_mock.call_count)
+
+    @mock.patch.object(time, 'monotonic', autospec=True)
+    def test_expired(self, mock_time, execute_mock):
+        mock_time.return_value = 100
+        utils.execute('lshw', '-json')
+        mock_time.return_value = 159
+        utils.execute('lshw', '-json')
+        self.assertEqual(1, execute_mock.call_count)
+        mock_time.return_value = 160
+        utils.execute('lshw', '-json')
+        self.assertEqual(2, execute_mock.call_count)
+
+    def test_not_read_only(self, execute_mock):
+        for cmd in [('mdadm', '--detail', '/dev/md0'),
+                    ('sgdisk', '-v', '/dev/sda'),
+                    ('ip', 'link'),
+                    ('lsblk -J', )]:
+            utils.execute(*cmd, shell=len(cmd) == 1)
+            utils.execute(*cmd, shell=len(cmd) == 1)
+        # Only the first two are cached, ip is unknown and shell commands
+        # are not parsed
+        self.assertEqual(6, execute_mock.call_count)
+        self.assertEqual(0, utils.get_execute_cache_stats()['invalidations'])
+
+    def test_invalidated(self, execute_mock):
+        for cmd in [('parted', '/dev/sda', 'print'),
+                    ('sgdisk', '-Z', '/dev/sda'),
+                    ('mdadm', '--create', '/dev/md0'),
+                    ('wipefs', '--all', '/dev/sda'),
+                    ('mkfs.ext4', '/dev/sda1')]:
+            utils.execute('blkid', '/dev/sda1')
+            utils.execute('mdadm', '--detail', '/dev/md0')
+            execute_mock.reset_mock()
+            utils.execute(*cmd)
+            utils.execute('blkid', '/dev/sda1')
+            utils.execute('mdadm', '--detail', '/dev/md0')
+            self.assertEqual(3, execute_mock.call_count, cmd)
+        # Before and after each mutating command
+        self.assertEqual(10, utils.get_execute_cache_stats()['invalidations'])
+
+    def test_failure_not_cached(self, execute_mock):
+        execute_mock.side_effect = [processutils.ProcessExecutionError(),
+                                    ('stdout', 'stderr')]
+        self.assertRaises(processutils.ProcessExecutionError,
+                          utils.execute, 'blkid', '/dev/sda1')
+        utils.execute('blkid', '/dev/sda1')
+        utils.execute('blkid', '/dev/sda1')
+        self.assertEqual(2, execute_mock.call_count)
+
+    def test_invalidated_while_running(self, execute_mock):
+        def _execute(*cmd, **kwargs):
+            # Another thread changes the partitions in the meantime
+            utils._EXECUTE_CACHE.invalidate()
+            return 'stale', ''
+
+        execute_mock.side_effect = _execute
+        self.assertEqual(('stale', ''), utils.execute('blkid', '/dev/sda1'))
+        execute_mock.side_effect = None
+        self.assertEqual(('stdout', 'stderr'),
+                         utils.execute('blkid', '/dev/sda1'))
+
+    @mock.patch.object(utils, '_send_execute_cache_counter', autospec=True)
+    def test_counters_sent(self, mock_send, execute_mock):
+        utils.execute('lsblk')
+        utils.execute('lsblk')
+        mock_send.assert_has_calls([mock.call('miss'), mock.call('hit')])
+
+
+@mock.patch.object(processutils, 'execute', autospec=True)
+class ExecutionHistoryTestCase(base.IronicAgentTest):
+    block_execute = False
+
+    @mock.patch.object(metrics_utils, 'get_metrics_logger', autospec=True)
+    def test_success(self, mock_metrics, execute_mock):
+        execute_mock.return_value = ('12345', '')
+        with utils.execution_step('erase_devices'):
+            utils.execute('/sbin/mkfs.ext4', '-L', 'root', '/dev/sda1')
+        utils.execute('tool', '--password', 'secret', 'print')
+
+        history = utils.get_execution_history()
+        self.assertEqual(2, len(history))
+        entry = history[0]
+        self.assertEqual('/sbin/mkfs.ext4 -L root /dev/sda1',
+                         entry['command'])
+        self.assertEqual('mkfs', entry['program'])
+        self.assertEqual('erase_devices', entry['step'])
+        self.assertEqual(0, entry['exit_code'])
+        self.assertEqual(5, entry['stdout_size'])
+        self.assertEqual(0, entry['stderr_size'])
+        self.assertGreaterEqual(entry['duration'], 0)
+        self.assertLessEqual(entry['started_at'], time.time())
+        self.assertEqual('tool --password *** print', history[1]['command'])
+        self.assertIsNone(history[1]['step'])
+        mock_metrics.return_value.send_timer.assert_has_calls([
+            mock.call('execute.mkfs', mock.ANY),
+            mock.call('execute.tool', mock.ANY)])
+
+    def test_worker_threads(self, execute_mock):
+        execute_mock.return_value = ('', '')
+        pool = multiprocessing.pool.ThreadPool(1)
+        self.addCleanup(pool.terminate)
+
+        with utils.execution_step('erase_devices'):
+            pool.apply(utils.execute, ('lsblk',))
+            pool.apply(utils.in_execution_step(utils.execute), ('shred',))
+        with utils.execution_step('other'):
+            wrapped = utils.in_execution_step(utils.execute)
+        pool.apply(wrapped, ('wipefs',))
+
+        self.assertEqual([('lsblk', None), ('shred', 'erase_devices'),
+                          ('wipefs', 'other')],
+                         [(entry['program'], entry['step'])
+                          for entry in utils.get_execution_history()])
+
+    def test_failure(self, execute_mock):
+        execute_mock.side_effect = [
+            processutils.ProcessExecutionError(stdout='', stderr='boom',
+                                               exit_code=2),
+            FileNotFoundError(),
+        ]
+        self.assertRaises(processutils.ProcessExecutionError,
+                          utils.execute, 'wipefs', '/dev/sda')
+        self.assertRaises(FileNotFoundError, utils.execute, 'missing')
+
+        history = utils.get_execution_history()
+        self.assertEqual([(2, 0, 4), (None, None, None)],
+                         [(entry['exit_code'], entry['stdout_size'],
+                           entry['stderr_size']) for entry in history])
+        self.assertEqual({'failures': 1, 'count': 1},
+                         {key: value for key, value in
+                          utils.summarize_execution_history(
+                              history)['missing'].items()
+                          if key in ('failures', 'count')})
+
+    def test_exit_code_unknown(self, execute_mock):
+        execute_mock.return_value = ('', '')
+        utils.execute('sgdisk', '-v', check_exit_code=[0, 2])
+        utils.execute('sgdisk', '-v', check_exit_code=False)
+        utils.execute('sgdisk', '-v', check_exit_code=0)
+        self.assertEqual([None, None, 0],
+                         [entry['exit_code']
+                          for entry in utils.get_execution_history()])
+
+    def test_bounded(self, execute_mock):
+        execute_mock.return_value = ('', '')
+        self.config(execution_history_size=2)
+        for cmd in ('lsblk', 'lscpu', 'lshw'):
+            utils.execute(cmd)
+        self.assertEqual(['lscpu', 'lshw'],
+                         [entry['program']
+                          for entry in utils.get_execution_history()])
+
+    def test_disabled(self, execute_mock):
+        execute_mock.return_value = ('', '')
+        self.config(execution_history_size=0)
+        utils.execute('lsblk')
+        self.assertEqual([], utils.get_execution_history())
+
+
 class MkfsTestCase(base.IronicAgentTest):
 
     @mock.patch.object(utils, 'execute', autospec=True)
@@ -13,10 +13,12 @@
 # limitations under the License.
 
 import base64
+import collections
 from collections import abc
 import contextlib
 import copy
 import errno
+import functools
 import glob
 import io
 import ipaddress
@@ -31,6 +33,7 @@ import subprocess
 import sys
 import tarfile
 import tempfile
+import threading
 import time
 import warnings
 
@@ -38,11 +41,13 @@ from oslo_concurrency import processutils
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import excutils
+from oslo_utils import strutils
 from oslo_utils import units
 import requests
 import tenacity
 
 from ironic_python_agent import errors
+from ironic_python_agent.metrics_lib import metrics_utils
 
 LOG = logging.getLogger(__name__)
 
@@ -74,6 +79,121 @@ DEVICE_EXTRACTOR = re.compile(r'^(?:(.*\d)p|(.*\D))(?:\d+)$')
 
 _EARLY_LOG_BUFFER = []
 
+# Commands whose output only depends on the state of the hardware, mapped to
+# the options that make them read-only (None for any invocation). Their
+# output is reused for execute_cache_ttl seconds.
+READ_ONLY_COMMANDS = {
+    'blkid': None,
+    'dmidecode': None,
+    'lsblk': None,
+    'lscpu': None,
+    'lshw': None,
+    'mdadm': ('--detail', '-D', '--examine', '-E', '--query', '-Q'),
+    'sgdisk': ('--verify', '-v', '--print', '-p'),
+}
+
+# Commands that change block devices, partitions or RAID arrays, unless
+# invoked with the options in READ_ONLY_COMMANDS. Running any of them drops
+# all the cached output.
+MUTATING_COMMANDS = frozenset([
+    'blkdiscard', 'cryptsetup', 'dd', 'hdparm', 'kpartx', 'lvremove',
+    'mdadm', 'mkfs', 'mkswap', 'mount', 'multipath', 'nvme', 'parted',
+    'partprobe', 'partx', 'pvremove', 'qemu-img', 'sfdisk', 'sgdisk',
+    'shred', 'umount', 'vgremove', 'wipefs',
+])
+
+
+def _command_name(cmd):
+    # The first word of the command without its directory and, for
+    # commands like mkfs.ext4, its variant
+    words = str(cmd[0]).split() if cmd else []
+    if not words:
+        return None
+    return os.path.basename(words[0]).split('.')[0]
+
+
+def _is_read_only(name, cmd, kwargs):
+    if name not in READ_ONLY_COMMANDS or kwargs.get('shell'):
+        return False
+    options = READ_ONLY_COMMANDS[name]
+    return options is None or (len(cmd) > 1 and str(cmd[1]) in options)
+
+
+class _ExecuteCache(object):
+    """Output of read-only commands, see READ_ONLY_COMMANDS."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(cmd, kwargs):
+        """Build the cache key of a command.
+
+        :param cmd: The command arguments.
+        :param kwargs: Keyword arguments for processutils.execute, including
+            the environment variables.
+        """
+        options = []
+        for name, value in sorted(kwargs.items()):
+            if name == 'env_variables':
+                value = sorted(value.items())
+            options.append((name, repr(value)))
+        return tuple(map(str, cmd)), tuple(options)
+
+    def get(self, key):
+        """Get the output of a command if it has not expired.
+
+        :returns: A tuple of the cache generation and the (stdout, stderr)
+            tuple, or None if the command has to be run.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return self._generation, entry[1]
+            self.misses += 1
+            return self._generation, None
+
+    def put(self, key, result, generation, ttl):
+        """Store the output of a command.
+
+        The output is dropped if the cache was invalidated since generation
+        was returned by get(), since it may have been produced before a
+        mutating command.
+        """
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic() + ttl, result)
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'invalidations': self.invalidations,
+                    'entries': len(self._entries)}
+
+
+_EXECUTE_CACHE = _ExecuteCache()
+
+
+def get_execute_cache_stats():
+    """Get the counters of the cache of read-only commands.
+
+    :returns: A dictionary with the number of hits, misses and
+        invalidations, and the number of cached commands.
+    """
+    return _EXECUTE_CACHE.stats()
+
 
 def execute(*cmd, use_standard_locale=False, log_stdout=True, **kwargs):
     """Convenience wrapper around oslo's execute() method.
@@ -87,7 +207,8 @@ def execute(*cmd, use_standard_locale=False, log_stdout=True, **kwargs):
                                 added to environment variables.
     :param log_stdout: Defaults to True. If set to True, logs the output.
     :param kwargs: keyword arguments to pass to processutils.execute()
-    :returns: (stdout, stderr) from process execution
+    :returns: (stdout, stderr) from process execution, possibly cached for
+              the commands in READ_ONLY_COMMANDS (see execute_cache_ttl)
     :raises: UnknownArgumentError on receiving unknown arguments
     :raises: ProcessExecutionError
     :raises: OSError
@@ -118,17 +239,162 @@ def execute(*cmd, use_standard_locale=False, log_stdout=True, **kwargs):
                       .decode('utf8', 'ignore'))
             LOG.debug('Command stderr is: "%s"', stderr)
 
+    cache_key = None
+    mutating = False
+    if CONF.execute_cache_ttl:
+        name = _command_name(cmd)
+        if _is_read_only(name, cmd, kwargs):
+            cache_key = _EXECUTE_CACHE.key(cmd, kwargs)
+            generation, result = _EXECUTE_CACHE.get(cache_key)
+            _send_execute_cache_counter('miss' if result is None else 'hit')
+            if result is not None:
+                LOG.debug('Using the cached output of command: "%s"',
+                          ' '.join(map(str, cmd)))
+                return result
+        elif name in MUTATING_COMMANDS:
+            mutating = True
+            _EXECUTE_CACHE.invalidate()
+
+    started_at = time.time()
+    start = time.monotonic()
+    exit_code = output = None
     try:
         result = processutils.execute(*cmd, **kwargs)
     except FileNotFoundError:
         with excutils.save_and_reraise_exception():
             LOG.debug('Command not found: "%s"', ' '.join(map(str, cmd)))
     except processutils.ProcessExecutionError as exc:
+        exit_code = exc.exit_code
+        output = (exc.stdout, exc.stderr)
         with excutils.save_and_reraise_exception():
             _log(exc.stdout, exc.stderr)
     else:
+        check_exit_code = kwargs.get('check_exit_code', True)
+        if (check_exit_code is True
+                or (check_exit_code is not False
+                    and check_exit_code in (0, [0], (0,)))):
+            exit_code = 0
+        output = result
         _log(result[0], result[1])
+        if cache_key is not None:
+            _EXECUTE_CACHE.put(cache_key, result, generation,
+                               CONF.execute_cache_ttl)
         return result
+    finally:
+        _record_execution(cmd, started_at, time.monotonic() - start,
+                          exit_code, output)
+        if mutating:
+            # Read-only commands run concurrently may have seen the
+            # changes half-way.
+            _EXECUTE_CACHE.invalidate()
+
+
+def _send_execute_cache_counter(result):
+    metrics_utils.get_metrics_logger(__name__).send_counter(
+        'execute_cache.%s' % result, 1)
+
+
+_EXECUTION_STEP = threading.local()
+_EXECUTIONS = collections.deque(maxlen=0)
+_EXECUTIONS_LOCK = threading.Lock()
+_METRIC_NAME_RE = re.compile(r'[^a-zA-Z0-9_-]')
+
+
+@contextlib.contextmanager
+def execution_step(name):
+    """Attribute the commands run by the calling thread to a step.
+
+    :param name: Name of the command or step, reported with the commands
+        in the execution history.
+    """
+    previous = getattr(_EXECUTION_STEP, 'name', None)
+    _EXECUTION_STEP.name = name
+    try:
+        yield
+    finally:
+        _EXECUTION_STEP.name = previous
+
+
+def in_execution_step(func):
+    """Bind a function to the execution step of the calling thread.
+
+    Threads do not inherit the step of the thread starting them. Functions
+    submitted to thread pools are wrapped with this, so that the commands
+    they run are attributed to the step they were submitted from.
+
+    :param func: The function to wrap.
+    :returns: A function running func in the current execution step.
+    """
+    step = getattr(_EXECUTION_STEP, 'name', None)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with execution_step(step):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _record_execution(cmd, started_at, duration, exit_code, output):
+    global _EXECUTIONS
+
+    program = _command_name(cmd) or ''
+    metrics_utils.get_metrics_logger(__name__).send_timer(
+        'execute.%s' % (_METRIC_NAME_RE.sub('_', program) or 'unknown'),
+        duration * 1000)
+
+    size = CONF.execution_history_size
+    if not size:
+        return
+    entry = {
+        'command': strutils.mask_password(' '.join(map(str, cmd))),
+        'program': program,
+        'step': getattr(_EXECUTION_STEP, 'name', None),
+        'started_at': started_at,
+        'duration': duration,
+        'exit_code': exit_code,
+        'stdout_size': len(output[0] or '') if output else None,
+        'stderr_size': len(output[1] or '') if output else None,
+    }
+    with _EXECUTIONS_LOCK:
+        if _EXECUTIONS.maxlen != size:
+            _EXECUTIONS = collections.deque(_EXECUTIONS, maxlen=size)
+        _EXECUTIONS.append(entry)
+
+
+def get_execution_history():
+    """Get the most recent commands run through execute().
+
+    :returns: A list of dictionaries, oldest first, with the command line
+        (with passwords masked), the program, the step that ran it, the
+        start time (seconds since the epoch), the duration (in seconds),
+        the exit code (None if unknown, e.g. when any exit code is
+        accepted) and the size of stdout and stderr. At most
+        execution_history_size entries are kept.
+    """
+    with _EXECUTIONS_LOCK:
+        return list(_EXECUTIONS)
+
+
+def summarize_execution_history(executions):
+    """Aggregate the execution history by program.
+
+    :param executions: A list returned by get_execution_history().
+    :returns: A dictionary mapping programs to dictionaries with the number
+        of executions, the number of failures, and the total and maximum
+        duration, sorted by decreasing total duration.
+    """
+    summary = {}
+    for entry in executions:
+        item = summary.setdefault(entry['program'], {
+            'count': 0, 'failures': 0, 'total_duration': 0.0,
+            'max_duration': 0.0})
+        item['count'] += 1
+        if entry['exit_code'] not in (0, None) or entry['stdout_size'] is None:
+            item['failures'] += 1
+        item['total_duration'] += entry['duration']
+        item['max_duration'] = max(item['max_duration'], entry['duration'])
+    return dict(sorted(summary.items(),
+                       key=lambda item: -item[1]['total_duration']))
 
 
 def mkfs(fs, path, label=None, uuid=None):
@@ -577,11 +843,15 @@ def get_agent_params():
 
 
 class AccumulatedFailures(object):
-    """Object to accumulate failures without raising exception."""
+    """Object to accumulate failures without raising exception.
+
+    Failures can be added from several threads at the same time.
+    """
 
     def __init__(self, exc_class=RuntimeError):
         self._failures = []
         self._exc_class = exc_class
+        self._lock = threading.Lock()
 
     def add(self, fail, *fmt):
         """Add failure with optional formatting.
@@ -592,15 +862,18 @@ class AccumulatedFailures(object):
         if fmt:
             fail = fail % fmt
         LOG.error('%s', fail)
-        self._failures.append(fail)
+        with self._lock:
+            self._failures.append(fail)
 
     def get_error(self):
         """Get error string or None."""
-        if not self._failures:
+        with self._lock:
+            failures = list(self._failures)
+        if not failures:
             return
 
         msg = ('The following errors were encountered:\n%s'
-               % '\n'.join('* %s' % item for item in self._failures))
+               % '\n'.join('* %s' % item for item in failures))
         return msg
 
     def raise_if_needed(self):
@@ -611,6 +884,15 @@ class AccumulatedFailures(object):
         if self._failures:
             raise self._exc_class(self.get_error())
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
     def __nonzero__(self):
         return bool(self._failures)
 
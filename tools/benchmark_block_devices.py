@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark hardware.list_all_block_devices on synthetic nodes.
+
+Builds lsblk output and a sysfs tree for a node with the given number of
+multipath disks, each seen through several paths, and times the
+enumeration. lsblk and udev are replaced with the synthetic data, sysfs is
+read from a temporary directory.
+
+Example::
+
+    python tools/benchmark_block_devices.py --disks 256 --paths 4
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import timeit
+from unittest import mock
+
+import pyudev
+
+from ironic_python_agent import config  # noqa: F401, registers options
+from ironic_python_agent import disk_utils
+from ironic_python_agent import hardware
+from ironic_python_agent import utils
+
+
+def _add_sysfs_device(root, name, vendor=None, hctl=None, holders=(),
+                      dm_uuid=None):
+    path = os.path.join(root, 'devices', name)
+    os.makedirs(os.path.join(path, 'holders'))
+    for holder in holders:
+        os.mkdir(os.path.join(path, 'holders', holder))
+    if vendor:
+        os.makedirs(os.path.join(path, 'device', 'scsi_device', hctl))
+        with open(os.path.join(path, 'device', 'vendor'), 'w') as f:
+            f.write('%s\n' % vendor)
+    if dm_uuid:
+        os.mkdir(os.path.join(path, 'dm'))
+        with open(os.path.join(path, 'dm', 'uuid'), 'w') as f:
+            f.write('%s\n' % dm_uuid)
+    os.symlink(path, os.path.join(root, 'class', name))
+
+
+def build_fixtures(root, disks, paths):
+    """Create the sysfs tree and return the lsblk output and udev devices."""
+    os.makedirs(os.path.join(root, 'class'))
+    blockdevices = []
+    udev_devices = []
+    for disk in range(disks):
+        mpath = 'dm-%d' % disk
+        _add_sysfs_device(root, mpath, dm_uuid='mpath-%d' % disk)
+        device = {'kname': mpath, 'model': 'Benchmark', 'size': 1 << 40,
+                  'rota': False, 'type': 'mpath', 'uuid': None,
+                  'partuuid': None, 'serial': None, 'wwn': None,
+                  'log-sec': 512, 'phy-sec': 512, 'tran': None}
+        blockdevices.append(device)
+        udev_devices.append(mock.Mock(device_node='/dev/%s' % mpath))
+        for path in range(paths):
+            kname = 'sdp%dd%d' % (path, disk)
+            _add_sysfs_device(root, kname, vendor='ACME',
+                              hctl='%d:0:%d:0' % (path, disk),
+                              holders=[mpath])
+            blockdevices.append(dict(device, kname=kname, type='disk',
+                                     tran='sas'))
+            udev_devices.append(mock.Mock(device_node='/dev/%s' % kname))
+    return json.dumps({'blockdevices': blockdevices}), udev_devices
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--disks', type=int, default=128,
+                        help='number of multipath disks')
+    parser.add_argument('--paths', type=int, default=2,
+                        help='number of paths to each disk')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='number of enumerations to time')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        lsblk, udev_devices = build_fixtures(root, args.disks, args.paths)
+        context = mock.Mock(spec=pyudev.Context)
+        context.list_devices.return_value = udev_devices
+        with mock.patch.object(utils, 'execute',
+                               return_value=(lsblk, '')), \
+                mock.patch.object(pyudev, 'Context', return_value=context), \
+                mock.patch.object(disk_utils, 'udev_settle'), \
+                mock.patch.object(hardware, 'get_multipath_status',
+                                  return_value=True), \
+                mock.patch.object(hardware, 'SYS_CLASS_BLOCK',
+                                  os.path.join(root, 'class')):
+            devices = hardware.list_all_block_devices()
+            assert len(devices) == args.disks, len(devices)
+            elapsed = timeit.timeit(hardware.list_all_block_devices,
+                                    number=args.repeat)
+    finally:
+        shutil.rmtree(root)
+
+    print('%d disks, %d paths each: %.1f ms per enumeration'
+          % (args.disks, args.paths, elapsed / args.repeat * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark the PCI devices collector on a synthetic sysfs tree.
+
+Builds a /sys/bus/pci/devices tree with the given number of PCI functions
+in a temporary directory and times inspector.collect_pci_devices_info,
+both on its own and inside sysfs.memoize() after a first run, against the
+path-per-file reads it replaced.
+
+Example::
+
+    python tools/benchmark_sysfs.py --functions 4096
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+from unittest import mock
+
+from ironic_python_agent import config  # noqa: F401, registers options
+from ironic_python_agent import inspector
+from ironic_python_agent import sysfs
+from ironic_python_agent import utils
+
+
+def build_fixtures(root, functions):
+    """Create the PCI devices tree and return the devices directory."""
+    devices_path = os.path.join(root, 'bus', 'pci', 'devices')
+    os.makedirs(devices_path)
+    for index in range(functions):
+        bus = '0000:%02x:%02x.%x' % (index // 256, index // 8 % 32, index % 8)
+        path = os.path.join(root, 'devices', 'pci0000:00', bus)
+        os.makedirs(path)
+        attributes = {'vendor': '0x8086', 'device': '0x%04x' % index,
+                      'class': '0x020000', 'revision': '0x01',
+                      'numa_node': str(index % 2)}
+        for name, value in attributes.items():
+            with open(os.path.join(path, name), 'w') as f:
+                f.write('%s\n' % value)
+        os.symlink(path, os.path.join(devices_path, bus))
+    return devices_path
+
+
+def collect_per_path(devices_path):
+    """The previous implementation, resolving a full path for every file."""
+    devices = []
+    for subdir in os.listdir(devices_path):
+        if not os.path.isdir(os.path.join(devices_path, subdir)):
+            continue
+        values = {}
+        for name in ('vendor', 'device', 'class'):
+            with open(os.path.join(devices_path, subdir, name)) as f:
+                values[name] = f.read().strip().split('x')[1]
+        for name in ('revision', 'numa_node'):
+            path = os.path.join(devices_path, subdir, name)
+            if os.path.isfile(path):
+                with open(path) as f:
+                    values[name] = f.read().strip()
+        devices.append(values)
+    return devices
+
+
+def collect():
+    data = {}
+    inspector.collect_pci_devices_info(data, utils.AccumulatedFailures())
+    return data['pci_devices']
+
+
+def memoized():
+    with sysfs.memoize():
+        collect()
+        return collect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--functions', type=int, default=4096,
+                        help='number of PCI functions')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='number of collections to time')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        devices_path = build_fixtures(root, args.functions)
+        with mock.patch.object(sysfs, 'PCI_DEVICES', devices_path):
+            assert len(collect()) == args.functions
+            results = [
+                ('per-path reads',
+                 timeit.timeit(lambda: collect_per_path(devices_path),
+                               number=args.repeat)),
+                ('shared reader',
+                 timeit.timeit(collect, number=args.repeat)),
+                # Includes the first, uncached collection
+                ('shared reader, memoized twice',
+                 timeit.timeit(memoized, number=args.repeat)),
+            ]
+    finally:
+        shutil.rmtree(root)
+
+    print('%d PCI functions:' % args.functions)
+    for name, elapsed in results:
+        print('  %-30s %.1f ms per collection'
+              % (name, elapsed / args.repeat * 1000))
+
+
+if __name__ == '__main__':
+    main()